@@ -1,38 +1,108 @@
 # SPDX-License-Identifier: MIT
 # Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
 
-import torch
 import os
+import ast
 import logging
-logger = logging.getLogger("aiter")
+import importlib
 import importlib.util
-if importlib.util.find_spec('aiter_') is not None:
-    from aiter_ import *
-# if importlib.util.find_spec('hipbsolidxgemm_') is not None:
-#     from hipbsolidxgemm_ import *
-# if importlib.util.find_spec('rocsolidxgemm_') is not None:
-#     from rocsolidxgemm_ import *
-from .ops.norm import *
-from .ops.quant import *
-from .ops.gemm_op_a8w8 import *
-from .ops.batched_gemm_op_a8w8 import *
-from .ops.batched_gemm_op_bf16 import *
-from .ops.aiter_operator import *
-from .ops.activation import *
-from .ops.attention import *
-from .ops.custom import *
-from .ops.custom_all_reduce import *
-from .ops.moe_op import *
-from .ops.moe_sorting import *
-from .ops.pos_encoding import *
-from .ops.cache import *
-from .ops.rmsnorm import *
-from .ops.communication import *
-from .ops.rope import *
-from .ops.topk import *
-from .ops.mha import *
-from .ops.gradlib import *
-from . import mla
+logger = logging.getLogger("aiter")
+
+# ops are resolved on first attribute access instead of star-imported here,
+# `import aiter` must stay cheap: no torch, no jit, no module builds.
+# the order matches the old star-import order, later modules win on clashes
+_OP_MODULES = [
+    ".ops.norm",
+    ".ops.quant",
+    ".ops.gemm_op_a8w8",
+    ".ops.batched_gemm_op_a8w8",
+    ".ops.batched_gemm_op_bf16",
+    ".ops.aiter_operator",
+    ".ops.activation",
+    ".ops.attention",
+    ".ops.custom",
+    ".ops.custom_all_reduce",
+    ".ops.moe_op",
+    ".ops.moe_sorting",
+    ".ops.pos_encoding",
+    ".ops.cache",
+    ".ops.rmsnorm",
+    ".ops.communication",
+    ".ops.rope",
+    ".ops.topk",
+    ".ops.mha",
+    ".ops.gradlib",
+    ".ops.gemm_dispatch",
+    ".ops.grouped_gemm",
+]
+
+_symbol_table = None
+
+
+def _defined_names(md_name):
+    '''public names a module defines at top level, found without importing it'''
+    spec = importlib.util.find_spec(md_name, __name__)
+    if spec is None or spec.origin is None:
+        return []
+    with open(spec.origin) as f:
+        tree = ast.parse(f.read(), spec.origin)
+    names = []
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.append(node.name)
+        elif isinstance(node, ast.Assign):
+            names += [el.id for el in node.targets if isinstance(el, ast.Name)]
+        elif isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+            names.append(node.target.id)
+    return [el for el in names if not el.startswith('_')]
+
+
+def _get_symbol_table():
+    global _symbol_table
+    if _symbol_table is None:
+        table = {}
+        for md_name in _OP_MODULES:
+            for name in _defined_names(md_name):
+                table[name] = md_name
+        _symbol_table = table
+    return _symbol_table
+
+
+def _load_prebuilt(name):
+    if importlib.util.find_spec('aiter_') is None:
+        raise AttributeError(name)
+    return getattr(importlib.import_module('aiter_'), name)
+
+
+def __getattr__(name):
+    if name.startswith('__'):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    md_name = _get_symbol_table().get(name)
+    if md_name is not None:
+        value = getattr(importlib.import_module(md_name, __name__), name)
+    elif importlib.util.find_spec(f'.{name}', __name__) is not None:
+        value = importlib.import_module(f'.{name}', __name__)
+    else:
+        # names re-exported through imports inside ops modules
+        value = None
+        for md_name in reversed(_OP_MODULES):
+            module = importlib.import_module(md_name, __name__)
+            if hasattr(module, name):
+                value = getattr(module, name)
+                break
+        else:
+            try:
+                value = _load_prebuilt(name)
+            except AttributeError:
+                raise AttributeError(
+                    f"module {__name__!r} has no attribute {name!r}") from None
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_get_symbol_table()))
+
 
 def getLogger():
     global logger
@@ -0,0 +1,6 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# benchmark suites with roofline efficiency and a local sqlite history,
+#   python -m aiter.benchmark.gemm --spec <yaml|csv> --db <sqlite>
+# importing this package must not pull in torch
@@ -0,0 +1,441 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# GEMM benchmark suite: a matrix of shapes from a yaml/csv spec through every
+# backend that supports them, latency with TFLOPs, GB/s and % of roofline,
+# kept in a sqlite history and compared against the previous run
+#   python -m aiter.benchmark.gemm                               # default spec, every backend
+#   python -m aiter.benchmark.gemm --spec shapes.yaml -b hipb_mm rocb_mm --fail_on_regression
+#   python -m aiter.benchmark.gemm --device cpu                  # torch_cpu only, tests the harness
+# yaml spec, every group is the product of its lists:
+#   suite: llama
+#   groups:
+#     - dtype: bf16                # fp32 bf16 fp16 fp8 i8
+#       outdtype: bf16             # default bf16 for fp8/i8, else dtype
+#       M: [1, 32, 256]
+#       NK: [[1280, 8192], [8192, 1024]]   # or N: [...] and K: [...]
+#       backends: [hipb_mm, rocb_mm]       # default all
+# a csv spec has a row per shape, M,N,K[,dtype][,outdtype][,backends]
+# with backends separated by spaces, so untuned csv files work as specs.
+# backends register with @register_backend, prepare(case) allocates the
+# inputs and returns the launch, raising Unsupported skips the case.
+
+import os
+import sys
+import csv
+import time
+import statistics
+import itertools
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from .roofline import get_roofline, DTYPE_BYTES
+from .history import History, DEFAULT_DB, git_revision
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_SPEC = os.path.join(this_dir, 'gemm_shapes.yaml')
+
+
+@dataclass(frozen=True)
+class GemmCase:
+    M: int
+    N: int
+    K: int
+    dtype: str = 'bf16'
+    outdtype: str = 'bf16'
+    # backends the spec asks for, empty for all
+    backends: Tuple[str, ...] = ()
+
+
+def _outdtype(dtype, outdtype=None):
+    return outdtype or ('bf16' if dtype in ('fp8', 'i8') else dtype)
+
+
+def _make_case(M, N, K, dtype='bf16', outdtype=None, backends=()):
+    dtype = dtype or 'bf16'
+    outdtype = _outdtype(dtype, outdtype)
+    for el in (dtype, outdtype):
+        if el not in DTYPE_BYTES:
+            raise ValueError(f'unknown dtype {el}, choose from {list(DTYPE_BYTES)}')
+    return GemmCase(int(M), int(N), int(K), dtype, outdtype, tuple(backends))
+
+
+def load_spec(path) -> Tuple[str, List[GemmCase]]:
+    '''(suite name, cases) of a yaml or csv spec'''
+    suite = os.path.splitext(os.path.basename(path))[0]
+    cases = []
+    if path.endswith('.csv'):
+        with open(path) as f:
+            for row in csv.DictReader(f):
+                cases.append(_make_case(row['M'], row['N'], row['K'], row.get('dtype'), row.get('outdtype'),
+                                        (row.get('backends') or '').split()))
+        return suite, list(dict.fromkeys(cases))
+    try:
+        import yaml
+    except ImportError:
+        raise ImportError(f'{path}: yaml specs need PyYAML, pip install pyyaml or use a csv spec')
+    with open(path) as f:
+        spec = yaml.safe_load(f)
+    for group in spec['groups']:
+        if 'NK' in group:
+            nk = [tuple(el) for el in group['NK']]
+        else:
+            nk = list(itertools.product(group['N'], group['K']))
+        for m, (n, k) in itertools.product(group['M'], nk):
+            cases.append(_make_case(m, n, k, group.get('dtype'), group.get('outdtype'),
+                                    group.get('backends', ())))
+    return spec.get('suite', suite), list(dict.fromkeys(cases))
+
+
+class Unsupported(Exception):
+    pass
+
+
+BACKENDS: Dict[str, type] = {}
+
+
+def register_backend(cls):
+    BACKENDS[cls.name] = cls
+    return cls
+
+
+def _torch_dtype(name):
+    import torch
+    return {'fp32': torch.float32, 'bf16': torch.bfloat16, 'fp16': torch.float16,
+            'fp8': torch.float8_e4m3fnuz, 'i8': torch.int8}[name]
+
+
+def _inputs(case, device):
+    '''x (M, K) and w (N, K) in case.dtype'''
+    import torch
+    if case.dtype == 'i8':
+        return torch.randint(-20, 20, (case.M, case.K), dtype=torch.int8, device=device), \
+            torch.randint(-20, 20, (case.N, case.K), dtype=torch.int8, device=device)
+    if case.dtype == 'fp8':
+        return (torch.rand((case.M, case.K), device=device) / 10).to(_torch_dtype('fp8')), \
+            (torch.rand((case.N, case.K), device=device) / 10).to(_torch_dtype('fp8'))
+    return torch.randn((case.M, case.K), dtype=_torch_dtype(case.dtype), device=device), \
+        torch.randn((case.N, case.K), dtype=_torch_dtype(case.dtype), device=device)
+
+
+class GemmBackend:
+    name = None
+    device = 'cuda'
+    dtypes = ('bf16', 'fp16')
+    outdtypes = ('bf16', 'fp16')
+
+    def supports(self, case: GemmCase) -> bool:
+        return case.dtype in self.dtypes and case.outdtype in self.outdtypes
+
+    def prepare(self, case: GemmCase):
+        '''allocate the inputs of case, returns the launch'''
+        raise NotImplementedError
+
+
+class _SameDtype(GemmBackend):
+
+    def supports(self, case):
+        return super().supports(case) and case.outdtype == case.dtype
+
+
+@register_backend
+class TorchCPU(GemmBackend):
+    '''reference math on the cpu, scaled int8/fp8 are dequantized to fp32'''
+    name = 'torch_cpu'
+    device = 'cpu'
+    dtypes = tuple(DTYPE_BYTES)
+    outdtypes = ('fp32', 'bf16', 'fp16')
+
+    def prepare(self, case):
+        import torch
+        import torch.nn.functional as F
+        x, w = _inputs(case, 'cpu')
+        out = _torch_dtype(case.outdtype)
+        if case.dtype in ('fp8', 'i8'):
+            x_scale = torch.rand((case.M, 1)) + 1e-6
+            w_scale = torch.rand((1, case.N)) + 1e-6
+            return lambda: (F.linear(x.to(torch.float32), w.to(torch.float32)) * x_scale * w_scale).to(out)
+        return lambda: F.linear(x, w).to(out)
+
+
+@register_backend
+class Torch(_SameDtype):
+    name = 'torch'
+    dtypes = ('fp32', 'bf16', 'fp16')
+    outdtypes = dtypes
+
+    def prepare(self, case):
+        import torch.nn.functional as F
+        x, w = _inputs(case, self.device)
+        return lambda: F.linear(x, w)
+
+
+@register_backend
+class HipbMM(GemmBackend):
+    '''hipBLASLt with its heuristic solution'''
+    name = 'hipb_mm'
+    dtypes = ('fp32', 'bf16', 'fp16', 'fp8')
+    outdtypes = ('fp32', 'bf16', 'fp16')
+
+    def supports(self, case):
+        return super().supports(case) and (case.dtype == 'fp8' or case.outdtype == case.dtype)
+
+    def prepare(self, case):
+        import torch
+        import aiter
+        aiter.hipb_create_extension()
+        x, w = _inputs(case, self.device)
+        scale_a = scale_b = None
+        if case.dtype == 'fp8':
+            scale_a = torch.ones(1, dtype=torch.float32, device=self.device)
+            scale_b = torch.ones(1, dtype=torch.float32, device=self.device)
+        out, wt = _torch_dtype(case.outdtype), w.t()
+        return lambda: aiter.hipb_mm(x, wt, -1, None, out, scale_a, scale_b)
+
+
+@register_backend
+class RocbMM(_SameDtype):
+    '''rocBLAS with its default solution'''
+    name = 'rocb_mm'
+    dtypes = ('fp32', 'bf16', 'fp16')
+    outdtypes = dtypes
+
+    def prepare(self, case):
+        import aiter
+        aiter.rocb_create_extension()
+        x, w = _inputs(case, self.device)
+        wt = w.t()
+        return lambda: aiter.rocb_mm(x, wt, 0)
+
+
+def _cu_count(device):
+    import torch
+    return torch.cuda.get_device_properties(device).multi_processor_count
+
+
+@register_backend
+class WvSpltK(_SameDtype):
+    '''skinny gemm of tuned_gemm for M <= 4'''
+    name = 'wvSpltK'
+    dtypes = ('fp16',)
+    outdtypes = dtypes
+
+    def supports(self, case):
+        return super().supports(case) and case.K % 8 == 0 and case.N > 8 and 0 < case.M <= 4
+
+    def prepare(self, case):
+        import torch
+        import aiter
+        x, w = _inputs(case, self.device)
+        y = torch.empty(case.M, case.N, dtype=x.dtype, device=self.device)
+        cu_count = _cu_count(self.device)
+        return lambda: aiter.wvSpltK(w, x, y, case.M, cu_count)
+
+
+@register_backend
+class LLMM1(_SameDtype):
+    '''skinny gemm of tuned_gemm for M == 1'''
+    name = 'LLMM1'
+    dtypes = ('fp16',)
+    outdtypes = dtypes
+
+    def supports(self, case):
+        return super().supports(case) and case.K % 8 == 0 and case.K <= 8192 and case.N % 4 == 0 and case.M == 1
+
+    def prepare(self, case):
+        import torch
+        import aiter
+        x, w = _inputs(case, self.device)
+        y = torch.empty(case.M, case.N, dtype=x.dtype, device=self.device)
+        return lambda: aiter.LLMM1(w, x, y, 4)
+
+
+def _rowwise_scales(case, device):
+    import torch
+    return torch.rand((case.M, 1), dtype=torch.float32, device=device) + 1e-6, \
+        torch.rand((1, case.N), dtype=torch.float32, device=device) + 1e-6
+
+
+@register_backend
+class CKA8W8(GemmBackend):
+    name = 'ck_a8w8'
+    dtypes = ('i8',)
+
+    def prepare(self, case):
+        import aiter
+        x, w = _inputs(case, self.device)
+        x_scale, w_scale = _rowwise_scales(case, self.device)
+        out = _torch_dtype(case.outdtype)
+        return lambda: aiter.gemm_a8w8_CK(x, w, x_scale, w_scale, None, out)
+
+
+@register_backend
+class ASMA8W8(GemmBackend):
+    '''only the shapes of asm_a8w8_gemm.csv, the others return None'''
+    name = 'asm_a8w8'
+    dtypes = ('i8',)
+    outdtypes = ('bf16',)
+
+    def prepare(self, case):
+        import torch
+        import aiter
+        from aiter.ops.shuffle import shuffle_weight
+        x, w = _inputs(case, self.device)
+        w = shuffle_weight(w, layout=(32, 16))
+        x_scale, w_scale = _rowwise_scales(case, self.device)
+        bias = torch.zeros((1, case.N), dtype=torch.float32, device=self.device)
+        out = _torch_dtype(case.outdtype)
+
+        def run():
+            return aiter.gemm_a8w8_ASM(x, w, x_scale, w_scale, bias, out)
+        if run() is None:
+            raise Unsupported(f'no asm kernel for {case.M}x{case.N}x{case.K}')
+        return run
+
+
+BLOCK_SHAPE = (128, 128)
+
+
+def _block_scales(case, device):
+    import torch
+    scale_n = (case.N + BLOCK_SHAPE[0] - 1) // BLOCK_SHAPE[0]
+    scale_k = (case.K + BLOCK_SHAPE[1] - 1) // BLOCK_SHAPE[1]
+    return torch.rand((case.M, scale_k), dtype=torch.float32, device=device), \
+        torch.rand((scale_n, scale_k), dtype=torch.float32, device=device)
+
+
+@register_backend
+class CKBlockscale(GemmBackend):
+    name = 'ck_blockscale'
+    dtypes = ('fp8',)
+
+    def prepare(self, case):
+        import aiter
+        x, w = _inputs(case, self.device)
+        x_scale, w_scale = _block_scales(case, self.device)
+        out = _torch_dtype(case.outdtype)
+        return lambda: aiter.gemm_a8w8_blockscale_CK(x, w, x_scale, w_scale, out)
+
+
+@register_backend
+class ASMBlockscale(GemmBackend):
+    '''flatmm, the weight in (N/16, K/64, 4, 16, 16) tiles and transposed scales'''
+    name = 'asm_blockscale'
+    dtypes = ('fp8',)
+    outdtypes = ('fp16',)
+
+    def supports(self, case):
+        return super().supports(case) and case.N % 16 == 0 and case.K % 64 == 0
+
+    def prepare(self, case):
+        import aiter
+        x, w = _inputs(case, self.device)
+        w = w.view(case.N // 16, 16, case.K // 64, 4, 16).permute(0, 2, 3, 1, 4).contiguous().view(case.N, -1)
+        x_scale, w_scale = _block_scales(case, self.device)
+        x_scale, w_scale = x_scale.t().contiguous(), w_scale.t().contiguous()
+        out = _torch_dtype(case.outdtype)
+        return lambda: aiter.flatmm_a8w8_blockscale_ASM(x, w, x_scale, w_scale, out)
+
+
+def time_us(run, device, iters=50, warmup=5) -> Optional[float]:
+    '''median latency of run in us, None if it raised'''
+    if device == 'cpu':
+        for _ in range(warmup):
+            run()
+        samples = []
+        for _ in range(iters):
+            start = time.perf_counter()
+            run()
+            samples.append((time.perf_counter() - start) * 1e6)
+        return statistics.median(samples)
+    from ..tuning.search import EventTimer
+    samples = EventTimer(lambda _: run(), warmup=warmup)(None, iters)
+    return statistics.median(samples) if samples else None
+
+
+def run_suite(cases, backends=None, device='cuda', iters=50, warmup=5, roofline=None, log=print):
+    '''
+    result dicts of every (case, backend) that runs, backends defaults to
+    every registered one of device, a case restricts them to its own list
+    '''
+    roofline = roofline or get_roofline(device)
+    selected = [BACKENDS[el]() for el in (backends or BACKENDS)]
+    selected = [el for el in selected if (el.device == 'cpu') == (device == 'cpu')]
+    results = []
+    for case in cases:
+        for backend in selected:
+            if (case.backends and backend.name not in case.backends) or not backend.supports(case):
+                continue
+            try:
+                us = time_us(backend.prepare(case), device, iters, warmup)
+            except (Unsupported, RuntimeError) as e:
+                log(f'[skip] {backend.name} {case.M}x{case.N}x{case.K} {case.dtype}: {e}')
+                continue
+            if us is None:
+                log(f'[skip] {backend.name} {case.M}x{case.N}x{case.K} {case.dtype}: failed to run')
+                continue
+            result = {'backend': backend.name, 'M': case.M, 'N': case.N, 'K': case.K,
+                      'dtype': case.dtype, 'outdtype': case.outdtype, 'us': us}
+            result.update(roofline.report(case.M, case.N, case.K, case.dtype, case.outdtype, us))
+            results.append(result)
+    return results
+
+
+def format_results(results):
+    lines = [f'{"backend":<16} {"M":>6} {"N":>6} {"K":>6} {"dtype":>11} {"us":>10} {"TFLOPs":>8} '
+             f'{"GB/s":>8} {"roofline":>8} bound']
+    for el in results:
+        eff = f'{el["efficiency"]:.1%}' if el['efficiency'] is not None else '-'
+        lines.append(f'{el["backend"]:<16} {el["M"]:>6} {el["N"]:>6} {el["K"]:>6} '
+                     f'{el["dtype"] + "->" + el["outdtype"]:>11} {el["us"]:>10.2f} {el["tflops"]:>8.2f} '
+                     f'{el["gbps"]:>8.1f} {eff:>8} {el["bound"]}')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="benchmark GEMM backends against roofline and track regressions")
+    parser.add_argument("--spec", default=DEFAULT_SPEC, help="yaml or csv spec of the shapes")
+    parser.add_argument("-b", "--backends", nargs='*', default=None, choices=list(BACKENDS),
+                        help="backends to run, default all that support a shape")
+    parser.add_argument("--device", default=None, help="cuda or cpu, default cuda if available")
+    parser.add_argument("--db", default=DEFAULT_DB, help="sqlite history")
+    parser.add_argument("--label", default=None, help="label of this run in the history")
+    parser.add_argument("--baseline", type=int, default=None,
+                        help="run id to compare against, default the previous run of the suite")
+    parser.add_argument("--threshold", type=float, default=0.05,
+                        help="slowdown that counts as a regression")
+    parser.add_argument("--iters", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--fail_on_regression", action='store_true',
+                        help="exit 1 when a case regressed")
+    parser.add_argument("--history", action='store_true', help="list the latest runs and exit")
+    args = parser.parse_args(argv)
+
+    history = History(args.db)
+    if args.history:
+        for el in history.runs():
+            print(f'{el["id"]:>5} {time.strftime("%Y-%m-%d %H:%M", time.localtime(el["created"]))} '
+                  f'{el["suite"]:<16} {el["device"]:<8} {el["git"] or "-":<10} {el["label"] or ""}')
+        return 0
+
+    import torch
+    device = args.device or ('cuda' if torch.cuda.is_available() else 'cpu')
+    suite, cases = load_spec(args.spec)
+    roofline = get_roofline(device)
+    results = run_suite(cases, args.backends, device, args.iters, args.warmup, roofline)
+    print(format_results(results))
+    run_id = history.add_run(suite, roofline.arch, results, args.label, git_revision())
+    regressions, improvements = history.compare(run_id, args.baseline, args.threshold)
+    print(f'run {run_id} of {suite} on {roofline.arch}: {len(results)} results, '
+          f'{len(regressions)} regressions, {len(improvements)} improvements over {args.threshold:.0%}')
+    for title, changes in (('regressions', regressions), ('improvements', improvements)):
+        if changes:
+            print(f'{title}:')
+            for el in changes:
+                print(f'  {el}')
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
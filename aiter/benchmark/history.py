@@ -0,0 +1,134 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# benchmark results in a local sqlite database, one run per invocation,
+# compared against an earlier run of the same suite and device to flag
+# cases that got slower by more than a threshold.
+
+import os
+import time
+import sqlite3
+import subprocess
+from dataclasses import dataclass
+from typing import Optional
+
+DEFAULT_DB = os.path.join(os.path.expanduser('~'), '.aiter', 'benchmark.db')
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created REAL,
+    suite TEXT,
+    device TEXT,
+    git TEXT,
+    label TEXT
+);
+CREATE TABLE IF NOT EXISTS results (
+    run_id INTEGER REFERENCES runs(id),
+    backend TEXT,
+    M INTEGER, N INTEGER, K INTEGER,
+    dtype TEXT, outdtype TEXT,
+    us REAL, tflops REAL, gbps REAL, efficiency REAL, bound TEXT,
+    PRIMARY KEY (run_id, backend, M, N, K, dtype, outdtype)
+);
+'''
+
+_CASE = ['backend', 'M', 'N', 'K', 'dtype', 'outdtype']
+
+
+def git_revision(path=None):
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=path or os.path.dirname(__file__),
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+@dataclass
+class Change:
+    backend: str
+    M: int
+    N: int
+    K: int
+    dtype: str
+    outdtype: str
+    old_us: float
+    new_us: float
+
+    @property
+    def ratio(self):
+        return self.new_us / self.old_us
+
+    def __str__(self):
+        return f'{self.backend:<16} {self.M:>6} {self.N:>6} {self.K:>6} {self.dtype:>5} -> {self.outdtype:<5} ' \
+               f'{self.old_us:>10.2f} us -> {self.new_us:>10.2f} us ({self.ratio - 1:+.1%})'
+
+
+class History:
+
+    def __init__(self, path=DEFAULT_DB):
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(_SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def add_run(self, suite, device, results, label=None, git=None):
+        '''results: dicts with the results columns, returns the run id'''
+        with self.conn:
+            cur = self.conn.execute(
+                'INSERT INTO runs (created, suite, device, git, label) VALUES (?, ?, ?, ?, ?)',
+                (time.time(), suite, device, git, label))
+            run_id = cur.lastrowid
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(run_id, el['backend'], el['M'], el['N'], el['K'], el['dtype'], el['outdtype'],
+                  el['us'], el.get('tflops'), el.get('gbps'), el.get('efficiency'), el.get('bound'))
+                 for el in results])
+        return run_id
+
+    def runs(self, suite=None, device=None, limit=20):
+        query, args = 'SELECT * FROM runs', []
+        where = [(col, val) for col, val in [('suite', suite), ('device', device)] if val is not None]
+        if where:
+            query += ' WHERE ' + ' AND '.join(f'{col} = ?' for col, _ in where)
+            args = [val for _, val in where]
+        query += ' ORDER BY id DESC LIMIT ?'
+        return [dict(el) for el in self.conn.execute(query, args + [limit])]
+
+    def results(self, run_id):
+        return [dict(el) for el in self.conn.execute('SELECT * FROM results WHERE run_id = ?', (run_id,))]
+
+    def previous_run(self, run_id) -> Optional[int]:
+        '''the latest earlier run of the same suite on the same device'''
+        row = self.conn.execute(
+            'SELECT b.id FROM runs a JOIN runs b ON a.suite = b.suite AND a.device = b.device '
+            'WHERE a.id = ? AND b.id < a.id ORDER BY b.id DESC LIMIT 1', (run_id,)).fetchone()
+        return row[0] if row else None
+
+    def compare(self, run_id, baseline_id=None, threshold=0.05):
+        '''
+        (regressions, improvements) of run_id against baseline_id (default the
+        previous run), cases whose latency changed by more than threshold
+        '''
+        baseline_id = baseline_id or self.previous_run(run_id)
+        if baseline_id is None:
+            return [], []
+        old = {tuple(el[c] for c in _CASE): el['us'] for el in self.results(baseline_id)}
+        regressions, improvements = [], []
+        for el in self.results(run_id):
+            case = tuple(el[c] for c in _CASE)
+            if case not in old:
+                continue
+            change = Change(*case, old[case], el['us'])
+            if change.ratio > 1 + threshold:
+                regressions.append(change)
+            elif change.ratio < 1 / (1 + threshold):
+                improvements.append(change)
+        regressions.sort(key=lambda el: -el.ratio)
+        improvements.sort(key=lambda el: el.ratio)
+        return regressions, improvements
@@ -0,0 +1,110 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# roofline of a GEMM: the time it needs at least, from the peak matrix
+# throughput of its input dtype and the peak memory bandwidth of the device.
+#   roof = get_roofline()                  # the current device, or 'cpu'
+#   roof.report(m, n, k, 'bf16', 'bf16', us) -> {'tflops', 'gbps', 'efficiency', 'bound'}
+# the peaks are dense datasheet numbers per device (one GCD for gfx90a),
+# AITER_PEAK_TFLOPS / AITER_PEAK_GBPS override them, e.g. for a power capped
+# part, the cpu peaks are measured once.
+
+import os
+import time
+import functools
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+# bytes per element of the dtype names used by the benchmark specs
+DTYPE_BYTES = {
+    'fp32': 4,
+    'bf16': 2,
+    'fp16': 2,
+    'fp8': 1,
+    'i8': 1,
+}
+
+# arch -> (dense matrix TFLOPs per input dtype, HBM GB/s)
+PEAKS = {
+    'gfx942': ({'fp32': 163.4, 'bf16': 1307.4, 'fp16': 1307.4, 'fp8': 2614.9, 'i8': 2614.9}, 5300.0),
+    'gfx90a': ({'fp32': 47.9, 'bf16': 191.5, 'fp16': 191.5, 'i8': 191.5}, 1638.4),
+}
+
+
+def gemm_flops(m, n, k):
+    return 2 * m * n * k
+
+
+def gemm_bytes(m, n, k, dtype, outdtype):
+    '''A, B read once and C written once, scales and bias are not counted'''
+    return (m * k + n * k) * DTYPE_BYTES[dtype] + m * n * DTYPE_BYTES[outdtype]
+
+
+@dataclass
+class Roofline:
+    arch: str
+    tflops: Dict[str, float] = field(default_factory=dict)
+    gbps: float = 0.0
+
+    def peak_tflops(self, dtype) -> Optional[float]:
+        return self.tflops.get(dtype, None)
+
+    def min_us(self, m, n, k, dtype, outdtype):
+        '''(roofline latency in us, 'compute' or 'memory')'''
+        compute_us = gemm_flops(m, n, k) / (self.peak_tflops(dtype) * 1e6) \
+            if self.peak_tflops(dtype) else 0.0
+        memory_us = gemm_bytes(m, n, k, dtype, outdtype) / (self.gbps * 1e3) if self.gbps else 0.0
+        return max(compute_us, memory_us), 'compute' if compute_us >= memory_us else 'memory'
+
+    def report(self, m, n, k, dtype, outdtype, us):
+        min_us, bound = self.min_us(m, n, k, dtype, outdtype)
+        return {'tflops': gemm_flops(m, n, k) / (us * 1e6),
+                'gbps': gemm_bytes(m, n, k, dtype, outdtype) / (us * 1e3),
+                'efficiency': min_us / us if min_us > 0 else None,
+                'bound': bound}
+
+
+def _override(roof):
+    tflops = os.environ.get('AITER_PEAK_TFLOPS', None)
+    gbps = os.environ.get('AITER_PEAK_GBPS', None)
+    if tflops is not None:
+        # a single number for every dtype or dtype=value,dtype=value
+        if '=' in tflops:
+            roof.tflops.update({k: float(v) for k, v in (el.split('=') for el in tflops.split(','))})
+        else:
+            roof.tflops = {el: float(tflops) for el in DTYPE_BYTES}
+    if gbps is not None:
+        roof.gbps = float(gbps)
+    return roof
+
+
+def measure_cpu(size=1024, repeat=3):
+    '''peak fp32 matmul TFLOPs and copy GB/s of this cpu, bf16/fp16 share the fp32 number'''
+    import torch
+    a = torch.randn(size, size)
+    b = torch.randn(size, size)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        torch.mm(a, b)
+        best = min(best, time.perf_counter() - start)
+    tflops = gemm_flops(size, size, size) / best / 1e12
+    src = torch.empty(64 * 1024 * 1024 // 4)
+    dst = torch.empty_like(src)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        dst.copy_(src)
+        best = min(best, time.perf_counter() - start)
+    gbps = 2 * src.numel() * 4 / best / 1e9
+    return Roofline('cpu', {el: tflops for el in DTYPE_BYTES}, gbps)
+
+
+@functools.lru_cache(maxsize=None)
+def get_roofline(device: str = 'cuda') -> Roofline:
+    if device == 'cpu':
+        return _override(measure_cpu())
+    import torch
+    arch = torch.cuda.get_device_properties(device).gcnArchName.split(':')[0]
+    tflops, gbps = PEAKS.get(arch, ({}, 0.0))
+    return _override(Roofline(arch, dict(tflops), gbps))
@@ -0,0 +1,218 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# pool of output and scratch tensors for the GEMM and MoE wrappers, a drop-in
+# for torch.empty that keeps its blocks instead of going through the caching
+# allocator on every call
+#   out = buffer_pool.empty((m, n), dtype=torch.bfloat16, device=x.device)
+# blocks are uint8 tensors of the exact size of the request, kept per device
+# and stream, a tensor is a view of the whole of one, so its storage is no
+# larger than the tensor. a block is free again once no tensor of it is
+# alive, so outputs the caller keeps are never handed out twice. the last
+# block of every (shape, dtype) is tried first.
+# a block is reused on the stream it was handed out on, which orders the
+# work of its next user after the last one. a tensor used on another stream
+# as well has to say so, like for the caching allocator:
+#   buffer_pool.record_stream(out, side_stream)
+# the stream of the next user of the block then waits for the work queued on
+# side_stream until the block was released.
+#   with buffer_pool.static():       # e.g. around cuda graph capture and replay
+# hands out the same buffers in the same order every time the block is
+# entered, whether they are alive or not, so addresses stay fixed. outside
+# of it, requests during graph capture go to torch.empty (the graph's pool).
+#   AITER_BUFFER_POOL=0                  torch.empty everywhere
+#   AITER_BUFFER_POOL_MAX_MB=<n>         free blocks beyond n MB are released (default 1024)
+
+import os
+import math
+import threading
+import contextlib
+import torch
+from aiter import logger
+
+AITER_BUFFER_POOL = int(os.environ.get('AITER_BUFFER_POOL', 1))
+AITER_BUFFER_POOL_MAX_MB = int(os.environ.get('AITER_BUFFER_POOL_MAX_MB', 1024))
+_use_count = getattr(torch._C, '_storage_Use_Count', None)
+
+
+class _Block:
+    __slots__ = ['data', 'refs', 'streams']
+
+    def __init__(self, nbytes, device):
+        self.data = torch.empty(nbytes, dtype=torch.uint8, device=device)
+        # the use count of the storage with no views alive
+        self.refs = self._count()
+        # other streams of its tensors, see record_stream
+        self.streams = set()
+
+    def _count(self):
+        return _use_count(self.data.untyped_storage()._cdata)
+
+    def free(self):
+        return self._count() <= self.refs
+
+    def ready(self, device):
+        '''the current stream waits for the other streams of the released tensors'''
+        if self.streams:
+            current = torch.cuda.current_stream(device)
+            for el in self.streams:
+                current.wait_stream(el)
+            self.streams.clear()
+
+    def view(self, shape, dtype):
+        return self.data.view(dtype).view(shape)
+
+
+class BufferPool:
+
+    def __init__(self, enabled=AITER_BUFFER_POOL, max_bytes=AITER_BUFFER_POOL_MAX_MB << 20):
+        self.enabled = bool(enabled) and _use_count is not None
+        self.max_bytes = max_bytes
+        # (device, stream, nbytes) -> [_Block]
+        self._blocks = {}
+        # (device, stream, shape, dtype) -> the _Block it got last
+        self._last = {}
+        # static mode: [(key, _Block)] in request order, and the position
+        self._static = []
+        self._static_pos = None
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hits = 0
+        self.allocs = 0
+        self.bypass = 0
+        self.bytes_held = 0
+
+    def _stream(self, device):
+        if device.type != 'cuda':
+            return 0
+        return torch.cuda.current_stream(device).cuda_stream
+
+    def empty(self, shape, dtype, device):
+        '''uninitialized tensor of shape, like torch.empty'''
+        device = torch.device(device)
+        if not self.enabled:
+            return torch.empty(shape, dtype=dtype, device=device)
+        shape = tuple(shape) if not isinstance(shape, int) else (shape,)
+        nbytes = math.prod(shape) * dtype.itemsize
+        with self._lock:
+            self.requests += 1
+            if self._static_pos is not None:
+                return self._static_get(shape, dtype, device, nbytes)
+            if device.type == 'cuda' and torch.cuda.is_current_stream_capturing():
+                self.bypass += 1
+                return torch.empty(shape, dtype=dtype, device=device)
+            stream = self._stream(device)
+            key = (device, stream, shape, dtype)
+            block = self._last.get(key, None)
+            if block is None or not block.free():
+                block = None
+                for el in self._blocks.get((device, stream, nbytes), []):
+                    if el.free():
+                        block = el
+                        break
+            if block is None:
+                block = self._alloc(device, stream, nbytes)
+            else:
+                self.hits += 1
+                block.ready(device)
+            self._last[key] = block
+            return block.view(shape, dtype)
+
+    def _alloc(self, device, stream, nbytes):
+        if self.bytes_held + nbytes > self.max_bytes:
+            self._trim(self.max_bytes - nbytes)
+        block = _Block(nbytes, device)
+        self._blocks.setdefault((device, stream, nbytes), []).append(block)
+        self.allocs += 1
+        self.bytes_held += nbytes
+        return block
+
+    def record_stream(self, tensor, stream):
+        '''
+        tensor of the pool is used on stream too, like tensor.record_stream:
+        its block is reused after the work queued on stream by its release
+        '''
+        tensor.record_stream(stream)
+        ptr = tensor.untyped_storage().data_ptr()
+        with self._lock:
+            for blocks in self._blocks.values():
+                for el in blocks:
+                    if el.data.data_ptr() == ptr:
+                        el.streams.add(stream)
+                        return
+
+    def _static_get(self, shape, dtype, device, nbytes):
+        key = (device, shape, dtype)
+        pos = self._static_pos
+        self._static_pos += 1
+        if pos < len(self._static) and self._static[pos][0] == key:
+            self.hits += 1
+            return self._static[pos][1].view(shape, dtype)
+        # a new or changed request sequence, this slot gets its own block
+        block = _Block(nbytes, device)
+        self.allocs += 1
+        if pos < len(self._static):
+            self.bytes_held -= self._static[pos][1].data.numel()
+            self._static[pos] = (key, block)
+        else:
+            self._static.append((key, block))
+        self.bytes_held += block.data.numel()
+        return block.view(shape, dtype)
+
+    @contextlib.contextmanager
+    def static(self):
+        '''the i-th request inside gets the same buffer on every entry'''
+        with self._lock:
+            outer, self._static_pos = self._static_pos, 0
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._static_pos = outer
+
+    def _trim(self, keep_bytes):
+        '''release free dynamic blocks until at most keep_bytes are held'''
+        for key in list(self._blocks):
+            blocks = self._blocks[key]
+            for block in [el for el in blocks if el.free()]:
+                if self.bytes_held <= keep_bytes:
+                    return
+                blocks.remove(block)
+                self.bytes_held -= block.data.numel()
+            if not blocks:
+                del self._blocks[key]
+        self._last = {k: v for k, v in self._last.items()
+                      if v in self._blocks.get((k[0], k[1], v.data.numel()), [])}
+
+    def trim(self, keep_bytes=0):
+        with self._lock:
+            self._trim(keep_bytes)
+
+    def clear(self):
+        '''drop every block, tensors still alive keep their memory'''
+        with self._lock:
+            self._blocks, self._last, self._static = {}, {}, []
+            self.bytes_held = 0
+
+    def stats(self):
+        with self._lock:
+            blocks = [el for v in self._blocks.values() for el in v]
+            in_use = sum(el.data.numel() for el in blocks if not el.free())
+            return {'requests': self.requests,
+                    'hits': self.hits,
+                    'allocs': self.allocs,
+                    'bypass': self.bypass,
+                    'hit_rate': self.hits / self.requests if self.requests else 0.0,
+                    'blocks': len(blocks) + len(self._static),
+                    'static_blocks': len(self._static),
+                    'bytes_held': self.bytes_held,
+                    'bytes_in_use': in_use + sum(el[1].data.numel() for el in self._static)}
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(f'buffer pool: {stats["requests"]} requests, hit rate {stats["hit_rate"]:.1%}, '
+                    f'{stats["blocks"]} blocks, {stats["bytes_held"] / (1 << 20):.1f} MB held, '
+                    f'{stats["bytes_in_use"] / (1 << 20):.1f} MB in use')
+
+
+buffer_pool = BufferPool()
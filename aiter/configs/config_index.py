@@ -0,0 +1,300 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# tuned config csv -> sorted fixed width binary table, looked up through mmap
+#   table = get_config_table(f'{configs_dir}/a8w8_tuned_gemm.csv', ['M', 'N', 'K'])
+#   table.get(128, 1280, 8192) -> {'M': 128, ..., 'kernelName': ..., 'tile_m': 32, ...}
+# the index is (re)compiled next to the csv (or AITER_CONFIG_INDEX_DIR) whenever
+# the csv changes, loading it is an mmap plus a small json header, no pandas.
+# every process maps the same file, so the pages are shared.
+#   python -m aiter.configs.config_index      # compile all tuned configs
+
+import os
+import re
+import csv
+import sys
+import json
+import mmap
+import bisect
+import math
+import struct
+import hashlib
+import functools
+from typing import List, Optional
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+
+MAGIC = b'AITERIDX'
+FORMAT_VERSION = 1
+# magic, version, meta bytes, csv size, csv mtime_ns
+_HEADER = struct.Struct('<8sIIqq')
+# every cell is 8 bytes: int64 for int/bool/string (index into the string table), float64 for float
+_CELL_FMT = {'i': 'q', 'b': 'q', 's': 'q', 'f': 'd'}
+_BOOL = {'True': 1, 'true': 1, 'False': 0, 'false': 0}
+# CK kernel names carry the tile as BLOCKxMxNxK, e.g. a8w8_rowwise_256x16x64x512_...
+_CK_TILE = re.compile(r'(?:^|_)(\d+)x(\d+)x(\d+)x(\d+)(?:_|$)')
+
+# the tuned configs aiter ships, with their lookup keys
+TUNED_CONFIGS = {
+    'a8w8_tuned_gemm.csv': ['M', 'N', 'K'],
+    'a8w8_blockscale_tuned_gemm.csv': ['M', 'N', 'K'],
+    'a8w8_tuned_batched_gemm.csv': ['B', 'M', 'N', 'K'],
+    'bf16_tuned_batched_gemm.csv': ['B', 'M', 'N', 'K'],
+    'asm_a8w8_gemm.csv': ['M', 'N', 'K', 'bias', 'outdtype'],
+    'tuned_gemm.csv': ['M', 'N', 'K', 'bias', 'dtype', 'outdtype', 'scaleAB'],
+}
+
+
+def _is_int(s):
+    try:
+        int(s)
+        return True
+    except ValueError:
+        return False
+
+
+def _is_float(s):
+    try:
+        float(s)
+        return True
+    except ValueError:
+        return False
+
+
+def _column_type(values):
+    filled = [el for el in values if el != '']
+    if not filled:
+        return 's'
+    if all(el in _BOOL for el in filled):
+        return 'b'
+    if len(filled) == len(values) and all(_is_int(el) for el in filled):
+        return 'i'
+    if all(_is_float(el) for el in filled):
+        return 'f'
+    return 's'
+
+
+def _ck_tile(name):
+    m = _CK_TILE.search(name)
+    return [int(el) for el in m.groups()[1:]] if m else None
+
+
+def index_path(csv_path):
+    csv_path = os.path.abspath(csv_path)
+    index_dir = os.environ.get('AITER_CONFIG_INDEX_DIR', None)
+    if index_dir is None and os.access(os.path.dirname(csv_path), os.W_OK):
+        return f'{csv_path}.idx'
+    index_dir = index_dir or os.path.expanduser('~/.aiter/configs')
+    os.makedirs(index_dir, exist_ok=True)
+    tag = hashlib.sha1(csv_path.encode()).hexdigest()[:12]
+    return os.path.join(index_dir, f'{os.path.basename(csv_path)}.{tag}.idx')
+
+
+def compile_config(csv_path: str, keys: List[str], out_path: Optional[str] = None):
+    '''parse the csv once and write the sorted binary table, returns its path'''
+    out_path = out_path or index_path(csv_path)
+    st = os.stat(csv_path)
+    with open(csv_path, newline='') as f:
+        reader = csv.reader(f)
+        header = [el.strip() for el in next(reader, [])]
+        lines = [[el.strip() for el in line] for line in reader if line]
+    missing = [el for el in keys if el not in header]
+    if missing:
+        raise ValueError(f'{csv_path} has no key columns {missing}')
+    columns = keys + [el for el in header if el not in keys]
+    raw = {name: [line[i] if i < len(line) else '' for line in lines]
+           for i, name in enumerate(header)}
+    types = [_column_type(raw[name]) for name in columns]
+
+    # derived CK tile, so lookups do not parse kernelName
+    if 'kernelName' in raw and lines:
+        tiles = [_ck_tile(el) for el in raw['kernelName']]
+        if all(el is not None for el in tiles):
+            for i, name in enumerate(['tile_m', 'tile_n', 'tile_k']):
+                raw[name] = [str(el[i]) for el in tiles]
+                columns.append(name)
+                types.append('i')
+
+    strings = sorted({el for name, t in zip(columns, types) if t == 's' for el in raw[name]})
+    string_id = {el: i for i, el in enumerate(strings)}
+
+    def encode(value, t):
+        if t == 'i':
+            return int(value)
+        if t == 'b':
+            return _BOOL.get(value, 0)
+        if t == 'f':
+            return float(value) if value != '' else math.nan
+        return string_id[value]
+
+    rows = [tuple(encode(raw[name][r], t) for name, t in zip(columns, types))
+            for r in range(len(lines))]
+    # stable, so the last of duplicated keys stays last and wins the lookup
+    rows.sort(key=lambda el: el[:len(keys)])
+
+    meta = json.dumps({'keys': keys,
+                       'columns': columns,
+                       'types': ''.join(types),
+                       'strings': strings,
+                       'rows': len(rows)}).encode()
+    meta += b' ' * (-(_HEADER.size + len(meta)) % 8)
+    row_struct = struct.Struct('<' + ''.join(_CELL_FMT[t] for t in types))
+    tmp = f'{out_path}.{os.getpid()}'
+    with open(tmp, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(meta), st.st_size, st.st_mtime_ns))
+        f.write(meta)
+        for row in rows:
+            f.write(row_struct.pack(*row))
+    os.replace(tmp, out_path)
+    return out_path
+
+
+class ConfigTable:
+    '''read only view of a compiled config index'''
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, meta_size, self.csv_size, self.csv_mtime_ns = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f'{path} is not a config index of version {FORMAT_VERSION}')
+        meta = json.loads(self._mm[_HEADER.size:_HEADER.size + meta_size])
+        self.keys = meta['keys']
+        self.columns = meta['columns']
+        self.types = meta['types']
+        self._strings = meta['strings']
+        self._string_id = {el: i for i, el in enumerate(self._strings)}
+        self._num_rows = meta['rows']
+        self._data = _HEADER.size + meta_size
+        self._row = struct.Struct('<' + ''.join(_CELL_FMT[t] for t in self.types))
+        self._key = struct.Struct('<' + ''.join(_CELL_FMT[t] for t in self.types[:len(self.keys)]))
+        # built on the first nearest() call
+        self._groups = None
+
+    def __len__(self):
+        return self._num_rows
+
+    def _encode_key(self, key):
+        ret = []
+        for value, t in zip(key, self.types):
+            if t == 's':
+                value = self._string_id.get(str(value), None)
+                if value is None:
+                    return None
+            elif t == 'b':
+                value = _BOOL.get(value, 0) if isinstance(value, str) else int(bool(value))
+            elif t == 'i':
+                value = int(value)
+            ret.append(value)
+        return tuple(ret)
+
+    def _decode(self, cells):
+        ret = {}
+        for name, t, value in zip(self.columns, self.types, cells):
+            if t == 's':
+                value = self._strings[value]
+            elif t == 'b':
+                value = bool(value)
+            ret[name] = value
+        return ret
+
+    def _key_at(self, i):
+        return self._key.unpack_from(self._mm, self._data + i * self._row.size)
+
+    def get(self, *key, default=None) -> Optional[dict]:
+        if len(key) != len(self.keys):
+            raise ValueError(f'expect key {self.keys}, got {key}')
+        key = self._encode_key(key)
+        if key is None:
+            return default
+        # rightmost match, the last row of duplicated keys wins like in the csv
+        lo, hi = 0, self._num_rows
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) <= key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0 or self._key_at(lo - 1) != key:
+            return default
+        return self._decode(self._row.unpack_from(self._mm, self._data + (lo - 1) * self._row.size))
+
+    def nearest(self, *key, bucket_key='M', default=None) -> Optional[dict]:
+        '''
+        row of the same key apart from bucket_key, with the smallest tuned
+        bucket_key >= the queried one (kernels pad anyway), else the largest
+        '''
+        if self._groups is None:
+            pos = self.keys.index(bucket_key)
+            groups = {}
+            for i in range(self._num_rows):
+                row_key = self._key_at(i)
+                groups.setdefault(row_key[:pos] + row_key[pos + 1:], []).append((row_key[pos], i))
+            self._groups = (pos, {k: sorted(v) for k, v in groups.items()})
+        pos, groups = self._groups
+        key = self._encode_key(key)
+        if key is None:
+            return default
+        group = groups.get(key[:pos] + key[pos + 1:], None)
+        if not group:
+            return default
+        i = bisect.bisect_left(group, (key[pos], -1))
+        if i == len(group):
+            i -= 1
+        else:
+            # the last row of duplicated keys wins like in get()
+            i = bisect.bisect_right(group, (group[i][0], self._num_rows)) - 1
+        return self._decode(self._row.unpack_from(self._mm, self._data + group[i][1] * self._row.size))
+
+    def rows(self):
+        for i in range(self._num_rows):
+            yield self._decode(self._row.unpack_from(self._mm, self._data + i * self._row.size))
+
+
+def _is_stale(table, csv_path, keys):
+    st = os.stat(csv_path)
+    return table.csv_size != st.st_size or \
+        table.csv_mtime_ns != st.st_mtime_ns or \
+        table.keys != list(keys)
+
+
+@functools.lru_cache(maxsize=None)
+def _load(csv_path, keys):
+    path = index_path(csv_path)
+    try:
+        table = ConfigTable(path)
+        if not _is_stale(table, csv_path, keys):
+            return table
+    except (OSError, ValueError, struct.error):
+        pass
+    return ConfigTable(compile_config(csv_path, list(keys), path))
+
+
+def get_config_table(csv_path: str, keys: List[str], reload: bool = False) -> ConfigTable:
+    '''reload: recheck the csv, for long running processes whose csv gets tuned'''
+    csv_path, keys = os.path.abspath(csv_path), tuple(keys)
+    table = _load(csv_path, keys)
+    if reload and _is_stale(table, csv_path, keys):
+        _load.cache_clear()
+        table = _load(csv_path, keys)
+    return table
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="compile the tuned config csv files into lookup indexes")
+    parser.add_argument("--config_dir", default=this_dir,
+                        help="directory holding the tuned csv files")
+    args = parser.parse_args(argv)
+    for name, keys in TUNED_CONFIGS.items():
+        csv_path = os.path.join(args.config_dir, name)
+        if not os.path.exists(csv_path):
+            continue
+        table = get_config_table(csv_path, keys)
+        print(f'{name:<36} {len(table):>6} rows -> {index_path(csv_path)}')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
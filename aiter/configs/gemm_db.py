@@ -0,0 +1,144 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# every tuned GEMM csv merged into one view: for a problem kind and shape,
+# the tuned latency of each backend that has one, fastest first. this is how
+# aiter.gemm compares e.g. the CK and asm a8w8 winners of the same shape.
+#   get_gemm_db().lookup('a8w8', {'M': 128, 'N': 1280, 'K': 8192, 'bias': True, 'outdtype': 'torch.bfloat16'})
+#   python -m aiter.configs.gemm_db           # the merged table, best backend per shape
+# an untuned M is looked up at the nearest tuned M of the same csv, the entry
+# says so, except for the hipBLASLt/rocBLAS solutions, which are exact only. torch free, so the dispatch decisions can be tested anywhere.
+
+import os
+import sys
+import csv
+import functools
+from dataclasses import dataclass
+from typing import List, Optional
+from .config_index import get_config_table, TUNED_CONFIGS, this_dir as config_dir
+
+# (kind, csv, backend) of every tuned csv, a backend of None is the libtype
+# column of the row. kinds: dense, fp8 (per tensor scales), a8w8 (rowwise
+# int8), blockscale (fp8 1x128x128), batched_a8w8, batched_bf16
+SOURCES = [
+    ('dense', 'tuned_gemm.csv', None),
+    ('fp8', 'tuned_gemm.csv', None),
+    ('a8w8', 'a8w8_tuned_gemm.csv', 'ck'),
+    ('a8w8', 'asm_a8w8_gemm.csv', 'asm'),
+    ('blockscale', 'a8w8_blockscale_tuned_gemm.csv', 'ck'),
+    ('batched_a8w8', 'a8w8_tuned_batched_gemm.csv', 'ck'),
+    ('batched_bf16', 'bf16_tuned_batched_gemm.csv', 'ck'),
+]
+# a hipBLASLt/rocBLAS solidx is tuned and checked for its exact shape, the
+# libraries do not check it supports another M, so no nearest rows of them
+EXACT_ONLY = ('hipblaslt', 'rocblas')
+
+
+@dataclass
+class TunedEntry:
+    backend: str
+    us: Optional[float]
+    csv: str
+    # False when the row is of the nearest tuned M
+    exact: bool
+    config: dict
+
+    def __str__(self):
+        us = f'{self.us:.2f}us' if self.us is not None else 'untimed'
+        return f'{self.backend} {us} ({self.csv}{"" if self.exact else ", nearest M " + str(self.config["M"])})'
+
+
+def _key(csv_name, kind, shape):
+    keys = TUNED_CONFIGS[csv_name]
+    # tuned_gemm.csv holds the dense and the per tensor scaled fp8 solutions
+    shape = dict(shape, scaleAB=kind == 'fp8', B=shape.get('B', 1))
+    return keys, tuple(shape[el] for el in keys)
+
+
+def _us(row):
+    us = row.get('us', row.get('soltimes', None))
+    return float(us) if isinstance(us, (int, float)) and us > 0 else None
+
+
+class GemmDB:
+
+    def __init__(self, config_dir: str = config_dir, nearest: bool = True):
+        self.config_dir = config_dir
+        self.nearest = nearest
+
+    def lookup(self, kind: str, shape: dict) -> List[TunedEntry]:
+        '''
+        shape holds the keys of the csv files of kind (B, M, N, K, bias, dtype,
+        outdtype as str of the torch dtype), fastest entry first, untimed last
+        '''
+        entries = []
+        for src_kind, csv_name, backend in SOURCES:
+            path = os.path.join(self.config_dir, csv_name)
+            if src_kind != kind or not os.path.exists(path):
+                continue
+            keys, key = _key(csv_name, kind, shape)
+            table = get_config_table(path, keys)
+            row, exact = table.get(*key), True
+            if row is None and self.nearest:
+                row, exact = table.nearest(*key, bucket_key='M'), False
+            if row is None or (not exact and (backend or row['libtype']) in EXACT_ONLY):
+                continue
+            entries.append(TunedEntry(backend or row['libtype'], _us(row), csv_name, exact, row))
+        return sorted(entries, key=lambda el: (el.us is None, el.us or 0))
+
+    def merged(self, kind: Optional[str] = None):
+        '''{(kind, shape key): [TunedEntry]} of every tuned shape, best first'''
+        ret = {}
+        for src_kind, csv_name, backend in SOURCES:
+            path = os.path.join(self.config_dir, csv_name)
+            if (kind and src_kind != kind) or not os.path.exists(path):
+                continue
+            keys = TUNED_CONFIGS[csv_name]
+            for row in get_config_table(path, keys).rows():
+                if csv_name == 'tuned_gemm.csv' and bool(row['scaleAB']) != (src_kind == 'fp8'):
+                    continue
+                shape = tuple((el, row[el]) for el in ('B', 'M', 'N', 'K') if el in row)
+                ret.setdefault((src_kind, shape), []).append(
+                    TunedEntry(backend or row['libtype'], _us(row), csv_name, True, row))
+        for el in ret.values():
+            el.sort(key=lambda e: (e.us is None, e.us or 0))
+        return ret
+
+
+@functools.lru_cache(maxsize=None)
+def get_gemm_db(config_dir: str = config_dir) -> GemmDB:
+    return GemmDB(config_dir)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="merged view of the tuned GEMM csv files, the best backend of every shape")
+    parser.add_argument("--config_dir", default=config_dir)
+    parser.add_argument("-k", "--kind", default=None, choices=sorted({el[0] for el in SOURCES}))
+    parser.add_argument("-o", "--output", default=None, help="write a csv instead of printing")
+    args = parser.parse_args(argv)
+
+    rows = []
+    for (kind, shape), entries in sorted(GemmDB(args.config_dir).merged(args.kind).items()):
+        best = entries[0]
+        runner_up = entries[1] if len(entries) > 1 else None
+        rows.append({'kind': kind, **dict(shape), 'backend': best.backend, 'us': best.us,
+                     'runner_up': runner_up.backend if runner_up else '',
+                     'runner_up_us': runner_up.us if runner_up else ''})
+    if args.output:
+        fields = ['kind', 'B', 'M', 'N', 'K', 'backend', 'us', 'runner_up', 'runner_up_us']
+        with open(args.output, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        for el in rows:
+            other = f', {el["runner_up"]} {el["runner_up_us"]}us' if el['runner_up'] else ''
+            print(f'{el["kind"]:<13} {el.get("B", 1):>4} {el["M"]:>6} {el["N"]:>6} {el["K"]:>6} '
+                  f'{el["backend"]:<10} {el["us"]}us{other}')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# tuned meta-parameters of the triton fused_moe_kernel, one json table per
+# (E, N, K, topk, dtype, device arch), N the intermediate size, K the model dim
+#   table = get_moe_table(8, 14336, 4096, 2, 'bf16')      # arch of the current device
+#   table.get(M)     # config of the tuned M nearest to M, bisect over precomputed bounds
+#   table.gaps()     # M the table covers only from more than 2x away
+#   python -m aiter.configs.moe_config                    # every table and its gaps
+# a table maps tuned M to {'BLOCK_SIZE_M': .., ..., 'us': ..}, written by
+# aiter.tuning.moe_tune. dtype is bf16, fp16, fp32 or the quant scheme
+# (fp8_w8a8, int8_w8a16, int8_w8a8). tables are searched in
+# AITER_MOE_CONFIG_DIR, then aiter/configs/moe, then as the vllm style
+# E=..,N=..,device_name=..[,dtype=..].json in aiter/configs. every lookup
+# without a table, or served from a tuned M far away, is logged once and
+# kept for get_moe_coverage().
+#   AITER_MOE_ARCH=gfx942    device arch of the tables, default the current device
+
+import os
+import sys
+import json
+import bisect
+import logging
+import tempfile
+import functools
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from .config_index import this_dir
+
+logger = logging.getLogger("aiter")
+
+AITER_MOE_CONFIG_DIR = os.environ.get('AITER_MOE_CONFIG_DIR', '')
+AITER_MOE_ARCH = os.environ.get('AITER_MOE_ARCH', '')
+MOE_CONFIG_DIR = os.path.join(this_dir, 'moe')
+# the meta-parameters a table entry passes to the kernel, the rest is information
+KERNEL_KEYS = ('BLOCK_SIZE_M', 'BLOCK_SIZE_N', 'BLOCK_SIZE_K', 'GROUP_SIZE_M',
+               'num_warps', 'num_stages', 'waves_per_eu', 'matrix_instr_nonkdim', 'kpack')
+# batch sizes a table should cover, those the tuner times by default
+MOE_TUNE_MS = [1, 2, 4, 8, 16, 24, 32, 48, 64, 96, 128, 256, 512, 1024, 1536, 2048, 3072, 4096]
+# a tuned M further than this factor from the queried one is a coverage gap
+GAP_RATIO = 2.0
+
+
+@functools.lru_cache(maxsize=None)
+def get_device_arch() -> str:
+    '''gfx arch of the current device (gfx942, ...), cpu without one'''
+    if AITER_MOE_ARCH:
+        return AITER_MOE_ARCH
+    import torch
+    if not torch.cuda.is_available():
+        return 'cpu'
+    return torch.cuda.get_device_properties(torch.cuda.current_device()).gcnArchName.split(':')[0]
+
+
+@dataclass(frozen=True)
+class MoeConfigKey:
+    E: int
+    N: int
+    K: int
+    topk: int
+    dtype: str
+    arch: str
+
+    @property
+    def file_name(self):
+        return f'E={self.E},N={self.N},K={self.K},topk={self.topk},dtype={self.dtype},arch={self.arch}.json'
+
+    @property
+    def legacy_file_name(self):
+        '''the vllm style name, it has no K, topk or arch, and no dtype for bf16/fp16'''
+        dtype = {'bf16': None, 'fp16': None, 'fp32': 'float32'}.get(self.dtype, self.dtype)
+        return f'E={self.E},N={self.N},device_name=AMD_Instinct_OAM{"" if not dtype else ",dtype=" + dtype}.json'
+
+    def __str__(self):
+        return self.file_name[:-len('.json')]
+
+
+def _ratio(a, b):
+    return max(a, b) / max(min(a, b), 1)
+
+
+class MoeConfigTable:
+
+    def __init__(self, key: MoeConfigKey, configs: Dict[int, dict], path: Optional[str] = None):
+        if not configs:
+            raise ValueError(f'{key}: empty moe config table')
+        self.key = key
+        self.path = path
+        self.Ms = sorted(configs)
+        self.configs = [{k: v for k, v in configs[el].items() if k in KERNEL_KEYS} for el in self.Ms]
+        self.us = [configs[el].get('us', None) for el in self.Ms]
+        # M up to bounds[i] is nearest to Ms[i], ties go to the smaller M
+        self.bounds = [(a + b) / 2 for a, b in zip(self.Ms, self.Ms[1:])]
+
+    def __len__(self):
+        return len(self.Ms)
+
+    def bucket(self, M: int) -> int:
+        '''index of the tuned M nearest to M'''
+        return bisect.bisect_left(self.bounds, M)
+
+    def get(self, M: int) -> dict:
+        return self.configs[self.bucket(M)]
+
+    def gaps(self, Ms: List[int] = MOE_TUNE_MS, ratio: float = GAP_RATIO) -> List[Tuple[int, int]]:
+        '''[(M, tuned M)] of the Ms served by a tuned M more than ratio away'''
+        return [(M, self.Ms[self.bucket(M)]) for M in Ms if _ratio(M, self.Ms[self.bucket(M)]) > ratio]
+
+    @classmethod
+    def load(cls, key: MoeConfigKey, path: str) -> 'MoeConfigTable':
+        with open(path) as f:
+            return cls(key, {int(k): v for k, v in json.load(f).items()}, path)
+
+
+def write_moe_table(key: MoeConfigKey, configs: Dict[int, dict], config_dir: str = MOE_CONFIG_DIR) -> str:
+    '''write configs {M: config} as the table of key, atomically, the path it went to'''
+    os.makedirs(config_dir, exist_ok=True)
+    path = os.path.join(config_dir, key.file_name)
+    fd, tmp = tempfile.mkstemp(dir=config_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump({str(el): configs[el] for el in sorted(configs)}, f, indent=4)
+            f.write('\n')
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    # get_moe_table also caches that there was no table
+    get_moe_table.cache_clear()
+    _misses.pop(key, None)
+    return path
+
+
+def _search_paths(key: MoeConfigKey, config_dir: Optional[str]):
+    dirs = [config_dir] if config_dir else [el for el in [AITER_MOE_CONFIG_DIR, MOE_CONFIG_DIR] if el]
+    paths = [os.path.join(el, key.file_name) for el in dirs]
+    if not config_dir:
+        paths.append(os.path.join(this_dir, key.legacy_file_name))
+    return paths
+
+
+@functools.lru_cache(maxsize=None)
+def get_moe_table(E: int, N: int, K: int, topk: int, dtype: str, arch: Optional[str] = None,
+                  config_dir: Optional[str] = None) -> Optional[MoeConfigTable]:
+    '''the table of the key, None if there is none'''
+    key = MoeConfigKey(E, N, K, topk, dtype, arch or get_device_arch())
+    for path in _search_paths(key, config_dir):
+        if os.path.exists(path):
+            try:
+                table = MoeConfigTable.load(key, path)
+            except (ValueError, OSError) as e:
+                logger.warning(f'moe config: skipping unreadable {path}: {e}')
+                continue
+            logger.info(f'moe config: using {path} for {key}')
+            return table
+    return None
+
+
+# key -> None (no table) or {M: tuned M} of the far away lookups
+_misses: Dict[MoeConfigKey, Optional[Dict[int, int]]] = {}
+
+
+def lookup_moe_config(E: int, N: int, K: int, topk: int, dtype: str, M: int) -> Optional[dict]:
+    '''the tuned config of M, None without a table. misses are logged once'''
+    table = get_moe_table(E, N, K, topk, dtype)
+    if table is None:
+        key = MoeConfigKey(E, N, K, topk, dtype, get_device_arch())
+        if key not in _misses:
+            _misses[key] = None
+            logger.warning(f'moe config: no table for {key}, using the default config')
+        return None
+    i = table.bucket(M)
+    if _ratio(M, table.Ms[i]) > GAP_RATIO:
+        far = _misses.setdefault(table.key, {})
+        if M not in far:
+            far[M] = table.Ms[i]
+            logger.info(f'moe config: {table.key} has no M near {M}, using M={table.Ms[i]}')
+    return table.configs[i]
+
+
+def get_moe_coverage() -> Dict[str, dict]:
+    '''{'missing': [key, ...], 'gaps': {key: {M: tuned M}}} of the lookups so far'''
+    return {'missing': [str(k) for k, v in _misses.items() if v is None],
+            'gaps': {str(k): dict(v) for k, v in _misses.items() if v is not None}}
+
+
+def list_moe_tables(config_dir: str = MOE_CONFIG_DIR) -> List[MoeConfigTable]:
+    tables = []
+    if not os.path.isdir(config_dir):
+        return tables
+    for name in sorted(os.listdir(config_dir)):
+        if not name.endswith('.json'):
+            continue
+        try:
+            fields = dict(el.split('=', 1) for el in name[:-len('.json')].split(','))
+            key = MoeConfigKey(int(fields['E']), int(fields['N']), int(fields['K']), int(fields['topk']),
+                               fields['dtype'], fields['arch'])
+            tables.append(MoeConfigTable.load(key, os.path.join(config_dir, name)))
+        except (KeyError, ValueError, OSError) as e:
+            logger.warning(f'moe config: skipping {name}: {e}')
+    return tables
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="tuned triton moe config tables and their coverage gaps")
+    parser.add_argument("--config_dir", default=AITER_MOE_CONFIG_DIR or MOE_CONFIG_DIR)
+    parser.add_argument("-M", type=int, nargs='+', default=MOE_TUNE_MS, help="batch sizes to check")
+    parser.add_argument("--ratio", type=float, default=GAP_RATIO)
+    args = parser.parse_args(argv)
+
+    tables = list_moe_tables(args.config_dir)
+    if not tables:
+        print(f'no moe config tables in {args.config_dir}')
+    for table in tables:
+        gaps = table.gaps(args.M, args.ratio)
+        print(f'{table.key}: {len(table)} tuned M {table.Ms[0]}..{table.Ms[-1]}, '
+              + (', '.join(f'{M}->{tuned}' for M, tuned in gaps) if gaps else 'no gaps'))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
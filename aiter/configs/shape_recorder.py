@@ -0,0 +1,118 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# frequency weighted record of the GEMM shapes that are not tuned
+#   AITER_RECORD_UNTUNED=<dir>   record every GEMM family into <dir>/<untuned csv>
+#   AITER_TUNE_GEMM=1            same, into aiter/configs, as gradlib/README describes
+#   AITER_RECORD_INTERVAL=30     seconds between two flushes
+# the forward pass only bumps a counter in a dict, no lock and no I/O. a daemon
+# thread swaps the dict out and merges it into the csv files, shapes that got
+# tuned in the meantime are dropped there. increments racing a swap may be
+# lost, which does not matter for a frequency.
+# python -m aiter.configs.tune_recorded feeds the hottest shapes to the tuners.
+
+import os
+import csv
+import time
+import atexit
+import logging
+import threading
+from typing import List, Optional
+from .config_index import get_config_table, this_dir
+
+logger = logging.getLogger("aiter")
+
+COUNT = 'count'
+
+
+def untuned_name(csv_path):
+    '''a8w8_tuned_gemm.csv -> a8w8_untuned_gemm.csv, asm_a8w8_gemm.csv -> asm_a8w8_gemm_untuned.csv'''
+    name = os.path.basename(csv_path)
+    if 'tuned' in name:
+        return name.replace('tuned', 'untuned', 1)
+    return name.replace('.csv', '_untuned.csv')
+
+
+def read_recorded(path, keys):
+    '''{key as str tuple: count} of a recorded untuned csv'''
+    if not os.path.exists(path):
+        return {}
+    ret = {}
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f, skipinitialspace=True):
+            key = tuple(row[el].strip() for el in keys)
+            ret[key] = ret.get(key, 0) + int(row.get(COUNT) or 1)
+    return ret
+
+
+class ShapeRecorder:
+
+    def __init__(self, out_dir: Optional[str] = None, interval: float = 30.0):
+        self.out_dir = out_dir
+        self.enabled = out_dir is not None
+        self.interval = interval
+        # tuned csv path -> key names / {key: count}
+        self._keys = {}
+        self._counts = {}
+        self._thread = None
+        # serializes flushes, record() never takes it
+        self._flush_lock = threading.Lock()
+
+    def record(self, csv_path: str, keys: List[str], key: tuple):
+        counts = self._counts.get(csv_path, None)
+        if counts is None:
+            self._keys[csv_path] = keys
+            counts = self._counts.setdefault(csv_path, {})
+        counts[key] = counts.get(key, 0) + 1
+        if self._thread is None:
+            self._start()
+
+    def _start(self):
+        def loop():
+            while True:
+                time.sleep(self.interval)
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.warning(f'failed to flush recorded shapes: {e}')
+        self._thread = threading.Thread(target=loop, name='aiter-shape-recorder', daemon=True)
+        self._thread.start()
+
+    def flush(self):
+        with self._flush_lock:
+            counts_by_csv, self._counts = self._counts, {}
+            for csv_path, counts in counts_by_csv.items():
+                # list() of a dict is a single C call, safe against record()
+                self._merge(csv_path, self._keys[csv_path], list(counts.items()))
+
+    def _merge(self, csv_path, keys, counts):
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = os.path.join(self.out_dir, untuned_name(csv_path))
+        merged = read_recorded(path, keys)
+        for key, cnt in counts:
+            key = tuple(str(el) for el in key)
+            merged[key] = merged.get(key, 0) + cnt
+        if os.path.exists(csv_path):
+            table = get_config_table(csv_path, keys, reload=True)
+            merged = {k: v for k, v in merged.items() if table.get(*k) is None}
+        tmp = f'{path}.{os.getpid()}'
+        with open(tmp, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(keys + [COUNT])
+            for key, cnt in sorted(merged.items(), key=lambda el: el[1], reverse=True):
+                writer.writerow(list(key) + [cnt])
+        os.replace(tmp, path)
+
+
+def _default_out_dir():
+    if os.environ.get('AITER_RECORD_UNTUNED', None):
+        return os.environ['AITER_RECORD_UNTUNED']
+    if int(os.environ.get('AITER_TUNE_GEMM', 0)):
+        return this_dir
+    return None
+
+
+shape_recorder = ShapeRecorder(_default_out_dir(),
+                               float(os.environ.get('AITER_RECORD_INTERVAL', 30)))
+if shape_recorder.enabled:
+    atexit.register(shape_recorder.flush)
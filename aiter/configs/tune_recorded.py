@@ -0,0 +1,111 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# tune the hottest shapes shape_recorder wrote, hottest first, with the tuner of
+# each GEMM family. the tuners merge their results into the tuned csv, the next
+# flush of the recorder drops them from the record.
+#   python -m aiter.configs.tune_recorded --record_dir /tmp/shapes --top 16
+#   python -m aiter.configs.tune_recorded --record_dir /tmp/shapes --watch 600
+#   python -m aiter.configs.tune_recorded --record_dir /tmp/shapes --dry_run
+# new CK configs need a rebuild of the module, new hipBLASLt ones a restart.
+
+import os
+import sys
+import csv
+import time
+import argparse
+import subprocess
+from .config_index import get_config_table, TUNED_CONFIGS, this_dir
+from .shape_recorder import untuned_name, read_recorded
+
+AITER_ROOT = os.path.dirname(os.path.dirname(this_dir))
+
+# tuned csv -> tuner command, relative to the aiter root.
+# asm_a8w8_gemm.csv is recorded too but has no tuner yet.
+TUNERS = {
+    'a8w8_tuned_gemm.csv':
+        ['csrc/ck_gemm_a8w8/gemm_a8w8_tune.py', '-i', '{untuned}', '-o', '{tuned}', '-k'],
+    'a8w8_blockscale_tuned_gemm.csv':
+        ['csrc/ck_gemm_a8w8_blockscale/gemm_a8w8_blockscale_tune.py', '-i', '{untuned}', '-o', '{tuned}', '-k'],
+    'a8w8_tuned_batched_gemm.csv':
+        ['csrc/ck_batched_gemm_a8w8/batched_gemm_a8w8_tune.py', '-i', '{untuned}', '-o', '{tuned}', '-k'],
+    'bf16_tuned_batched_gemm.csv':
+        ['csrc/ck_batched_gemm_bf16/batched_gemm_bf16_tune.py', '-i', '{untuned}', '-o', '{tuned}', '-k'],
+    'tuned_gemm.csv':
+        ['gradlib/gradlib/gemm_tuner.py', '--input_file', '{untuned}', '--tuned_file', '{tuned}'],
+}
+
+
+def plan(record_dir, config_dir=this_dir, top=16, families=None):
+    '''{tuned csv name: [(key, count), ...]}, the hottest shapes still not tuned'''
+    ret = {}
+    for name in TUNERS:
+        if families and name not in families:
+            continue
+        keys = TUNED_CONFIGS[name]
+        recorded = read_recorded(os.path.join(record_dir, untuned_name(name)), keys)
+        tuned_csv = os.path.join(config_dir, name)
+        if recorded and os.path.exists(tuned_csv):
+            table = get_config_table(tuned_csv, keys, reload=True)
+            recorded = {k: v for k, v in recorded.items() if table.get(*k) is None}
+        shapes = sorted(recorded.items(), key=lambda el: el[1], reverse=True)
+        if shapes:
+            ret[name] = shapes[:top] if top else shapes
+    return ret
+
+
+def write_untuned(path, keys, shapes):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(keys)
+        writer.writerows([list(key) for key, _ in shapes])
+
+
+def tune(record_dir, config_dir=this_dir, top=16, families=None, dry_run=False):
+    '''runs the tuners of one round, returns the number of shapes sent to them'''
+    num = 0
+    for name, shapes in plan(record_dir, config_dir, top, families).items():
+        untuned = os.path.join(record_dir, f'queue_{untuned_name(name)}')
+        write_untuned(untuned, TUNED_CONFIGS[name], shapes)
+        cmd = [sys.executable] + [el.format(untuned=untuned, tuned=os.path.join(config_dir, name))
+                                  for el in TUNERS[name]]
+        print(f'[aiter] {name}: tune {len(shapes)} shapes, hottest {shapes[0][0]} x{shapes[0][1]}')
+        print(' '.join(cmd))
+        num += len(shapes)
+        if dry_run:
+            continue
+        ret = subprocess.run(cmd, cwd=AITER_ROOT)
+        if ret.returncode != 0:
+            print(f'[aiter] {name}: tuner failed with {ret.returncode}')
+    return num
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="tune the hottest untuned GEMM shapes recorded by AITER_RECORD_UNTUNED")
+    parser.add_argument("--record_dir", required=True,
+                        help="the AITER_RECORD_UNTUNED dir of the workload")
+    parser.add_argument("--config_dir", default=this_dir,
+                        help="directory of the tuned csv files the results are merged into")
+    parser.add_argument("--top", type=int, default=16,
+                        help="shapes per family and round, 0 for all")
+    parser.add_argument("-f", "--families", nargs='+', default=None, choices=list(TUNERS),
+                        help="only tune these tuned csv files")
+    parser.add_argument("--watch", type=float, default=0,
+                        help="keep tuning every WATCH seconds, as a background queue")
+    parser.add_argument("--dry_run", action='store_true',
+                        help="print the tuner commands only")
+    args = parser.parse_args(argv)
+
+    while True:
+        num = tune(args.record_dir, args.config_dir, args.top, args.families, args.dry_run)
+        if not args.watch:
+            break
+        if num == 0:
+            print(f'[aiter] nothing to tune, next round in {args.watch}s')
+        time.sleep(args.watch)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
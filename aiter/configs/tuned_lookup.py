@@ -0,0 +1,158 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# tuned config lookup with a fallback for shapes that are not tuned
+#   AITER_GEMM_LOOKUP=nearest (default)  untuned M is bucketed to the nearest
+#                                        tuned M of the same (N, K, ...)
+#   AITER_GEMM_LOOKUP=exact              only exact hits, the old behavior
+# the CK wrappers only take the splitK of the nearest M when the CK dispatcher
+# runs its kernel too, the one of the padded M (ck_splitK). hipblaslt and
+# rocblas solutions are checked for their M only, tuned_gemm looks them up
+# exactly (nearest=False).
+# a shape without any tuned M of its (N, K, ...) runs the heuristic of the CK
+# dispatcher. with AITER_GEMM_COST_MODEL=1 (the shipped model) or =<json> it
+# gets the kernel and splitK the learned cost model (aiter/tuning/cost_model.py)
+# expects fastest instead. the dispatcher of the tuned instances does not have
+# that kernel, the CK wrappers run it by kernelId through the tune module of
+# the family (bf16 out without bias only), only when that module is already
+# built (aiter-prebuild --with_tune), a forward never builds it.
+# every miss is logged once, shape_recorder writes how often each shape ran
+# (AITER_RECORD_UNTUNED=<dir>) for the tuners.
+
+import os
+import logging
+import functools
+import importlib.util
+from typing import Callable, List, Optional
+from .config_index import get_config_table
+from .shape_recorder import untuned_name
+
+logger = logging.getLogger("aiter")
+
+AITER_GEMM_LOOKUP = os.environ.get('AITER_GEMM_LOOKUP', 'nearest')
+AITER_GEMM_COST_MODEL = os.environ.get('AITER_GEMM_COST_MODEL', '0')
+
+# CK family -> the kernels_list its tune module is built from (under csrc), the tune module
+TUNE_MODULES = {
+    'a8w8_tuned_gemm.csv': ('ck_gemm_a8w8/gemm_a8w8_common.py', 'module_gemm_a8w8_tune'),
+    'a8w8_tuned_batched_gemm.csv': ('ck_batched_gemm_a8w8/batched_gemm_a8w8_common.py',
+                                    'module_batched_gemm_a8w8_tune'),
+    'bf16_tuned_batched_gemm.csv': ('ck_batched_gemm_bf16/batched_gemm_bf16_common.py',
+                                    'module_batched_gemm_bf16_tune'),
+}
+
+# csv_path -> (keys, {untuned key: nearest tuned key or None})
+_untuned = {}
+
+
+def record_untuned(csv_path: str, keys: List[str], key: tuple, nearest: Optional[tuple] = None):
+    _, shapes = _untuned.setdefault(csv_path, (keys, {}))
+    if key not in shapes:
+        shapes[key] = nearest
+        logger.info(f'{os.path.basename(csv_path)}: {dict(zip(keys, key))} is not tuned, '
+                    f'{"use " + str(nearest) if nearest else "no fallback"}')
+
+
+def get_untuned_shapes():
+    '''{untuned csv name: [key dict, ...]} of every miss so far'''
+    return {untuned_name(csv_path): [dict(zip(keys, key)) for key in shapes]
+            for csv_path, (keys, shapes) in _untuned.items()}
+
+
+@functools.lru_cache(maxsize=None)
+def _kernel_ids(family: str) -> dict:
+    '''kernelName -> kernelId of the tune module of family, from its kernels_list'''
+    from ..jit.core import AITER_CSRC_DIR
+    path = f'{AITER_CSRC_DIR}/{TUNE_MODULES[family][0]}'
+    spec = importlib.util.spec_from_file_location(os.path.basename(path)[:-3], path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return {kernel.name: i for i, kernel in module.kernels_list.items()}
+
+
+@functools.lru_cache(maxsize=None)
+def _tune_module_built(md_name: str) -> bool:
+    from ..jit.core import is_module_up_to_date
+    if not is_module_up_to_date(md_name, md_name):
+        logger.info(f'{md_name} is not built, untuned shapes run the CK heuristic')
+        return False
+    return True
+
+
+def predict_tuned(csv_path: str, keys: List[str], key: tuple) -> Optional[dict]:
+    '''config of the kernel the cost model expects fastest with its kernelId, marked predicted'''
+    family = os.path.basename(csv_path)
+    if AITER_GEMM_COST_MODEL == '0' or family not in TUNE_MODULES:
+        return None
+    try:
+        from ..tuning.cost_model import get_cost_model, parse_kernel, MODEL_PATH
+    except ImportError:
+        # the model needs numpy
+        return None
+    model = get_cost_model(MODEL_PATH if AITER_GEMM_COST_MODEL == '1' else AITER_GEMM_COST_MODEL)
+    if model is None or not _tune_module_built(TUNE_MODULES[family][1]):
+        return None
+    config = dict(zip(keys, key))
+    best = model.best_kernel(family, (config.get('B', 1), config['M'], config['N'], config['K']))
+    if best is None:
+        return None
+    name, splitK, us = best
+    kernel_id = _kernel_ids(family).get(name, None)
+    if kernel_id is None:
+        # a kernel the tune module can not be asked for
+        return None
+    _, tile_m, tile_n, tile_k, _, _ = parse_kernel(name)
+    config.update({'kernelId': kernel_id, 'splitK': splitK, 'us': us, 'kernelName': name,
+                   'tile_m': tile_m, 'tile_n': tile_n, 'tile_k': tile_k, 'predicted': True})
+    return config
+
+
+def ck_padded_m(M: int) -> int:
+    '''the M the CK rowwise/batched dispatchers look up after the exact one, see gemm_a8w8.cu'''
+    if 1 < M <= 16:
+        return 16
+    if M <= 16384:
+        return 1 if M <= 1 else 1 << (M - 1).bit_length()
+    if M <= 20480:
+        return 20480
+    return M
+
+
+def ck_splitK(config: Optional[dict], M: int, predict: Callable[[int, int, int], int]) -> int:
+    '''
+    splitK for M of a lookup_tuned row of a CK family. the dispatcher picks the
+    kernel of the exact row, else of the row of ck_padded_m(M), else its
+    heuristic: the tuned splitK of an exact row, predict(tile_m, tile_n,
+    tile_k) when the row is the padded one, 0 otherwise, a splitK of another
+    tile than the dispatched kernel's may not be supported by it
+    '''
+    if config is None or config.get('predicted'):
+        return 0
+    if config['M'] == M:
+        return config['splitK']
+    if config['M'] == ck_padded_m(M):
+        return predict(config['tile_m'], config['tile_n'], config['tile_k'])
+    return 0
+
+
+def lookup_tuned(csv_path: str, keys: List[str], key: tuple, bucket_key: str = 'M',
+                 nearest: bool = True) -> Optional[dict]:
+    '''
+    exact row of key, else (AITER_GEMM_LOOKUP=nearest and nearest) the row of
+    the nearest tuned bucket_key, else the cost model's prediction for key.
+    the caller can tell them apart by comparing bucket_key, predictions carry
+    predicted=True
+    '''
+    if not os.path.exists(csv_path):
+        return None
+    table = get_config_table(csv_path, keys)
+    config = table.get(*key)
+    if config is not None:
+        return config
+    if AITER_GEMM_LOOKUP == 'nearest' and nearest:
+        config = table.nearest(*key, bucket_key=bucket_key)
+        if config is None:
+            config = predict_tuned(csv_path, keys, key)
+    record_untuned(csv_path, keys, tuple(key),
+                   tuple(config[el] for el in keys) if config else None)
+    return config
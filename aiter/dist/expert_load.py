@@ -0,0 +1,160 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# per expert load of a moe layer and the expert placement that balances it
+#   load = ExpertLoad(E, device='cuda', snapshot_every=100, group=ep_group)
+#   fused_moe(..., expert_load=load)       # or select_experts / ExpertParallelMoE
+#   plan = plan_placement(load.load(), world_size, redundant=world_size)
+#   plan.placement                          # an ExpertPlacement for ExpertParallelMoE
+# record() adds the (token, expert) pairs of a routing to counters on the
+# device, without a host sync and, for contiguous int32/int64 topk_ids,
+# without allocating, so it also runs inside a cuda graph. every
+# snapshot_every records, or on snapshot(), the counters are copied to the
+# host as one window and start over, the last history windows are kept.
+# under expert parallelism every rank routes its own tokens: with group a
+# snapshot sums the windows of all ranks (an all-reduce on its gloo cpu
+# group, every rank snapshots together), so every rank plans the same
+# placement from the global load. without it the load is of this rank only,
+# and placements planned from it differ between ranks. the pairs of a layer
+# all cost the same gemm flops, so the planner balances pairs: the hot
+# experts get the redundant copies, one at a time to the expert with the
+# most pairs per copy, then the copies go to the ranks heaviest first, each
+# to the least loaded rank with a free slot that has no copy of it yet. a
+# copy takes an even share of its expert's pairs, the round robin of
+# ExpertPlacement.slots.
+
+import heapq
+from collections import deque
+from dataclasses import dataclass
+from typing import List, Sequence
+
+import torch
+import torch.distributed
+
+from .expert_parallel import ExpertPlacement
+
+
+class ExpertLoad:
+    '''the (token, expert) pairs of every expert of one moe layer, counted on the device'''
+
+    def __init__(self, E: int, device='cuda', snapshot_every: int = 0, history: int = 16, group=None):
+        self.E = E
+        # a GroupCoordinator the snapshots sum over
+        self.group = group
+        self.counts = torch.zeros(E, dtype=torch.int64, device=device)
+        self._one = torch.ones(1, dtype=torch.int64, device=device)
+        self.snapshot_every = snapshot_every
+        self.calls = 0
+        # host [E] counts of the last windows, oldest first
+        self.snapshots = deque(maxlen=history)
+
+    def record(self, topk_ids: torch.Tensor):
+        ids = topk_ids.reshape(-1)
+        self.counts.index_add_(0, ids, self._one.expand(ids.numel()))
+        self.calls += 1
+        if self.snapshot_every and self.calls % self.snapshot_every == 0:
+            self.snapshot()
+
+    def snapshot(self) -> torch.Tensor:
+        '''the counts since the last snapshot on the host, of all ranks of group, kept as a window'''
+        window = self.counts.to('cpu', copy=True)
+        self.counts.zero_()
+        if self.group is not None and self.group.world_size > 1:
+            torch.distributed.all_reduce(window, group=self.group.cpu_group)
+        self.snapshots.append(window)
+        return window
+
+    def load(self, decay: float = 1.0) -> torch.Tensor:
+        '''pairs per expert of the kept windows, a window weighted by decay per newer one, float64 [E]'''
+        total = torch.zeros(self.E, dtype=torch.float64)
+        for el in self.snapshots:
+            total = total * decay + el
+        return total
+
+
+def imbalance(load: Sequence[float]) -> float:
+    '''max over mean, 1 is balanced'''
+    load = [float(el) for el in load]
+    mean = sum(load) / max(len(load), 1)
+    return max(load) / mean if mean > 0 else 1.0
+
+
+def rank_load(placement: ExpertPlacement, load: Sequence[float]) -> List[float]:
+    '''the expected pairs of every rank, an expert's pairs split evenly over its copies'''
+    replicas = placement.num_replicas.tolist()
+    return [sum(float(load[e]) / replicas[e] for e in el) for el in placement.experts]
+
+
+def moe_flops(pairs: float, model_dim: int, inter_dim: int, gated: bool = True) -> float:
+    '''gemm flops of the pairs through both gemms of an expert'''
+    return 2.0 * pairs * model_dim * inter_dim * (3 if gated else 2)
+
+
+@dataclass
+class PlacementPlan:
+    placement: ExpertPlacement
+    replicas: List[int]  # copies of every expert
+    rank_load: List[float]  # expected pairs of every rank
+
+    @property
+    def imbalance(self) -> float:
+        return imbalance(self.rank_load)
+
+    def __str__(self):
+        hot = [f'{e}x{n}' for e, n in enumerate(self.replicas) if n > 1]
+        return (f'{self.placement.world_size} ranks x {len(self.placement.experts[0])} slots, '
+                f'imbalance {self.imbalance:.3f}, replicated {", ".join(hot) or "none"}')
+
+
+def _replicate(load: List[float], redundant: int, world_size: int) -> List[int]:
+    replicas = [1] * len(load)
+    heap = [(-el, e) for e, el in enumerate(load)]
+    heapq.heapify(heap)
+    for _ in range(redundant):
+        # a rank holds one copy of an expert at most
+        while True:
+            _, e = heapq.heappop(heap)
+            if replicas[e] < world_size:
+                break
+        replicas[e] += 1
+        if replicas[e] < world_size:
+            heapq.heappush(heap, (-load[e] / replicas[e], e))
+    return replicas
+
+
+def plan_placement(load: Sequence[float], world_size: int, redundant: int = 0) -> PlacementPlan:
+    '''
+    the placement of len(load) experts and redundant copies of the hot ones
+    on world_size ranks with the same number of slots, balancing the pairs
+    '''
+    load = [float(el) for el in load]
+    E = len(load)
+    if (E + redundant) % world_size:
+        raise ValueError(f'{E} experts and {redundant} copies do not split over {world_size} ranks')
+    if redundant > E * (world_size - 1):
+        raise ValueError(f'{redundant} copies of {E} experts do not fit one per rank')
+    slots = (E + redundant) // world_size
+    replicas = _replicate(load, redundant, world_size)
+
+    experts = [[] for _ in range(world_size)]
+    loads = [0.0] * world_size
+    copies = sorted(((load[e] / replicas[e], e) for e in range(E) for _ in range(replicas[e])),
+                    key=lambda el: (-el[0], el[1]))
+    for w, e in copies:
+        free = [r for r in range(world_size) if len(experts[r]) < slots and e not in experts[r]]
+        if not free:
+            # the ranks with a free slot all hold e: one of them takes an
+            # expert of the least loaded rank without e, which takes e
+            r = next(r for r in range(world_size) if len(experts[r]) < slots)
+            q = min((q for q in range(world_size) if e not in experts[q]), key=lambda q: (loads[q], q))
+            f = min((f for f in experts[q] if f not in experts[r]), key=lambda f: (load[f] / replicas[f], f))
+            experts[q].remove(f)
+            experts[r].append(f)
+            loads[q] -= load[f] / replicas[f]
+            loads[r] += load[f] / replicas[f]
+            free = [q]
+        r = min(free, key=lambda r: (loads[r], r))
+        experts[r].append(e)
+        loads[r] += w
+    placement = ExpertPlacement.from_experts([sorted(el) for el in experts])
+    return PlacementPlan(placement, replicas, rank_load(placement, load))
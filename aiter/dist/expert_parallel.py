@@ -0,0 +1,244 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# expert parallel moe: every rank of a GroupCoordinator holds some of the
+# experts, the tokens go to the ranks of their experts and back by all-to-all
+#   placement = ExpertPlacement.contiguous(E, group.world_size)
+#   ep = ExpertParallelMoE(group, placement, local_experts(w1[mine], w2[mine]))
+#   out = ep(hidden, topk_weights, topk_ids)    # topk_ids of the global experts
+# a rank counts its (token, expert) pairs per destination rank, exchanges the
+# counts, permutes the rows by (rank, local expert) and all-to-alls them with
+# those split sizes. the received rows run through the local experts and go
+# back the same way, the sender sums them with the routing weights, which
+# never travel. the tokens go in num_chunks pieces with async all-to-alls, so
+# the exchange of one piece overlaps the experts of the previous one.
+# an expert placed on several ranks has its pairs spread round robin over
+# the copies, the i-th pair of the expert on a rank to copy i + rank.
+# aiter.dist.expert_load plans such placements from the routing.
+# capacity_factor caps the pairs a copy takes from a rank at
+# ceil(capacity_factor * tokens * topk / copies), in token order, the dropped
+# pairs add nothing to their token. a gloo group runs on cpu tensors.
+
+import math
+from typing import Callable, List, Optional
+
+import torch
+
+# (rows, local expert ids) -> the rows through their experts
+ExpertFn = Callable[[torch.Tensor, torch.Tensor], torch.Tensor]
+
+
+def _position(keys: torch.Tensor, n: int) -> torch.Tensor:
+    '''the index of every element among the elements of its key in [0, n), in order'''
+    order = torch.argsort(keys, stable=True)
+    counts = torch.bincount(keys, minlength=n)
+    starts = torch.cumsum(counts, 0) - counts
+    pos = torch.empty_like(order)
+    pos[order] = torch.arange(order.numel(), device=order.device) - starts[keys[order]]
+    return pos
+
+
+class ExpertPlacement:
+    '''
+    the experts of every rank, an expert on several ranks is replicated and
+    its pairs go to the replicas round robin. slot s is local expert
+    slot_local[s] of rank slot_rank[s], a copy of expert slot_expert[s]
+    '''
+
+    def __init__(self, expert_rank: List[int], world_size: int):
+        if any(not 0 <= el < world_size for el in expert_rank):
+            raise ValueError(f'expert placement {expert_rank} has ranks outside of {world_size}')
+        self._build([[e for e, r in enumerate(expert_rank) if r == rank] for rank in range(world_size)])
+
+    def _build(self, experts: List[List[int]]):
+        self.world_size = len(experts)
+        self.experts = [list(el) for el in experts]
+        E = max(max(el, default=-1) for el in experts) + 1
+        slots = [(e, rank, i) for rank, el in enumerate(experts) for i, e in enumerate(el)]
+        replicas = [[s for s, el in enumerate(slots) if el[0] == e] for e in range(E)]
+        missing = [e for e in range(E) if not replicas[e]]
+        if missing:
+            raise ValueError(f'expert placement has no rank for experts {missing}')
+        self.slot_expert, self.slot_rank, self.slot_local = \
+            (torch.tensor(el, dtype=torch.long) for el in zip(*slots))
+        self.num_replicas = torch.tensor([len(el) for el in replicas], dtype=torch.long)
+        # [E, max replicas] slots of every expert, padded with its first one
+        width = int(self.num_replicas.max())
+        self.replica_slots = torch.tensor([el + el[:1] * (width - len(el)) for el in replicas], dtype=torch.long)
+        self.max_local = max(len(el) for el in experts)
+
+    @classmethod
+    def contiguous(cls, E: int, world_size: int) -> 'ExpertPlacement':
+        '''experts [r * E / world_size, (r + 1) * E / world_size) on rank r'''
+        if E % world_size:
+            raise ValueError(f'{E} experts do not split over {world_size} ranks')
+        return cls([e // (E // world_size) for e in range(E)], world_size)
+
+    @classmethod
+    def from_experts(cls, experts: List[List[int]]) -> 'ExpertPlacement':
+        '''the placement of the global experts of every rank, in local index order'''
+        placement = cls.__new__(cls)
+        placement._build(experts)
+        return placement
+
+    @property
+    def E(self):
+        return self.num_replicas.numel()
+
+    @property
+    def num_slots(self):
+        return self.slot_expert.numel()
+
+    def local_experts(self, rank: int) -> List[int]:
+        '''global ids of the experts on rank, in local index order'''
+        return self.experts[rank]
+
+    def slots(self, experts: torch.Tensor, offset: int = 0) -> torch.Tensor:
+        '''
+        the slot of every (token, expert) pair of the flat experts: the i-th
+        pair of an expert goes to its copy (i + offset) % copies, the ranks
+        pass their rank as offset to start on different copies
+        '''
+        device = experts.device
+        pos = _position(experts, self.E)
+        pick = (pos + offset) % self.num_replicas.to(device)[experts]
+        return self.replica_slots.to(device)[experts, pick]
+
+    def expert_mask(self, rank: int) -> torch.Tensor:
+        '''the expert_mask of asm_moe / moe_sorting_ck for rank, [E] int32'''
+        if int(self.num_replicas.max()) > 1:
+            # every rank with a copy would add the whole expert to the all-reduce
+            raise ValueError('a placement with replicated experts has no expert_mask')
+        mask = torch.zeros(self.E, dtype=torch.int32)
+        mask[self.experts[rank]] = 1
+        return mask
+
+    def __eq__(self, other):
+        return isinstance(other, ExpertPlacement) and self.experts == other.experts
+
+    def __repr__(self):
+        return f'ExpertPlacement({self.experts})'
+
+
+def local_experts(w1: torch.Tensor, w2: torch.Tensor, activation: str = 'silu', **kwargs) -> ExpertFn:
+    '''the expert fn of the local weights w1 [E_local, N, K], w2 [E_local, K, N / 2] on fused_experts'''
+    from aiter.fused_moe_core import fused_experts
+
+    def run(x, ids):
+        if x.shape[0] == 0:
+            return x.new_empty(x.shape)
+        ones = torch.ones(x.shape[0], 1, dtype=torch.float32, device=x.device)
+        return fused_experts(x, w1, w2, ones, ids.view(-1, 1).to(torch.int32), activation=activation, **kwargs)
+    return run
+
+
+class ExpertParallelMoE:
+    '''
+    moe layer over the experts of placement, expert_fn runs the experts of
+    this rank. every rank of the group calls it with the same num_chunks,
+    the routing of a call goes to expert_load when given
+    '''
+
+    def __init__(self, group, placement: ExpertPlacement, expert_fn: ExpertFn,
+                 capacity_factor: Optional[float] = None, num_chunks: int = 1, expert_load=None):
+        if placement.world_size != group.world_size:
+            raise ValueError(f'placement of {placement.world_size} ranks on a group of {group.world_size}')
+        self.group = group
+        self.placement = placement
+        self.expert_fn = expert_fn
+        self.capacity_factor = capacity_factor
+        self.num_chunks = num_chunks
+        self.expert_load = expert_load
+        # pairs of the last call: sent, received and dropped by the capacity
+        self.stats = {'sent': 0, 'received': 0, 'dropped': 0}
+
+    def capacity(self, tokens: int, topk: int) -> Optional[int]:
+        '''pairs an expert slot takes from this rank, None without a capacity factor'''
+        if self.capacity_factor is None:
+            return None
+        return max(1, math.ceil(self.capacity_factor * tokens * topk / self.placement.num_slots))
+
+    def _keep(self, slots: torch.Tensor, capacity: int) -> torch.Tensor:
+        '''mask of the pairs within the capacity of their slot, in token order'''
+        return _position(slots, self.placement.num_slots) < capacity
+
+    def _route(self, topk_ids: torch.Tensor):
+        '''per chunk: the token of every sent pair, in send order, and the pair counts [world, max_local]'''
+        tokens, topk = topk_ids.shape
+        device = topk_ids.device
+        p = self.placement
+        slots = p.slots(topk_ids.reshape(-1).long(), self.group.rank_in_group)
+        pairs = torch.arange(slots.numel(), device=device)
+        capacity = self.capacity(tokens, topk)
+        keep = self._keep(slots, capacity) if capacity is not None else None
+        bins = (p.slot_rank.to(device) * p.max_local + p.slot_local.to(device))[slots]
+        routes = []
+        for chunk in torch.arange(tokens, device=device).tensor_split(self.num_chunks):
+            lo, hi = (chunk[0].item(), chunk[-1].item() + 1) if chunk.numel() else (0, 0)
+            sel = pairs[lo * topk:hi * topk]
+            if keep is not None:
+                sel = sel[keep[sel]]
+            order = sel[torch.argsort(bins[sel], stable=True)]
+            counts = torch.bincount(bins[sel], minlength=p.world_size * p.max_local)
+            routes.append((order, counts.view(p.world_size, p.max_local)))
+        dropped = 0 if keep is None else int((~keep).sum())
+        return routes, dropped
+
+    def _exchange_counts(self, counts: torch.Tensor) -> torch.Tensor:
+        '''[chunks, world, max_local] sent to each rank -> received from each rank'''
+        send = counts.transpose(0, 1).contiguous()
+        return self.group.all_to_all(send).view_as(send).transpose(0, 1)
+
+    def __call__(self, hidden_states: torch.Tensor, topk_weights: torch.Tensor,
+                 topk_ids: torch.Tensor) -> torch.Tensor:
+        tokens, topk = topk_ids.shape
+        p = self.placement
+        if self.expert_load is not None:
+            self.expert_load.record(topk_ids)
+        routes, dropped = self._route(topk_ids)
+        send_counts = torch.stack([el[1] for el in routes])
+        recv_counts = self._exchange_counts(send_counts.to(self.group.device))
+        # one host sync for the split sizes of every chunk
+        send_splits = send_counts.sum(2).tolist()
+        recv_splits = recv_counts.sum(2).tolist()
+        local_ids = torch.arange(p.max_local, device=hidden_states.device).repeat(p.world_size)
+        weights = topk_weights.reshape(-1).float()
+        out = torch.zeros(hidden_states.shape, dtype=torch.float32, device=hidden_states.device)
+
+        def dispatch(c):
+            order = routes[c][0]
+            return self.group.all_to_all(hidden_states[order // topk], recv_splits[c], send_splits[c],
+                                         async_op=True)
+
+        def combine(c, rows):
+            return self.group.all_to_all(rows, send_splits[c], recv_splits[c], async_op=True)
+
+        def accumulate(c, rows):
+            order = routes[c][0]
+            out.index_add_(0, order // topk, rows.float() * weights[order].unsqueeze(1))
+
+        pending = dispatch(0)
+        combining = None
+        for c in range(self.num_chunks):
+            # the next chunk is on the way while this one runs
+            upcoming = dispatch(c + 1) if c + 1 < self.num_chunks else None
+            rows, work = pending
+            if work is not None:
+                work.wait()
+            ids = local_ids.repeat_interleave(recv_counts[c].reshape(-1).to(local_ids.device))
+            done = combine(c, self.expert_fn(rows, ids))
+            if combining is not None:
+                accumulate(*_wait(combining))
+            combining = (c, done)
+            pending = upcoming
+        accumulate(*_wait(combining))
+        self.stats = {'sent': sum(map(sum, send_splits)), 'received': sum(map(sum, recv_splits)),
+                      'dropped': dropped}
+        return out.to(hidden_states.dtype)
+
+
+def _wait(combining):
+    c, (rows, work) = combining
+    if work is not None:
+        work.wait()
+    return c, rows
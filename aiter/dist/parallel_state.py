@@ -195,19 +195,17 @@ class GroupCoordinator:
         assert self.cpu_group is not None
         assert self.device_group is not None
 
-        self.device = torch.device(f"cuda:{local_rank}")
-        # if current_platform.is_cuda_alike():
-        #     self.device = torch.device(f"cuda:{local_rank}")
-        # else:
-        #     self.device = torch.device("cpu")
+        # a gloo device group runs on cpu tensors, e.g. the expert parallel
+        # tests without a GPU
+        if torch.distributed.get_backend(self.device_group) == "gloo":
+            self.device = torch.device("cpu")
+        else:
+            self.device = torch.device(f"cuda:{local_rank}")
 
         self.use_pynccl = use_pynccl
         self.use_custom_allreduce = use_custom_allreduce
         self.use_tpu_communicator = use_tpu_communicator
 
-        # lazy import to avoid documentation build error
-        from .custom_all_reduce import (
-            CustomAllreduce)
         # from vllm.distributed.device_communicators.pynccl import (
         #     PyNcclCommunicator)
 
@@ -218,8 +216,10 @@ class GroupCoordinator:
                 device=self.device,
             )
 
-        self.ca_comm: Optional[CustomAllreduce] = None
+        self.ca_comm: Optional[Any] = None
         if use_custom_allreduce and self.world_size > 1:
+            # lazy import, it needs the compiled ops
+            from .custom_all_reduce import CustomAllreduce
             # Initialize a custom fast all-reduce implementation.
             self.ca_comm = CustomAllreduce(
                 group=self.cpu_group,
@@ -232,9 +232,9 @@ class GroupCoordinator:
         if use_tpu_communicator and self.world_size > 1:
             self.tpu_communicator = TpuCommunicator(group=self.cpu_group)
 
-        from .shm_broadcast import (MessageQueue)
         self.mq_broadcaster = None
         if use_message_queue_broadcaster and self.world_size > 1:
+            from .shm_broadcast import MessageQueue
             self.mq_broadcaster = MessageQueue.create_from_process_group(
                 self.cpu_group, 1 << 22, 6)
 
@@ -442,6 +442,34 @@ class GroupCoordinator:
             output_tensor = None
         return output_tensor
 
+    def all_to_all(self,
+                   input_: torch.Tensor,
+                   output_split_sizes: Optional[List[int]] = None,
+                   input_split_sizes: Optional[List[int]] = None,
+                   output: Optional[torch.Tensor] = None,
+                   async_op: bool = False):
+        """
+        All-to-all along dim 0: rank i sends input_split_sizes[i] rows to
+        rank i and receives output_split_sizes[i] rows from it, even splits
+        when they are None.
+        Returns the output, and the work to wait on when async_op.
+        """
+        if output is None:
+            rows = (sum(output_split_sizes) if output_split_sizes is not None
+                    else input_.shape[0])
+            output = input_.new_empty((rows, ) + tuple(input_.shape[1:]))
+        # Bypass the function if we are using only 1 GPU.
+        if self.world_size == 1:
+            output.copy_(input_)
+            return (output, None) if async_op else output
+        work = torch.distributed.all_to_all_single(output,
+                                                   input_,
+                                                   output_split_sizes,
+                                                   input_split_sizes,
+                                                   group=self.device_group,
+                                                   async_op=async_op)
+        return (output, work) if async_op else output
+
     def broadcast(self, input_: torch.Tensor, src: int = 0):
         """Broadcast the input tensor.
         NOTE: `src` is the local rank of the source rank.
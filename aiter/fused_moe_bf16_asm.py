@@ -10,6 +10,8 @@ from typing import Any, Callable, Dict, Optional, Tuple
 import aiter
 from aiter import logger
 from aiter import ActivationType
+from aiter.buffer_pool import buffer_pool
+from aiter.fused_moe_core import fused_topk  # noqa: F401
 BLOCK_SIZE_M = 32
 
 
@@ -19,21 +21,11 @@ def moe_sorting_ck(topk_ids, topk_weights, num_experts, model_dim, moebuf_dtype,
     topk = topk_ids.shape[1]
     max_num_tokens_padded = topk_ids.numel() + num_experts * block_size - topk
     max_num_m_blocks = int((max_num_tokens_padded+block_size-1)//block_size)
-    sorted_ids = torch.empty((max_num_tokens_padded, ),
-                             dtype=torch.int32,
-                             device=device)
-    sorted_weights = torch.empty((max_num_tokens_padded, ),
-                                 dtype=torch.float,
-                                 device=device)
-    sorted_expert_ids = torch.empty((max_num_m_blocks, ),
-                                    dtype=torch.int32,
-                                    device=device)
-    num_valid_ids = torch.empty((1),
-                                dtype=torch.int32,
-                                device=device)
-    moe_buf = torch.empty((M, model_dim),
-                          dtype=moebuf_dtype,
-                          device=device)
+    sorted_ids = buffer_pool.empty((max_num_tokens_padded, ), torch.int32, device)
+    sorted_weights = buffer_pool.empty((max_num_tokens_padded, ), torch.float, device)
+    sorted_expert_ids = buffer_pool.empty((max_num_m_blocks, ), torch.int32, device)
+    num_valid_ids = buffer_pool.empty((1, ), torch.int32, device)
+    moe_buf = buffer_pool.empty((M, model_dim), moebuf_dtype, device)
 
     aiter.moe_sorting_fwd(topk_ids, topk_weights, sorted_ids, sorted_weights,  sorted_expert_ids,
                           num_valid_ids, moe_buf, num_experts, block_size, expert_mask)
@@ -310,46 +302,3 @@ def torch_moe(hidden_states, w1, w2, topk_weight, topk_ids,
     return (
         out * topk_weight.view(B, -1, 1)
     ).sum(dim=1).to(dtype)
-
-
-def fused_topk(
-    hidden_states: torch.Tensor,
-    gating_output: torch.Tensor,
-    topk: int,
-    renormalize: bool,
-    topk_ids: Optional[torch.Tensor] = None,
-    topk_weights: Optional[torch.Tensor] = None,
-):
-    assert hidden_states.shape[0] == gating_output.shape[0], (
-        "Number of tokens mismatch")
-
-    M, _ = hidden_states.shape
-
-    if topk_weights is None:
-        topk_weights = torch.empty(M,
-                                   topk,
-                                   dtype=torch.float32,
-                                   device=hidden_states.device)
-    if topk_ids is None:
-        topk_ids = torch.empty(M,
-                               topk,
-                               dtype=torch.int32,
-                               device=hidden_states.device)
-    token_expert_indicies = torch.empty(M,
-                                        topk,
-                                        dtype=torch.int32,
-                                        device=hidden_states.device)
-
-    aiter.topk_softmax(
-        topk_weights,
-        topk_ids,
-        token_expert_indicies,
-        gating_output.float(),  # TODO(woosuk): Optimize this.
-        renormalize
-    )
-    del token_expert_indicies  # Not used. Will be used in the future.
-
-    # if renormalize:
-    #     topk_weights = topk_weights / topk_weights.sum(dim=-1, keepdim=True)
-
-    return topk_weights, topk_ids
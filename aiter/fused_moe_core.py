@@ -0,0 +1,1050 @@
+'''
+ * Copyright © Advanced Micro Devices, Inc. All rights reserved.
+ * Copyright (c) 2024, The vLLM team.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ '''
+
+# one MoE engine behind fused_moe.py, fused_moe_gelu.py and fused_moe_int8_a8w8.py
+#   out = fused_moe(x, w1, w2, gating_output, topk, renormalize)
+#   out = fused_experts(x, w1, w2, topk_weights, topk_ids, activation='gelu_tanh')
+#   out = fused_experts(x, w1, w2, topk_weights, topk_ids, quant='int8_w8a8', w1_scale=s1, w2_scale=s2)
+#   out = fused_experts(x, w1_shuffled, w2_shuffled, topk_weights, topk_ids, backend='asm')
+# w1 is (E, N, K) and w2 (E, K, inter): N == 2 * inter when w1 holds gate and
+# up (g1u1, the activation runs as its own gated op), N == inter otherwise
+# (g1u0, the triton kernel applies it in the epilogue of the first gemm). the
+# K of both may carry the zero padding of VLLM_MOE_PADDING, it follows from
+# the shapes. routing, the tuned config cache, the scratch plan and the token
+# chunking are shared by every activation, quant scheme and backend. the
+# triton backend runs in a MoeWorkspace allocated once per shape and stream
+# and shared by the layers, moe_workspace_stats() reports what they hold and
+# use.
+# the meta-parameters of the triton kernel come from the tables of
+# aiter.configs.moe_config, aiter.tuning.moe_tune writes them. select_experts
+# and fused_moe count the routing into an aiter.dist.expert_load.ExpertLoad.
+#   activations  silu, gelu (erf), gelu_tanh
+#   quant        none, fp8_w8a8 (per tensor a, per expert w), int8_w8a16 (per
+#                channel w), int8_w8a8 (per token a, per channel w, int32 accumulation)
+#   backends     triton, ck_2stages, asm (see fused_moe_bf16_asm), register_moe_backend adds one
+# on cpu tensors the compiled helpers (topk softmax, block alignment, gated
+# activations, moe_sum) have torch stand-ins, the triton backend then runs
+# under TRITON_INTERPRET=1.
+
+import functools
+import os
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+import triton
+import triton.language as tl
+
+from aiter.buffer_pool import buffer_pool
+from aiter.configs.moe_config import lookup_moe_config
+
+FUSED_MOE_PERSISTENT = bool(int(os.getenv("FUSED_MOE_PERSISTENT", "0")))
+ENABLE_MOE_LDS_BYPASS = bool(int(os.getenv("ENABLE_MOE_LDS_BYPASS", "1")))
+# BLOCK_SIZE_M the routing buffers of a workspace are sized for
+MIN_BLOCK_SIZE_M = 16
+MAX_BLOCK_SIZE_M = 256
+# tokens per pass of fused_experts, see https://github.com/vllm-project/vllm/issues/5938
+VLLM_FUSED_MOE_CHUNK_SIZE = 65536
+
+
+def _launch_options():
+    # launch option of the ROCm triton, the interpreter does not know it. read
+    # at launch, TRITON_INTERPRET may be set after this module was imported
+    if os.getenv("TRITON_INTERPRET", "0") == "1":
+        return {}
+    return {'enable_moe_lds_bypass': ENABLE_MOE_LDS_BYPASS}
+
+
+# constexpr codes of the kernels
+ACTIVATIONS = {'none': 0, 'silu': 1, 'gelu': 2, 'gelu_tanh': 3}
+QUANT_SCHEMES = {'none': 0, 'fp8_w8a8': 1, 'int8_w8a16': 2, 'int8_w8a8': 3}
+_COMPUTE_TYPES = {torch.bfloat16: tl.bfloat16, torch.float16: tl.float16, torch.float32: tl.float32}
+
+
+@triton.jit
+def _activation(x, ACTIVATION: tl.constexpr):
+    if ACTIVATION == 1:
+        x = x * tl.sigmoid(x)
+    elif ACTIVATION == 2:
+        x = 0.5 * x * (1.0 + tl.erf(x * 0.7071067811865476))
+    elif ACTIVATION == 3:
+        # tanh is just a scaled sigmoid
+        x = 0.5 * x * (1.0 + (2 * tl.sigmoid(2 * 0.7978845608 * (x + 0.044715 * x * x * x)) - 1))
+    return x
+
+
+@triton.jit
+def _moe_tile(pid_m, pid_n,
+              a_ptr, b_ptr, c_ptr, a_scale_ptr, b_scale_ptr, topk_weights_ptr,
+              sorted_token_ids_ptr, expert_ids_ptr, token_nums_ptr,
+              N, K,
+              stride_am, stride_ak, stride_be, stride_bk, stride_bn,
+              stride_cm, stride_cn, stride_bse, stride_bsn,
+              BLOCK_SIZE_M: tl.constexpr, BLOCK_SIZE_N: tl.constexpr, BLOCK_SIZE_K: tl.constexpr,
+              EVEN_K: tl.constexpr, MUL_ROUTED_WEIGHT: tl.constexpr, top_k: tl.constexpr,
+              compute_type: tl.constexpr, QUANT: tl.constexpr, ACTIVATION: tl.constexpr):
+    '''
+    one BLOCK_SIZE_M x BLOCK_SIZE_N block of C = A[sorted tokens] @ B[expert].T,
+    the rows of a block all belong to the expert of expert_ids[pid_m], only the
+    first token_nums[pid_m] of them are tokens, the rest is padding
+    '''
+    blk_m_range = tl.arange(0, BLOCK_SIZE_M)
+    block_token_num = tl.load(token_nums_ptr + pid_m)
+    token_mask = blk_m_range < block_token_num
+    offs_token = tl.load(sorted_token_ids_ptr + pid_m * BLOCK_SIZE_M + blk_m_range, mask=token_mask, other=0)
+
+    offs_bn = (pid_n * BLOCK_SIZE_N + tl.arange(0, BLOCK_SIZE_N)) % N
+    offs_k = tl.arange(0, BLOCK_SIZE_K)
+    a_ptrs = a_ptr + (offs_token[:, None] // top_k * stride_am + offs_k[None, :] * stride_ak)
+    off_experts = tl.load(expert_ids_ptr + pid_m)
+    b_ptrs = b_ptr + off_experts * stride_be + (offs_k[:, None] * stride_bk + offs_bn[None, :] * stride_bn)
+
+    if QUANT == 3:
+        accumulator = tl.zeros((BLOCK_SIZE_M, BLOCK_SIZE_N), dtype=tl.int32)
+    else:
+        accumulator = tl.zeros((BLOCK_SIZE_M, BLOCK_SIZE_N), dtype=tl.float32)
+    for k in range(0, tl.cdiv(K, BLOCK_SIZE_K)):
+        if EVEN_K:
+            a = tl.load(a_ptrs, mask=token_mask[:, None], other=0)
+            b = tl.load(b_ptrs)
+        else:
+            a = tl.load(a_ptrs, mask=token_mask[:, None] & (offs_k[None, :] < K - k * BLOCK_SIZE_K), other=0)
+            b = tl.load(b_ptrs, mask=offs_k[:, None] < K - k * BLOCK_SIZE_K, other=0)
+        if QUANT == 2:
+            accumulator = tl.dot(a, b.to(compute_type), acc=accumulator)
+        else:
+            accumulator = tl.dot(a, b, acc=accumulator)
+        a_ptrs += BLOCK_SIZE_K * stride_ak
+        b_ptrs += BLOCK_SIZE_K * stride_bk
+
+    if QUANT == 1:
+        accumulator = accumulator * tl.load(a_scale_ptr) * tl.load(b_scale_ptr + off_experts)
+    elif QUANT == 2:
+        accumulator = accumulator * tl.load(b_scale_ptr + off_experts * stride_bse + offs_bn * stride_bsn)[None, :]
+    elif QUANT == 3:
+        a_scale = tl.load(a_scale_ptr + offs_token // top_k, mask=token_mask, other=0)
+        b_scale = tl.load(b_scale_ptr + off_experts * stride_bse + offs_bn * stride_bsn)
+        accumulator = accumulator.to(tl.float32) * a_scale[:, None] * b_scale[None, :]
+    accumulator = _activation(accumulator, ACTIVATION)
+    if MUL_ROUTED_WEIGHT:
+        moe_weight = tl.load(topk_weights_ptr + offs_token, mask=token_mask, other=0)
+        accumulator = accumulator * moe_weight[:, None]
+
+    offs_cn = pid_n * BLOCK_SIZE_N + tl.arange(0, BLOCK_SIZE_N)
+    c_ptrs = c_ptr + stride_cm * offs_token[:, None] + stride_cn * offs_cn[None, :]
+    tl.store(c_ptrs, accumulator.to(compute_type), mask=token_mask[:, None] & (offs_cn[None, :] < N))
+
+
+@triton.heuristics({
+    'EVEN_K': lambda args: args['K'] % args['BLOCK_SIZE_K'] == 0,
+})
+@triton.jit
+def fused_moe_kernel(
+        a_ptr, b_ptr, c_ptr, a_scale_ptr, b_scale_ptr, topk_weights_ptr,
+        sorted_token_ids_ptr, expert_ids_ptr, token_nums_ptr, num_tokens_post_padded_ptr,
+        N, K, EM,
+        stride_am, stride_ak, stride_be, stride_bk, stride_bn,
+        stride_cm, stride_cn, stride_bse, stride_bsn,
+        BLOCK_SIZE_M: tl.constexpr,
+        BLOCK_SIZE_N: tl.constexpr,
+        BLOCK_SIZE_K: tl.constexpr,
+        GROUP_SIZE_M: tl.constexpr,
+        EVEN_K: tl.constexpr,
+        MUL_ROUTED_WEIGHT: tl.constexpr,
+        top_k: tl.constexpr,
+        compute_type: tl.constexpr,
+        QUANT: tl.constexpr,
+        ACTIVATION: tl.constexpr):
+    """
+    Implements the fused computation for a Mixture of Experts (MOE) using
+    token and expert matrices.
+
+    Key Parameters:
+    - A: The input tensor representing tokens with shape (*, K), where '*' can
+        be any shape representing batches and K is the feature dimension of
+        each token.
+    - B: The stacked MOE weight tensor with shape (E, N, K), where E is
+        the number of experts, K is the input feature dimension, and N is
+        the output feature dimension.
+    - C: The output cache tensor with shape (M, topk, N), where M is the
+        total number of tokens post padding, topk is the number of times
+        each token is repeated, and N is the output feature dimension.
+    - sorted_token_ids: A tensor containing the sorted indices of tokens,
+        repeated topk times and arranged by the expert index they are
+        assigned to.
+    - expert_ids: A tensor containing the indices of the expert for each
+        block. It determines which expert matrix from B should be used for
+        each block in A.
+    This kernel performs the multiplication of a token by its corresponding
+    expert matrix as determined by `expert_ids`. The sorting of
+    `sorted_token_ids` by expert index and padding ensures divisibility by
+    BLOCK_SIZE_M, which is necessary to maintain consistency in block matrix
+    multiplication across different blocks processed by the same expert.
+    """
+    # Map program ids `pid` to the block of C it should compute.
+    # This is done in a grouped ordering to promote L2 data reuse.
+    pid = tl.program_id(axis=0)
+    num_pid_m = tl.cdiv(EM, BLOCK_SIZE_M)
+    num_pid_n = tl.cdiv(N, BLOCK_SIZE_N)
+    num_pid_in_group = GROUP_SIZE_M * num_pid_n
+    group_id = pid // num_pid_in_group
+    first_pid_m = group_id * GROUP_SIZE_M
+    group_size_m = min(num_pid_m - first_pid_m, GROUP_SIZE_M)
+    pid_m = first_pid_m + ((pid % num_pid_in_group) % group_size_m)
+    pid_n = (pid % num_pid_in_group) // group_size_m
+    if pid_m * BLOCK_SIZE_M < tl.load(num_tokens_post_padded_ptr):
+        _moe_tile(pid_m, pid_n, a_ptr, b_ptr, c_ptr, a_scale_ptr, b_scale_ptr, topk_weights_ptr,
+                  sorted_token_ids_ptr, expert_ids_ptr, token_nums_ptr, N, K,
+                  stride_am, stride_ak, stride_be, stride_bk, stride_bn, stride_cm, stride_cn,
+                  stride_bse, stride_bsn, BLOCK_SIZE_M, BLOCK_SIZE_N, BLOCK_SIZE_K,
+                  EVEN_K, MUL_ROUTED_WEIGHT, top_k, compute_type, QUANT, ACTIVATION)
+
+
+@triton.heuristics({
+    'EVEN_K': lambda args: args['K'] % args['BLOCK_SIZE_K'] == 0,
+})
+@triton.jit
+def fused_moe_persistent_kernel(
+        a_ptr, b_ptr, c_ptr, a_scale_ptr, b_scale_ptr, topk_weights_ptr,
+        sorted_token_ids_ptr, expert_ids_ptr, token_nums_ptr, num_tokens_post_padded_ptr,
+        N, K, EM,
+        stride_am, stride_ak, stride_be, stride_bk, stride_bn,
+        stride_cm, stride_cn, stride_bse, stride_bsn,
+        BLOCK_SIZE_M: tl.constexpr,
+        BLOCK_SIZE_N: tl.constexpr,
+        BLOCK_SIZE_K: tl.constexpr,
+        GROUP_SIZE_M: tl.constexpr,
+        EVEN_K: tl.constexpr,
+        NUM_SMS: tl.constexpr,
+        MUL_ROUTED_WEIGHT: tl.constexpr,
+        top_k: tl.constexpr,
+        compute_type: tl.constexpr,
+        QUANT: tl.constexpr,
+        ACTIVATION: tl.constexpr):
+    '''fused_moe_kernel with NUM_SMS programs striding over the blocks of C'''
+    num_pid_m = tl.cdiv(EM, BLOCK_SIZE_M)
+    num_pid_n = tl.cdiv(N, BLOCK_SIZE_N)
+    num_pid_in_group = GROUP_SIZE_M * num_pid_n
+    num_tokens_post_padded = tl.load(num_tokens_post_padded_ptr)
+    for tile_id in range(tl.program_id(axis=0), num_pid_m * num_pid_n, NUM_SMS):
+        group_id = tile_id // num_pid_in_group
+        first_pid_m = group_id * GROUP_SIZE_M
+        group_size_m = min(num_pid_m - first_pid_m, GROUP_SIZE_M)
+        pid_m = first_pid_m + ((tile_id % num_pid_in_group) % group_size_m)
+        pid_n = (tile_id % num_pid_in_group) // group_size_m
+        if pid_m * BLOCK_SIZE_M < num_tokens_post_padded:
+            _moe_tile(pid_m, pid_n, a_ptr, b_ptr, c_ptr, a_scale_ptr, b_scale_ptr, topk_weights_ptr,
+                      sorted_token_ids_ptr, expert_ids_ptr, token_nums_ptr, N, K,
+                      stride_am, stride_ak, stride_be, stride_bk, stride_bn, stride_cm, stride_cn,
+                      stride_bse, stride_bsn, BLOCK_SIZE_M, BLOCK_SIZE_N, BLOCK_SIZE_K,
+                      EVEN_K, MUL_ROUTED_WEIGHT, top_k, compute_type, QUANT, ACTIVATION)
+
+
+@triton.jit
+def _abs_max(val1, val2):
+    return tl.maximum(tl.abs(val1), tl.abs(val2))
+
+
+@triton.jit
+def _triton_dynamic_quantize_kernel(
+    output_ptr,
+    input_ptr,
+    scale_ptr,
+    stride_outputm,
+    stride_inputm,
+    n_elements,
+    N: tl.constexpr,
+):
+    pid = tl.program_id(axis=0)
+    offsets = tl.arange(0, N)
+    mask = offsets < n_elements
+    input_vals = tl.load(input_ptr + pid * stride_inputm + offsets, mask=mask, other=1e-6).to(tl.float32)
+    abs_max_f = tl.maximum(tl.reduce(input_vals, 0, _abs_max), 1e-6)
+    dynamic_per_token_scale = 127.0 / abs_max_f
+    precison_mask = tl.where(input_vals > 0, 0.5, -0.5)
+    output_vals = (input_vals * dynamic_per_token_scale + precison_mask).to(tl.int8)
+    tl.store(output_ptr + pid * stride_outputm + offsets, output_vals, mask=mask)
+    tl.store(scale_ptr + pid, abs_max_f / 127.0)
+
+
+def triton_dynamic_quantize(out, input, scale):
+    '''per token int8 of input into out, the dequant scale of every row into scale'''
+    assert input.stride(-1) == 1 and out.stride(-1) == 1, "rows must be contiguous"
+    if input.shape[0] == 0:
+        return
+    # tl.reduce needs a power of two elements
+    _triton_dynamic_quantize_kernel[(input.shape[0], 1, 1)](
+        out, input, scale, out.stride(0), input.stride(0), input.shape[1],
+        N=triton.next_power_of_2(int(input.shape[1])))
+
+
+# routing
+
+
+def fused_topk(
+    hidden_states: torch.Tensor,
+    gating_output: torch.Tensor,
+    topk: int,
+    renormalize: bool,
+    topk_ids: Optional[torch.Tensor] = None,
+    topk_weights: Optional[torch.Tensor] = None,
+):
+    '''softmax top-k of gating_output, into topk_ids/topk_weights when given'''
+    assert hidden_states.shape[0] == gating_output.shape[0], (
+        "Number of tokens mismatch")
+    M = hidden_states.shape[0]
+    if topk_weights is None:
+        topk_weights = torch.empty(M, topk, dtype=torch.float32, device=hidden_states.device)
+    if topk_ids is None:
+        topk_ids = torch.empty(M, topk, dtype=torch.int32, device=hidden_states.device)
+
+    if gating_output.is_cuda:
+        import aiter
+        token_expert_indicies = torch.empty(M, topk, dtype=torch.int32, device=hidden_states.device)
+        aiter.topk_softmax(topk_weights, topk_ids, token_expert_indicies,
+                           gating_output.float(),  # TODO(woosuk): Optimize this.
+                           renormalize)
+    else:
+        weights, ids = torch.topk(torch.softmax(gating_output.float(), dim=-1), topk, dim=-1)
+        if renormalize:
+            weights = weights / weights.sum(dim=-1, keepdim=True)
+        topk_weights.copy_(weights)
+        topk_ids.copy_(ids)
+    return topk_weights, topk_ids
+
+
+# This is used by the Deepseek-V2 model
+def grouped_topk(hidden_states: torch.Tensor,
+                 gating_output: torch.Tensor,
+                 topk: int,
+                 renormalize: bool,
+                 num_expert_group: int = 0,
+                 topk_group: int = 0):
+
+    assert hidden_states.shape[0] == gating_output.shape[0], (
+        "Number of tokens mismatch")
+
+    scores = torch.softmax(gating_output, dim=-1)
+    num_token = scores.shape[0]
+    group_scores = scores.view(num_token, num_expert_group,
+                               -1).max(dim=-1).values  # [n, n_group]
+    group_idx = torch.topk(group_scores, k=topk_group, dim=-1,
+                           sorted=False)[1]  # [n, top_k_group]
+    group_mask = torch.zeros_like(group_scores)  # [n, n_group]
+    group_mask.scatter_(1, group_idx, 1)  # [n, n_group]
+    score_mask = group_mask.unsqueeze(-1).expand(
+        num_token, num_expert_group,
+        scores.shape[-1] // num_expert_group).reshape(num_token, -1)  # [n, e]
+    tmp_scores = scores.masked_fill(~score_mask.bool(), 0.0)  # [n, e]
+    topk_weights, topk_ids = torch.topk(tmp_scores,
+                                        k=topk,
+                                        dim=-1,
+                                        sorted=False)
+
+    if renormalize:
+        topk_weights = topk_weights / topk_weights.sum(dim=-1, keepdim=True)
+
+    return topk_weights.to(torch.float32), topk_ids.to(torch.int32)
+
+
+def select_experts(hidden_states: torch.Tensor,
+                   gating_output: torch.Tensor,
+                   topk: int,
+                   renormalize: bool,
+                   use_grouped_topk: bool = False,
+                   num_expert_group: Optional[int] = None,
+                   topk_group: Optional[int] = None,
+                   custom_routing_function: Optional[Callable] = None,
+                   expert_load=None):
+    '''
+    (topk_weights, topk_ids) of every token, the routing of every fused_moe,
+    counted by expert_load (an aiter.dist.expert_load.ExpertLoad) when given
+    '''
+    if use_grouped_topk:
+        assert num_expert_group is not None and topk_group is not None
+        topk_weights, topk_ids = grouped_topk(hidden_states, gating_output, topk, renormalize,
+                                              num_expert_group, topk_group)
+    elif custom_routing_function is not None:
+        topk_weights, topk_ids = custom_routing_function(hidden_states, gating_output, topk, renormalize)
+    else:
+        topk_weights, topk_ids = fused_topk(hidden_states, gating_output, topk, renormalize)
+    if expert_load is not None:
+        expert_load.record(topk_ids)
+    return topk_weights, topk_ids
+
+
+def moe_align_block_size(
+        topk_ids: torch.Tensor, block_size: int, num_experts: int,
+        out: Optional[Tuple[torch.Tensor, ...]] = None) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+    """
+    Aligns the token distribution across experts to be compatible with block
+    size for matrix multiplication.
+
+    Parameters:
+    - topk_ids: A tensor of shape [total_tokens, top_k] representing the
+        top-k expert indices for each token.
+    - block_size: The block size used in block matrix multiplication.
+    - num_experts: The total number of experts.
+
+    Returns:
+    - sorted_token_ids: A tensor containing the sorted token indices according
+        to their allocated expert.
+    - expert_ids: A tensor indicating the assigned expert index for each block.
+    - token_nums: The number of tokens of each block, the rest is padding.
+    - num_tokens_post_padded: The total number of tokens after padding,
+        ensuring divisibility by block_size.
+    They are written to prefixes of out when it is given, the buffers of a
+    MoeWorkspace.
+
+    This function pads the number of tokens that each expert needs to process
+    so that it is divisible by block_size.
+
+    Example:
+    Given topk_ids = [[2, 3, 4], [1, 2, 4], [1, 3, 4], [1, 2, 3]],
+    block_size = 4, and num_experts = 4:
+    - We initially have 12 tokens (after repeating 'top_k' times) and 4 experts,
+        with each expert needing to process 3 tokens.
+    - As block_size is 4, we pad 1 token for each expert.
+    - First, flatten topk_ids to [2, 3, 4, 1, 2, 4, 1, 3, 4, 1, 2, 3].
+    - Then append padding tokens [12, 12, 12, 12] for each block.
+    - After sorting by expert index, we obtain token_ids
+        [3, 6, 9, 12, 0, 4, 10, 12, 1, 7, 11, 12, 2, 5, 8, 12].
+        Tokens 12 are non-existent (padding) and are ignored in
+        the subsequent matrix multiplication.
+    """
+    device = topk_ids.device
+    max_num_tokens_padded = topk_ids.numel() + num_experts * (block_size - 1)
+    max_num_m_blocks = triton.cdiv(max_num_tokens_padded, block_size)
+    if out is None:
+        sorted_ids = torch.empty((max_num_tokens_padded, ), dtype=torch.int32, device=device)
+        expert_ids = torch.empty((max_num_m_blocks, ), dtype=torch.int32, device=device)
+        token_nums = torch.empty((max_num_m_blocks, ), dtype=torch.int32, device=device)
+        num_tokens_post_pad = torch.empty((1), dtype=torch.int32, device=device)
+    else:
+        if out[0].shape[0] < max_num_tokens_padded or out[1].shape[0] < max_num_m_blocks:
+            raise ValueError(f'routing buffers of {out[0].shape[0]} tokens and {out[1].shape[0]} blocks are too '
+                             f'small for {topk_ids.numel()} tokens in blocks of {block_size}')
+        sorted_ids, expert_ids, token_nums = (out[0][:max_num_tokens_padded], out[1][:max_num_m_blocks],
+                                              out[2][:max_num_m_blocks])
+        num_tokens_post_pad = out[3]
+    if device.type == 'cuda':
+        import aiter
+        aiter.moe_align_block_size(topk_ids, num_experts, block_size, sorted_ids,
+                                   expert_ids, token_nums, num_tokens_post_pad)
+        return sorted_ids, expert_ids, token_nums, num_tokens_post_pad
+
+    flat = topk_ids.reshape(-1).long()
+    counts = torch.bincount(flat, minlength=num_experts)
+    padded = (counts + block_size - 1) // block_size * block_size
+    order = torch.argsort(flat, stable=True)
+    experts = flat[order]
+    rank = torch.arange(flat.numel(), device=device) - (torch.cumsum(counts, 0) - counts)[experts]
+    sorted_ids.fill_(topk_ids.numel())
+    sorted_ids[(torch.cumsum(padded, 0) - padded)[experts] + rank] = order.to(torch.int32)
+    blocks = padded // block_size
+    n_blocks = int(blocks.sum())
+    expert_ids.zero_()
+    expert_ids[:n_blocks] = torch.repeat_interleave(torch.arange(num_experts, device=device), blocks)
+    # block j of an expert holds min(block_size, count - j * block_size) tokens
+    first_block = (torch.cumsum(blocks, 0) - blocks)[expert_ids[:n_blocks].long()]
+    taken = (torch.arange(n_blocks, device=device) - first_block) * block_size
+    token_nums.zero_()
+    token_nums[:n_blocks] = torch.clamp(counts[expert_ids[:n_blocks].long()] - taken, max=block_size)
+    num_tokens_post_pad.fill_(int(padded.sum()))
+    return sorted_ids, expert_ids, token_nums, num_tokens_post_pad
+
+
+# tuned configs of the triton kernel
+
+
+def get_default_config(
+    M: int,
+    E: int,
+    N: int,
+    K: int,
+    topk: int,
+    dtype: Optional[str],
+    is_marlin: bool,
+) -> Dict[str, int]:
+    config = {
+        # int8 x int8 blocks are 4x the bytes of int32 accumulators
+        'BLOCK_SIZE_M': 16 if dtype == 'int8_w8a8' else 64,
+        'BLOCK_SIZE_N': 128,  # reqd. for MOE shuffle
+        'BLOCK_SIZE_K': 128,  # reqd. for MOE shuffle
+        'GROUP_SIZE_M': 8
+    }
+    # A heuristic: fused marlin works faster with this config for small M
+    if M <= E or (is_marlin and M <= 32):
+        config = {
+            'BLOCK_SIZE_M': 16,
+            'BLOCK_SIZE_N': 128,  # reqd. for MOE shuffle
+            'BLOCK_SIZE_K': 128,  # reqd. for MOE shuffle
+            'GROUP_SIZE_M': 1
+        }
+    return config
+
+
+def try_get_optimal_moe_config(
+    w1_shape: Tuple[int, ...],
+    w2_shape: Tuple[int, ...],
+    top_k: int,
+    dtype: str,
+    M: int,
+    override_config: Optional[Dict[str, Any]] = None,
+    is_marlin: bool = False,
+):
+    '''the tuned config of M from aiter.configs.moe_config, else the default'''
+    if override_config:
+        return override_config
+    E, K, N = w2_shape
+    config = lookup_moe_config(E, N, K, top_k, dtype, M)
+    if config is not None:
+        return config
+    return get_default_config(M, E, N, w1_shape[2], top_k, dtype, is_marlin)
+
+
+def config_dtype(dtype: torch.dtype, quant: str = 'none') -> str:
+    '''the dtype of the moe config tables: the quant scheme, else bf16, fp16 or fp32'''
+    if quant != 'none':
+        return quant
+    return {torch.bfloat16: 'bf16', torch.float16: 'fp16', torch.float32: 'fp32'}[dtype]
+
+
+def quant_scheme(use_fp8_w8a8: bool = False, use_int8_w8a16: bool = False, use_int8_w8a8: bool = False) -> str:
+    '''the quant scheme of the use_* flags of the vllm style signatures'''
+    flags = [el for el, on in [('fp8_w8a8', use_fp8_w8a8), ('int8_w8a16', use_int8_w8a16),
+                               ('int8_w8a8', use_int8_w8a8)] if on]
+    if len(flags) > 1:
+        raise ValueError(f'choose one quant scheme of {flags}')
+    return flags[0] if flags else 'none'
+
+
+# the problem, its scratch and the backends
+
+
+@dataclass(frozen=True)
+class MoeProblem:
+    tokens: int
+    E: int
+    model_dim: int
+    inter_dim: int
+    # w1 holds gate and up
+    gated: bool
+    topk: int
+    dtype: torch.dtype
+    w_dtype: torch.dtype
+    quant: str
+    activation: str
+    # zero columns at the end of the K of w1 and w2
+    padding: int
+    device: str
+
+    @property
+    def N(self):
+        '''output columns of the first gemm'''
+        return self.inter_dim * (2 if self.gated else 1)
+
+    def __str__(self):
+        return f'moe tokens={self.tokens} E={self.E} topk={self.topk} dim={self.model_dim} ' \
+               f'inter={self.inter_dim} {"g1u1" if self.gated else "g1u0"} {self.activation} ' \
+               f'{self.dtype}/{self.w_dtype} quant={self.quant}{" pad=" + str(self.padding) if self.padding else ""} ' \
+               f'on {self.device}'
+
+
+def make_moe_problem(hidden_states, w1, w2, topk_ids, activation='silu', quant='none') -> MoeProblem:
+    if activation not in ACTIVATIONS or activation == 'none':
+        raise ValueError(f'unknown {activation=}, choose from {list(ACTIVATIONS)[1:]}')
+    if quant not in QUANT_SCHEMES:
+        raise ValueError(f'unknown {quant=}, choose from {list(QUANT_SCHEMES)}')
+    E, N, K = w1.shape
+    model_dim = hidden_states.shape[1]
+    padding = K - model_dim
+    inter_dim = w2.shape[2] - padding
+    if padding < 0 or w2.shape[0] != E or w2.shape[1] != model_dim or N not in (inter_dim, 2 * inter_dim):
+        raise ValueError(f'moe weights {tuple(w1.shape)} and {tuple(w2.shape)} do not fit {model_dim=}')
+    if topk_ids.shape[0] != hidden_states.shape[0]:
+        raise ValueError(f'{topk_ids.shape[0]} routed tokens for {hidden_states.shape[0]} hidden states')
+    return MoeProblem(hidden_states.shape[0], E, model_dim, inter_dim, N == 2 * inter_dim, topk_ids.shape[1],
+                      hidden_states.dtype, w1.dtype, quant, activation, padding, hidden_states.device.type)
+
+
+def scratch_plan(p: MoeProblem, M: int) -> List[Tuple[str, Tuple[int, ...], torch.dtype]]:
+    '''
+    (name, shape, dtype) of the buffers one chunk of M tokens needs, rows are
+    per token or per (token, expert) so a shorter chunk takes a prefix of them
+    '''
+    plan = [('cache1', (M, p.topk, p.N), p.dtype)]
+    # ungated: the kernel applied the activation, cache1 is the second input
+    if p.gated:
+        plan.append(('cache2', (M * p.topk, p.inter_dim), p.dtype))
+    plan.append(('cache3', (M, p.topk, p.model_dim), p.dtype))
+    if p.quant == 'int8_w8a8':
+        plan += [('a1', (M, p.model_dim), torch.int8),
+                 ('a1_scale', (M, ), torch.float32),
+                 ('a2', (M * p.topk, p.inter_dim), torch.int8),
+                 ('a2_scale', (M * p.topk, ), torch.float32)]
+    elif p.quant == 'fp8_w8a8':
+        plan += [('a1', (M, p.model_dim), p.w_dtype),
+                 ('a1_scale', (1, ), torch.float32),
+                 ('a2', (M * p.topk, p.inter_dim), p.w_dtype),
+                 ('a2_scale', (1, ), torch.float32)]
+    return plan
+
+
+# the outputs of moe_align_block_size
+_ROUTING = ('sorted_ids', 'expert_ids', 'token_nums', 'num_tokens_post_pad')
+
+
+def routing_plan(p: MoeProblem, M: int, max_block_m: int = MAX_BLOCK_SIZE_M):
+    '''the outputs of moe_align_block_size for M tokens and blocks of MIN_BLOCK_SIZE_M to max_block_m'''
+    max_num_tokens_padded = M * p.topk + p.E * (max_block_m - 1)
+    max_num_m_blocks = triton.cdiv(max_num_tokens_padded, MIN_BLOCK_SIZE_M)
+    sizes = (max_num_tokens_padded, max_num_m_blocks, max_num_m_blocks, 1)
+    return [(name, (size, ), torch.int32) for name, size in zip(_ROUTING, sizes)]
+
+
+def _capturing(device):
+    return device.type == 'cuda' and torch.cuda.is_current_stream_capturing()
+
+
+class MoeWorkspace:
+    '''
+    the scratch of the triton fused_experts, allocated once for chunks of up
+    to max_tokens and reused by every call and every layer of its shape: the
+    intermediate caches, the activation quant buffers and the outputs of
+    moe_align_block_size. a chunk takes views of the buffers, so the
+    addresses are fixed and a captured cuda graph replays on the same
+    memory. it only grows outside of graph capture, reserve() the largest
+    batch before capturing.
+    '''
+
+    def __init__(self, p: MoeProblem, max_tokens: int, device, max_block_m: int = MAX_BLOCK_SIZE_M):
+        self.problem = p
+        self.device = torch.device(device)
+        self.max_block_m = max_block_m
+        self.max_tokens = 0
+        self.buffers: Dict[str, torch.Tensor] = {}
+        self.nbytes = 0
+        self.peak_bytes = 0
+        self.calls = 0
+        self.reserve(max_tokens)
+
+    def reserve(self, max_tokens: int):
+        '''size the buffers for chunks of max_tokens, a no-op when they are large enough'''
+        rows = min(max_tokens, VLLM_FUSED_MOE_CHUNK_SIZE)
+        if rows <= self.max_tokens:
+            return
+        if _capturing(self.device):
+            raise RuntimeError(f'moe workspace of {self.max_tokens} tokens can not grow to {rows} while '
+                               f'capturing a cuda graph, reserve({rows}) it before the capture')
+        plan = scratch_plan(self.problem, rows) + routing_plan(self.problem, rows, self.max_block_m)
+        # drop the old buffers first, both sets rarely fit
+        self.buffers = {}
+        self.buffers = {name: torch.empty(shape, dtype=dtype, device=self.device) for name, shape, dtype in plan}
+        self.max_tokens = rows
+        self.nbytes = sum(el.numel() * el.element_size() for el in self.buffers.values())
+
+    def fits(self, p: MoeProblem) -> bool:
+        '''the buffers have the shapes and dtypes of p, whatever its tokens'''
+        return _workspace_key(p) == _workspace_key(self.problem)
+
+    def chunk(self, tokens: int) -> Dict[str, torch.Tensor]:
+        '''views of the buffers for a chunk of tokens'''
+        assert tokens <= self.max_tokens, f'chunk of {tokens} tokens in a workspace of {self.max_tokens}'
+        topk = self.problem.topk
+        views = {}
+        for name, t in self.buffers.items():
+            if name in _ROUTING:
+                views[name] = t
+            elif t.shape[0] == self.max_tokens * topk:
+                views[name] = t[:tokens * topk]
+            elif t.shape[0] == self.max_tokens:
+                views[name] = t[:tokens]
+            else:
+                # the per tensor scales
+                views[name] = t
+        used = sum(el.numel() * el.element_size() for el in views.values())
+        self.peak_bytes = max(self.peak_bytes, used)
+        self.calls += 1
+        return views
+
+    def stats(self):
+        return {'max_tokens': self.max_tokens, 'bytes': self.nbytes, 'peak_bytes': self.peak_bytes,
+                'calls': self.calls}
+
+    def __str__(self):
+        return f'moe workspace {self.max_tokens} tokens, {self.nbytes / (1 << 20):.1f}MiB, ' \
+               f'peak {self.peak_bytes / (1 << 20):.1f}MiB of {self.problem}'
+
+
+def _workspace_key(p: MoeProblem):
+    return p.E, p.model_dim, p.inter_dim, p.gated, p.topk, p.dtype, p.w_dtype, p.quant
+
+
+# (E, dims, topk, dtypes, quant, device, stream) -> the workspace the layers
+# of that shape share. a layer on another stream gets its own, the buffers of
+# one may still be read by the kernels queued on another
+_workspaces: Dict[tuple, MoeWorkspace] = {}
+
+
+def get_moe_workspace(p: MoeProblem, device, max_tokens: Optional[int] = None) -> MoeWorkspace:
+    '''the shared workspace of p's shape on the current stream, grown to max_tokens (default p.tokens)'''
+    device = torch.device(device)
+    if device.type == 'cuda' and device.index is None:
+        device = torch.device('cuda', torch.cuda.current_device())
+    stream = torch.cuda.current_stream(device).cuda_stream if device.type == 'cuda' else 0
+    key = (*_workspace_key(p), str(device), stream)
+    ws = _workspaces.get(key, None)
+    if ws is None:
+        ws = _workspaces[key] = MoeWorkspace(p, max_tokens or p.tokens, device)
+    else:
+        ws.reserve(max_tokens or p.tokens)
+    return ws
+
+
+def moe_workspace_stats():
+    '''{'bytes': held, 'peak_bytes': used at most, 'workspaces': [stats of each]}'''
+    ws = [el.stats() for el in _workspaces.values()]
+    return {'bytes': sum(el['bytes'] for el in ws), 'peak_bytes': sum(el['peak_bytes'] for el in ws),
+            'workspaces': ws}
+
+
+def release_moe_workspaces():
+    '''drop the shared workspaces, the next call allocates again'''
+    _workspaces.clear()
+
+
+@dataclass
+class MoeBackend:
+    name: str
+    # check(problem) -> None if the backend can run problem, else why not
+    check: Callable
+    # run(problem, hidden_states, w1, w2, topk_weights, topk_ids, scales, out, override_config, expert_mask,
+    #     workspace), workspace a MoeWorkspace or None
+    run: Callable
+
+
+MOE_BACKENDS: Dict[str, MoeBackend] = {}
+
+
+def register_moe_backend(name: str, check: Callable):
+    '''decorates run, a backend of the same name is replaced'''
+    def decorator(run):
+        MOE_BACKENDS[name] = MoeBackend(name, check, run)
+        return run
+    return decorator
+
+
+def fused_experts(hidden_states: torch.Tensor,
+                  w1: torch.Tensor,
+                  w2: torch.Tensor,
+                  topk_weights: torch.Tensor,
+                  topk_ids: torch.Tensor,
+                  inplace: bool = False,
+                  override_config: Optional[Dict[str, Any]] = None,
+                  activation: str = 'silu',
+                  quant: str = 'none',
+                  backend: str = 'triton',
+                  w1_scale: Optional[torch.Tensor] = None,
+                  w2_scale: Optional[torch.Tensor] = None,
+                  a1_scale: Optional[torch.Tensor] = None,
+                  a2_scale: Optional[torch.Tensor] = None,
+                  expert_mask: Optional[torch.Tensor] = None,
+                  workspace: Optional[MoeWorkspace] = None) -> torch.Tensor:
+    '''
+    the experts of topk_ids applied to hidden_states, weighted by topk_weights
+    and summed. w1_scale/w2_scale are (E,) for fp8_w8a8 and (E, N)/(E, dim) for
+    the int8 schemes, a1_scale/a2_scale the static fp8 activation scales. the
+    triton backend runs in workspace, default the one shared by this shape
+    '''
+    assert topk_weights.shape == topk_ids.shape, "topk shape mismatch"
+    assert hidden_states.is_contiguous(), "Hidden_states must be contiguous"
+    assert w1.is_contiguous(), "Expert weights1 must be contiguous"
+    assert w2.is_contiguous(), "Expert weights2 must be contiguous"
+    p = make_moe_problem(hidden_states, w1, w2, topk_ids, activation, quant)
+    if backend not in MOE_BACKENDS:
+        raise ValueError(f'unknown moe {backend=}, choose from {list(MOE_BACKENDS)}')
+    reason = MOE_BACKENDS[backend].check(p)
+    if reason is not None:
+        raise ValueError(f'{backend} can not run {p}: {reason}')
+    if quant != 'none' and (w1_scale is None or w2_scale is None):
+        raise ValueError(f'{quant} moe needs w1_scale and w2_scale')
+    out = hidden_states if inplace else buffer_pool.empty(hidden_states.shape, hidden_states.dtype,
+                                                          hidden_states.device)
+    scales = (w1_scale, w2_scale, a1_scale, a2_scale)
+    return MOE_BACKENDS[backend].run(p, hidden_states, w1, w2, topk_weights, topk_ids, scales, out,
+                                     override_config, expert_mask, workspace)
+
+
+def fused_moe(
+    hidden_states: torch.Tensor,
+    w1: torch.Tensor,
+    w2: torch.Tensor,
+    gating_output: torch.Tensor,
+    topk: int,
+    renormalize: bool,
+    inplace: bool = False,
+    override_config: Optional[Dict[str, Any]] = None,
+    use_grouped_topk: bool = False,
+    num_expert_group: Optional[int] = None,
+    topk_group: Optional[int] = None,
+    custom_routing_function: Optional[Callable] = None,
+    activation: str = 'silu',
+    quant: str = 'none',
+    backend: str = 'triton',
+    w1_scale: Optional[torch.Tensor] = None,
+    w2_scale: Optional[torch.Tensor] = None,
+    a1_scale: Optional[torch.Tensor] = None,
+    a2_scale: Optional[torch.Tensor] = None,
+    expert_load=None,
+) -> torch.Tensor:
+    """
+    This function computes a Mixture of Experts (MoE) layer using two sets of
+    weights, w1 and w2, and top-k gating mechanism.
+
+    Parameters:
+    - hidden_states (torch.Tensor): The input tensor to the MoE layer.
+    - w1 (torch.Tensor): The first set of expert weights.
+    - w2 (torch.Tensor): The second set of expert weights.
+    - gating_output (torch.Tensor): The output of the gating operation
+        (before softmax).
+    - topk (int): The number of top-k experts to select.
+    - renormalize (bool): If True, renormalize the top-k weights to sum to 1.
+    - inplace (bool): If True, perform the operation in-place.
+    - override_config (Optional[Dict[str, Any]]): Optional override
+        for the kernel configuration.
+    - use_grouped_topk: If True, use grouped_topk instead of fused_topk
+        note: Deepseekv2 model uses grouped_topk
+    - num_expert_group, topk_group: additional parameters for grouped_topk
+    - activation, quant, backend: see the top of fused_moe_core.py
+    - w1_scale, w2_scale, a1_scale, a2_scale: the scales of quant
+    - expert_load: an aiter.dist.expert_load.ExpertLoad counting the routing
+
+    Returns:
+    - torch.Tensor: The output tensor after applying the MoE layer.
+    """
+    assert gating_output.shape[1] == w1.shape[0], "Number of experts mismatch"
+    topk_weights, topk_ids = select_experts(hidden_states, gating_output, topk, renormalize, use_grouped_topk,
+                                            num_expert_group, topk_group, custom_routing_function,
+                                            expert_load)
+    return fused_experts(hidden_states, w1, w2, topk_weights, topk_ids, inplace=inplace,
+                         override_config=override_config, activation=activation, quant=quant,
+                         backend=backend, w1_scale=w1_scale, w2_scale=w2_scale,
+                         a1_scale=a1_scale, a2_scale=a2_scale)
+
+
+# triton backend
+
+
+def invoke_fused_moe_kernel(A: torch.Tensor, B: torch.Tensor, C: torch.Tensor,
+                            A_scale: Optional[torch.Tensor],
+                            B_scale: Optional[torch.Tensor],
+                            topk_weights: torch.Tensor, topk_ids: torch.Tensor,
+                            sorted_token_ids: torch.Tensor,
+                            expert_ids: torch.Tensor,
+                            token_nums: torch.Tensor,
+                            num_tokens_post_padded: torch.Tensor,
+                            mul_routed_weight: bool, top_k: int,
+                            config: Dict[str, Any], compute_type: tl.dtype,
+                            quant: str = 'none', activation: str = 'none',
+                            K: Optional[int] = None) -> None:
+    '''
+    C[token, k] = A[token] @ B[expert].T for the sorted (token, k), K defaults
+    to the K of B, less when B carries padding. A is already quantized
+    '''
+    assert topk_weights.stride(1) == 1
+    assert sorted_token_ids.stride(0) == 1
+    if quant == 'none':
+        assert A_scale is None and B_scale is None
+    else:
+        assert B_scale is not None
+    if quant in ('int8_w8a16', 'int8_w8a8'):
+        B_scale = B_scale.view(-1, B.shape[1])
+    bs_strides = (B_scale.stride(0), B_scale.stride(1)) if quant in ('int8_w8a16', 'int8_w8a8') else (0, 0)
+    N = B.shape[1]
+    args = [A, B, C, A_scale, B_scale, topk_weights, sorted_token_ids, expert_ids, token_nums,
+            num_tokens_post_padded, N, B.shape[2] if K is None else K, sorted_token_ids.shape[0],
+            A.stride(0), A.stride(1), B.stride(0), B.stride(2), B.stride(1), C.stride(1), C.stride(2), *bs_strides]
+    kwargs = dict(MUL_ROUTED_WEIGHT=mul_routed_weight, top_k=top_k, compute_type=compute_type,
+                  QUANT=QUANT_SCHEMES[quant], ACTIVATION=ACTIVATIONS[activation], **config, **_launch_options())
+    num_tiles = triton.cdiv(sorted_token_ids.shape[0], config["BLOCK_SIZE_M"]) * triton.cdiv(N, config["BLOCK_SIZE_N"])
+    if not FUSED_MOE_PERSISTENT:
+        fused_moe_kernel[(num_tiles, )](*args, **kwargs)
+    else:
+        from aiter.tuning.occupancy import get_cu_num
+        NUM_SMS = get_cu_num() * 2
+        fused_moe_persistent_kernel[(min(NUM_SMS, num_tiles), )](*args, NUM_SMS=NUM_SMS, **kwargs)
+
+
+def _quant_per_tensor(a, scale, out, out_scale):
+    '''a in the fp8 dtype of out, by scale or a dynamic one written to out_scale'''
+    if a.is_cuda and out.dtype == torch.float8_e4m3fnuz:
+        from aiter.ops.quant import static_scaled_fp8_quant, dynamic_scaled_fp8_quant
+        if scale is None:
+            dynamic_scaled_fp8_quant(out, a, out_scale)
+            return out, out_scale
+        static_scaled_fp8_quant(out, a, scale)
+        return out, scale
+    from aiter.ops.quant import per_tensor_quant
+    y, y_scale = per_tensor_quant(a, scale, quant_dtype=out.dtype)
+    out.copy_(y)
+    out_scale.copy_(y_scale.view(1))
+    return out, out_scale
+
+
+def _gated_activation(out, x, activation):
+    '''act(gate) * up of x = [gate, up]'''
+    if x.is_cuda:
+        import aiter
+        {'silu': aiter.silu_and_mul, 'gelu': aiter.gelu_and_mul,
+         'gelu_tanh': aiter.gelu_tanh_and_mul}[activation](out, x)
+        return
+    gate, up = x.float().chunk(2, dim=-1)
+    if activation == 'silu':
+        gate = F.silu(gate)
+    else:
+        gate = F.gelu(gate, approximate='tanh' if activation == 'gelu_tanh' else 'none')
+    out.copy_(gate * up)
+
+
+def _moe_sum(x, out):
+    if x.is_cuda:
+        import aiter
+        aiter.moe_sum(x, out)
+    else:
+        torch.sum(x, dim=1, out=out)
+
+
+def _check_triton(p: MoeProblem):
+    if p.dtype not in _COMPUTE_TYPES:
+        return f'no triton compute type for {p.dtype}'
+    if p.quant == 'int8_w8a8' and p.w_dtype != torch.int8:
+        return f'int8_w8a8 needs int8 weights, not {p.w_dtype}'
+    return None
+
+
+@register_moe_backend('triton', _check_triton)
+def _run_triton(p, hidden_states, w1, w2, topk_weights, topk_ids, scales, out, override_config, expert_mask,
+                workspace):
+    if expert_mask is not None:
+        raise ValueError('the triton moe has no expert_mask, route to local experts instead')
+    w1_scale, w2_scale, a1_scale, a2_scale = scales
+    compute_type = _COMPUTE_TYPES[p.dtype]
+    M = min(p.tokens, VLLM_FUSED_MOE_CHUNK_SIZE)
+    get_config_func = functools.partial(
+        try_get_optimal_moe_config,
+        w1.shape,
+        (p.E, p.model_dim, p.inter_dim),
+        p.topk,
+        config_dtype(p.dtype, p.quant),
+        override_config=override_config,
+    )
+    if workspace is None:
+        ws = get_moe_workspace(p, hidden_states.device)
+    elif not workspace.fits(p):
+        raise ValueError(f'{workspace} can not run {p}')
+    else:
+        ws = workspace
+    ws.reserve(M)
+    # the activation runs in the first kernel when w1 has no separate up
+    fused_act = 'none' if p.gated else p.activation
+    config = None
+    for begin in range(0, p.tokens, VLLM_FUSED_MOE_CHUNK_SIZE):
+        end = min(begin + VLLM_FUSED_MOE_CHUNK_SIZE, p.tokens)
+        tokens = end - begin
+        if config is None or tokens != M:
+            config = get_config_func(tokens)
+        buf = ws.chunk(tokens)
+        cache1, cache3 = buf['cache1'], buf['cache3']
+        cache2 = buf['cache2'] if p.gated else cache1.view(tokens * p.topk, p.N)
+        curr_topk_ids = topk_ids[begin:end]
+        curr_topk_weights = topk_weights[begin:end]
+        sorted_token_ids, expert_ids, token_nums, num_tokens_post_padded = \
+            moe_align_block_size(curr_topk_ids, config['BLOCK_SIZE_M'], p.E, [buf[el] for el in _ROUTING])
+        routing = (curr_topk_weights, curr_topk_ids, sorted_token_ids, expert_ids, token_nums, num_tokens_post_padded)
+
+        a1, a1s = hidden_states[begin:end], None
+        if p.quant == 'fp8_w8a8':
+            a1, a1s = _quant_per_tensor(a1, a1_scale, buf['a1'], buf['a1_scale'])
+        elif p.quant == 'int8_w8a8':
+            triton_dynamic_quantize(buf['a1'], a1, buf['a1_scale'])
+            a1, a1s = buf['a1'], buf['a1_scale']
+        invoke_fused_moe_kernel(a1, w1, cache1, a1s, w1_scale, *routing, False, p.topk, config,
+                                compute_type, p.quant, fused_act, K=p.model_dim)
+        if p.gated:
+            _gated_activation(cache2, cache1.view(-1, p.N), p.activation)
+
+        a2, a2s = cache2, None
+        if p.quant == 'fp8_w8a8':
+            a2, a2s = _quant_per_tensor(a2, a2_scale, buf['a2'], buf['a2_scale'])
+        elif p.quant == 'int8_w8a8':
+            triton_dynamic_quantize(buf['a2'], a2, buf['a2_scale'])
+            a2, a2s = buf['a2'], buf['a2_scale']
+        invoke_fused_moe_kernel(a2, w2, cache3, a2s, w2_scale, *routing, True, 1, config,
+                                compute_type, p.quant, 'none', K=p.inter_dim)
+        _moe_sum(cache3, out[begin:end])
+    return out
+
+
+# ck 2-stage and asm backends, their weights are shuffled, see fused_moe_bf16_asm
+
+
+def _check_ck_2stages(p: MoeProblem):
+    if p.device != 'cuda':
+        return 'needs cuda tensors'
+    if p.quant not in ('none', 'fp8_w8a8'):
+        return f'no {p.quant}, only bf16 and fp8 per tensor'
+    if p.activation != ('silu' if p.gated else 'gelu'):
+        return f'{"g1u1 has silu" if p.gated else "g1u0 has gelu"} only'
+    if p.padding:
+        return 'no padded weights'
+    return None
+
+
+@register_moe_backend('ck_2stages', _check_ck_2stages)
+def _run_ck_2stages(p, hidden_states, w1, w2, topk_weights, topk_ids, scales, out, override_config, expert_mask,
+                    workspace):
+    from aiter.fused_moe_bf16_asm import ck_moe_2stages
+    w1_scale, w2_scale, a1_scale, a2_scale = scales
+    return out.copy_(ck_moe_2stages(hidden_states, w1, w2, topk_weights, topk_ids,
+                                    w1_scale, w2_scale, a1_scale, a2_scale, expert_mask=expert_mask))
+
+
+def _check_asm(p: MoeProblem):
+    if p.device != 'cuda':
+        return 'needs cuda tensors'
+    if p.quant == 'none':
+        return None if p.activation == 'silu' and p.gated else 'bf16 fmoe is g1u1 silu only'
+    if p.quant != 'int8_w8a8':
+        return f'no {p.quant}, only bf16 and int8_w8a8'
+    if p.activation not in ('silu', 'gelu'):
+        return f'no {p.activation}'
+    if p.padding:
+        return 'no padded weights'
+    return None
+
+
+@register_moe_backend('asm', _check_asm)
+def _run_asm(p, hidden_states, w1, w2, topk_weights, topk_ids, scales, out, override_config, expert_mask,
+             workspace):
+    from aiter import ActivationType
+    from aiter.fused_moe_bf16_asm import asm_moe
+    w1_scale, w2_scale, _, _ = scales
+    activation = ActivationType.Gelu if p.activation == 'gelu' else ActivationType.Silu
+    return out.copy_(asm_moe(hidden_states, w1, w2, topk_weights, topk_ids, w1_scale, w2_scale,
+                             expert_mask=expert_mask, activation=activation))
@@ -0,0 +1,280 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+import os
+import json
+import time
+import shutil
+import shlex
+import hashlib
+import logging
+import subprocess
+import functools
+from typing import List, Optional
+
+logger = logging.getLogger("aiter")
+
+# bump this when the layout of a cache entry or the digest recipe changes
+CACHE_FORMAT_VERSION = 1
+DIGEST_SUFFIX = ".digest"
+
+
+def _hash_file(h, path):
+    h.update(path.encode())
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+
+
+def _hash_path(h, path):
+    '''hash a file or every file under a directory, in a stable order'''
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                _hash_file(h, os.path.join(root, name))
+    elif os.path.isfile(path):
+        _hash_file(h, path)
+    else:
+        h.update(f'missing:{path}'.encode())
+
+
+def _blob_gen_inputs(blob_gen_cmd, ignore_dirs=[]):
+    '''the generator scripts and data files (e.g. tuned csv) a blob_gen_cmd reads'''
+    if not blob_gen_cmd:
+        return []
+    cmds = blob_gen_cmd if isinstance(blob_gen_cmd, (list, tuple)) else [blob_gen_cmd]
+    inputs = []
+    for cmd in cmds:
+        for token in shlex.split(cmd):
+            if any(token.startswith(el) for el in ignore_dirs):
+                continue
+            if os.path.isfile(token):
+                inputs.append(token)
+                # generators import their sibling *_common.py
+                script_dir = os.path.dirname(token)
+                if token.endswith('.py'):
+                    inputs += sorted(os.path.join(script_dir, el)
+                                     for el in os.listdir(script_dir)
+                                     if el.endswith('.py') and
+                                     os.path.join(script_dir, el) != token)
+    return inputs
+
+
+def _git(repo, *args):
+    try:
+        return subprocess.run(['git', '-C', repo, *args],
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL,
+                              timeout=60).stdout
+    except (OSError, subprocess.SubprocessError):
+        return b''
+
+
+@functools.lru_cache(maxsize=None)
+def get_ck_revision(ck_dir):
+    rev = _git(ck_dir, 'rev-parse', 'HEAD').decode().strip()
+    if rev:
+        # HEAD misses local edits of the checkout, hash them on top
+        status = _git(ck_dir, 'status', '--porcelain', '-z', '--untracked-files=all')
+        if status:
+            h = hashlib.sha256()
+            h.update(_git(ck_dir, 'diff', 'HEAD', '--binary'))
+            for el in status.decode(errors='replace').split('\0'):
+                if el.startswith('?? '):
+                    _hash_path(h, os.path.join(ck_dir, el[3:]))
+            rev = f'{rev}-dirty-{h.hexdigest()[:16]}'
+        return rev
+    # not a git checkout (e.g. installed aiter_meta), fall back to the headers
+    h = hashlib.sha256()
+    _hash_path(h, os.path.join(ck_dir, 'include'))
+    return f'tree-{h.hexdigest()}'
+
+
+def get_build_digest(md_name: str,
+                     srcs: List[str],
+                     flags_cc: List[str],
+                     flags_hip: List[str],
+                     blob_gen_cmd,
+                     extra_include: List[str],
+                     extra_ldflags: Optional[List[str]],
+                     hip_version: str,
+                     ck_revision: str,
+                     ignore_dirs: List[str] = []) -> str:
+    '''
+    content digest of everything that goes into a jit module:
+    sources, include dirs (callers pass every dir the build includes, e.g.
+    csrc/include), blob generators and their inputs, the full compiler
+    flags (which already carry --offload-arch for GPU_ARCHS), hip version
+    and CK revision with its local edits. files under ignore_dirs are
+    left out, e.g. generators of the staged CK already covered by ck_revision
+    '''
+    h = hashlib.sha256()
+    meta = {
+        'format': CACHE_FORMAT_VERSION,
+        'md_name': md_name,
+        'flags_cc': list(flags_cc),
+        'flags_hip': list(flags_hip),
+        'blob_gen_cmd': blob_gen_cmd,
+        'extra_ldflags': extra_ldflags,
+        'hip_version': str(hip_version),
+        'ck_revision': ck_revision,
+    }
+    h.update(json.dumps(meta, sort_keys=True).encode())
+    for el in list(srcs) + list(extra_include) + _blob_gen_inputs(blob_gen_cmd, ignore_dirs):
+        if any(el.startswith(ignore) for ignore in ignore_dirs):
+            h.update(el.encode())
+            continue
+        _hash_path(h, el)
+    return h.hexdigest()
+
+
+def read_module_digest(so_path):
+    try:
+        with open(f'{so_path}{DIGEST_SUFFIX}') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def write_module_digest(so_path, digest):
+    tmp = f'{so_path}{DIGEST_SUFFIX}.{os.getpid()}'
+    with open(tmp, 'w') as f:
+        f.write(digest)
+    os.replace(tmp, f'{so_path}{DIGEST_SUFFIX}')
+
+
+def _dir_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+class BuildStore:
+    '''
+    one content-addressed directory of built modules:
+        {root}/{digest[:2]}/{digest}/{md_name}.so + meta.json
+    entries are published with an atomic directory rename, so readers on
+    other hosts never observe a half-copied .so. entry mtime is the LRU clock.
+    '''
+
+    def __init__(self, root: str, max_bytes: Optional[int] = None):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def entry_dir(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def lookup(self, digest, md_name):
+        so_path = os.path.join(self.entry_dir(digest), f'{md_name}.so')
+        if not os.path.isfile(so_path):
+            return None
+        try:
+            os.utime(self.entry_dir(digest))
+        except OSError:
+            # read only shared store
+            pass
+        return so_path
+
+    def publish(self, digest, md_name, so_path, meta: Optional[dict] = None):
+        dst = self.entry_dir(digest)
+        if os.path.isdir(dst):
+            return os.path.join(dst, f'{md_name}.so')
+        tmp = f'{dst}.tmp-{os.uname().nodename}-{os.getpid()}'
+        try:
+            os.makedirs(tmp, exist_ok=True)
+            shutil.copy(so_path, os.path.join(tmp, f'{md_name}.so'))
+            with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                json.dump({'md_name': md_name,
+                           'digest': digest,
+                           'created': time.time(),
+                           **(meta or {})}, f, indent=2)
+            os.rename(tmp, dst)
+        except OSError as e:
+            # lost the race against another publisher, or store not writable
+            if not os.path.isdir(dst):
+                logger.warning(f'failed to publish [{md_name}] to {self.root}: {e}')
+        finally:
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+        return os.path.join(dst, f'{md_name}.so')
+
+    def entries(self):
+        if not os.path.isdir(self.root):
+            return []
+        ret = []
+        for prefix in os.listdir(self.root):
+            prefix_dir = os.path.join(self.root, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for digest in os.listdir(prefix_dir):
+                path = os.path.join(prefix_dir, digest)
+                if '.tmp-' in digest or not os.path.isdir(path):
+                    continue
+                ret.append((os.path.getmtime(path), _dir_size(path), path))
+        return ret
+
+    def evict(self):
+        if not self.max_bytes:
+            return
+        entries = sorted(self.entries())
+        total = sum(el[1] for el in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            logger.info(f'evict jit cache entry {path}')
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+class BuildCache:
+    '''local store, plus an optional shared store (e.g. NFS) for the fleet'''
+
+    def __init__(self, local_dir: str,
+                 shared_dir: Optional[str] = None,
+                 max_bytes: Optional[int] = None,
+                 shared_max_bytes: Optional[int] = None):
+        self.local = BuildStore(local_dir, max_bytes)
+        self.shared = BuildStore(shared_dir, shared_max_bytes) \
+            if shared_dir else None
+
+    def lookup(self, digest, md_name):
+        so_path = self.local.lookup(digest, md_name)
+        if so_path is None and self.shared is not None:
+            so_path = self.shared.lookup(digest, md_name)
+            if so_path is not None:
+                # pull into the local store so the next lookup is local
+                so_path = self.local.publish(digest, md_name, so_path,
+                                             {'source': self.shared.root})
+        return so_path
+
+    def publish(self, digest, md_name, so_path, meta: Optional[dict] = None):
+        self.local.publish(digest, md_name, so_path, meta)
+        if self.shared is not None:
+            self.shared.publish(digest, md_name, so_path, meta)
+
+
+def _gb_to_bytes(val):
+    return int(float(val) * (1024 ** 3)) if val else None
+
+
+@functools.lru_cache(maxsize=1)
+def get_build_cache(default_dir):
+    '''
+    AITER_JIT_CACHE=0 disables the cache,
+    AITER_JIT_CACHE_DIR overrides the local store (default {jit_dir}/build_cache),
+    AITER_JIT_SHARED_CACHE_DIR enables the shared store,
+    AITER_JIT_CACHE_MAX_GB/AITER_JIT_SHARED_CACHE_MAX_GB bound their sizes
+    '''
+    if not int(os.environ.get('AITER_JIT_CACHE', 1)):
+        return None
+    return BuildCache(os.environ.get('AITER_JIT_CACHE_DIR', default_dir),
+                      os.environ.get('AITER_JIT_SHARED_CACHE_DIR', None),
+                      _gb_to_bytes(os.environ.get('AITER_JIT_CACHE_MAX_GB', 20)),
+                      _gb_to_bytes(os.environ.get('AITER_JIT_SHARED_CACHE_MAX_GB', None)))
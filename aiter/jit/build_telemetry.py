@@ -0,0 +1,201 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# build telemetry of the jit modules, one json per module, kept out of the
+# package tree under AITER_BUILD_TELEMETRY_DIR (default ~/.aiter/build_telemetry)
+#   {telemetry_dir}/{md_name}.json
+# aiter-build-report ranks the slowest translation units across modules
+#   aiter-build-report                      # top 20 over every module
+#   aiter-build-report -m module_gemm_a8w8 --top 50
+#   aiter-build-report --json
+
+import os
+import sys
+import json
+import argparse
+import threading
+
+NINJA_LOG = '.ninja_log'
+# each ninja job peaks at ~8-9GB when threads = 4, used until a build measured it
+DEFAULT_JOB_MEM_GB = 9
+# measured peaks vary with the instance mix, keep some headroom
+JOB_MEM_HEADROOM = 1.2
+# what a cache hit keeps from the last real build of the module
+COMPILE_FIELDS = ['compile_seconds', 'max_jobs', 'peak_job_rss_gb', 'units']
+
+
+def ninja_log_offset(build_dir):
+    path = os.path.join(build_dir, NINJA_LOG)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def parse_ninja_log(build_dir, offset=0):
+    '''
+    compile time of every output ninja built after offset, slowest first.
+    .ninja_log v5 lines are: start_ms end_ms mtime output cmd_hash
+    '''
+    path = os.path.join(build_dir, NINJA_LOG)
+    if not os.path.exists(path):
+        return []
+    if os.path.getsize(path) < offset:
+        # ninja recompacted the log
+        offset = 0
+    with open(path) as f:
+        f.seek(offset)
+        lines = f.read().splitlines()
+    units = {}
+    for line in lines:
+        fields = line.split('\t')
+        if line.startswith('#') or len(fields) < 4:
+            continue
+        try:
+            start, end = int(fields[0]), int(fields[1])
+        except ValueError:
+            continue
+        # a rebuilt output shows up again, the last entry wins
+        units[fields[3]] = end - start
+    return sorted([{'output': k, 'ms': v} for k, v in units.items()],
+                  key=lambda el: el['ms'], reverse=True)
+
+
+def get_telemetry_dir():
+    return os.environ.get('AITER_BUILD_TELEMETRY_DIR', os.path.expanduser('~/.aiter/build_telemetry'))
+
+
+class JobPeakRss:
+    '''
+    peak RSS of one ninja job of a build: the largest descendant process
+    while the block runs, sampled every interval seconds. only the
+    processes this build spawns count, gb is None until a sample saw one
+    '''
+
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        import psutil
+        me = psutil.Process()
+        while True:
+            for child in me.children(recursive=True):
+                try:
+                    self.peak = max(self.peak, child.memory_info().rss)
+                except psutil.Error:
+                    # exited between listing and reading it
+                    continue
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    @property
+    def gb(self):
+        return round(self.peak / (1024 ** 3), 2) if self.peak else None
+
+
+def write_telemetry(md_name, data, telemetry_dir=None):
+    telemetry_dir = telemetry_dir or get_telemetry_dir()
+    os.makedirs(telemetry_dir, exist_ok=True)
+    path = os.path.join(telemetry_dir, f'{md_name}.json')
+    if data.get('status') == 'cache_hit' and os.path.isfile(path):
+        try:
+            with open(path) as f:
+                previous = json.load(f)
+        except (OSError, ValueError):
+            previous = {}
+        data = {**{k: previous[k] for k in COMPILE_FIELDS if k in previous}, **data}
+    tmp = f'{path}.{os.getpid()}'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+    return path
+
+
+def load_telemetry(telemetry_dir=None, md_names=None):
+    telemetry_dir = telemetry_dir or get_telemetry_dir()
+    if not os.path.isdir(telemetry_dir):
+        return []
+    ret = []
+    for name in sorted(os.listdir(telemetry_dir)):
+        md_name, ext = os.path.splitext(name)
+        if ext != '.json' or (md_names and md_name not in md_names):
+            continue
+        path = os.path.join(telemetry_dir, name)
+        try:
+            with open(path) as f:
+                ret.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return ret
+
+
+def get_job_mem_gb(telemetry_dir=None, default=DEFAULT_JOB_MEM_GB):
+    '''memory of one ninja job, from the largest peak previous builds measured'''
+    peaks = [el['peak_job_rss_gb'] for el in load_telemetry(telemetry_dir)
+             if el.get('peak_job_rss_gb')]
+    if not peaks:
+        return default
+    return max(1.0, max(peaks) * JOB_MEM_HEADROOM)
+
+
+def rank_units(records, top=20):
+    rows = []
+    for rec in records:
+        for el in rec.get('units', []):
+            rows.append((el['ms'], rec['md_name'], el['output']))
+    rows.sort(reverse=True)
+    return rows[:top] if top else rows
+
+
+def format_report(records, top=20):
+    lines = [f"{'module':<36} {'status':>10} {'total s':>9} {'blob s':>8} {'units':>6} {'peak GB':>8}"]
+    for rec in records:
+        lines.append(f"{rec['md_name']:<36} {rec.get('status', ''):>10} "
+                     f"{rec.get('seconds', 0):>9.1f} {rec.get('blob_gen_seconds', 0):>8.1f} "
+                     f"{len(rec.get('units', [])):>6} {rec.get('peak_job_rss_gb') or 0:>8.2f}")
+    lines.append('')
+    lines.append(f"{'compile s':>10}  {'module':<36} output")
+    for ms, md_name, output in rank_units(records, top):
+        lines.append(f"{ms / 1000:>10.1f}  {md_name:<36} {output}")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="aiter-build-report",
+        description="rank the slowest translation units of the aiter jit builds",
+    )
+    parser.add_argument("-m", "--modules", nargs='+', default=None,
+                        help="only report these modules")
+    parser.add_argument("--top", type=int, default=20,
+                        help="how many translation units to list, 0 for all")
+    parser.add_argument("--telemetry_dir", default=None,
+                        help="telemetry dir, default: $AITER_BUILD_TELEMETRY_DIR or ~/.aiter/build_telemetry")
+    parser.add_argument("--json", action='store_true',
+                        help="dump the raw telemetry instead of the report")
+    args = parser.parse_args(argv)
+
+    telemetry_dir = args.telemetry_dir or get_telemetry_dir()
+    records = load_telemetry(telemetry_dir, args.modules)
+    if not records:
+        print(f'no build telemetry under {telemetry_dir}')
+        return 1
+    if args.json:
+        print(json.dumps(records, indent=2))
+    else:
+        print(format_report(records, args.top))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
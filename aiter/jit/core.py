@@ -4,6 +4,7 @@
 import os
 import sys
 import shutil
+import filecmp
 import time
 import importlib
 import functools
@@ -14,8 +15,11 @@ from torch.utils import cpp_extension
 from torch.utils.file_baton import FileBaton
 import logging
 import json
-import multiprocessing
 from packaging.version import parse, Version
+from .build_cache import get_build_cache, get_build_digest, get_ck_revision, \
+    read_module_digest, write_module_digest
+from .build_telemetry import ninja_log_offset, parse_ninja_log, \
+    JobPeakRss, write_telemetry, get_job_mem_gb
 
 PREBUILD_KERNELS = False
 if os.path.exists(os.path.dirname(os.path.abspath(__file__))+"/aiter_.so"):
@@ -70,14 +74,34 @@ def get_user_jit_dir():
 
 
 bd_dir = f'{get_user_jit_dir()}/build'
-# copy ck to build, thus hippify under bd_dir
-if multiprocessing.current_process().name == 'MainProcess':
-    shutil.copytree(CK_DIR, f'{bd_dir}/ck', dirs_exist_ok=True)
-    if os.path.exists(f'{bd_dir}/ck/library'):
-        shutil.rmtree(f'{bd_dir}/ck/library')
+CK_SRC_DIR = CK_DIR
+# ck is copied to build, thus hippify under bd_dir, see stage_ck
 CK_DIR = f'{bd_dir}/ck'
 
 
+@functools.lru_cache(maxsize=1)
+def stage_ck():
+    '''copy ck into the build dir, only once per ck revision and only when a build happens'''
+    marker = f'{CK_DIR}/.aiter_ck_revision'
+    revision = get_ck_revision(CK_SRC_DIR)
+    if os.path.exists(marker) and open(marker).read().strip() == revision:
+        return
+    os.makedirs(bd_dir, exist_ok=True)
+    baton = FileBaton(f'{bd_dir}/ck.lock')
+    if baton.try_acquire():
+        try:
+            logger.info(f'stage ck {revision[:12]} from {CK_SRC_DIR}')
+            shutil.copytree(CK_SRC_DIR, CK_DIR, dirs_exist_ok=True)
+            if os.path.exists(f'{CK_DIR}/library'):
+                shutil.rmtree(f'{CK_DIR}/library')
+            with open(marker, 'w') as f:
+                f.write(revision)
+        finally:
+            baton.release()
+    else:
+        baton.wait()
+
+
 def validate_and_update_archs():
     archs = os.getenv("GPU_ARCHS", "native").split(";")
     # List of allowed architectures
@@ -98,22 +122,57 @@ def check_and_set_ninja_worker():
         # calculate the maximum allowed NUM_JOBS based on free memory
         free_memory_gb = psutil.virtual_memory().available / \
             (1024 ** 3)  # free memory in GB
-        # each JOB peak memory cost is ~8-9GB when threads = 4
-        max_num_jobs_memory = int(free_memory_gb / 9)
+        # each JOB peak memory cost is ~8-9GB when threads = 4,
+        # previous builds may have measured it, see build_telemetry
+        max_num_jobs_memory = int(free_memory_gb / get_job_mem_gb())
 
         # pick lower value of jobs based on cores vs memory metric to minimize oom and swap usage during compilation
         max_jobs = max(1, min(max_num_jobs_cores, max_num_jobs_memory))
+        # aiter-prebuild runs several builds at once, they share the jobs
+        parallel_builds = int(os.environ.get("AITER_PARALLEL_BUILDS", '1'))
+        max_jobs = max(1, max_jobs // max(1, parallel_builds))
         max_jobs = str(max_jobs)
         os.environ["MAX_JOBS"] = max_jobs
 
 
+def copy_if_changed(src, dst):
+    '''
+    copy only when the content differs, an untouched dst keeps its mtime
+    and ninja does not recompile it. returns True if dst was written
+    '''
+    if os.path.isfile(dst) and filecmp.cmp(src, dst, shallow=False):
+        return False
+    shutil.copy(src, dst)
+    return True
+
+
+def sync_dir(src, dst):
+    '''make dst a copy of src, only writing changed files and removing stale ones'''
+    changed = []
+    kept = set()
+    for root, _, files in os.walk(src):
+        rel = os.path.relpath(root, src)
+        dst_root = os.path.normpath(os.path.join(dst, rel))
+        os.makedirs(dst_root, exist_ok=True)
+        for name in files:
+            kept.add(os.path.join(dst_root, name))
+            if copy_if_changed(os.path.join(root, name), os.path.join(dst_root, name)):
+                changed.append(os.path.join(dst_root, name))
+    for root, _, files in os.walk(dst):
+        for name in files:
+            path = os.path.join(root, name)
+            if path not in kept:
+                os.remove(path)
+    return changed
+
+
 def rename_cpp_to_cu(els, dst, recurisve=False):
     def do_rename_and_mv(name, src, dst, ret):
         newName = name
         if name.endswith(".cpp") or name.endswith(".cu"):
             newName = name.replace(".cpp", ".cu")
             ret.append(f'{dst}/{newName}')
-        shutil.copy(f'{src}/{name}', f'{dst}/{newName}')
+        copy_if_changed(f'{src}/{name}', f'{dst}/{newName}')
     ret = []
     for el in els:
         if not os.path.exists(el):
@@ -137,79 +196,174 @@ def get_hip_version():
     return parse(torch.version.hip.split()[-1].rstrip('-').replace('-', '+'))
 
 
-@functools.lru_cache(maxsize=1024)
-def get_module(md_name):
-    numa_balance_set = os.popen(
-        "cat /proc/sys/kernel/numa_balancing").read().strip()
+@functools.lru_cache(maxsize=1)
+def check_numa_balancing():
+    try:
+        with open("/proc/sys/kernel/numa_balancing") as f:
+            numa_balance_set = f.read().strip()
+    except OSError:
+        return
     if numa_balance_set == "1":
         logger.warning("WARNING: NUMA balancing is enabled, which may cause errors. "
                        "It is recommended to disable NUMA balancing by running 'sudo sh -c echo 0 > /proc/sys/kernel/numa_balancing' "
                        "for more details: https://rocm.docs.amd.com/en/latest/how-to/system-optimization/mi300x.html#disable-numa-auto-balancing")
+
+
+@functools.lru_cache(maxsize=1024)
+def get_module(md_name):
+    check_numa_balancing()
     return importlib.import_module(f'{__package__}.{md_name}')
 
 
+def get_build_flags(flags_extra_cc, flags_extra_hip):
+    flags_cc = ["-O3", "-std=c++17"]
+    flags_hip = [
+        "-DLEGACY_HIPBLAS_DIRECT",
+        "-DUSE_PROF_API=1",
+        "-D__HIP_PLATFORM_HCC__=1",
+        "-D__HIP_PLATFORM_AMD__=1",
+        "-U__HIP_NO_HALF_CONVERSIONS__",
+        "-U__HIP_NO_HALF_OPERATORS__",
+
+        "-mllvm", "--amdgpu-kernarg-preload-count=16",
+        # "-v", "--save-temps",
+        "-Wno-unused-result",
+        "-Wno-switch-bool",
+        "-Wno-vla-cxx-extension",
+        "-Wno-undefined-func-template",
+        "-Wno-macro-redefined",
+        "-fgpu-flush-denormals-to-zero",
+    ]
+
+    # Imitate https://github.com/ROCm/composable_kernel/blob/c8b6b64240e840a7decf76dfaa13c37da5294c4a/CMakeLists.txt#L190-L214
+    hip_version = get_hip_version()
+    if hip_version > Version('5.7.23302'):
+        flags_hip += ["-fno-offload-uniform-block"]
+    if hip_version > Version('6.1.40090'):
+        flags_hip += ["-mllvm", "-enable-post-misched=0"]
+    if hip_version > Version('6.2.41132'):
+        flags_hip += ["-mllvm", "-amdgpu-early-inline-all=true",
+                      "-mllvm", "-amdgpu-function-calls=false"]
+    if hip_version > Version('6.2.41133'):
+        flags_hip += ["-mllvm", "-amdgpu-coerce-illegal-types=1"]
+
+    flags_cc += flags_extra_cc
+    flags_hip += flags_extra_hip
+    archs = validate_and_update_archs()
+    flags_hip += [f"--offload-arch={arch}" for arch in archs]
+    return flags_cc, flags_hip
+
+
+def get_module_digest(md_name, srcs, flags_extra_cc, flags_extra_hip, blob_gen_cmd, extra_include, extra_ldflags):
+    flags_cc, flags_hip = get_build_flags(flags_extra_cc, flags_extra_hip)
+    # files of the staged ck are covered by the ck revision, csrc/include
+    # is an include dir of every module, see build_module
+    return get_build_digest(md_name, srcs, flags_cc, flags_hip,
+                            blob_gen_cmd, [f"{AITER_CSRC_DIR}/include"] + extra_include, extra_ldflags,
+                            get_hip_version(), get_ck_revision(CK_SRC_DIR),
+                            ignore_dirs=[CK_DIR])
+
+
+def get_jit_build_cache():
+    return get_build_cache(f'{get_user_jit_dir()}/build_cache')
+
+
+def build_args_key(custom_build_args):
+    '''custom_build_args as a hashable key, lists (e.g. the blob_gen_cmd of mha) as tuples'''
+    return tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in custom_build_args.items()))
+
+
+@functools.lru_cache(maxsize=1024)
+def is_module_up_to_date(ops_name, md_name, custom_build_args=()):
+    '''
+    the jit .so is only reused when it was built from the same inputs,
+    a missing or different digest means it has to be rebuilt. without the
+    build cache (AITER_JIT_CACHE=0) any built .so is reused.
+    custom_build_args as of build_args_key
+    '''
+    so_path = f'{get_user_jit_dir()}/{md_name}.so'
+    if not os.path.exists(so_path):
+        return False
+    if get_jit_build_cache() is None:
+        return True
+    d_args = get_args_of_build(ops_name)
+    d_args.update({k: list(v) if isinstance(v, tuple) else v for k, v in custom_build_args})
+    digest = get_module_digest(md_name, d_args["srcs"], d_args["flags_extra_cc"], d_args["flags_extra_hip"],
+                               d_args["blob_gen_cmd"], d_args["extra_include"], d_args["extra_ldflags"])
+    if read_module_digest(so_path) != digest:
+        logger.info(f'[{md_name}] is out of date, digest {digest[:12]}')
+        return False
+    return True
+
+
 def build_module(md_name, srcs, flags_extra_cc, flags_extra_hip, blob_gen_cmd, extra_include, extra_ldflags, verbose):
     startTS = time.perf_counter()
+    op_dir = f'{bd_dir}/{md_name}'
+    telemetry = {'md_name': md_name,
+                 'started': time.time(),
+                 'status': 'failed',
+                 'cache': 'disabled'}
+    peak = JobPeakRss()
     try:
-        op_dir = f'{bd_dir}/{md_name}'
+        so_path = f'{get_user_jit_dir()}/{md_name}.so'
+
+        build_cache = get_jit_build_cache()
+        if build_cache is not None:
+            digest = get_module_digest(md_name, srcs, flags_extra_cc, flags_extra_hip,
+                                       blob_gen_cmd, extra_include, extra_ldflags)
+            telemetry['digest'] = digest
+            cached_so = build_cache.lookup(digest, md_name)
+            if cached_so is not None:
+                shutil.copy(cached_so, so_path)
+                write_module_digest(so_path, digest)
+                module = get_module(md_name)
+                logger.info(
+                    f'load [{md_name}] from jit cache {digest[:12]}, cost {time.perf_counter()-startTS:.8f}s')
+                telemetry.update(status='cache_hit', cache='hit')
+                return module
+            telemetry['cache'] = 'miss'
         logger.info(f'start build [{md_name}] under {op_dir}')
+        stage_ck()
 
         opbd_dir = f'{op_dir}/build'
         src_dir = f'{op_dir}/build/srcs'
         os.makedirs(src_dir, exist_ok=True)
-        if os.path.exists(f'{get_user_jit_dir()}/{md_name}.so'):
-            os.remove(f'{get_user_jit_dir()}/{md_name}.so')
+        if os.path.exists(so_path):
+            os.remove(so_path)
 
         sources = rename_cpp_to_cu(srcs, src_dir)
 
-        flags_cc = ["-O3", "-std=c++17"]
-        flags_hip = [
-            "-DLEGACY_HIPBLAS_DIRECT",
-            "-DUSE_PROF_API=1",
-            "-D__HIP_PLATFORM_HCC__=1",
-            "-D__HIP_PLATFORM_AMD__=1",
-            "-U__HIP_NO_HALF_CONVERSIONS__",
-            "-U__HIP_NO_HALF_OPERATORS__",
-
-            "-mllvm", "--amdgpu-kernarg-preload-count=16",
-            # "-v", "--save-temps",
-            "-Wno-unused-result",
-            "-Wno-switch-bool",
-            "-Wno-vla-cxx-extension",
-            "-Wno-undefined-func-template",
-            "-Wno-macro-redefined",
-            "-fgpu-flush-denormals-to-zero",
-        ]
-
-        # Imitate https://github.com/ROCm/composable_kernel/blob/c8b6b64240e840a7decf76dfaa13c37da5294c4a/CMakeLists.txt#L190-L214
-        hip_version = get_hip_version()
-        if hip_version > Version('5.7.23302'):
-            flags_hip += ["-fno-offload-uniform-block"]
-        if hip_version > Version('6.1.40090'):
-            flags_hip += ["-mllvm", "-enable-post-misched=0"]
-        if hip_version > Version('6.2.41132'):
-            flags_hip += ["-mllvm", "-amdgpu-early-inline-all=true",
-                          "-mllvm", "-amdgpu-function-calls=false"]
-        if hip_version > Version('6.2.41133'):
-            flags_hip += ["-mllvm", "-amdgpu-coerce-illegal-types=1"]
-
-        flags_cc += flags_extra_cc
-        flags_hip += flags_extra_hip
-        archs = validate_and_update_archs()
-        flags_hip += [f"--offload-arch={arch}" for arch in archs]
+        flags_cc, flags_hip = get_build_flags(flags_extra_cc, flags_extra_hip)
         check_and_set_ninja_worker()
 
-        def exec_blob(blob_gen_cmd, op_dir, src_dir, sources):
-            if blob_gen_cmd:
+        def exec_blob(blob_gen_cmds, op_dir, src_dir, sources):
+            blob_gen_cmds = [el for el in blob_gen_cmds if el]
+            if blob_gen_cmds:
                 blob_dir = f"{op_dir}/blob"
                 os.makedirs(blob_dir, exist_ok=True)
-                baton = FileBaton(os.path.join(blob_dir, 'lock'))
+                baton = FileBaton(os.path.join(op_dir, 'blob.lock'))
                 if baton.try_acquire():
                     try:
-                        if AITER_LOG_MORE:
-                            logger.info(
-                                f'exec_blob ---> {PY} {blob_gen_cmd.format(blob_dir)}')
-                        os.system(f'{PY} {blob_gen_cmd.format(blob_dir)}')
+                        # generators rewrite every file, run them into a
+                        # staging dir and only carry over what changed, so
+                        # ninja recompiles just the touched instances
+                        stage_dir = f"{op_dir}/blob_staging"
+                        if os.path.exists(stage_dir):
+                            shutil.rmtree(stage_dir)
+                        os.makedirs(stage_dir)
+                        blobTS = time.perf_counter()
+                        for cmd in blob_gen_cmds:
+                            if AITER_LOG_MORE:
+                                logger.info(
+                                    f'exec_blob ---> {PY} {cmd.format(stage_dir)}')
+                            os.system(f'{PY} {cmd.format(stage_dir)}')
+                        telemetry['blob_gen_seconds'] = round(
+                            time.perf_counter() - blobTS, 2)
+                        changed = sync_dir(stage_dir, blob_dir)
+                        telemetry['blob_files_changed'] = len(changed)
+                        shutil.rmtree(stage_dir)
+                        logger.info(
+                            f'[{md_name}] blob gen: {len(changed)} files changed')
                     finally:
                         baton.release()
                 else:
@@ -218,11 +372,8 @@ def build_module(md_name, srcs, flags_extra_cc, flags_extra_hip, blob_gen_cmd, e
                                             src_dir, recurisve=True)
             return sources
 
-        if isinstance(blob_gen_cmd, list):
-            for s_blob_gen_cmd in blob_gen_cmd:
-                sources = exec_blob(s_blob_gen_cmd, op_dir, src_dir, sources)
-        else:
-            sources = exec_blob(blob_gen_cmd, op_dir, src_dir, sources)
+        sources = exec_blob(blob_gen_cmd if isinstance(blob_gen_cmd, list) else [blob_gen_cmd],
+                            op_dir, src_dir, sources)
 
         bd_include_dir = f'{op_dir}/build/include'
         os.makedirs(bd_include_dir, exist_ok=True)
@@ -234,25 +385,44 @@ def build_module(md_name, srcs, flags_extra_cc, flags_extra_hip, blob_gen_cmd, e
             f"{bd_include_dir}",
         ]
 
-        module = cpp_extension.load(
-            md_name,
-            sources,
-            extra_cflags=flags_cc,
-            extra_cuda_cflags=flags_hip,
-            extra_ldflags=extra_ldflags,
-            extra_include_paths=extra_include_paths,
-            build_directory=opbd_dir,
-            verbose=verbose or AITER_LOG_MORE > 0,
-            with_cuda=True,
-            is_python_module=True,
-        )
+        log_offset = ninja_log_offset(opbd_dir)
+        compileTS = time.perf_counter()
+        with peak:
+            module = cpp_extension.load(
+                md_name,
+                sources,
+                extra_cflags=flags_cc,
+                extra_cuda_cflags=flags_hip,
+                extra_ldflags=extra_ldflags,
+                extra_include_paths=extra_include_paths,
+                build_directory=opbd_dir,
+                verbose=verbose or AITER_LOG_MORE > 0,
+                with_cuda=True,
+                is_python_module=True,
+            )
+        telemetry.update(status='built',
+                         compile_seconds=round(time.perf_counter() - compileTS, 2),
+                         max_jobs=int(os.environ.get('MAX_JOBS', 0)),
+                         units=parse_ninja_log(opbd_dir, log_offset))
         shutil.copy(f'{opbd_dir}/{md_name}.so', f'{get_user_jit_dir()}')
+        if build_cache is not None:
+            write_module_digest(so_path, digest)
+            build_cache.publish(digest, md_name, so_path)
     except Exception as e:
         logger.error('failed build jit [{}]\n-->[History]: {}'.format(
             md_name,
             '-->'.join(traceback.format_exception(*sys.exc_info()))
         ))
         raise Exception(f"failed build jit [{md_name}]...")
+    finally:
+        telemetry['seconds'] = round(time.perf_counter() - startTS, 2)
+        # also of a failed build, an OOM killed compile is exactly the peak worth knowing
+        if peak.gb is not None:
+            telemetry['peak_job_rss_gb'] = peak.gb
+        try:
+            write_telemetry(md_name, telemetry)
+        except OSError as e:
+            logger.warning(f'failed to write build telemetry of [{md_name}]: {e}')
     logger.info(
         f'finish build [{md_name}], cost {time.perf_counter()-startTS:.8f}s')
     return module
@@ -327,46 +497,127 @@ def get_args_of_build(ops_name: str, exclue=[]):
                 "ERROR: pls use dict_format to write 'optCompilerConfig.json'! ")
 
 
+def load_op(_md_name: str, loadName: str, custom_build_args={}):
+    '''find the c++ function of an op, building its module if needed'''
+    md_name = _md_name
+    try:
+        module = None
+        if PREBUILD_KERNELS and hasattr(aiter_, loadName):
+            module = aiter_
+        if module is None:
+            md_name = custom_build_args.get('md_name', md_name)
+            if not is_module_up_to_date(_md_name, md_name, build_args_key(custom_build_args)):
+                raise ImportError(f"{md_name} is out of date")
+            module = get_module(md_name)
+    except Exception as e:
+        logger.info(f"[{md_name}] not found, build from source...")
+        d_args = get_args_of_build(_md_name)
+        d_args.update(custom_build_args)
+
+        # update module if we have coustom build
+        md_name = custom_build_args.get('md_name', md_name)
+
+        srcs = d_args["srcs"]
+        flags_extra_cc = d_args["flags_extra_cc"]
+        flags_extra_hip = d_args["flags_extra_hip"]
+        blob_gen_cmd = d_args["blob_gen_cmd"]
+        extra_include = d_args["extra_include"]
+        extra_ldflags = d_args["extra_ldflags"]
+        verbose = d_args["verbose"]
+        module = build_module(md_name, srcs, flags_extra_cc, flags_extra_hip,
+                              blob_gen_cmd, extra_include, extra_ldflags, verbose)
+        is_module_up_to_date.cache_clear()
+    if AITER_LOG_MORE:
+        logger.info(f"load {loadName} from {module.__name__}")
+    return getattr(module, loadName)
+
+
+# AITER_PROFILE_DISPATCH=1 records the python overhead of every compile_ops
+# call: dispatch_ns is spent before the c++ function is entered, call_ns
+# inside it (argument conversion + kernel launch on the host)
+AITER_PROFILE_DISPATCH = int(os.getenv("AITER_PROFILE_DISPATCH", 0))
+_dispatch_profile = {}
+
+
+def get_dispatch_profile():
+    '''{op: (calls, avg dispatch us, avg call us)}'''
+    return {name: (cnt, dispatch_ns / cnt / 1000, call_ns / cnt / 1000)
+            for name, (cnt, dispatch_ns, call_ns) in _dispatch_profile.items()}
+
+
+def reset_dispatch_profile():
+    _dispatch_profile.clear()
+
+
+def log_dispatch_profile():
+    profile = sorted(get_dispatch_profile().items(),
+                     key=lambda el: el[1][0] * el[1][1], reverse=True)
+    if not profile:
+        return
+    lines = [f"{'op':<40} {'calls':>10} {'dispatch us':>12} {'call us':>12}"]
+    for name, (cnt, dispatch_us, call_us) in profile:
+        lines.append(f"{name:<40} {cnt:>10} {dispatch_us:>12.2f} {call_us:>12.2f}")
+    logger.info("compile_ops dispatch profile:\n" + "\n".join(lines))
+
+
+if AITER_PROFILE_DISPATCH:
+    import atexit
+    atexit.register(log_dispatch_profile)
+
+
 def compile_ops(_md_name: str, fc_name: Optional[str] = None):
     def decorator(func):
+        loadName = fc_name if fc_name is not None else func.__name__
+        op = None
+        # build_args_key of custom_build_args (their md_name included) -> bound c++ function
+        custom_ops = {}
+
+        def load_custom(custom_build_args):
+            key = build_args_key(custom_build_args)
+            call = custom_ops.get(key, None)
+            if call is None:
+                call = custom_ops[key] = load_op(_md_name, loadName, custom_build_args)
+            return call
+
+        if AITER_LOG_MORE == 2 or AITER_PROFILE_DISPATCH:
+            @functools.wraps(func)
+            def wrapper(*args, custom_build_args={}, **kwargs):
+                nonlocal op
+                startTS = time.perf_counter_ns()
+                if custom_build_args:
+                    call = load_custom(custom_build_args)
+                else:
+                    if op is None:
+                        op = load_op(_md_name, loadName)
+                    call = op
+
+                if AITER_LOG_MORE == 2:
+                    from ..test_common import log_args
+                    log_args(func, *args, **kwargs)
+
+                if not AITER_PROFILE_DISPATCH:
+                    return call(*args, **kwargs)
+                callTS = time.perf_counter_ns()
+                ret = call(*args, **kwargs)
+                endTS = time.perf_counter_ns()
+                stats = _dispatch_profile.setdefault(loadName, [0, 0, 0])
+                stats[0] += 1
+                stats[1] += callTS - startTS
+                stats[2] += endTS - callTS
+                return ret
+            return wrapper
+
+        # the c++ function is bound on first success, after that the
+        # wrapper is a single check plus a direct call, one dict lookup
+        # more with custom_build_args (e.g. the mha variants)
+        @functools.wraps(func)
         def wrapper(*args, custom_build_args={}, **kwargs):
-            loadName = fc_name
-            md_name = _md_name
-            if fc_name is None:
-                loadName = func.__name__
-            try:
-                module = None
-                if PREBUILD_KERNELS:
-                    print("load module from aiter_")
-                    if hasattr(aiter_, loadName):
-                        module = aiter_
-                if module is None:
-                    module = get_module(custom_build_args.get('md_name',
-                                                              md_name))
-                    print(f"load module from {md_name}")
-            except Exception as e:
-                print("aiter_ not found, build from source...")
-                d_args = get_args_of_build(md_name)
-                d_args.update(custom_build_args)
-
-                # update module if we have coustom build
-                md_name = custom_build_args.get('md_name', md_name)
-
-                srcs = d_args["srcs"]
-                flags_extra_cc = d_args["flags_extra_cc"]
-                flags_extra_hip = d_args["flags_extra_hip"]
-                blob_gen_cmd = d_args["blob_gen_cmd"]
-                extra_include = d_args["extra_include"]
-                extra_ldflags = d_args["extra_ldflags"]
-                verbose = d_args["verbose"]
-                module = build_module(md_name, srcs, flags_extra_cc, flags_extra_hip,
-                                      blob_gen_cmd, extra_include, extra_ldflags, verbose)
-            op = getattr(module, loadName)
-
-            if AITER_LOG_MORE == 2:
-                from ..test_common import log_args
-                log_args(func, *args, **kwargs)
-
+            nonlocal op
+            if op is not None and not custom_build_args:
+                return op(*args, **kwargs)
+            if custom_build_args:
+                return load_custom(custom_build_args)(*args, **kwargs)
+            op = load_op(_md_name, loadName)
             return op(*args, **kwargs)
         return wrapper
     return decorator
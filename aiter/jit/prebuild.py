@@ -0,0 +1,175 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# aiter-prebuild: build the compile_ops modules ahead of time, in parallel
+#   aiter-prebuild                                  # every non tune module
+#   aiter-prebuild -m module_gemm_a8w8 module_moe   # a subset
+#   aiter-prebuild -x module_mha_fwd --workers 4 --manifest prebuild.json
+
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from . import core
+from .core import logger
+from .build_telemetry import get_job_mem_gb
+
+# a blob generator usually emits dozens of instances, weigh it accordingly
+BLOB_GEN_COST = 40
+
+
+def list_modules(exclude=[], with_tune=False):
+    with open(f'{core.this_dir}/optCompilerConfig.json', 'r') as file:
+        data = json.load(file)
+    return [md for md in data
+            if md not in exclude and (with_tune or not md.endswith('tune'))]
+
+
+def count_sources(srcs):
+    num = 0
+    for el in srcs:
+        if os.path.isdir(el):
+            num += len([f for f in os.listdir(el)
+                        if f.endswith('.cu') or f.endswith('.cpp')])
+        elif os.path.exists(el):
+            num += 1
+    return num
+
+
+def estimate_cost(d_args):
+    '''rough number of translation units a module compiles'''
+    blob_gen_cmd = d_args['blob_gen_cmd']
+    if not blob_gen_cmd:
+        num_blob = 0
+    elif isinstance(blob_gen_cmd, list):
+        num_blob = len(blob_gen_cmd)
+    else:
+        num_blob = 1
+    return count_sources(d_args['srcs']) + num_blob * BLOB_GEN_COST
+
+
+def get_free_memory_gb():
+    import psutil
+    return psutil.virtual_memory().available / (1024 ** 3)
+
+
+def get_num_workers(num_modules, workers=None):
+    '''
+    never run more builds than ninja jobs fit into free memory,
+    every concurrent build gets at least one job
+    '''
+    max_jobs_cores = int(max(1, os.cpu_count()*0.8))
+    max_jobs_memory = int(max(1, get_free_memory_gb() / get_job_mem_gb()))
+    max_workers = max(1, min(max_jobs_cores, max_jobs_memory, num_modules))
+    if workers is not None:
+        max_workers = max(1, min(workers, max_workers))
+    return max_workers
+
+
+def build_one(md_name, parallel_builds):
+    # share the ninja jobs between the concurrent builds
+    os.environ['AITER_PARALLEL_BUILDS'] = str(parallel_builds)
+    startTS = time.perf_counter()
+    ret = {'md_name': md_name}
+    try:
+        so_path = f'{core.get_user_jit_dir()}/{md_name}.so'
+        if os.path.exists(so_path) and core.is_module_up_to_date(md_name, md_name):
+            ret['status'] = 'up_to_date'
+        else:
+            d_args = core.get_args_of_build(md_name)
+            core.build_module(md_name, d_args['srcs'], d_args['flags_extra_cc'], d_args['flags_extra_hip'],
+                              d_args['blob_gen_cmd'], d_args['extra_include'], d_args['extra_ldflags'],
+                              d_args['verbose'])
+            ret['status'] = 'built'
+        ret['so'] = so_path
+        ret['digest'] = core.read_module_digest(so_path)
+        ret['size'] = os.path.getsize(so_path)
+    except Exception:
+        ret['status'] = 'failed'
+        ret['error'] = traceback.format_exc()
+    ret['seconds'] = round(time.perf_counter() - startTS, 2)
+    return ret
+
+
+def prebuild(modules, workers=None, manifest=None):
+    costs = {md: estimate_cost(core.get_args_of_build(md)) for md in modules}
+    # longest first, so the big CK modules do not end up as the tail
+    modules = sorted(modules, key=lambda md: costs[md], reverse=True)
+    num_workers = get_num_workers(len(modules), workers)
+    logger.info(f'prebuild {len(modules)} modules with {num_workers} workers')
+
+    startTS = time.perf_counter()
+    results = []
+    ctx = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=ctx) as executor:
+        futures = {executor.submit(build_one, md, num_workers): md
+                   for md in modules}
+        for future in as_completed(futures):
+            ret = future.result()
+            ret['estimated_cost'] = costs[ret['md_name']]
+            logger.info(f"[{ret['md_name']}] {ret['status']} in {ret['seconds']}s")
+            if ret['status'] == 'failed':
+                logger.error(ret['error'])
+            results.append(ret)
+
+    manifest_data = {
+        'created': time.time(),
+        'seconds': round(time.perf_counter() - startTS, 2),
+        'workers': num_workers,
+        'gpu_archs': core.validate_and_update_archs(),
+        'hip_version': str(core.get_hip_version()),
+        'ck_revision': core.get_ck_revision(core.CK_SRC_DIR),
+        'modules': sorted(results, key=lambda el: el['md_name']),
+    }
+    manifest = manifest or f'{core.get_user_jit_dir()}/prebuild_manifest.json'
+    with open(manifest, 'w') as f:
+        json.dump(manifest_data, f, indent=2)
+    logger.info(f'prebuild manifest written to {manifest}')
+    return manifest_data
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="aiter-prebuild",
+        description="build aiter jit modules ahead of time",
+    )
+    parser.add_argument("-m", "--modules", nargs='+', default=None,
+                        help="modules to build, default: all non tune modules in optCompilerConfig.json")
+    parser.add_argument("-x", "--exclude", nargs='+', default=[],
+                        help="modules to skip")
+    parser.add_argument("--with_tune", action='store_true',
+                        help="also build the *_tune modules")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="concurrent builds, default: bounded by cores and free memory")
+    parser.add_argument("--manifest", default=None,
+                        help="where to write the manifest, default: {jit_dir}/prebuild_manifest.json")
+    parser.add_argument("--list", action='store_true',
+                        help="print the modules with their estimated cost and exit")
+    args = parser.parse_args(argv)
+
+    all_modules = list_modules(with_tune=True)
+    modules = args.modules or list_modules(args.exclude, args.with_tune)
+    unknown = [md for md in modules if md not in all_modules]
+    if unknown:
+        parser.error(f'unknown modules: {unknown}')
+    modules = [md for md in modules if md not in args.exclude]
+
+    if args.list:
+        for md in modules:
+            print(f'{md:<40} {estimate_cost(core.get_args_of_build(md))}')
+        return 0
+
+    manifest = prebuild(modules, args.workers, args.manifest)
+    failed = [el['md_name'] for el in manifest['modules'] if el['status'] == 'failed']
+    if failed:
+        logger.error(f'failed to build: {failed}')
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
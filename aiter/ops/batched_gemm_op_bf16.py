@@ -5,8 +5,12 @@ import torch
 from torch import Tensor
 from typing import List, Optional
 import functools
-import pandas as pd
 from ..jit.core import compile_ops, CK_DIR, AITER_CSRC_DIR, AITER_ROOT_DIR, AITER_CORE_DIR
+from ..configs.tuned_lookup import lookup_tuned, ck_splitK
+from ..configs.shape_recorder import shape_recorder
+from ..tuning.occupancy import best_splitK, get_cu_num
+
+BF16_BATCHED_TUNED_CSV = f"{AITER_CORE_DIR}/aiter/configs/bf16_tuned_batched_gemm.csv"
 
 
 @compile_ops("module_batched_gemm_bf16", fc_name="batched_gemm_bf16")
@@ -19,23 +23,16 @@ def batched_gemm_bf16(
 ): ...
 
 
-@functools.lru_cache(maxsize=1024)
 def compute_batched_gemm_SplitK(
+        B: int,
         M: int,
         N: int,
         K: int,
         tile_m: int,
         tile_n: int,
         tile_k: int):
-
-    device_properties = torch.cuda.get_device_properties(0)
-    cu_num = device_properties.multi_processor_count
-    tile_num = ((M + tile_m - 1) // tile_m) * ((N + tile_n - 1) // tile_n)
-    cusPerTile = cu_num / tile_num
-    splitK = 0
-    while( cusPerTile >= pow(2, splitK+1) and (pow(2, splitK+1) * tile_k) < 2 * K):
-        splitK += 1
-    return splitK
+    # the splitK of the fewest full waves on this device, see tuning/occupancy.py
+    return best_splitK(M, N, K, tile_m, tile_n, tile_k, get_cu_num(), B).splitK
 
 
 @functools.lru_cache(maxsize=1024)
@@ -45,16 +42,9 @@ def get_CKBatchedGEMM_config(
     N: int,
     K: int,
 ):
-    if not hasattr(get_CKBatchedGEMM_config, "ck_batched_gemm_dict"):
-        ck_batched_gemm_dict = pd.read_csv(f"{AITER_CORE_DIR}/aiter/configs/bf16_tuned_batched_gemm.csv").drop_duplicates()
-        get_CKBatchedGEMM_config.ck_batched_gemm_dict = ck_batched_gemm_dict.set_index(['B','M','N','K']).to_dict('index')
-    config = get_CKBatchedGEMM_config.ck_batched_gemm_dict.get((B,M,N,K), None)
-    if config != None:
-        mnk = config['kernelName'].split('_')[2].split('x')[1:]
-        config["tile_m"] = int(mnk[0])
-        config["tile_n"] = int(mnk[1])
-        config["tile_k"] = int(mnk[2])
-    return config
+    # tile_m/tile_n/tile_k are parsed from kernelName when the index is compiled,
+    # an untuned M gets the config of the nearest tuned M, see tuned_lookup
+    return lookup_tuned(BF16_BATCHED_TUNED_CSV, ['B', 'M', 'N', 'K'], (B, M, N, K))
 
 def batched_gemm_bf16_CK(
     XQ: Tensor,
@@ -73,11 +63,18 @@ def batched_gemm_bf16_CK(
     n = WQ.shape[1]
     k = XQ.shape[2]
     ck_config = get_CKBatchedGEMM_config(b, m, n, k)
+    if shape_recorder.enabled:
+        shape_recorder.record(BF16_BATCHED_TUNED_CSV, ['B', 'M', 'N', 'K'], (b, m, n, k))
+    if splitK == None and ck_config is not None and ck_config.get('predicted') \
+            and bias is None and dtype == torch.bfloat16:
+        # no tuned M of this (N, K): the dispatcher does not have the
+        # predicted kernel, the tune module runs it by id, see tuned_lookup
+        Y = torch.empty(b, m, n, dtype=dtype, device=XQ.device)
+        return batched_gemm_bf16_tune(XQ, WQ, Y, ck_config['kernelId'], ck_config['splitK'])
     if splitK == None:
-        if ck_config != None:
-            splitK = ck_config['splitK']
-        else:
-            splitK = 0
+        # the nearest tuned M only when the CK dispatcher runs its kernel
+        splitK = ck_splitK(ck_config, m, lambda tile_m, tile_n, tile_k:
+                           compute_batched_gemm_SplitK(b, m, n, k, tile_m, tile_n, tile_k))
     Y = torch.empty(b, m, n, dtype=dtype, device=XQ.device)
     return batched_gemm_bf16(XQ, WQ, Y, bias, splitK)
 
@@ -0,0 +1,397 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# one GEMM entry point over every backend
+#   y = aiter.gemm(x, w)                                              # fp32/bf16/fp16
+#   y = aiter.gemm(xq, wq, x_scale, w_scale, out_dtype=torch.bfloat16)  # int8 rowwise, fp8 per tensor/blockscale
+#   y = aiter.gemm(xq, shuffle_weight(wq, (32, 16)), x_scale, w_scale, bias_f32, w_layout='shuffle32x16')
+#   print(aiter.gemm_trace(x, w))                                     # the decision, nothing runs
+# x is (..., M, K) with a (N, K) w, or (B, M, K) with a (B, N, K) w.
+# the kind of problem follows from the dtypes and scales, every backend of
+# the kind checks whether it can run the problem. the capable ones with a
+# tuned latency in the merged tuning database (configs/gemm_db.py) compete on
+# it, the others follow in the fallback order of registration. a backend that
+# finds it can not run the shape after all (asm without a kernel) falls
+# through to the next one, which the trace records.
+# AITER_GEMM_TRACE=1 logs the decision of every new problem.
+
+import os
+import torch
+import torch.nn.functional as F
+from torch import Tensor
+from dataclasses import dataclass, field, replace
+from typing import Callable, Dict, List, Optional
+from ..configs.gemm_db import get_gemm_db, GemmDB, TunedEntry
+from ..buffer_pool import buffer_pool
+from ..tuning.occupancy import get_cu_num
+from .. import logger
+
+AITER_GEMM_TRACE = int(os.environ.get('AITER_GEMM_TRACE', 0))
+
+FP8 = (torch.float8_e4m3fnuz, torch.float8_e4m3fn)
+FLOAT = (torch.float32, torch.bfloat16, torch.float16)
+BLOCK_SHAPE = (128, 128)
+# weight layouts besides the plain (N, K)
+#   shuffle32x16  shuffle_weight(w, layout=(32, 16)), asm a8w8
+#   flatmm        (N/16, K/64, 4, 16, 16) tiles, asm blockscale
+W_LAYOUTS = (None, 'shuffle32x16', 'flatmm')
+
+
+@dataclass(frozen=True)
+class GemmProblem:
+    kind: str
+    B: int
+    M: int
+    N: int
+    K: int
+    dtype: torch.dtype
+    out_dtype: torch.dtype
+    # dtype of the bias, None without one
+    bias: Optional[torch.dtype]
+    w_layout: Optional[str]
+    device: str
+
+    def shape(self):
+        '''the lookup keys of the tuned csv files'''
+        return {'B': self.B, 'M': self.M, 'N': self.N, 'K': self.K, 'bias': self.bias is not None,
+                'dtype': str(self.dtype), 'outdtype': str(self.out_dtype)}
+
+    def __str__(self):
+        return f'{self.kind} {"B=" + str(self.B) + " " if self.B > 1 else ""}M={self.M} N={self.N} K={self.K} ' \
+               f'{self.dtype}->{self.out_dtype}{" +bias" if self.bias else ""}' \
+               f'{" " + self.w_layout if self.w_layout else ""} on {self.device}'
+
+
+@dataclass
+class GemmBackend:
+    kind: str
+    name: str
+    # check(problem) -> None if the backend can run problem, else why not
+    check: Callable
+    # run(problem, entry, x, w, x_scale, w_scale, bias) -> out, or None if it
+    # can not run the shape after all. entry is its TunedEntry or None
+    run: Callable
+    # picked ahead of any tuned backend whenever capable
+    pinned: bool = False
+
+
+# kind -> backends in fallback order
+GEMM_BACKENDS: Dict[str, List[GemmBackend]] = {}
+# problem -> decision, reset when a backend registers
+_decisions = {}
+
+
+def register_gemm_backend(kind: str, name: str, check: Callable, pinned: bool = False, first: bool = False):
+    '''
+    decorates run, appended to the fallback order of kind (first=True
+    prepends), a backend of the same name is replaced in place
+    '''
+    def decorator(run):
+        backends = GEMM_BACKENDS.setdefault(kind, [])
+        backend = GemmBackend(kind, name, check, run, pinned)
+        names = [el.name for el in backends]
+        if name in names:
+            backends[names.index(name)] = backend
+        else:
+            backends.insert(0 if first else len(backends), backend)
+        _decisions.clear()
+        return run
+    return decorator
+
+
+def make_problem(x, w, x_scale=None, w_scale=None, bias=None, out_dtype=None, w_layout=None):
+    if w_layout not in W_LAYOUTS:
+        raise ValueError(f'unknown {w_layout=}, choose from {W_LAYOUTS}')
+    quantized = x.dtype == torch.int8 or x.dtype in FP8
+    if quantized and (x_scale is None or w_scale is None):
+        raise ValueError(f'{x.dtype} gemm needs x_scale and w_scale')
+    if not quantized and (x_scale is not None or w_scale is not None):
+        raise ValueError(f'{x.dtype} gemm takes no scales')
+    if w.dim() == 3:
+        B, M, K = x.shape
+        N = w.shape[1]
+        kind = {torch.int8: 'batched_a8w8', torch.bfloat16: 'batched_bf16'}.get(x.dtype, None)
+    else:
+        B, M, K, N = 1, x.numel() // x.shape[-1], x.shape[-1], w.shape[0]
+        if x.dtype == torch.int8:
+            kind = 'a8w8'
+        elif x.dtype in FP8:
+            kind = 'fp8' if x_scale.numel() == 1 and w_scale.numel() == 1 else 'blockscale'
+        else:
+            kind = 'dense' if x.dtype in FLOAT else None
+    if kind is None:
+        raise ValueError(f'no gemm for {x.dtype} x {w.dtype} with a {w.dim()}d weight')
+    if out_dtype is None:
+        out_dtype = torch.bfloat16 if quantized else x.dtype
+    return GemmProblem(kind, B, M, N, K, x.dtype, out_dtype,
+                       bias.dtype if bias is not None else None, w_layout, x.device.type)
+
+
+@dataclass
+class GemmDecision:
+    problem: GemmProblem
+    # capable backends in the order they are tried
+    order: List[GemmBackend]
+    tuned: Dict[str, TunedEntry]
+    trace: List[str] = field(default_factory=list)
+
+    def __str__(self):
+        return '\n'.join(self.trace)
+
+
+def decide(problem: GemmProblem, db: Optional[GemmDB] = None) -> GemmDecision:
+    trace = [f'gemm {problem}']
+    tuned = {}
+    for entry in (db or get_gemm_db()).lookup(problem.kind, problem.shape()):
+        tuned.setdefault(entry.backend, entry)
+    capable = []
+    for backend in GEMM_BACKENDS.get(problem.kind, []):
+        reason = backend.check(problem)
+        if reason is not None:
+            trace.append(f'  {backend.name:<10} not capable: {reason}')
+            continue
+        capable.append(backend)
+        entry = tuned.get(backend.name, None)
+        trace.append(f'  {backend.name:<10} capable, {"tuned " + str(entry) if entry else "not tuned"}'
+                     f'{", pinned" if backend.pinned else ""}')
+    pinned = [el for el in capable if el.pinned]
+    ranked = sorted([el for el in capable if el.name in tuned and not el.pinned],
+                    key=lambda el: (tuned[el.name].us is None, tuned[el.name].us or 0))
+    order = pinned + ranked + [el for el in capable if el not in pinned and el not in ranked]
+    if not order:
+        trace.append('  no capable backend')
+    elif pinned:
+        trace.append(f'  -> {order[0].name}: pinned for this shape')
+    elif ranked:
+        others = [f'{el.name} {tuned[el.name].us}us' for el in ranked[1:]]
+        trace.append(f'  -> {order[0].name}: fastest tuned{" over " + ", ".join(others) if others else ""}')
+    else:
+        trace.append(f'  -> {order[0].name}: no capable backend is tuned, first in the fallback order')
+    decision = GemmDecision(problem, order, tuned, trace)
+    if AITER_GEMM_TRACE:
+        logger.info(str(decision))
+    return decision
+
+
+def get_decision(problem: GemmProblem) -> GemmDecision:
+    decision = _decisions.get(problem, None)
+    if decision is None:
+        decision = _decisions[problem] = decide(problem)
+    return decision
+
+
+def gemm_trace(x: Tensor, w: Tensor, x_scale: Optional[Tensor] = None, w_scale: Optional[Tensor] = None,
+               bias: Optional[Tensor] = None, out_dtype: Optional[torch.dtype] = None,
+               w_layout: Optional[str] = None) -> str:
+    '''why aiter.gemm picks the backend it does for these arguments, fall throughs so far included'''
+    return str(get_decision(make_problem(x, w, x_scale, w_scale, bias, out_dtype, w_layout)))
+
+
+def gemm(x: Tensor, w: Tensor, x_scale: Optional[Tensor] = None, w_scale: Optional[Tensor] = None,
+         bias: Optional[Tensor] = None, out_dtype: Optional[torch.dtype] = None,
+         w_layout: Optional[str] = None) -> Tensor:
+    '''
+    y = x @ w^T (scaled by x_scale, w_scale) + bias through the best backend.
+    scales: int8 rowwise (M, 1) and (1, N), fp8 per tensor (1,) and (1,), fp8
+    blockscale (M, K/128) and (N/128, K/128) (transposed for w_layout='flatmm')
+    '''
+    problem = make_problem(x, w, x_scale, w_scale, bias, out_dtype, w_layout)
+    decision = get_decision(problem)
+    x2 = x.view(-1, x.shape[-1]) if w.dim() == 2 and x.dim() != 2 else x
+    for backend in decision.order:
+        out = backend.run(problem, decision.tuned.get(backend.name, None), x2, w, x_scale, w_scale, bias)
+        if out is not None:
+            return out.view(*x.shape[:-1], problem.N) if x2 is not x else out
+        # not again for this problem: the cached decision is replaced, never
+        # changed, other threads keep iterating the one they got
+        current = _decisions.get(problem, decision)
+        order = [el for el in current.order if el is not backend]
+        note = f'  {backend.name} could not run it, falls through{" to " + order[0].name if order else ""}'
+        _decisions[problem] = replace(current, order=order, trace=current.trace + [note])
+        if AITER_GEMM_TRACE:
+            logger.info(note)
+    raise RuntimeError(f'no backend can run\n{_decisions.get(problem, decision)}')
+
+
+def _requires(p: GemmProblem, dtypes, out_dtypes, layout=None, cuda=True, bias=True):
+    if cuda and p.device != 'cuda':
+        return f'needs cuda tensors, got {p.device}'
+    if p.dtype not in dtypes:
+        return f'{p.dtype} input not supported'
+    if p.out_dtype not in out_dtypes:
+        return f'{p.out_dtype} output not supported'
+    if p.w_layout != layout:
+        return f'needs {layout or "plain"} weights, got {p.w_layout or "plain"}'
+    if not bias and p.bias is not None:
+        return 'no bias support'
+    return None
+
+
+_extensions = set()
+
+
+def _create_extension(name):
+    if name not in _extensions:
+        import aiter
+        getattr(aiter, f'{name}_create_extension')()
+        _extensions.add(name)
+
+
+def _add_bias(out, bias):
+    return out if bias is None else out + bias
+
+
+# dense
+
+
+def _check_skinny(p):
+    reason = _requires(p, (torch.float16,), (torch.float16,))
+    if reason:
+        return reason
+    if p.K % 8 != 0 or not ((p.N > 8 and p.M <= 4) or (p.M == 1 and p.N % 4 == 0 and p.K <= 8192)):
+        return 'not a skinny shape'
+    return None
+
+
+@register_gemm_backend('dense', 'skinny', _check_skinny, pinned=True)
+def _run_skinny(p, entry, x, w, x_scale, w_scale, bias):
+    import aiter
+    out = buffer_pool.empty((p.M, p.N), x.dtype, x.device)
+    if p.N > 8 and p.M <= 4:
+        aiter.wvSpltK(w, x, out, p.M, get_cu_num(x.device.index))
+    else:
+        aiter.LLMM1(w, x, out, 4)
+    return _add_bias(out, bias)
+
+
+@register_gemm_backend('dense', 'hipblaslt', lambda p: _requires(p, FLOAT, FLOAT))
+def _run_hipblaslt(p, entry, x, w, x_scale, w_scale, bias):
+    import aiter
+    _create_extension('hipb')
+    solidx = entry.config['solidx'] if entry is not None else -1
+    return aiter.hipb_mm(x, w.t(), solidx, bias, p.out_dtype, None, None)
+
+
+def _check_rocblas(p):
+    reason = _requires(p, FLOAT, FLOAT)
+    return reason or (f'{p.out_dtype} output of {p.dtype} input not supported' if p.out_dtype != p.dtype else None)
+
+
+@register_gemm_backend('dense', 'rocblas', _check_rocblas)
+def _run_rocblas(p, entry, x, w, x_scale, w_scale, bias):
+    import aiter
+    _create_extension('rocb')
+    solidx = entry.config['solidx'] if entry is not None else 0
+    return _add_bias(aiter.rocb_mm(x, w.t(), solidx), bias)
+
+
+@register_gemm_backend('dense', 'torch', lambda p: _requires(p, FLOAT, FLOAT, cuda=False))
+def _run_torch(p, entry, x, w, x_scale, w_scale, bias):
+    return F.linear(x, w, bias).to(p.out_dtype)
+
+
+# fp8 with per tensor scales
+
+
+@register_gemm_backend('fp8', 'hipblaslt', lambda p: _requires(p, FP8, FLOAT))
+def _run_hipblaslt_fp8(p, entry, x, w, x_scale, w_scale, bias):
+    import aiter
+    _create_extension('hipb')
+    solidx = entry.config['solidx'] if entry is not None else -1
+    return aiter.hipb_mm(x, w.t(), solidx, bias, p.out_dtype, x_scale, w_scale)
+
+
+@register_gemm_backend('fp8', 'torch', lambda p: _requires(p, FP8, FLOAT, cuda=False))
+def _run_torch_fp8(p, entry, x, w, x_scale, w_scale, bias):
+    out = F.linear(x.to(torch.float32), w.to(torch.float32)) * x_scale * w_scale
+    return _add_bias(out, bias).to(p.out_dtype)
+
+
+# int8 with rowwise scales
+
+
+def _check_asm_a8w8(p):
+    reason = _requires(p, (torch.int8,), (torch.bfloat16,), layout='shuffle32x16')
+    if reason:
+        return reason
+    if p.bias != torch.float32:
+        return 'needs a float32 bias'
+    from .gemm_op_a8w8 import get_ASMGEMM_config
+    if get_ASMGEMM_config(p.M, p.N, p.K, True, p.out_dtype) is None:
+        return 'no asm kernel for this shape in asm_a8w8_gemm.csv'
+    return None
+
+
+@register_gemm_backend('a8w8', 'asm', _check_asm_a8w8)
+def _run_asm_a8w8(p, entry, x, w, x_scale, w_scale, bias):
+    from .gemm_op_a8w8 import gemm_a8w8_ASM
+    return gemm_a8w8_ASM(x, w, x_scale, w_scale, bias, p.out_dtype)
+
+
+@register_gemm_backend('a8w8', 'ck', lambda p: _requires(p, (torch.int8,), (torch.bfloat16, torch.float16)))
+def _run_ck_a8w8(p, entry, x, w, x_scale, w_scale, bias):
+    from .gemm_op_a8w8 import gemm_a8w8_CK
+    return gemm_a8w8_CK(x, w, x_scale, w_scale, bias, p.out_dtype)
+
+
+@register_gemm_backend('a8w8', 'torch', lambda p: _requires(p, (torch.int8,), FLOAT, cuda=False))
+def _run_torch_a8w8(p, entry, x, w, x_scale, w_scale, bias):
+    out = F.linear(x.to(torch.float32), w.to(torch.float32)) * x_scale * w_scale
+    return _add_bias(out, bias).to(p.out_dtype)
+
+
+# fp8 with 1x128 x 128x128 block scales
+
+
+def _check_asm_blockscale(p):
+    reason = _requires(p, FP8, (torch.float16,), layout='flatmm', bias=False)
+    return reason or ('needs N % 16 == 0 and K % 64 == 0' if p.N % 16 or p.K % 64 else None)
+
+
+@register_gemm_backend('blockscale', 'asm', _check_asm_blockscale)
+def _run_asm_blockscale(p, entry, x, w, x_scale, w_scale, bias):
+    from .gemm_op_a8w8 import flatmm_a8w8_blockscale_ASM
+    return flatmm_a8w8_blockscale_ASM(x, w, x_scale, w_scale, p.out_dtype)
+
+
+@register_gemm_backend('blockscale', 'ck',
+                       lambda p: _requires(p, FP8, (torch.bfloat16, torch.float16), bias=False))
+def _run_ck_blockscale(p, entry, x, w, x_scale, w_scale, bias):
+    from .gemm_op_a8w8 import gemm_a8w8_blockscale_CK
+    return gemm_a8w8_blockscale_CK(x, w, x_scale, w_scale, p.out_dtype)
+
+
+@register_gemm_backend('blockscale', 'torch', lambda p: _requires(p, FP8, FLOAT, cuda=False))
+def _run_torch_blockscale(p, entry, x, w, x_scale, w_scale, bias):
+    block_n, block_k = BLOCK_SHAPE
+    xs = x_scale.repeat_interleave(block_k, dim=1)[:, :p.K]
+    ws = w_scale.repeat_interleave(block_n, dim=0).repeat_interleave(block_k, dim=1)[:p.N, :p.K]
+    out = F.linear(x.to(torch.float32) * xs, w.to(torch.float32) * ws)
+    return _add_bias(out, bias).to(p.out_dtype)
+
+
+# batched, (B, M, K) x (B, N, K)
+
+
+@register_gemm_backend('batched_a8w8', 'ck',
+                       lambda p: _requires(p, (torch.int8,), (torch.bfloat16, torch.float16)))
+def _run_ck_batched_a8w8(p, entry, x, w, x_scale, w_scale, bias):
+    from .batched_gemm_op_a8w8 import batched_gemm_a8w8_CK
+    return batched_gemm_a8w8_CK(x, w, x_scale, w_scale, bias, p.out_dtype)
+
+
+@register_gemm_backend('batched_a8w8', 'torch', lambda p: _requires(p, (torch.int8,), FLOAT, cuda=False))
+def _run_torch_batched_a8w8(p, entry, x, w, x_scale, w_scale, bias):
+    out = torch.bmm(x.to(torch.float32), w.to(torch.float32).transpose(1, 2)) * x_scale * w_scale
+    return _add_bias(out, bias).to(p.out_dtype)
+
+
+@register_gemm_backend('batched_bf16', 'ck', lambda p: _requires(p, (torch.bfloat16,), (torch.bfloat16,)))
+def _run_ck_batched_bf16(p, entry, x, w, x_scale, w_scale, bias):
+    from .batched_gemm_op_bf16 import batched_gemm_bf16_CK
+    return batched_gemm_bf16_CK(x, w, bias, p.out_dtype)
+
+
+@register_gemm_backend('batched_bf16', 'torch', lambda p: _requires(p, (torch.bfloat16,), FLOAT, cuda=False))
+def _run_torch_batched_bf16(p, entry, x, w, x_scale, w_scale, bias):
+    return _add_bias(torch.bmm(x, w.transpose(1, 2)), bias).to(p.out_dtype)
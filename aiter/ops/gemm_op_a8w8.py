@@ -5,8 +5,16 @@ import torch
 from torch import Tensor
 from typing import List, Optional
 import functools
-import pandas as pd
 from ..jit.core import compile_ops, CK_DIR, AITER_CSRC_DIR, AITER_ROOT_DIR, AITER_CORE_DIR
+from ..configs.config_index import get_config_table
+from ..configs.tuned_lookup import lookup_tuned, ck_splitK
+from ..configs.shape_recorder import shape_recorder
+from ..buffer_pool import buffer_pool
+from ..tuning.occupancy import best_splitK, get_cu_num
+
+A8W8_TUNED_CSV = f"{AITER_CORE_DIR}/aiter/configs/a8w8_tuned_gemm.csv"
+A8W8_BLOCKSCALE_TUNED_CSV = f"{AITER_CORE_DIR}/aiter/configs/a8w8_blockscale_tuned_gemm.csv"
+ASM_A8W8_CSV = f"{AITER_CORE_DIR}/aiter/configs/asm_a8w8_gemm.csv"
 
 
 @compile_ops("module_gemm_a8w8", fc_name="gemm_a8w8")
@@ -56,7 +64,6 @@ def flatmm_a8w8_blockscale_asm(
     out: Tensor,
 ): ...
 
-@functools.lru_cache(maxsize=1024)
 def compute_gemm_SplitK(
         M: int,
         N: int,
@@ -64,15 +71,8 @@ def compute_gemm_SplitK(
         tile_m: int,
         tile_n: int,
         tile_k: int):
-    
-    device_properties = torch.cuda.get_device_properties(0)
-    cu_num = device_properties.multi_processor_count
-    tile_num = ((M + tile_m - 1) // tile_m) * ((N + tile_n - 1) // tile_n)
-    cusPerTile = cu_num / tile_num
-    splitK = 0
-    while( cusPerTile >= pow(2, splitK+1) and (pow(2, splitK+1) * tile_k) < 2 * K):
-        splitK += 1
-    return splitK
+    # the splitK of the fewest full waves on this device, see tuning/occupancy.py
+    return best_splitK(M, N, K, tile_m, tile_n, tile_k, get_cu_num()).splitK
 
 
 @functools.lru_cache(maxsize=1024)
@@ -81,16 +81,9 @@ def get_CKGEMM_config(
     N: int,
     K: int,
 ):
-    if not hasattr(get_CKGEMM_config, "ckgemm_dict"):
-        ckgemm_dict = pd.read_csv(f"{AITER_CORE_DIR}/aiter/configs/a8w8_tuned_gemm.csv").drop_duplicates()
-        get_CKGEMM_config.ckgemm_dict = ckgemm_dict.set_index(['M','N','K']).to_dict('index')
-    config = get_CKGEMM_config.ckgemm_dict.get((M,N,K), None)
-    if config != None:
-        mnk = config['kernelName'].split('_')[2].split('x')[1:]
-        config["tile_m"] = int(mnk[0])
-        config["tile_n"] = int(mnk[1])
-        config["tile_k"] = int(mnk[2])
-    return config
+    # tile_m/tile_n/tile_k are parsed from kernelName when the index is compiled,
+    # an untuned M gets the config of the nearest tuned M, see tuned_lookup
+    return lookup_tuned(A8W8_TUNED_CSV, ['M', 'N', 'K'], (M, N, K))
 
  
 @functools.lru_cache(maxsize=1024)
@@ -101,11 +94,7 @@ def get_ASMGEMM_config(
     bias: bool,
     dtype: torch.dtype
 ):
-    if not hasattr(get_ASMGEMM_config, "asmgemm_dict"):
-        asmGemmDictDf = pd.read_csv(f"{AITER_CORE_DIR}/aiter/configs/asm_a8w8_gemm.csv").drop_duplicates()
-        asmGemmDictDf.bias = asmGemmDictDf.bias.apply(lambda s: True if s in ['True',1,'true'] else False)
-        get_ASMGEMM_config.asmgemm_dict = asmGemmDictDf.set_index(['M','N','K','bias','outdtype']).to_dict('index')
-    return get_ASMGEMM_config.asmgemm_dict.get((M,N,K,bias,str(dtype)), None)
+    return get_config_table(ASM_A8W8_CSV, ['M', 'N', 'K', 'bias', 'outdtype']).get(M, N, K, bias, str(dtype))
 
 
 def gemm_a8w8_ASM(
@@ -132,6 +121,9 @@ def gemm_a8w8_ASM(
     m = XQ.shape[0]
     n = WQ.shape[0]
     k = XQ.shape[-1]
+    if shape_recorder.enabled:
+        shape_recorder.record(ASM_A8W8_CSV, ['M', 'N', 'K', 'bias', 'outdtype'],
+                              (m, n, k, bias is not None, str(dtype)))
     if x_scale.dtype == torch.float32 and w_scale.dtype == torch.float32 and \
         (asm_config := get_ASMGEMM_config(m,n,k,bias!=None,dtype)) != None:
         assert bias != None, "Use asm gemm must give bias, please give a \
@@ -159,12 +151,19 @@ def gemm_a8w8_CK(
     n = WQ.shape[0]
     k = XQ.shape[-1]
     ck_config = get_CKGEMM_config(m, n, k)
+    if shape_recorder.enabled:
+        shape_recorder.record(A8W8_TUNED_CSV, ['M', 'N', 'K'], (m, n, k))
+    if splitK == None and ck_config is not None and ck_config.get('predicted') \
+            and bias is None and dtype == torch.bfloat16:
+        # no tuned M of this (N, K): the dispatcher does not have the
+        # predicted kernel, the tune module runs it by id, see tuned_lookup
+        Y = buffer_pool.empty((m, n), dtype, XQ.device)
+        return gemm_a8w8_tune(XQ, WQ, x_scale, w_scale, Y, ck_config['kernelId'], ck_config['splitK'])
     if splitK == None:
-        if ck_config != None:
-            splitK = ck_config['splitK']
-        else:
-            splitK = 0
-    Y = torch.empty(m, n, dtype=dtype, device=XQ.device)
+        # the nearest tuned M only when the CK dispatcher runs its kernel
+        splitK = ck_splitK(ck_config, m, lambda tile_m, tile_n, tile_k:
+                           compute_gemm_SplitK(m, n, k, tile_m, tile_n, tile_k))
+    Y = buffer_pool.empty((m, n), dtype, XQ.device)
     return gemm_a8w8(XQ, WQ, x_scale, w_scale, Y, bias, splitK)
 
 
@@ -182,7 +181,9 @@ def gemm_a8w8_blockscale_CK(
     m = XQ.shape[0]
     n = WQ.shape[0]
     k = XQ.shape[-1]
-    Y = torch.empty(m, n, dtype=dtype, device=XQ.device)
+    if shape_recorder.enabled:
+        shape_recorder.record(A8W8_BLOCKSCALE_TUNED_CSV, ['M', 'N', 'K'], (m, n, k))
+    Y = buffer_pool.empty((m, n), dtype, XQ.device)
     return gemm_a8w8_blockscale(XQ, WQ, x_scale, w_scale, Y)
 
 def flatmm_a8w8_blockscale_ASM(
@@ -0,0 +1,208 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# many small GEMMs of different M (per lora, per expert) as a few uniform
+# batched launches
+#   ys = aiter.grouped_gemm([x0, x1, ...], [w0, w1, ...])                     # y_i = x_i @ w_i.T
+#   ys = aiter.grouped_gemm(xqs, wqs, x_scales, w_scales, out_dtype=torch.bfloat16)
+#   print(aiter.plan_grouped_gemm([(M0, N0, K0), ...]))
+#   stacked = aiter.stack_grouped_weights(plan, ws)                          # once per plan
+#   ys = aiter.grouped_gemm(xs, ws, plan=plan, stacked=stacked)
+# problems of the same (N, K) are sorted by M and cut into buckets, every
+# bucket is one (B, M, K) x (B, N, K) launch padded to its largest M. the cut
+# minimises the launched flops plus launch_flops per launch, so padding is
+# only spent where it saves a launch. a bucket runs through aiter.gemm (the
+# batched ck kernels on the GPU), the executor can be replaced, e.g. by
+# torch_grouped_executor, the reference. the weights of a bucket are stacked
+# on every call unless a plan reused across calls (fixed routing, a lora
+# batch of the same adapters) gets them once from stack_grouped_weights. the
+# inputs of a bucket are padded with one cat and one row scatter.
+
+import math
+import functools
+import torch
+from torch import Tensor
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Sequence, Tuple
+
+# flops a launch is worth: about 1us of MI300X bf16 peak
+LAUNCH_FLOPS = 1 << 30
+
+
+@dataclass(frozen=True)
+class GroupedBucket:
+    M: int
+    N: int
+    K: int
+    # problem indices, in increasing M
+    members: Tuple[int, ...]
+    # M of every member
+    Ms: Tuple[int, ...]
+
+    @property
+    def B(self):
+        return len(self.members)
+
+    @property
+    def flops(self):
+        return 2 * self.B * self.M * self.N * self.K
+
+    @property
+    def useful_flops(self):
+        return 2 * sum(self.Ms) * self.N * self.K
+
+
+@dataclass
+class GroupedPlan:
+    buckets: List[GroupedBucket]
+    launch_flops: int
+
+    @property
+    def flops(self):
+        return sum(el.flops for el in self.buckets)
+
+    @property
+    def useful_flops(self):
+        return sum(el.useful_flops for el in self.buckets)
+
+    @property
+    def padding(self):
+        '''fraction of the launched flops spent on padded rows'''
+        return 1 - self.useful_flops / self.flops if self.flops else 0.0
+
+    def __str__(self):
+        lines = [f'{len(self.buckets)} launches, {self.padding:.1%} padded flops']
+        for el in self.buckets:
+            lines.append(f'  B={el.B} M={el.M} N={el.N} K={el.K}  Ms={list(el.Ms)}')
+        return '\n'.join(lines)
+
+
+def _cut(Ms: List[int], N: int, K: int, launch_flops: int, m_align: int, max_batch: Optional[int]):
+    '''cut sorted Ms into contiguous runs of the least flops + launches, as [(start, end)]'''
+    n = len(Ms)
+    best = [0] + [math.inf] * n
+    prev = [0] * (n + 1)
+    for j in range(1, n + 1):
+        M = -(-Ms[j - 1] // m_align) * m_align
+        lo = 0 if max_batch is None else max(0, j - max_batch)
+        for i in range(lo, j):
+            cost = best[i] + 2 * (j - i) * M * N * K + launch_flops
+            if cost < best[j]:
+                best[j], prev[j] = cost, i
+    runs = []
+    while n:
+        runs.append((prev[n], n))
+        n = prev[n]
+    return runs[::-1]
+
+
+def plan_grouped_gemm(shapes: Sequence[Tuple[int, int, int]], launch_flops: int = LAUNCH_FLOPS,
+                      m_align: int = 1, max_batch: Optional[int] = None) -> GroupedPlan:
+    '''
+    buckets of the (M, N, K) problems, M padded to a multiple of m_align and
+    at most max_batch problems per launch
+    '''
+    groups = {}
+    for i, (M, N, K) in enumerate(shapes):
+        groups.setdefault((N, K), []).append(i)
+    buckets = []
+    for (N, K), members in groups.items():
+        members.sort(key=lambda el: shapes[el][0])
+        Ms = [shapes[el][0] for el in members]
+        for start, end in _cut(Ms, N, K, launch_flops, m_align, max_batch):
+            M = -(-Ms[end - 1] // m_align) * m_align
+            buckets.append(GroupedBucket(M, N, K, tuple(members[start:end]), tuple(Ms[start:end])))
+    return GroupedPlan(buckets, launch_flops)
+
+
+def torch_grouped_executor(x: Tensor, w: Tensor, x_scale: Optional[Tensor], w_scale: Optional[Tensor],
+                           out_dtype: torch.dtype) -> Tensor:
+    '''reference: (B, M, K) x (B, N, K) in fp32, scales (B, M, 1) and (B, 1, N)'''
+    out = torch.bmm(x.to(torch.float32), w.to(torch.float32).transpose(1, 2))
+    if x_scale is not None:
+        out = out * x_scale * w_scale
+    return out.to(out_dtype)
+
+
+def _gemm_executor(x, w, x_scale, w_scale, out_dtype):
+    # aiter.gemm has batched kernels for int8 and bf16 only
+    if x.dtype not in (torch.int8, torch.bfloat16):
+        return torch_grouped_executor(x, w, x_scale, w_scale, out_dtype)
+    from .gemm_dispatch import gemm
+    return gemm(x, w, x_scale, w_scale, out_dtype=out_dtype)
+
+
+def stack_grouped_weights(plan: GroupedPlan, ws: Sequence[Tensor],
+                          w_scales: Optional[Sequence[Tensor]] = None) -> List[Tuple[Tensor, Optional[Tensor]]]:
+    '''(B, N, K) weights and (B, 1, N) w_scales of every bucket of plan, the stacked of grouped_gemm'''
+    stacked = []
+    for bucket in plan.buckets:
+        w = torch.stack([ws[i] for i in bucket.members])
+        w_scale = None
+        if w_scales is not None:
+            w_scale = torch.stack([w_scales[i].view(1, bucket.N) for i in bucket.members])
+        stacked.append((w, w_scale))
+    return stacked
+
+
+@functools.lru_cache(maxsize=1024)
+def _padded_rows(bucket: GroupedBucket, device: torch.device) -> Tensor:
+    '''row of every member row in the flat (B * M) rows of bucket'''
+    return torch.cat([torch.arange(M) + b * bucket.M for b, M in enumerate(bucket.Ms)]).to(device)
+
+
+def _pad(parts: List[Tensor], bucket: GroupedBucket, fill) -> Tensor:
+    '''the (M_b, C) parts of bucket as one (B, M, C), the padded rows fill'''
+    flat = torch.cat(parts)
+    if all(M == bucket.M for M in bucket.Ms):
+        return flat.view(bucket.B, bucket.M, -1)
+    out = flat.new_full((bucket.B * bucket.M, flat.shape[1]), fill)
+    out.index_copy_(0, _padded_rows(bucket, flat.device), flat)
+    return out.view(bucket.B, bucket.M, -1)
+
+
+def grouped_gemm(xs: Sequence[Tensor], ws: Sequence[Tensor], x_scales: Optional[Sequence[Tensor]] = None,
+                 w_scales: Optional[Sequence[Tensor]] = None, out_dtype: Optional[torch.dtype] = None,
+                 plan: Optional[GroupedPlan] = None, executor: Optional[Callable] = None,
+                 launch_flops: int = LAUNCH_FLOPS, m_align: int = 1, max_batch: Optional[int] = None,
+                 stacked: Optional[List[Tuple[Tensor, Optional[Tensor]]]] = None) -> List[Tensor]:
+    '''
+    y_i = x_i @ w_i.T for (M_i, K_i) x_i and (N_i, K_i) w_i, quantized ones
+    scaled by their (M_i, 1) x_scale and (1, N_i) w_scale. stacked, the
+    stack_grouped_weights of plan, saves stacking the weights per call
+    '''
+    if len(xs) != len(ws):
+        raise ValueError(f'{len(xs)} inputs for {len(ws)} weights')
+    if (x_scales is None) != (w_scales is None):
+        raise ValueError('grouped gemm needs both x_scales and w_scales or neither')
+    for x, w in zip(xs, ws):
+        if x.dim() != 2 or w.dim() != 2 or x.shape[1] != w.shape[1]:
+            raise ValueError(f'grouped gemm takes (M, K) x (N, K), got {tuple(x.shape)} x {tuple(w.shape)}')
+        if x.dtype != xs[0].dtype or w.dtype != ws[0].dtype:
+            raise ValueError('grouped gemm problems must share their dtypes')
+    if stacked is not None:
+        if plan is None or len(stacked) != len(plan.buckets):
+            raise ValueError('stacked weights need the plan they were stacked for')
+        if stacked and (x_scales is None) != (stacked[0][1] is None):
+            raise ValueError('stacked weights need w_scales stacked when x_scales are given')
+    if out_dtype is None:
+        out_dtype = torch.bfloat16 if x_scales is not None else xs[0].dtype
+    if plan is None:
+        plan = plan_grouped_gemm([(x.shape[0], w.shape[0], x.shape[1]) for x, w in zip(xs, ws)],
+                                 launch_flops, m_align, max_batch)
+    executor = executor or _gemm_executor
+    outs = [None] * len(xs)
+    for j, bucket in enumerate(plan.buckets):
+        if any(xs[i].shape[0] != M for i, M in zip(bucket.members, bucket.Ms)):
+            raise ValueError(f'inputs of other M than planned for bucket {bucket}')
+        x = _pad([xs[i] for i in bucket.members], bucket, 0)
+        w, w_scale = stacked[j] if stacked is not None else (torch.stack([ws[i] for i in bucket.members]), None)
+        x_scale = None
+        if x_scales is not None:
+            x_scale = _pad([x_scales[i].view(-1, 1) for i in bucket.members], bucket, 1)
+            if stacked is None:
+                w_scale = torch.stack([w_scales[i].view(1, bucket.N) for i in bucket.members])
+        y = executor(x, w, x_scale, w_scale, out_dtype)
+        for b, (i, M) in enumerate(zip(bucket.members, bucket.Ms)):
+            outs[i] = y[b, :M]
+    return outs
@@ -1,7 +1,13 @@
 # SPDX-License-Identifier: MIT
 # Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
 
+# weight layouts of the asm/ck kernels: the (16, 16)/(32, 16)/(32, 32)
+# shuffles and the int4 packing, aiter.prepack caches their results
+#   w = get_layout('int4_shuffle16x16').apply(w_int8)
+
 import torch
+from dataclasses import dataclass
+from typing import Optional, Tuple
 
 
 def shuffle_weight(x: torch.Tensor, layout=(16, 16)) -> torch.Tensor:
@@ -23,3 +29,83 @@ def shuffle_weight(x: torch.Tensor, layout=(16, 16)) -> torch.Tensor:
     x_ = x_.contiguous()
     x_ = x_.view(*x.shape)
     return x_
+
+
+# the int4 packing is adapted from
+# https://github.com/ROCm/vllm/blob/main/vllm/model_executor/layers/quantization/awq_triton.py
+def convert_int8_to_uint32_int4(tensor: torch.Tensor) -> torch.Tensor:
+    '''int8 values in [-8, 7] along the last dim, 8 per uint32, element i in bits 4i'''
+    assert tensor.dtype == torch.int8, "input should be int8"
+    if tensor.shape[-1] % 8 != 0:
+        raise ValueError("k % 8 should be zero")
+    nibbles = (tensor.reshape(*tensor.shape[:-1], tensor.shape[-1] // 8, 8) & 0x0F).to(torch.int32)
+    merged = nibbles[..., 0]
+    for i in range(1, 8):
+        merged = merged | (nibbles[..., i] << (4 * i))
+    return merged.view(dtype=torch.uint32)
+
+
+def rearrange_4bit_elements(tensor: torch.Tensor) -> torch.Tensor:
+    '''
+    the nibble order of the AMD int4 kernels, element i of
+    convert_int8_to_uint32_int4 in bits 4i, listed from bits 0-3 up
+    [e0, e1, e2, e3, e4, e5, e6, e7] -> [e0, e2, e4, e6, e1, e3, e5, e7]
+    '''
+    t_ = tensor.view(dtype=torch.int32)
+    return (
+        ((t_ & 0xF0000000) << 0) |   # e7 stays in bits 28-31
+        ((t_ & 0x00F00000) << 4) |   # e5 (bits 20-23) -> 24-27
+        ((t_ & 0x0000F000) << 8) |   # e3 (bits 12-15) -> 20-23
+        ((t_ & 0x000000F0) << 12) |  # e1 (bits 4-7) -> 16-19
+        ((t_ & 0x0F000000) >> 12) |  # e6 (bits 24-27) -> 12-15
+        ((t_ & 0x000F0000) >> 8) |   # e4 (bits 16-19) -> 8-11
+        ((t_ & 0x00000F00) >> 4) |   # e2 (bits 8-11) -> 4-7
+        (t_ & 0x0000000F)            # e0 stays in bits 0-3
+    ).view(dtype=torch.uint32)
+
+
+def pack_int4(tensor: torch.Tensor) -> torch.Tensor:
+    '''int8 in [-8, 7] of shape (..., K) -> uint32 (..., K // 8) as the int4 moe kernels read it'''
+    return rearrange_4bit_elements(convert_int8_to_uint32_int4(tensor))
+
+
+@dataclass(frozen=True)
+class WeightLayout:
+    # (IN, IK) of shuffle_weight, None keeps the row-major order
+    shuffle: Optional[Tuple[int, int]] = None
+    # pack int8 into 8 int4 per uint32 before the shuffle
+    int4: bool = False
+
+    @property
+    def name(self):
+        parts = ['int4'] if self.int4 else []
+        if self.shuffle is not None:
+            parts.append(f'shuffle{self.shuffle[0]}x{self.shuffle[1]}')
+        return '_'.join(parts) or 'plain'
+
+    def apply(self, w: torch.Tensor) -> torch.Tensor:
+        if self.int4:
+            w = pack_int4(w)
+        if self.shuffle is not None:
+            w = shuffle_weight(w, self.shuffle)
+        return w
+
+
+WEIGHT_LAYOUTS = {el.name: el for el in [
+    WeightLayout((16, 16)),
+    WeightLayout((32, 16)),
+    WeightLayout((32, 32)),
+    WeightLayout(int4=True),
+    WeightLayout((16, 16), int4=True),
+]}
+
+
+def get_layout(layout) -> WeightLayout:
+    '''a WeightLayout, its name or the (IN, IK) of a plain shuffle'''
+    if isinstance(layout, WeightLayout):
+        return layout
+    if isinstance(layout, tuple):
+        return WeightLayout(tuple(layout))
+    if layout not in WEIGHT_LAYOUTS:
+        raise ValueError(f'unknown weight layout {layout}, one of {list(WEIGHT_LAYOUTS)}')
+    return WEIGHT_LAYOUTS[layout]
@@ -0,0 +1,122 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# on-disk cache of pre-packed weights, so a restarted server maps the
+# shuffled/int4 packed experts and GEMM weights instead of packing them again
+#   w1 = prepack(w1, 'shuffle16x16')                  # asm_moe, ck_moe
+#   w = prepack(w, 'shuffle32x16', key=f'{ckpt}:{name}')   # gemm_a8w8_ASM
+# an entry is keyed by the layout, shape, dtype and a hash of the source
+# bytes, or by the caller's key (e.g. checkpoint file and tensor name) which
+# skips the hashing. entries are torch.save files loaded with mmap, a cpu
+# weight stays backed by the page cache, others are copied to their device.
+#   AITER_PREPACK_CACHE=<dir>    default ~/.aiter/prepack, empty to only pack
+
+import os
+import hashlib
+import tempfile
+import threading
+import torch
+from aiter import logger
+from aiter.ops.shuffle import WeightLayout, get_layout
+
+AITER_PREPACK_CACHE = os.environ.get('AITER_PREPACK_CACHE', os.path.expanduser('~/.aiter/prepack'))
+# bytes hashed per update
+_CHUNK = 64 << 20
+
+
+def tensor_digest(w: torch.Tensor) -> str:
+    '''hash of the shape, dtype and bytes of w'''
+    h = hashlib.blake2b(f'{tuple(w.shape)}:{w.dtype}'.encode(), digest_size=20)
+    flat = w.detach().reshape(-1).view(torch.uint8)
+    for i in range(0, flat.numel(), _CHUNK):
+        h.update(flat[i:i + _CHUNK].cpu().numpy().data)
+    return h.hexdigest()
+
+
+class PrepackCache:
+
+    def __init__(self, path=AITER_PREPACK_CACHE):
+        self.path = path
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_written = 0
+
+    def entry_key(self, w: torch.Tensor, layout: WeightLayout, key=None) -> str:
+        source = tensor_digest(w) if key is None else f'{key}:{tuple(w.shape)}:{w.dtype}'
+        return hashlib.blake2b(f'{layout.name}:{source}'.encode(), digest_size=20).hexdigest()
+
+    def _file(self, entry):
+        return os.path.join(self.path, entry[:2], f'{entry}.pt')
+
+    def load(self, entry, layout: WeightLayout):
+        '''the cached tensor of entry, memory mapped, or None'''
+        path = self._file(entry)
+        if not self.path or not os.path.exists(path):
+            return None
+        try:
+            data = torch.load(path, mmap=True, weights_only=True)
+            if data['layout'] != layout.name:
+                raise ValueError(f'layout {data["layout"]} != {layout.name}')
+            return data['weight']
+        except Exception as e:
+            logger.warning(f'prepack cache: dropping unreadable {path}: {e}')
+            with self._lock:
+                if os.path.exists(path):
+                    os.remove(path)
+            return None
+
+    def store(self, entry, layout: WeightLayout, w: torch.Tensor):
+        '''write w for entry, atomically so concurrent loaders never see half a file'''
+        if not self.path:
+            return
+        path = self._file(entry)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                torch.save({'layout': layout.name, 'weight': w.detach().cpu().contiguous()}, f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        with self._lock:
+            self.bytes_written += w.numel() * w.element_size()
+
+    def prepack(self, w: torch.Tensor, layout='shuffle16x16', key=None) -> torch.Tensor:
+        '''w in layout on w's device, from the cache when an earlier run packed it'''
+        layout = get_layout(layout)
+        if not self.path:
+            return layout.apply(w)
+        entry = self.entry_key(w, layout, key)
+        packed = self.load(entry, layout)
+        with self._lock:
+            if packed is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if packed is None:
+            packed = layout.apply(w)
+            self.store(entry, layout, packed)
+            return packed
+        return packed.to(w.device)
+
+    def clear(self):
+        '''remove every cached entry'''
+        if not self.path or not os.path.isdir(self.path):
+            return
+        for root, _, files in os.walk(self.path):
+            for el in files:
+                if el.endswith('.pt'):
+                    os.remove(os.path.join(root, el))
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'bytes_written': self.bytes_written}
+
+
+prepack_cache = PrepackCache()
+
+
+def prepack(w: torch.Tensor, layout='shuffle16x16', key=None) -> torch.Tensor:
+    return prepack_cache.prepack(w, layout, key)
@@ -18,12 +18,15 @@
 import os
 from pathlib import Path
 import functools
-import pandas as pd
 import torch
 import torch.nn.functional as F
 from aiter import hipb_create_extension, hipb_mm, getHipblasltKernelName
 from aiter import rocb_create_extension, rocb_mm
 from aiter import logger
+from aiter.configs.config_index import get_config_table, TUNED_CONFIGS
+from aiter.configs.tuned_lookup import lookup_tuned
+from aiter.configs.shape_recorder import shape_recorder
+from aiter.buffer_pool import buffer_pool
 
 this_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -32,10 +35,8 @@ class TunedGemm:
 
     def __init__(self):
         self.extensions_created = False
-        self.save_gemm = int(os.environ.get('AITER_TUNE_GEMM', 0))
-        self.untune_path = f'{this_dir}/configs/untuned_gemm.csv'
         self.tune_path = f'{this_dir}/configs/tuned_gemm.csv'
-        self.bestsols = {}
+        self.bestsols = None
         self.solMap = ['torch', 'hipblaslt', 'rocblas', 'skinny']
         self.cu_count = torch.cuda.get_device_properties(
             device='cuda').multi_processor_count
@@ -44,36 +45,23 @@ class TunedGemm:
         #     "gfx1" not in torch.cuda.get_device_properties('cuda').gcnArchName
         self.use_skinny = True
 
-        if (self.save_gemm == 1):
-            self.tuned_df = pd.DataFrame(
-                columns=['M', 'N', 'K', 'bias', 'dtype', 'outdtype', 'scaleAB'])
-        else:
-            self.tuned_df = None
-
     def load_best_sols(self):
         if self.tune_path is not None and Path(self.tune_path).is_file():
-            self.bestsols = pd.read_csv(self.tune_path)
+            self.bestsols = get_config_table(
+                self.tune_path, TUNED_CONFIGS['tuned_gemm.csv'])
             if len(self.bestsols) > 0 and 'kernelName' in self.bestsols.columns:
-                hipblasltKernelNames = self.bestsols.apply(
-                    lambda s: getHipblasltKernelName(s.solidx) if s.libtype == 'hipblaslt' else "", axis=1)
-                pd.set_option('display.max_colwidth', 100)
-                assert hipblasltKernelNames.equals(
-                    self.bestsols['kernelName'].fillna('')), "error: gradlib tune gemm not match the current environment, need re-tune!!!\n" + \
-                    f"differece:\n{pd.concat([self.bestsols[['solidx','kernelName']], hipblasltKernelNames], axis=1)[hipblasltKernelNames != self.bestsols['kernelName'].fillna('')]}"
+                mismatch = []
+                for ds in self.bestsols.rows():
+                    kernelName = getHipblasltKernelName(
+                        ds['solidx']) if ds['libtype'] == 'hipblaslt' else ""
+                    if kernelName != ds['kernelName']:
+                        mismatch.append(
+                            f"{ds['solidx']:>10} {ds['kernelName']:<100} {kernelName}")
+                assert not mismatch, "error: gradlib tune gemm not match the current environment, need re-tune!!!\n" + \
+                    "differece:\n" + "\n".join(mismatch)
 
     def create_ds(self):
-        df: pd.DataFrame = self.bestsols
-        solds = {}
-        for i in range(len(df)):
-            ds = df.iloc[i]
-            key = (ds['M'], ds['N'], ds['K'], ds['bias'],
-                   ds['dtype'], ds['outdtype'], ds['scaleAB'])
-            if ds['libtype'] == 'hipblaslt':
-                soltype = self.solMap.index(ds['libtype'])
-            elif ds['libtype'] == 'rocblas':
-                soltype = self.solMap.index(ds['libtype'])
-            solds[key] = (soltype, int(ds['solidx']))
-        self.solids = solds
+        # solutions are looked up in the indexed tuned_gemm.csv by query_sol
         self.solfuncs = [
             self.apply_torch_mm,
             self.apply_hipb_mm,
@@ -88,25 +76,24 @@ class TunedGemm:
                 return 3, 0
             elif n % 4 == 0 and m == 1 and k <= 8192:
                 return 3, 1
-        soltype, solidx = self.solids.get(
-            (m, n, k, bias, str(dtype), str(otype), scaleAB), (0, 0))
-        logger.info(
+        soltype, solidx = 0, 0
+        # exact rows only: a hipblaslt/rocblas solidx is tuned and checked for
+        # its M, hipb_mm does not check that it supports another one
+        ds = lookup_tuned(self.tune_path, TUNED_CONFIGS['tuned_gemm.csv'],
+                          (m, n, k, bias, str(dtype), str(otype), scaleAB), nearest=False) \
+            if self.bestsols is not None else None
+        if ds is not None and ds['libtype'] in self.solMap:
+            soltype, solidx = self.solMap.index(ds['libtype']), ds['solidx']
+        logger.debug(
             f'using {soltype=}, {solidx=} for {m=} {n=} {k=} {dtype=} {bias=}, {scaleAB=}')
         return soltype, solidx
 
     def apply_skinny(self, inp, weights, solidx, bias=None, otype=None, scale_a=None, scale_b=None, scale_c=None):
         import aiter as ops
+        out = buffer_pool.empty((inp.shape[0], weights.shape[0]), inp.dtype, inp.device)
         if solidx == 0:
-            out = torch.empty(inp.shape[0],
-                              weights.shape[0],
-                              dtype=inp.dtype,
-                              device='cuda')
             ops.wvSpltK(weights, inp, out, inp.shape[0], self.cu_count)
         elif solidx == 1:
-            out = torch.empty(inp.shape[0],
-                              weights.shape[0],
-                              dtype=inp.dtype,
-                              device='cuda')
             ops.LLMM1(weights, inp, out, 4)
         if bias is not None:
             out += bias
@@ -125,22 +112,6 @@ class TunedGemm:
         return out
 
     def apply_torch_mm(self, inp, weights, solidx, bias=None, otype=None, scale_a=None, scale_b=None, scale_c=None):
-        if (self.save_gemm == 1):
-            m, k = inp.shape
-            n = weights.shape[0]
-            self.tuned_df = pd.concat([
-                self.tuned_df,
-                pd.DataFrame({
-                    'M': [m],
-                    'N': [n],
-                    'K': [k],
-                    'bias': [bias is not None],
-                    'dtype': [inp.dtype],
-                    'outdtype': [otype],
-                    'scaleAB': [scale_a is not None or scale_b is not None],
-                })
-            ]).drop_duplicates()
-            self.tuned_df.to_csv(self.untune_path, index=False)
         if inp.dtype == torch.float8_e4m3fnuz:
             if scale_a is None:
                 scale_a = torch.ones(1, dtype=torch.float, device=inp.device)
@@ -163,16 +134,24 @@ class TunedGemm:
             out = out.to(otype)
         return out
 
-    def mm(self, inp, weights, bias=None, otype=None, scale_a=None, scale_b=None, scale_c=None):
-        # F.Linear can take a 3 dimensional input. vllm
-        # uses this for linear units. However, sampler
-        # will use torch.matmul with 2 dimensions only
+    def init_extensions(self):
         if self.extensions_created == False:
             rocb_create_extension()
             hipb_create_extension()
             self.extensions_created = True
             self.load_best_sols()
             self.create_ds()
+
+    def prepare(self, weights, bias=None, otype=None, scale_b=None, scale_c=None, reuse_output=False):
+        '''PreparedGemm of one layer, call it instead of mm(inp, weights, ...)'''
+        self.init_extensions()
+        return PreparedGemm(self, weights, bias, otype, scale_b, scale_c, reuse_output)
+
+    def mm(self, inp, weights, bias=None, otype=None, scale_a=None, scale_b=None, scale_c=None):
+        # F.Linear can take a 3 dimensional input. vllm
+        # uses this for linear units. However, sampler
+        # will use torch.matmul with 2 dimensions only
+        self.init_extensions()
         if inp.dim() >= 3:
             try:
                 inp_view = inp.view(-1, inp.size(-1))
@@ -185,13 +164,19 @@ class TunedGemm:
         m, k = inp_view.shape
         n = weights.shape[0]
         use_bias = bias is not None
+        scaleAB = scale_a is not None or scale_b is not None
         soltype, solidx = self.query_sol(m=m,
                                          n=n,
                                          k=k,
                                          bias=use_bias,
                                          dtype=inp.dtype,
                                          otype=otype if otype is not None else inp.dtype,
-                                         scaleAB=scale_a is not None or scale_b is not None)
+                                         scaleAB=scaleAB)
+        # skinny shapes never use a tuned solution
+        if shape_recorder.enabled and soltype != 3:
+            shape_recorder.record(self.tune_path, TUNED_CONFIGS['tuned_gemm.csv'],
+                                  (m, n, k, use_bias, str(inp.dtype),
+                                   str(otype if otype is not None else inp.dtype), scaleAB))
         out = self.solfuncs[soltype](
             inp_view, weights, solidx, bias, otype, scale_a, scale_b, scale_c)
         if batched:
@@ -199,4 +184,94 @@ class TunedGemm:
         return out
 
 
+class PreparedGemm:
+    '''
+    the weights, bias and dtypes of one layer bound once, for decode loops
+    that run the same layers every step. the solution of an M is resolved on
+    its first call and kept as a closure over the weights, so later calls
+    skip query_sol, the solfuncs dispatch and the argument checks of mm.
+        qkv = tgemm.prepare(weight, bias)
+        out = qkv(inp)                    # same as tgemm.mm(inp, weight, bias)
+    reuse_output=True keeps the output of the skinny kernels per M, it is
+    overwritten by the next call with the same M. a plan is kept per M, input
+    dtype and whether scale_a is given, the solution mm picks for them, at
+    most max_plans of them.
+    '''
+
+    def __init__(self, tgemm, weights, bias=None, otype=None, scale_b=None, scale_c=None,
+                 reuse_output=False, max_plans=64):
+        self.tgemm = tgemm
+        self.weights = weights
+        self.weights_t = weights.t()
+        self.bias = bias
+        self.n, self.k = weights.shape
+        # None: the dtype of the input, as mm
+        self.otype = otype
+        self.scale_b = scale_b
+        self.scale_c = scale_c
+        self.reuse_output = reuse_output
+        self.max_plans = max_plans
+        # (M, input dtype, scale_a given) -> run(inp, scale_a)
+        self._plans = {}
+
+    def plan(self, m, dtype, scaled=False):
+        '''run(inp, scale_a) of M rows of dtype, scaled when scale_a is given'''
+        tg = self.tgemm
+        use_bias = self.bias is not None
+        # the arguments of query_sol as mm derives them
+        otype = self.otype if self.otype is not None else dtype
+        scaleAB = scaled or self.scale_b is not None
+        soltype, solidx = tg.query_sol(m=m, n=self.n, k=self.k, bias=use_bias, dtype=dtype,
+                                       otype=otype, scaleAB=scaleAB)
+        w, wt, bias = self.weights, self.weights_t, self.bias
+        scale_b, scale_c = self.scale_b, self.scale_c
+        if soltype == 1:
+            def run(inp, scale_a):
+                return hipb_mm(inp, wt, solidx, bias, otype, scale_a, scale_b, scale_c)
+        elif soltype == 2:
+            def run(inp, scale_a):
+                out = rocb_mm(inp, wt, solidx)
+                return out + bias if use_bias else out
+        elif soltype == 3:
+            import aiter as ops
+            wvSpltK, LLMM1, cu_count = ops.wvSpltK, ops.LLMM1, tg.cu_count
+            shared = torch.empty(m, self.n, dtype=dtype, device=w.device) if self.reuse_output else None
+
+            def run(inp, scale_a):
+                out = shared if shared is not None else buffer_pool.empty((m, self.n), inp.dtype, inp.device)
+                if solidx == 0:
+                    wvSpltK(w, inp, out, m, cu_count)
+                else:
+                    LLMM1(w, inp, out, 4)
+                if use_bias:
+                    out += bias
+                return out
+        else:
+            def run(inp, scale_a):
+                return tg.apply_torch_mm(inp, w, solidx, bias, self.otype, scale_a, scale_b, scale_c)
+        if shape_recorder.enabled and soltype != 3:
+            key = (m, self.n, self.k, use_bias, str(dtype), str(otype), scaleAB)
+            solve = run
+
+            def run(inp, scale_a):
+                shape_recorder.record(tg.tune_path, TUNED_CONFIGS['tuned_gemm.csv'], key)
+                return solve(inp, scale_a)
+        if len(self._plans) >= self.max_plans:
+            del self._plans[next(iter(self._plans))]
+        self._plans[(m, dtype, scaled)] = run
+        return run
+
+    def __call__(self, inp, scale_a=None):
+        m = inp.numel() // self.k
+        key = (m, inp.dtype, scale_a is not None)
+        run = self._plans.get(key, None) or self.plan(*key)
+        if inp.dim() == 2:
+            return run(inp, scale_a)
+        try:
+            inp_view = inp.view(m, self.k)
+        except RuntimeError:
+            return self.tgemm.mm(inp, self.weights, self.bias, self.otype, scale_a, self.scale_b, self.scale_c)
+        return run(inp_view, scale_a).view(*inp.shape[:-1], self.n)
+
+
 tgemm = TunedGemm()
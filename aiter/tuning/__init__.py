@@ -0,0 +1,5 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# helpers shared by the tuners (gradlib, csrc/*/..._tune.py), importing this
+# package must not pull in torch so they can be tested without a GPU
@@ -0,0 +1,235 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# learned latency of CK GEMM instances, trained on the tuned csv files
+#   python -m aiter.tuning.cost_model            # train, report holdout error, write the model
+#   model = get_cost_model()
+#   model.predict_us('a8w8_tuned_gemm.csv', [(B, M, N, K, kernelName, splitK), ...])
+#   model.rank('a8w8_tuned_gemm.csv', (1, M, N, K), [(key, kernelName, splitK), ...])
+# ridge regression on log latency over shape/tile features, the wave and
+# padding terms of simulate_gemm_us carry most of it. the tuned csv files only
+# hold the winning instance of every shape, train on the candidate timings of
+# a tuner for a model that also knows the losers.
+# used for shapes without any tuned neighbor (tuned_lookup) and to pre-filter
+# the candidates of the CK tuners, numpy only.
+
+import os
+import re
+import sys
+import json
+import math
+import functools
+import numpy as np
+from .search import simulate_gemm_us
+from ..configs.config_index import get_config_table, TUNED_CONFIGS, this_dir as config_dir
+
+MODEL_PATH = os.path.join(config_dir, 'gemm_cost_model.json')
+# the CK families the model knows, a one hot feature each
+FAMILIES = ['a8w8_tuned_gemm.csv',
+            'a8w8_blockscale_tuned_gemm.csv',
+            'a8w8_tuned_batched_gemm.csv',
+            'bf16_tuned_batched_gemm.csv']
+# the csv files were tuned on MI300X
+CU_NUM = 304
+
+_TILE = re.compile(r'(?:^|_)(\d+)x(\d+)x(\d+)x(\d+)(?:_|$)')
+_PIPELINE = re.compile(r'_(intra|inter)wave_v(\d)')
+
+
+def parse_kernel(name):
+    '''a8w8_rowwise_256x16x64x512_..._intrawave_v3 -> (block, tile_m, tile_n, tile_k, interwave, pipeline)'''
+    tile = _TILE.search(name)
+    if tile is None:
+        return None
+    pipe = _PIPELINE.search(name)
+    block, tile_m, tile_n, tile_k = [int(el) for el in tile.groups()]
+    return block, tile_m, tile_n, tile_k, \
+        int(pipe is not None and pipe.group(1) == 'inter'), int(pipe.group(2)) if pipe else 0
+
+
+def features(family, B, M, N, K, kernel, splitK, cu_num=CU_NUM):
+    block, tile_m, tile_n, tile_k, interwave, pipeline = kernel
+    split = 2 ** splitK
+    tiles_m, tiles_n = math.ceil(M / tile_m), math.ceil(N / tile_n)
+    tiles = B * tiles_m * tiles_n * split
+    waves = math.ceil(tiles / cu_num)
+    k_iters = math.ceil(K / split / tile_k)
+    sim = B * simulate_gemm_us(M, N, K, tile_m, tile_n, tile_k, splitK, cu_num=cu_num)
+    return [1.0,
+            math.log2(2 * B * M * N * K),
+            math.log2(sim),
+            math.log2(tiles),
+            math.log2(waves),
+            tiles / (waves * cu_num),
+            M / (tiles_m * tile_m),
+            N / (tiles_n * tile_n),
+            math.log2(M), math.log2(N), math.log2(K), math.log2(B),
+            math.log2(tile_m), math.log2(tile_n), math.log2(tile_k), math.log2(block),
+            math.log2(k_iters),
+            float(splitK),
+            float(interwave)] + \
+        [float(pipeline == el) for el in range(1, 6)] + \
+        [float(family == el) for el in FAMILIES]
+
+
+def load_rows(csv_path):
+    '''[(B, M, N, K, kernelName, splitK, us)] of a tuned csv, rows without a CK kernel are skipped'''
+    keys = TUNED_CONFIGS[os.path.basename(csv_path)]
+    ret = []
+    for row in get_config_table(csv_path, keys).rows():
+        us = row.get('us', None)
+        if not isinstance(us, float) or not us > 0 or parse_kernel(str(row['kernelName'])) is None:
+            continue
+        ret.append((row.get('B', 1), row['M'], row['N'], row['K'], row['kernelName'], int(row['splitK']), us))
+    return ret
+
+
+class CostModel:
+
+    def __init__(self, weights, mean, std, cu_num=CU_NUM, kernels=None, max_splitK=None):
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.std = np.asarray(std, dtype=np.float64)
+        self.cu_num = cu_num
+        # family -> kernelName / largest splitK seen in training, the candidates of best_kernel()
+        self.kernels = kernels or {}
+        self.max_splitK = max_splitK or {}
+
+    def _matrix(self, family, rows):
+        x = np.array([features(family, B, M, N, K, parse_kernel(name), splitK, self.cu_num)
+                      for B, M, N, K, name, splitK in rows], dtype=np.float64)
+        return (x - self.mean) / self.std
+
+    def predict_us(self, family, rows):
+        '''rows of (B, M, N, K, kernelName, splitK)'''
+        if not rows:
+            return np.zeros(0)
+        return np.exp(self._matrix(family, rows) @ self.weights)
+
+    def rank(self, family, shape, candidates):
+        '''candidates of (key, kernelName, splitK) -> [(key, us)], fastest first'''
+        candidates = [el for el in candidates if parse_kernel(el[1]) is not None]
+        us = self.predict_us(family, [(*shape, name, splitK) for _, name, splitK in candidates])
+        return sorted([(el[0], float(t)) for el, t in zip(candidates, us)], key=lambda el: el[1])
+
+    def best_kernel(self, family, shape):
+        '''(kernelName, splitK, us) of the best kernel of family seen in training for shape'''
+        candidates = [((name, s), name, s) for name in self.kernels.get(family, [])
+                      for s in range(self.max_splitK.get(family, 0) + 1)]
+        ranking = self.rank(family, shape, candidates)
+        if not ranking:
+            return None
+        (name, splitK), us = ranking[0]
+        return name, splitK, us
+
+    def to_dict(self):
+        return {'weights': self.weights.tolist(),
+                'mean': self.mean.tolist(),
+                'std': self.std.tolist(),
+                'cu_num': self.cu_num,
+                'kernels': self.kernels,
+                'max_splitK': self.max_splitK}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['weights'], data['mean'], data['std'], data['cu_num'],
+                   data['kernels'], data['max_splitK'])
+
+    def save(self, path=MODEL_PATH):
+        tmp = f'{path}.{os.getpid()}'
+        with open(tmp, 'w') as f:
+            json.dump(self.to_dict(), f)
+        os.replace(tmp, path)
+
+
+def fit(data, l2=1.0, cu_num=CU_NUM):
+    '''data: {family: [(B, M, N, K, kernelName, splitK, us)]}, ridge on log(us)'''
+    x, y, kernels, max_splitK = [], [], {}, {}
+    for family, rows in data.items():
+        for B, M, N, K, name, splitK, us in rows:
+            x.append(features(family, B, M, N, K, parse_kernel(name), splitK, cu_num))
+            y.append(math.log(us))
+        if rows:
+            kernels[family] = sorted({el[4] for el in rows})
+            max_splitK[family] = max(el[5] for el in rows)
+    x, y = np.array(x, dtype=np.float64), np.array(y, dtype=np.float64)
+    mean, std = x.mean(axis=0), x.std(axis=0)
+    # the bias and constant columns are not scaled
+    mean[std < 1e-12] = 0
+    std[std < 1e-12] = 1
+    mean[0], std[0] = 0, 1
+    xs = (x - mean) / std
+    reg = l2 * np.eye(xs.shape[1])
+    reg[0, 0] = 0
+    weights = np.linalg.solve(xs.T @ xs + reg, xs.T @ y)
+    return CostModel(weights, mean, std, cu_num, kernels, max_splitK)
+
+
+def load_training_data(config_dir=config_dir):
+    data = {}
+    for family in FAMILIES:
+        path = os.path.join(config_dir, family)
+        if os.path.exists(path):
+            data[family] = load_rows(path)
+    return data
+
+
+def evaluate(data, l2=1.0, folds=5):
+    '''
+    k-fold over (N, K) groups, so every shape is predicted by a model that saw
+    none of its N, K. returns the relative errors of the predicted latency of
+    the tuned kernel and its position in the model's ranking of the kernels
+    of its family, with the number of candidates
+    '''
+    groups = sorted({(family, row[0], row[2], row[3]) for family, rows in data.items() for row in rows})
+    errors, positions = [], []
+    for fold in range(folds):
+        held = set(groups[fold::folds])
+        train = {f: [r for r in rows if (f, r[0], r[2], r[3]) not in held] for f, rows in data.items()}
+        model = fit(train, l2)
+        for family, rows in data.items():
+            test = [r for r in rows if (family, r[0], r[2], r[3]) in held]
+            if not test:
+                continue
+            pred = model.predict_us(family, [r[:6] for r in test])
+            errors += [abs(p - r[6]) / r[6] for p, r in zip(pred, test)]
+            names = model.kernels.get(family, [])
+            for r in test:
+                if r[4] not in names:
+                    continue
+                ranking = [el[0] for el in model.rank(family, r[:4], [(name, name, r[5]) for name in names])]
+                positions.append((ranking.index(r[4]), len(ranking)))
+    return errors, positions
+
+
+@functools.lru_cache(maxsize=None)
+def get_cost_model(path=MODEL_PATH):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return CostModel.from_dict(json.load(f))
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="train the CK GEMM cost model on the tuned csv files")
+    parser.add_argument("--config_dir", default=config_dir,
+                        help="directory holding the tuned csv files")
+    parser.add_argument("-o", "--output", default=MODEL_PATH)
+    parser.add_argument("--l2", type=float, default=1.0, help="ridge regularization")
+    args = parser.parse_args(argv)
+
+    data = load_training_data(args.config_dir)
+    errors, positions = evaluate(data, args.l2)
+    print(f'{sum(len(el) for el in data.values())} rows, holdout over unseen (N, K): '
+          f'median error {np.median(errors) * 100:.1f}%, p90 {np.percentile(errors, 90) * 100:.1f}%, '
+          f'tuned kernel in top 3 {np.mean([el[0] < 3 for el in positions]) * 100:.1f}% '
+          f'of {np.mean([el[1] for el in positions]):.1f} kernels')
+    fit(data, args.l2).save(args.output)
+    print(f'model written to {args.output}')
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
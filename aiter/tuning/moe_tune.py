@@ -0,0 +1,167 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# tunes the meta-parameters of the triton fused_moe_kernel for the batch sizes
+# of one moe layer and writes the table aiter.configs.moe_config looks up
+#   python -m aiter.tuning.moe_tune -E 8 -N 14336 -K 4096 --topk 2 --dtype bf16
+#   python -m aiter.tuning.moe_tune -E 8 -N 14336 -K 4096 --topk 2 --dtype int8_w8a8 -M 1 64 1024 --search racing
+# N is the intermediate size, K the model dim. every M gets the candidates of
+# MOE_SEARCH_SPACE that fit it, timed on the whole fused_experts (both gemms
+# share the config) by a search strategy of aiter/tuning/search.py, a
+# candidate whose output differs from the default config's is dropped.
+# cpu tensors run under TRITON_INTERPRET=1 and are timed by the wall clock,
+# which only tests the driver.
+
+import sys
+import math
+import itertools
+from typing import Dict, List, Optional
+
+from aiter.configs.moe_config import MoeConfigKey, MOE_TUNE_MS, MOE_CONFIG_DIR, AITER_MOE_CONFIG_DIR, \
+    get_device_arch, write_moe_table, list_moe_tables, MoeConfigTable
+from .search import get_search, EventTimer, WallTimer, SEARCH_STRATEGIES
+
+MOE_SEARCH_SPACE = {
+    'BLOCK_SIZE_M': [16, 32, 64, 128],
+    'BLOCK_SIZE_N': [32, 64, 128, 256],
+    'BLOCK_SIZE_K': [32, 64, 128, 256],
+    'GROUP_SIZE_M': [1, 4, 8, 16],
+    'num_warps': [4, 8],
+    'num_stages': [2],
+}
+# relative error of a candidate's output to the default config's
+TOLERANCE = 2e-2
+
+
+def moe_candidates(M: int, E: int, N: int, K: int, topk: int, space: Dict[str, List[int]] = MOE_SEARCH_SPACE):
+    '''
+    the configs of space worth timing for M, as sorted item tuples: blocks no
+    larger than the problem and BLOCK_SIZE_M at most twice the rows of an
+    average expert
+    '''
+    rows = max(1, math.ceil(2 * M * topk / E))
+    block_m_cap = max(min(space['BLOCK_SIZE_M']), 1 << (rows - 1).bit_length())
+    names = sorted(space)
+    cands = []
+    for values in itertools.product(*(space[el] for el in names)):
+        config = dict(zip(names, values))
+        if config['BLOCK_SIZE_M'] > block_m_cap:
+            continue
+        if config['BLOCK_SIZE_K'] > max(K, min(space['BLOCK_SIZE_K'])):
+            continue
+        if config['BLOCK_SIZE_N'] > max(2 * N, min(space['BLOCK_SIZE_N'])):
+            continue
+        # grouping only reorders more than one block row
+        if config['GROUP_SIZE_M'] > 1 and M * topk <= config['BLOCK_SIZE_M']:
+            continue
+        cands.append(tuple(sorted(config.items())))
+    return cands
+
+
+def make_moe_inputs(M: int, E: int, N: int, K: int, topk: int, dtype: str, device: str = 'cuda',
+                    gated: bool = True, seed: int = 0) -> dict:
+    '''random fused_experts arguments of the table dtype, bf16 activations of the quant ones'''
+    import torch
+    from aiter.fused_moe_core import fused_topk
+    torch.manual_seed(seed)
+    float_dtypes = {'bf16': torch.bfloat16, 'fp16': torch.float16, 'fp32': torch.float32}
+    # the triton interpreter has no bf16
+    act_dtype = float_dtypes.get(dtype, torch.bfloat16 if device != 'cpu' else torch.float16)
+    N1 = 2 * N if gated else N
+    hidden = torch.randn(M, K, dtype=act_dtype, device=device)
+    w1 = torch.randn(E, N1, K, device=device) / K ** 0.5
+    w2 = torch.randn(E, K, N, device=device) / N ** 0.5
+    topk_weights, topk_ids = fused_topk(hidden, torch.randn(M, E, device=device), topk, True)
+    args = dict(hidden_states=hidden, topk_weights=topk_weights, topk_ids=topk_ids,
+                quant=dtype if dtype not in float_dtypes else 'none')
+    if dtype in float_dtypes:
+        return dict(args, w1=w1.to(act_dtype), w2=w2.to(act_dtype))
+    if dtype == 'fp8_w8a8':
+        fp8 = torch.float8_e4m3fnuz
+        s1, s2 = (w.abs().amax(dim=(1, 2)) / torch.finfo(fp8).max for w in (w1, w2))
+        return dict(args, w1=(w1 / s1.view(-1, 1, 1)).to(fp8), w2=(w2 / s2.view(-1, 1, 1)).to(fp8),
+                    w1_scale=s1, w2_scale=s2)
+    s1, s2 = (w.abs().amax(dim=2) / 127 for w in (w1, w2))
+    return dict(args, w1=torch.round(w1 / s1.unsqueeze(2)).to(torch.int8),
+                w2=torch.round(w2 / s2.unsqueeze(2)).to(torch.int8), w1_scale=s1, w2_scale=s2)
+
+
+def tune_moe(E: int, N: int, K: int, topk: int, dtype: str, Ms: List[int] = MOE_TUNE_MS,
+             search='halving', device: str = 'cuda', space: Dict[str, List[int]] = MOE_SEARCH_SPACE,
+             gated: bool = True, activation: str = 'silu') -> Dict[int, dict]:
+    '''{M: best config with its us} of the Ms any candidate could run, search is a name or a strategy'''
+    from aiter import logger
+    from aiter.fused_moe_core import fused_experts, get_default_config
+    strategy = get_search(search) if isinstance(search, str) else search
+    configs = {}
+    for M in Ms:
+        args = make_moe_inputs(M, E, N, K, topk, dtype, device, gated)
+        # the reference of the default config, not of a table being tuned
+        ref = fused_experts(**args, activation=activation,
+                            override_config=get_default_config(M, E, N, K, topk, dtype, False)).float()
+        # the output of the last run only, the timer checks a candidate right
+        # after its warmup, one output per candidate would pin them all
+        last = {}
+
+        def run(cand):
+            try:
+                last['out'] = fused_experts(**args, activation=activation, override_config=dict(cand))
+            except Exception as e:
+                # compile errors, out of resources, ... drop the candidate
+                raise RuntimeError(str(e)) from e
+
+        def check(cand):
+            err = (last.pop('out').float() - ref).norm() / ref.norm().clamp(min=1e-6)
+            return err.item() < TOLERANCE
+
+        timer = (EventTimer if device != 'cpu' else WallTimer)(run, check)
+        ranking = strategy.search(moe_candidates(M, E, N, K, topk, space), timer)
+        if not ranking:
+            logger.warning(f'moe tune: no config runs E={E} N={N} K={K} topk={topk} {dtype} M={M}')
+            continue
+        last.clear()
+        best, us = ranking[0]
+        configs[M] = dict(best, us=round(us, 3))
+        logger.info(f'moe tune: M={M} {configs[M]}')
+    return configs
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="tune the triton fused_moe_kernel of one moe layer")
+    parser.add_argument("-E", type=int, required=True, help="experts")
+    parser.add_argument("-N", type=int, required=True, help="intermediate size")
+    parser.add_argument("-K", type=int, required=True, help="model dim")
+    parser.add_argument("--topk", type=int, required=True)
+    parser.add_argument("--dtype", default='bf16',
+                        choices=['bf16', 'fp16', 'fp32', 'fp8_w8a8', 'int8_w8a16', 'int8_w8a8'])
+    parser.add_argument("-M", type=int, nargs='+', default=MOE_TUNE_MS, help="batch sizes to tune")
+    parser.add_argument("--g1u0", action='store_true', help="w1 without the up projection")
+    parser.add_argument("--search", default='halving', choices=list(SEARCH_STRATEGIES))
+    parser.add_argument("--device", default='cuda')
+    parser.add_argument("--arch", default=None, help="arch of the table, default the device's")
+    parser.add_argument("-o", "--config_dir", default=AITER_MOE_CONFIG_DIR or MOE_CONFIG_DIR)
+    parser.add_argument("--replace", action='store_true', help="drop the tuned M of an existing table")
+    args = parser.parse_args(argv)
+
+    key = MoeConfigKey(args.E, args.N, args.K, args.topk, args.dtype, args.arch or get_device_arch())
+    configs = {}
+    if not args.replace:
+        for table in list_moe_tables(args.config_dir):
+            if table.key == key:
+                configs = {M: dict(c, us=us) if us is not None else dict(c)
+                           for M, c, us in zip(table.Ms, table.configs, table.us)}
+    configs.update(tune_moe(args.E, args.N, args.K, args.topk, args.dtype, args.M, args.search,
+                            args.device, MOE_SEARCH_SPACE, gated=not args.g1u0))
+    if not configs:
+        print(f'nothing tuned for {key}')
+        return 1
+    path = write_moe_table(key, configs, args.config_dir)
+    gaps = MoeConfigTable(key, configs).gaps()
+    print(f'wrote {len(configs)} tuned M to {path}'
+          + (', gaps ' + ', '.join(f'{M}->{tuned}' for M, tuned in gaps) if gaps else ''))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# wave quantization of a tiled GEMM on the CUs, shared by the CK GEMM ops
+# (splitK of an untuned M) and their tuners (which splitK to time)
+#   occ = best_splitK(M, N, K, tile_m, tile_n, tile_k, cu_num=get_cu_num())
+#   occ.splitK, occ.waves, occ.efficiency
+#   splitK_range(M, N, K, tile_m, tile_n, tile_k)   # [0, ...] worth timing
+# every workgroup computes one tile_m x tile_n tile over K / 2^splitK, the
+# workgroups run in waves of cu_num, so a wave that is only partly filled
+# costs as much as a full one. cost is in tile_k iterations along the
+# critical path, PROLOGUE iterations per workgroup cover its load/store of
+# the output and the atomics of splitK. pure arithmetic, torch is only
+# needed to query the CU count.
+
+import os
+import math
+import functools
+from dataclasses import dataclass
+from typing import List, Optional
+
+AITER_CU_NUM = int(os.environ.get('AITER_CU_NUM', 0))
+
+# iterations a workgroup spends outside the K loop
+PROLOGUE = 2
+# K is split in at most 2^MAX_SPLITK parts, as far as the old cusPerTile
+# heuristic went for a single tile on 304 CUs
+MAX_SPLITK = 8
+
+
+@dataclass(frozen=True)
+class Occupancy:
+    splitK: int
+    cu_num: int
+    # workgroups launched
+    tiles: int
+    waves: int
+    # busy fraction of the launched waves, 1.0 when the last wave is full
+    efficiency: float
+    # tile_k iterations of every workgroup
+    k_iters: int
+    # critical path in tile_k iterations
+    cost: int
+
+    @property
+    def tail(self):
+        '''busy fraction of the last wave alone'''
+        return (self.tiles - (self.waves - 1) * self.cu_num) / self.cu_num
+
+
+def occupancy(M, N, K, tile_m, tile_n, tile_k, splitK=0, cu_num=None, B=1) -> Occupancy:
+    cu_num = cu_num or get_cu_num()
+    split = 2 ** splitK
+    tiles = B * math.ceil(M / tile_m) * math.ceil(N / tile_n) * split
+    waves = math.ceil(tiles / cu_num)
+    k_iters = math.ceil(K / split / tile_k)
+    return Occupancy(splitK, cu_num, tiles, waves, tiles / (waves * cu_num), k_iters, waves * (k_iters + PROLOGUE))
+
+
+def _splits(K, tile_k, max_splitK):
+    '''splitK values that leave every part at least one tile_k'''
+    return [el for el in range(max_splitK + 1) if el == 0 or 2 ** el * tile_k <= K]
+
+
+@functools.lru_cache(maxsize=4096)
+def best_splitK(M, N, K, tile_m, tile_n, tile_k, cu_num=None, B=1, max_splitK=MAX_SPLITK) -> Occupancy:
+    '''the splitK of the lowest cost, the smallest one on ties'''
+    cu_num = cu_num or get_cu_num()
+    return min((occupancy(M, N, K, tile_m, tile_n, tile_k, el, cu_num, B)
+                for el in _splits(K, tile_k, max_splitK)),
+               key=lambda el: (el.cost, el.splitK))
+
+
+def splitK_range(M, N, K, tile_m, tile_n, tile_k, cu_num=None, B=1, max_splitK=MAX_SPLITK,
+                 slack=0.25) -> List[int]:
+    '''splitK worth timing: 0 and every one within slack of the best cost'''
+    cu_num = cu_num or get_cu_num()
+    occ = [occupancy(M, N, K, tile_m, tile_n, tile_k, el, cu_num, B) for el in _splits(K, tile_k, max_splitK)]
+    best = min(el.cost for el in occ)
+    return [el.splitK for el in occ if el.splitK == 0 or el.cost <= best * (1 + slack)]
+
+
+@functools.lru_cache(maxsize=None)
+def _device_cu_num(index):
+    import torch
+    return torch.cuda.get_device_properties(index).multi_processor_count
+
+
+def get_cu_num(device: Optional[int] = None) -> int:
+    '''CU count of device (default the current one), AITER_CU_NUM overrides it'''
+    if AITER_CU_NUM:
+        return AITER_CU_NUM
+    if device is None:
+        import torch
+        device = torch.cuda.current_device()
+    return _device_cu_num(device)
@@ -0,0 +1,253 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# search strategies over the candidate solutions of one GEMM shape.
+# a strategy decides how many timed iterations every candidate gets, so
+# hopeless candidates are dropped after a few iterations instead of 100+.
+#   timer(cand, iters) -> [us, ...] per iteration, or None if cand can not run
+#   ranking = get_search('halving').search(candidates, timer)   # [(cand, mean us)], best first
+# EventTimer times on the GPU with hip events, WallTimer on the cpu, SimulatedTimer draws latencies
+# from a cost model to test the strategies without a GPU.
+
+import math
+import time
+import random
+import statistics
+from typing import Callable, Dict, Optional
+
+
+def _mean(samples):
+    return sum(samples) / len(samples)
+
+
+def _rank(samples, order=None):
+    '''[(cand, mean)], by order (higher survived longer) then mean'''
+    order = order or {}
+    return sorted([(k, _mean(v)) for k, v in samples.items()],
+                  key=lambda el: (-order.get(el[0], 0), el[1]))
+
+
+class Exhaustive:
+    '''every candidate gets the same iterations, what perftest did'''
+
+    def __init__(self, iters=101):
+        self.iters = iters
+
+    def search(self, candidates, timer):
+        samples = {}
+        for cand in candidates:
+            ret = timer(cand, self.iters)
+            if ret:
+                samples[cand] = ret
+        return _rank(samples)
+
+
+class SuccessiveHalving:
+    '''
+    all candidates get min_iters, the best 1/eta survive and get eta times the
+    iterations (capped by max_iters), until keep of them are left
+    '''
+
+    def __init__(self, min_iters=2, eta=3, max_iters=50, keep=1):
+        self.min_iters = min_iters
+        self.eta = eta
+        self.max_iters = max_iters
+        self.keep = keep
+
+    def search(self, candidates, timer):
+        samples, survived = {}, {}
+        alive, iters, rnd = list(candidates), self.min_iters, 0
+        while alive:
+            for cand in alive:
+                more = iters - len(samples.get(cand, []))
+                ret = timer(cand, more) if more > 0 else []
+                if ret is None:
+                    samples.pop(cand, None)
+                    continue
+                samples.setdefault(cand, []).extend(ret)
+                survived[cand] = rnd
+            alive = sorted([el for el in alive if el in samples], key=lambda el: _mean(samples[el]))
+            if len(alive) <= self.keep:
+                break
+            alive = alive[:max(self.keep, len(alive) // self.eta)]
+            iters, rnd = min(iters * self.eta, self.max_iters), rnd + 1
+        return _rank(samples, survived)
+
+
+class Racing:
+    '''
+    every round adds batch iterations to the candidates still racing, one is
+    dropped once its confidence interval lies entirely above the leader's
+    '''
+
+    def __init__(self, batch=3, max_iters=45, z=2.0):
+        self.batch = batch
+        self.max_iters = max_iters
+        self.z = z
+
+    def _interval(self, samples):
+        half = self.z * statistics.stdev(samples) / math.sqrt(len(samples)) if len(samples) > 1 else math.inf
+        mean = _mean(samples)
+        return mean - half, mean + half
+
+    def search(self, candidates, timer):
+        samples, survived = {}, {}
+        alive, rnd = list(candidates), 0
+        while alive:
+            for cand in alive:
+                ret = timer(cand, self.batch)
+                if ret is None:
+                    samples.pop(cand, None)
+                    continue
+                samples.setdefault(cand, []).extend(ret)
+                survived[cand] = rnd
+            alive = [el for el in alive if el in samples]
+            if not alive:
+                break
+            leader = min(alive, key=lambda el: _mean(samples[el]))
+            _, leader_hi = self._interval(samples[leader])
+            alive = [el for el in alive if self._interval(samples[el])[0] <= leader_hi]
+            if len(alive) == 1 or len(samples[leader]) >= self.max_iters:
+                break
+            rnd += 1
+        return _rank(samples, survived)
+
+
+class WithinBest:
+    '''
+    candidates one after another, probe_iters first, only those within pct of
+    the best so far get the full iters
+    '''
+
+    def __init__(self, pct=0.1, probe_iters=3, iters=30):
+        self.pct = pct
+        self.probe_iters = probe_iters
+        self.iters = iters
+
+    def search(self, candidates, timer):
+        samples, full, best = {}, {}, math.inf
+        for cand in candidates:
+            ret = timer(cand, self.probe_iters)
+            if ret is None:
+                continue
+            samples[cand] = ret
+            if _mean(ret) > best * (1 + self.pct):
+                continue
+            ret = timer(cand, self.iters - self.probe_iters)
+            if ret is None:
+                del samples[cand]
+                continue
+            samples[cand] += ret
+            full[cand] = 1
+            best = min(best, _mean(samples[cand]))
+        return _rank(samples, full)
+
+
+SEARCH_STRATEGIES = {
+    'exhaustive': Exhaustive,
+    'halving': SuccessiveHalving,
+    'racing': Racing,
+    'within': WithinBest,
+}
+
+
+def get_search(name: str, **kwargs):
+    if name not in SEARCH_STRATEGIES:
+        raise ValueError(f'unknown search strategy {name}, choose from {list(SEARCH_STRATEGIES)}')
+    return SEARCH_STRATEGIES[name](**kwargs)
+
+
+class EventTimer:
+    '''
+    per iteration latency from hip events, no profiler. run(cand) launches the
+    candidate once, check(cand) validates its output and runs once per
+    candidate after the warmup, RuntimeError or a failed check drop it.
+    '''
+
+    def __init__(self, run: Callable, check: Optional[Callable] = None, warmup: int = 2):
+        self.run = run
+        self.check = check
+        self.warmup = warmup
+        self._ready = {}
+
+    def __call__(self, cand, iters):
+        try:
+            if cand not in self._ready:
+                for _ in range(self.warmup):
+                    self.run(cand)
+                self._ready[cand] = self.check is None or bool(self.check(cand))
+            if not self._ready[cand]:
+                return None
+            return self._time(cand, iters)
+        except RuntimeError:
+            self._ready[cand] = False
+            return None
+
+    def _time(self, cand, iters):
+        import torch
+        events = [(torch.cuda.Event(enable_timing=True), torch.cuda.Event(enable_timing=True))
+                  for _ in range(iters)]
+        for start, end in events:
+            start.record()
+            self.run(cand)
+            end.record()
+        torch.cuda.synchronize()
+        return [start.elapsed_time(end) * 1000 for start, end in events]
+
+
+class WallTimer(EventTimer):
+    '''EventTimer by the wall clock, for cpu runs such as triton under TRITON_INTERPRET=1'''
+
+    def _time(self, cand, iters):
+        samples = []
+        for _ in range(iters):
+            start = time.perf_counter()
+            self.run(cand)
+            samples.append((time.perf_counter() - start) * 1e6)
+        return samples
+
+
+def simulate_gemm_us(m, n, k, tile_m, tile_n, tile_k, splitK=0, cu_num=304,
+                     tflops_per_cu=4.3, launch_us=4.0):
+    '''
+    rough latency of a tiled GEMM: full waves of output tiles over the CUs,
+    a partial last wave costs as much as a full one, splitK spreads K over
+    2^splitK workgroups and pays an extra reduction
+    '''
+    split = 2 ** splitK
+    tiles = math.ceil(m / tile_m) * math.ceil(n / tile_n) * split
+    waves = math.ceil(tiles / cu_num)
+    k_iters = math.ceil(k / split / tile_k)
+    tile_us = 2 * tile_m * tile_n * tile_k * k_iters / (tflops_per_cu * 1e6)
+    reduce_us = m * n * split * 4 / (cu_num * 50e3) if split > 1 else 0
+    return launch_us + waves * tile_us + reduce_us
+
+
+class SimulatedTimer:
+    '''
+    draws iterations from latency[cand] with lognormal noise, counts the
+    simulated GPU time (cost) and iterations a search spends, warmup included
+    '''
+
+    def __init__(self, latency: Dict, noise: float = 0.03, invalid=(), warmup: int = 2, seed: int = 0):
+        self.latency = latency
+        self.noise = noise
+        self.invalid = set(invalid)
+        self.warmup = warmup
+        self.rng = random.Random(seed)
+        self.cost = 0.0
+        self.iters = 0
+        self._seen = set()
+
+    def __call__(self, cand, iters):
+        lat = self.latency[cand]
+        if cand not in self._seen:
+            self._seen.add(cand)
+            self.cost += self.warmup * lat
+            self.iters += self.warmup
+        if cand in self.invalid:
+            return None
+        samples = [lat * math.exp(self.rng.gauss(0, self.noise)) for _ in range(iters)]
+        self.cost += sum(samples)
+        self.iters += iters
+        return samples
@@ -8,6 +8,7 @@ import torch
 import torch.nn.functional as F
 import aiter
 from aiter.test_common import checkAllclose, perftest
+from aiter.tuning.occupancy import splitK_range
 from batched_gemm_a8w8_common import kernelInstance, kernels_list
 import argparse
 
@@ -72,9 +73,10 @@ def tune_batched_gemm(b, m, n, k, useSplitK = False):
     best_time = -1
     for i in range(kernels_num):
         kernel = kernels_list[i]
-        maxsplitK = aiter.compute_batched_gemm_SplitK(b, m, n, k, kernel.MPerBLOCK, kernel.NPerBLOCK, kernel.KPerBLOCK) \
-            if useSplitK else 0
-        for splitK in range(maxsplitK+1):
+        # only the splitK the wave model expects near the best
+        splits = splitK_range(m, n, k, kernel.MPerBLOCK, kernel.NPerBLOCK, kernel.KPerBLOCK, B=b) \
+            if useSplitK else [0]
+        for splitK in splits:
             try:
                 (out), avg_t = kernel_instance_test(x, weight, x_scale, w_scale, out, i, splitK)
                 isClosed = checkClose(ref_out, out, rtol=1e-2, atol=0.01)
@@ -206,24 +206,36 @@ torch::Tensor
             shutil.rmtree(self.instances_path)
         os.mkdir(self.instances_path)
 
-        for mnk, k in kernels_dict.items():
+        # shapes tuned to the same kernel share one instance
+        unique_kernels = {k.name: k for k in kernels_dict.values()}
+        for k in unique_kernels.values():
             self.gen_instance(k)
 
         self.gen_lookup_dict(kernels_dict)
-        self.gen_manifest_head(kernels_dict)
+        self.gen_manifest_head(unique_kernels)
 
 
 def get_tune_dict(tune_dict_csv):
     tune_dict = default_kernels_dict
     if os.path.exists(tune_dict_csv):
         tune_df = pd.read_csv(tune_dict_csv)
+        # kernelName is what was tuned, kernelId only indexes kernels_list
+        # at tuning time and goes stale when the list is edited
+        kernels_by_name = {k.name: k for k in kernels_list.values()}
         for i in range(len(tune_df)):
             B = tune_df.loc[i, "B"]
             M = tune_df.loc[i, "M"]
             N = tune_df.loc[i, "N"]
             K = tune_df.loc[i, "K"]
             kid = tune_df.loc[i, "kernelId"]
-            tune_dict[(B, M, N, K)] = kernels_list[kid]
+            name = tune_df.loc[i, "kernelName"] if "kernelName" in tune_df.columns else None
+            if name in kernels_by_name:
+                tune_dict[(B, M, N, K)] = kernels_by_name[name]
+            elif name is None and kid in kernels_list:
+                tune_dict[(B, M, N, K)] = kernels_list[kid]
+            else:
+                # not instantiated, the shape goes to the default dispatch
+                print(f"[aiter] skip tuned shape {(B, M, N, K)}: kernel {kid} {name} not in kernels_list")
     return tune_dict
 
 if __name__ == "__main__":
@@ -7,7 +7,9 @@ import pandas as pd
 import torch
 import torch.nn.functional as F
 import aiter
-from aiter.test_common import checkAllclose, perftest
+from aiter.test_common import checkAllclose
+from aiter.tuning.search import get_search, EventTimer, SEARCH_STRATEGIES
+from aiter.tuning.occupancy import splitK_range
 from gemm_a8w8_blockscale_common import kernelInstance, kernels_list
 import argparse
 from einops import rearrange
@@ -61,13 +63,7 @@ def get_tuned_gemm_list(tuned_gemm_file):
         tunedf = pd.DataFrame(columns=["M", "N", "K", "kernelId", "splitK", "us", "kernelName"])
     return tunedf
 
-@perftest()
-def kernel_instance_test(x, weight, x_scale, w_scale, out, kernel_id, splitK=0):
-    aiter.gemm_a8w8_blockscale_tune(x, weight, x_scale, w_scale, out, kernel_id, splitK)
-    return out
-
-
-def tune_gemm(m, n, k, useSplitK = False):
+def tune_gemm(m, n, k, useSplitK = False, search = 'halving'):
     dim = (m, n, k)
     block_shape_n, block_shape_k = block_shape
     scale_n =  (n + block_shape_n - 1) // block_shape_n
@@ -81,34 +77,35 @@ def tune_gemm(m, n, k, useSplitK = False):
     ref_out = run_torch(x, weight, x_scale, w_scale)
 
     print(f"*******************M:{m} X N:{n} X K:{k}**************************")
-    print(f"Start tuning a8w8 gemm kernel for M:{m}, N:{n}, K{k}:")
-    kernels_num = len(kernels_list)
-    best_kernelConfig = (-1, 0)
-    best_time = -1
-    for i in range(kernels_num):
-        kernel = kernels_list[i]
-        maxsplitK = aiter.compute_gemm_SplitK(m, n, k, kernel.MPerBLOCK, kernel.NPerBLOCK, kernel.KPerBLOCK) \
-            if useSplitK else 0
-        for splitK in range(maxsplitK+1):
-            try:
-                (out), avg_t = kernel_instance_test(x, weight, x_scale, w_scale, out, i, splitK)
-                isClosed = checkClose(ref_out, out, rtol=1e-2, atol=0.1)
-                if isClosed:
-                    print(f"{str(dim):<20} kernelid:{i:<3d}\t avg: {avg_t:<8.2f} us, {kernel.name}, {splitK=}")
-                    if best_time < 0 or avg_t < best_time:
-                        best_kernelConfig = (i, splitK)
-                        best_time = avg_t
-                else:
-                    print(f"{str(dim):<20} kernelid:{i:<3d}\t No pass         , {kernel.name}, {splitK=}") 
-            except RuntimeError as e:
-                print(e)
-                print(f"{str(dim):<20} kernelid:{i:<3d}\t No support      , {kernel.name}, {splitK=}") 
-
-    best_kernelId, splitK = best_kernelConfig
-    if best_kernelConfig[0] == -1:
+    print(f"Start tuning a8w8 gemm kernel for M:{m}, N:{n}, K{k} with {search} search:")
+    candidates = []
+    for i, kernel in kernels_list.items():
+        # only the splitK the wave model expects near the best
+        splits = splitK_range(m, n, k, kernel.MPerBLOCK, kernel.NPerBLOCK, kernel.KPerBLOCK) \
+            if useSplitK else [0]
+        candidates += [(i, splitK) for splitK in splits]
+
+    def run(cand):
+        aiter.gemm_a8w8_blockscale_tune(x, weight, x_scale, w_scale, out, cand[0], cand[1])
+
+    def check(cand):
+        # out holds the output of cand, the timer checks right after its warmup
+        if checkClose(ref_out, out, rtol=1e-2, atol=0.1):
+            return True
+        print(f"{str(dim):<20} kernelid:{cand[0]:<3d}\t No pass         , {kernels_list[cand[0]].name}, splitK={cand[1]}")
+        return False
+
+    ranking = get_search(search).search(candidates, EventTimer(run, check))
+    for (i, splitK), avg_t in ranking[:5]:
+        print(f"{str(dim):<20} kernelid:{i:<3d}\t avg: {avg_t:<8.2f} us, {kernels_list[i].name}, {splitK=}")
+    print(f"{str(dim):<20} {len(ranking)} of {len(candidates)} candidates run")
+
+    if not ranking:
+        best_kernelId, splitK = -1, 0
         print(f"No kernel can be used for M:{m}, N:{n}, K:{k}")
         best_time = 'nan'
     else:
+        (best_kernelId, splitK), best_time = ranking[0]
         best_time = round(best_time, 4)
         
         print(f"Tuning result for M:{m}, N:{n}, K:{k} is kernelId={best_kernelId} {kernels_list[best_kernelId].name} {splitK=}, {best_time}us")
@@ -117,14 +114,14 @@ def tune_gemm(m, n, k, useSplitK = False):
     return best_kernelId, splitK, best_time
 
 
-def tune_gemm_list(untunedf, tunedf, issorted = False, useSplitK = False):
+def tune_gemm_list(untunedf, tunedf, issorted = False, useSplitK = False, search = 'halving'):
     for i in range(len(untunedf)):
         M = untunedf.loc[i, "M"]
         N = untunedf.loc[i, "N"]
         K = untunedf.loc[i, "K"]
         
         if tunedf[(tunedf["M"]==M) & (tunedf["N"]==N) & (tunedf["K"]==K)].empty:
-            kernelId, splitK, time = tune_gemm(M, N, K, useSplitK)
+            kernelId, splitK, time = tune_gemm(M, N, K, useSplitK, search)
             kernelName = 'None' if kernelId == -1 else kernels_list[kernelId].name
             temp = pd.DataFrame({"M":[M], "N":[N], "K":[K], "kernelId":[kernelId], "splitK":[splitK], 
                            "us":[time], "kernelName":[kernelName]})
@@ -172,6 +169,14 @@ if __name__ == "__main__":
         help="Use splitK kernels"
     )
 
+    parser.add_argument(
+        "--search",
+        default="halving",
+        choices=list(SEARCH_STRATEGIES),
+        required=False,
+        help="how the candidates are timed, exhaustive gives every one the full iterations"
+    )
+
     parser.add_argument(
         "--sort",
         action='store_true',
@@ -182,5 +187,5 @@ if __name__ == "__main__":
     args = parser.parse_args()
     untunedf = get_untuned_gemm_list(args.untune_file)
     tunedf = get_tuned_gemm_list(args.tune_file)
-    tunedf = tune_gemm_list(untunedf, tunedf, args.sort, args.splitK)
+    tunedf = tune_gemm_list(untunedf, tunedf, args.sort, args.splitK, args.search)
     tunedf.to_csv(args.tune_file, index=False)
@@ -8,6 +8,7 @@
 // __HIP_NO_HALF_CONVERSIONS__ #endif
 
 #include "hipbsolgemm.cuh"
+#include <atomic>
 
 // #include <rocblas/rocblas.h>
 
@@ -284,9 +285,14 @@ hipblasStatus_t hipblasLtMatmul_sol_wrapper(
   if (solution_index < 0)
   {
     // nvtxRangePushA("hipblasLtMatmulAlgoGetHeuristic");
-    std::cout
-        << "Warning! HipbSolId Gemm Fallback Path used for solution index <0"
-        << std::endl;
+    // untuned shapes take this path on every call, warn once per process
+    static std::atomic<bool> fallback_warned{false};
+    if (!fallback_warned.exchange(true))
+    {
+      std::cout
+          << "Warning! HipbSolId Gemm Fallback Path used for solution index <0"
+          << std::endl;
+    }
     if (cout_print)
     {
       std::cout << (op_A == HIPBLAS_OP_N ? "N" : "T")
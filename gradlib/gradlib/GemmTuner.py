@@ -24,6 +24,8 @@ import aiter
 import torch
 import torch.nn.functional as F
 from aiter.test_common import perftest
+from aiter.tuning.search import get_search, EventTimer
+from parallel_tuner import ParallelTuner, HipBackend, make_shape
 
 aiter.rocb_create_extension()
 aiter.hipb_create_extension()
@@ -38,7 +40,7 @@ HALF = torch.tensor(0.5, dtype=torch.float32, device='cuda')
 
 class Gemm:
 
-    def __init__(self, m, n, k, bias, indtype, outdtype, scaleAB=False, rocblas_decode=False):
+    def __init__(self, m, n, k, bias, indtype, outdtype, scaleAB=False, rocblas_decode=False, search=None):
         self.m = m
         self.k = k
         self.n = n
@@ -71,6 +73,8 @@ class Gemm:
         # ratio of hipblaslt time
         self.hipb_prefer_ratio = 0.995
         self.rocblas_decode = rocblas_decode
+        # name of an aiter.tuning.search strategy, None times every solution twice
+        self.search = get_search(search) if search is not None else None
 
     def find_hipblas_sols(self):
         sols = aiter.hipb_findallsols(self.inp,
@@ -267,6 +271,28 @@ class Gemm:
         print('>>> Rocblas top solutions, Fast Mode', fast_mode, flush=True)
         print(self.rocb_gtimedf.head(self.topn), flush=True)
 
+    def search_time_sols(self, libtype, solutions):
+        '''ranked by the search strategy among the solutions passing the reference check, the fastest wins'''
+        scaleA = HALF if self.scaleAB else None
+        scaleB = HALF if self.scaleAB else None
+
+        def run(solidx):
+            weight = self.weights2[random.randint(0, self.nb - 1)].t()
+            if libtype == 'hipblaslt':
+                aiter.hipb_mm(self.inp, weight, solidx, out_dtype=self.outdtype, scaleA=scaleA, scaleB=scaleB)
+            elif self.bias is not None:
+                aiter.rocb_mm(self.inp, weight, solidx) + self.bias
+            else:
+                aiter.rocb_mm(self.inp, weight, solidx)
+
+        # a solution failing the reference check is dropped before it is timed
+        timer = EventTimer(run, lambda solidx: self.check_gemm_ref(libtype=libtype, solidx=solidx))
+        ranking = self.search.search(list(solutions), timer)
+        gtimes = {solidx: us / 1000.0 for solidx, us in ranking[:1]}
+        gtimedf = pd.DataFrame.from_dict(gtimes, orient='index', columns=['gtimems'])
+        print(f'>>> {libtype} {len(ranking)} of {len(solutions)} solutions timed, best', gtimes, flush=True)
+        return gtimedf
+
     def warmup(self, warmi=500):
         for i in range(warmi):
             self.blob = self.blob + 0.00001
@@ -288,15 +314,21 @@ class Gemm:
             self.find_rocblas_sols()
         if not (self.rocblas_decode and self.m == 1):
             self.find_hipblas_sols()
-        self.warmup()
-        self.rocb_time_all_sols(fast_mode=1)
-        self.warmup()
-        self.hipb_time_all_sols(fast_mode=1)
-        self.functional_check_topn_fastest()
-        self.warmup()
-        self.rocb_time_all_sols(fast_mode=0, top_sols=1)
-        self.warmup()
-        self.hipb_time_all_sols(fast_mode=0, top_sols=1)
+        if self.search is not None:
+            self.warmup()
+            self.rocb_gtimedf = self.search_time_sols('rocblas', self.rocb_sols)
+            self.warmup()
+            self.hipb_gtimedf = self.search_time_sols('hipblaslt', self.hipb_sols)
+        else:
+            self.warmup()
+            self.rocb_time_all_sols(fast_mode=1)
+            self.warmup()
+            self.hipb_time_all_sols(fast_mode=1)
+            self.functional_check_topn_fastest()
+            self.warmup()
+            self.rocb_time_all_sols(fast_mode=0, top_sols=1)
+            self.warmup()
+            self.hipb_time_all_sols(fast_mode=0, top_sols=1)
         if len(self.rocb_gtimedf) > 0 and len(self.hipb_gtimedf) > 0:
             best_rocb_time = self.rocb_gtimedf.gtimems.iloc[0]
             best_hipb_time = self.hipb_gtimedf.gtimems.iloc[0]
@@ -339,8 +371,10 @@ class GemmTuner:
                  indtype,
                  outdtype,
                  tuned_file=None,
-                 rocblas_decode=False):
+                 rocblas_decode=False,
+                 search=None):
         self.gemm_problems = pd.DataFrame(columns=['M', 'N', 'K', 'bias'])
+        self.search = search
         self.indtype = indtype
         self.outdtype = outdtype
         self.rocblas_decode = rocblas_decode
@@ -376,6 +410,18 @@ class GemmTuner:
             print(f">>>Info: Found Duplicate shape(M:{m},"
                   f" N:{n}, K:{k} bias:{bias}), skipping")
 
+    def find_best_sols_parallel(self, devices, timeout=None, checkpoint=None):
+        '''one worker process per device, resumable from the checkpoint'''
+        df = self.gemm_problems
+        shapes = [make_shape(ds['M'], ds['N'], ds['K'], ds['bias'], ds['dtype'],
+                             ds['outdtype'], ds['scaleAB'])
+                  for _, ds in df.iterrows()]
+        tuner = ParallelTuner(self.tuned_file, devices,
+                              backend=HipBackend(self.rocblas_decode, self.search),
+                              checkpoint=checkpoint,
+                              timeout=timeout)
+        return tuner.run(shapes)
+
     def find_best_sols(self):
         df = self.gemm_problems
         soldf = pd.DataFrame(
@@ -391,7 +437,8 @@ class GemmTuner:
                            indtype=indtype,
                            outdtype=outdtype,
                            scaleAB=ds['scaleAB'],
-                           rocblas_decode=self.rocblas_decode)
+                           rocblas_decode=self.rocblas_decode,
+                           search=self.search)
             gemmobj.find_fastest_solution()
             soldf.loc[i, 'libtype'] = gemmobj.best_libtype
             soldf.loc[i, 'solidx'] = gemmobj.best_solidx
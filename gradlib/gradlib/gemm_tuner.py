@@ -25,6 +25,7 @@ import pandas as pd
 import aiter
 
 from GemmTuner import GemmTuner
+from aiter.tuning.search import SEARCH_STRATEGIES
 
 aiter.rocb_create_extension()
 aiter.hipb_create_extension()
@@ -127,6 +128,25 @@ if __name__ == '__main__':
                         help="Tune for both bias and non bias cases,"
                         " regardless of what was used"
                         " to collect the shapes")
+    parser.add_argument("--search",
+                        type=str,
+                        default="twopass",
+                        choices=["twopass"] + list(SEARCH_STRATEGIES),
+                        help="how the solutions are timed, twopass times all of them"
+                        " in fast mode and the top 20 again")
+    parser.add_argument("--devices",
+                        type=list_of_ints,
+                        default=None,
+                        help="tune in parallel, one worker process per device: 0,1,2,3."
+                        " results are checkpointed, rerun to resume")
+    parser.add_argument("--timeout",
+                        type=float,
+                        default=None,
+                        help="seconds one shape may take before its worker is restarted")
+    parser.add_argument("--checkpoint",
+                        type=str,
+                        default=None,
+                        help="checkpoint of the parallel tuning, default: {tuned_file}.ckpt.jsonl")
     args = parser.parse_args()
 
     if args.outdtype is None:
@@ -134,7 +154,8 @@ if __name__ == '__main__':
     indtype = get_dtype(args.indtype)
     outdtype = get_dtype(args.outdtype)
 
-    gtuner = GemmTuner(indtype, outdtype, args.tuned_file, args.rocblas_decode)
+    gtuner = GemmTuner(indtype, outdtype, args.tuned_file, args.rocblas_decode,
+                       None if args.search == 'twopass' else args.search)
     nsets = [i * args.batch_size for i in args.nsets]
     if args.input_file:
         print(f">>> Loading {args.input_file}")
@@ -178,4 +199,7 @@ if __name__ == '__main__':
             for m, k in mksets:
                 gtuner.add_gemm(m, n, k, indtype=dtype)
 
-    gtuner.find_best_sols()
+    if args.devices:
+        gtuner.find_best_sols_parallel(args.devices, args.timeout, args.checkpoint)
+    else:
+        gtuner.find_best_sols()
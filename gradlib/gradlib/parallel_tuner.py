@@ -0,0 +1,295 @@
+'''
+ * Copyright © Advanced Micro Devices, Inc. All rights reserved.
+ *
+ * Licensed under the Apache License, Version 2.0 (the "License");
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ *      http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing, software
+ * distributed under the License is distributed on an "AS IS" BASIS,
+ * WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+ * See the License for the specific language governing permissions and
+ * limitations under the License.
+ '''
+# work queue tuner: one worker process per device, each pulls the next shape
+# as soon as it is idle. every result is appended to a checkpoint first, so a
+# crash, a hung shape or a killed job resumes where it stopped, the results are
+# merged into the tuned csv at the end.
+#   python gradlib/gradlib/gemm_tuner.py --input_file ... --tuned_file ... --devices 0,1,2,3
+# this module must not import torch, the parent only schedules, the workers
+# are spawned with only their device visible.
+import os
+import csv
+import json
+import time
+import zlib
+import queue
+import multiprocessing as mp
+from collections import deque
+
+KEYS = ['M', 'N', 'K', 'bias', 'dtype', 'outdtype', 'scaleAB']
+SOLUTION = ['libtype', 'solidx', 'soltimes', 'kernelName']
+
+
+def shape_id(shape):
+    return '_'.join(str(shape[el]) for el in KEYS)
+
+
+def make_shape(m, n, k, bias=False, dtype='torch.float16', outdtype=None, scaleAB=False):
+    return {'M': int(m), 'N': int(n), 'K': int(k), 'bias': bool(bias),
+            'dtype': str(dtype), 'outdtype': str(outdtype if outdtype is not None else dtype),
+            'scaleAB': bool(scaleAB)}
+
+
+class HipBackend:
+    '''rocBLAS/hipBLASLt through GemmTuner.Gemm, one device per worker'''
+
+    def __init__(self, rocblas_decode=False, search=None):
+        self.rocblas_decode = rocblas_decode
+        self.search = search
+
+    def env(self, device):
+        '''environment of the worker process, 'cuda' in GemmTuner is this device'''
+        for var in ['HIP_VISIBLE_DEVICES', 'CUDA_VISIBLE_DEVICES']:
+            visible = os.environ.get(var, None)
+            if visible:
+                return {var: visible.split(',')[device]}
+        return {'HIP_VISIBLE_DEVICES': str(device)}
+
+    def setup(self, device):
+        import torch
+        import aiter
+        from GemmTuner import Gemm
+        self.torch, self.aiter, self.Gemm = torch, aiter, Gemm
+
+    def tune(self, shape):
+        torch = self.torch
+        gemmobj = self.Gemm(shape['M'], shape['N'], shape['K'], shape['bias'],
+                            indtype=getattr(torch, shape['dtype'].split('.')[1]),
+                            outdtype=getattr(torch, shape['outdtype'].split('.')[1]),
+                            scaleAB=shape['scaleAB'],
+                            rocblas_decode=self.rocblas_decode,
+                            search=self.search)
+        gemmobj.find_fastest_solution()
+        ret = {'libtype': gemmobj.best_libtype,
+               'solidx': int(gemmobj.best_solidx),
+               'soltimes': round(gemmobj.best_soltime * 1000, 2),
+               'kernelName': self.aiter.getHipblasltKernelName(int(gemmobj.best_solidx))
+               if gemmobj.best_libtype == 'hipblaslt' else ''}
+        del gemmobj
+        torch.cuda.empty_cache()
+        return ret
+
+
+class FakeBackend:
+    '''
+    deterministic solutions without a GPU, for the scheduling, checkpoint and
+    merge logic. shapes in crash kill the worker, shapes in hang never return.
+    '''
+
+    def __init__(self, delay=0.0, crash=(), hang=()):
+        self.delay = delay
+        self.crash = set(crash)
+        self.hang = set(hang)
+
+    def env(self, device):
+        return {'AITER_FAKE_DEVICE': str(device)}
+
+    def setup(self, device):
+        assert os.environ['AITER_FAKE_DEVICE'] == str(device)
+        self.device = device
+
+    def tune(self, shape):
+        sid = shape_id(shape)
+        if sid in self.crash:
+            os._exit(1)
+        if sid in self.hang:
+            time.sleep(3600)
+        time.sleep(self.delay)
+        solidx = zlib.crc32(sid.encode()) % 1000
+        return {'libtype': 'hipblaslt',
+                'solidx': solidx,
+                'soltimes': round(shape['M'] * shape['N'] * shape['K'] / 1e9, 2),
+                'kernelName': f'fake_kernel_{solidx}'}
+
+
+def _worker(device, backend, tasks, results):
+    backend.setup(device)
+    results.put(('ready', device, None, None))
+    while True:
+        shape = tasks.get()
+        if shape is None:
+            break
+        try:
+            results.put(('done', device, shape_id(shape), backend.tune(shape)))
+        except Exception as e:
+            results.put(('error', device, shape_id(shape), repr(e)))
+
+
+def load_checkpoint(path):
+    '''{shape id: solved row} of every shape tuned so far'''
+    ret = {}
+    if not os.path.exists(path):
+        return ret
+    with open(path) as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except ValueError:
+                # the last line of a killed run may be cut
+                continue
+            ret[shape_id(row)] = row
+    return ret
+
+
+def merge_tuned(tuned_file, rows):
+    '''new rows replace the ones of the same shape, the rest of tuned_file stays'''
+    header, old = KEYS + SOLUTION, []
+    if os.path.exists(tuned_file):
+        with open(tuned_file, newline='') as f:
+            reader = csv.DictReader(f)
+            header = reader.fieldnames or header
+            old = list(reader)
+    for el in KEYS + SOLUTION:
+        if el not in header:
+            header.append(el)
+    new_ids = {shape_id(el) for el in rows}
+    merged = [el for el in old if shape_id(el) not in new_ids] + list(rows)
+    tmp = f'{tuned_file}.{os.getpid()}'
+    with open(tmp, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=header, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(merged)
+    os.replace(tmp, tuned_file)
+
+
+class ParallelTuner:
+
+    def __init__(self, tuned_file, devices, backend=None, checkpoint=None,
+                 timeout=None, retries=1, poll=0.1):
+        self.tuned_file = tuned_file
+        self.devices = list(devices)
+        self.backend = backend if backend is not None else HipBackend()
+        self.checkpoint = checkpoint or f'{tuned_file}.ckpt.jsonl'
+        # seconds one shape may take before its worker is killed
+        self.timeout = timeout
+        self.retries = retries
+        self.poll = poll
+        self.ctx = mp.get_context('spawn')
+
+    def _spawn(self, device):
+        tasks = self.ctx.Queue()
+        proc = self.ctx.Process(target=_worker,
+                                args=(device, self.backend, tasks, self.results),
+                                daemon=True)
+        # the child inherits the environment at start, so the device is pinned
+        # before anything in it (the re-imported main module too) touches HIP
+        env = self.backend.env(device)
+        saved = {k: os.environ.get(k, None) for k in env}
+        os.environ.update(env)
+        try:
+            proc.start()
+        finally:
+            for k, v in saved.items():
+                if v is None:
+                    del os.environ[k]
+                else:
+                    os.environ[k] = v
+        return proc, tasks
+
+    def run(self, shapes):
+        '''
+        tune shapes not in the checkpoint yet, merge everything into tuned_file.
+        returns {'tuned': n, 'resumed': n, 'failed': [shape id, ...]}
+        '''
+        shapes = {shape_id(el): el for el in shapes}
+        done = load_checkpoint(self.checkpoint)
+        resumed = len([el for el in shapes if el in done])
+        pending = deque(el for el in shapes if el not in done)
+        attempts = {el: 0 for el in pending}
+        failed, tuned = [], 0
+
+        self.results = self.ctx.Queue()
+        workers = {dev: self._spawn(dev) for dev in self.devices[:len(pending)]}
+        ready = set()
+        # a device whose worker keeps dying before it is ready is dropped
+        setup_failures = {dev: 0 for dev in workers}
+        # device -> (shape id, start time)
+        inflight = {}
+
+        def retry(dev, sid, why):
+            attempts[sid] += 1
+            print(f'>>> {sid} on device {dev}: {why}, attempt {attempts[sid]}', flush=True)
+            if attempts[sid] <= self.retries:
+                pending.append(sid)
+            else:
+                failed.append(sid)
+
+        with open(self.checkpoint, 'a') as ckpt:
+            while pending or inflight:
+                for dev in sorted(ready - set(inflight)):
+                    if not pending:
+                        break
+                    sid = pending.popleft()
+                    inflight[dev] = (sid, time.time())
+                    workers[dev][1].put(shapes[sid])
+                try:
+                    kind, dev, sid, value = self.results.get(timeout=self.poll)
+                except queue.Empty:
+                    kind = None
+                if kind == 'ready':
+                    ready.add(dev)
+                elif kind is not None and inflight.get(dev, (None,))[0] == sid:
+                    del inflight[dev]
+                    if kind == 'done':
+                        row = {**shapes[sid], **value}
+                        ckpt.write(json.dumps(row) + '\n')
+                        ckpt.flush()
+                        os.fsync(ckpt.fileno())
+                        done[sid] = row
+                        tuned += 1
+                        print(f'>>> [{len(done)}/{len(shapes)}] device {dev}: {sid} -> '
+                              f'{value["libtype"]} {value["solidx"]} {value["soltimes"]}us', flush=True)
+                    else:
+                        retry(dev, sid, value)
+
+                # crashed or hung workers are replaced, their shape goes back to the queue
+                for dev, (proc, tasks) in list(workers.items()):
+                    hung = dev in inflight and self.timeout and \
+                        time.time() - inflight[dev][1] > self.timeout
+                    if proc.is_alive() and not hung:
+                        continue
+                    if hung:
+                        proc.kill()
+                    proc.join()
+                    if dev in inflight:
+                        sid, _ = inflight.pop(dev)
+                        retry(dev, sid, 'timeout' if hung else f'worker exited with {proc.exitcode}')
+                    elif dev not in ready:
+                        setup_failures[dev] += 1
+                    ready.discard(dev)
+                    if setup_failures[dev] >= 3:
+                        print(f'>>> device {dev} failed to start 3 times, dropped', flush=True)
+                        del workers[dev]
+                        continue
+                    workers[dev] = self._spawn(dev)
+                if not workers:
+                    failed.extend(pending)
+                    pending.clear()
+
+        for proc, tasks in workers.values():
+            tasks.put(None)
+        for proc, tasks in workers.values():
+            proc.join(timeout=10)
+            if proc.is_alive():
+                proc.kill()
+
+        if shapes:
+            merge_tuned(self.tuned_file, [done[el] for el in shapes if el in done])
+        if not failed:
+            os.remove(self.checkpoint)
+        else:
+            print(f'>>> {len(failed)} shapes failed, rerun to retry them: {failed}', flush=True)
+        return {'tuned': tuned, 'resumed': resumed, 'failed': failed}
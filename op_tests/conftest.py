@@ -0,0 +1,12 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# without a GPU the triton kernels of the cpu tests (test_moe_*) run through
+# the interpreter. triton picks it when a kernel is decorated, i.e. when the
+# first test module imports aiter.fused_moe_core, so it is set before any is
+# collected, a setdefault inside a test module is too late in a full run
+import os
+import torch
+
+if not torch.cuda.is_available():
+    os.environ.setdefault('TRITON_INTERPRET', '1')
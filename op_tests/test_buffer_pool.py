@@ -0,0 +1,103 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# the output/scratch buffer pool on cpu tensors, the stream test on a GPU
+import pytest
+import torch
+from aiter.buffer_pool import BufferPool
+
+
+def test_exact_storage():
+    # a tensor of the pool is all of its storage, like one of torch.empty
+    pool = BufferPool(enabled=True)
+    for shape, dtype in [((3, 5), torch.float32), ((7,), torch.bfloat16), ((2, 0), torch.int32)]:
+        t = pool.empty(shape, dtype, 'cpu')
+        assert t.untyped_storage().nbytes() == t.numel() * dtype.itemsize and t.storage_offset() == 0
+
+
+def test_reuse():
+    pool = BufferPool(enabled=True)
+    a = pool.empty((16, 32), torch.float32, 'cpu')
+    ptr = a.data_ptr()
+    # alive, another request of the same shape gets another block
+    b = pool.empty((16, 32), torch.float32, 'cpu')
+    assert b.data_ptr() != ptr
+    # a view keeps the block taken
+    c = a.view(-1)[:8]
+    del a
+    t = pool.empty((16, 32), torch.float32, 'cpu')
+    assert t.data_ptr() not in (ptr, b.data_ptr())
+    del c
+    # free again: same shape, then another shape of the same bytes
+    d = pool.empty((16, 32), torch.float32, 'cpu')
+    assert d.data_ptr() == ptr and d.shape == (16, 32) and d.dtype == torch.float32
+    del d
+    e = pool.empty((32, 16, 2), torch.bfloat16, 'cpu')
+    assert e.data_ptr() == ptr and e.shape == (32, 16, 2)
+    stats = pool.stats()
+    assert stats['requests'] == 5 and stats['allocs'] == 3 and stats['hits'] == 2
+    assert stats['bytes_held'] == 3 * 2048 and stats['bytes_in_use'] == 3 * 2048
+    del b, e, t
+    pool.trim()
+    assert pool.stats()['bytes_held'] == 0
+    assert pool.empty(0, torch.int32, 'cpu').shape == (0,)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason='needs a GPU')
+def test_record_stream():
+    pool = BufferPool(enabled=True)
+    side = torch.cuda.Stream()
+    a = pool.empty((1 << 20,), torch.float32, 'cuda')
+    ptr = a.data_ptr()
+    pool.record_stream(a, side)
+    with torch.cuda.stream(side):
+        torch.cuda._sleep(1 << 26)
+        a.fill_(1)
+    del a
+    # the block comes back once the current stream waits for side
+    b = pool.empty((1 << 20,), torch.float32, 'cuda')
+    assert b.data_ptr() == ptr
+    b.fill_(2)
+    torch.cuda.synchronize()
+    assert bool((b == 2).all())
+
+
+def test_max_bytes():
+    pool = BufferPool(enabled=True, max_bytes=4096)
+    for _ in range(3):
+        pool.empty(1024, torch.float32, 'cpu')
+        pool.empty(512, torch.float32, 'cpu')
+    assert pool.stats()['bytes_held'] <= 4096
+
+
+def test_static():
+    pool = BufferPool(enabled=True)
+    ptrs = []
+    for _ in range(3):
+        with pool.static():
+            # the same sequence on every step, alive or not
+            x = pool.empty((8, 8), torch.float16, 'cpu')
+            y = pool.empty((8, 8), torch.float16, 'cpu')
+            ptrs.append((x.data_ptr(), y.data_ptr()))
+    assert ptrs[0] == ptrs[1] == ptrs[2] and ptrs[0][0] != ptrs[0][1]
+    # outside the static block the pool never hands them out
+    assert pool.empty((8, 8), torch.float16, 'cpu').data_ptr() not in ptrs[0]
+    # a changed sequence replaces the slot
+    with pool.static():
+        assert pool.empty((4, 4), torch.float16, 'cpu').data_ptr() != ptrs[0][0]
+        assert pool.empty((8, 8), torch.float16, 'cpu').data_ptr() == ptrs[0][1]
+    assert pool.stats()['static_blocks'] == 2
+
+
+def test_disabled():
+    pool = BufferPool(enabled=False)
+    a = pool.empty((4, 4), torch.float32, 'cpu')
+    assert a.shape == (4, 4) and pool.stats()['requests'] == 0
+
+
+if __name__ == '__main__':
+    for test in [test_exact_storage, test_reuse, test_max_bytes, test_static, test_disabled]:
+        test()
+    if torch.cuda.is_available():
+        test_record_stream()
+    print('buffer pool tests passed')
@@ -0,0 +1,74 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+import os
+import sys
+import subprocess
+import tempfile
+from aiter.jit.build_telemetry import parse_ninja_log, ninja_log_offset, JobPeakRss, \
+    write_telemetry, load_telemetry, get_job_mem_gb, rank_units, format_report
+
+NINJA_LOG = '''# ninja log v5
+0\t52000\t1700000000\tgemm_a8w8.cuda.o\t1111
+10\t181000\t1700000000\ta8w8_rowwise_256x256x256x64_dBF16_eBF16.cuda.o\t2222
+'''
+
+
+def test_ninja_log(tmp_path):
+    build_dir = f'{tmp_path}/build'
+    os.makedirs(build_dir)
+    with open(f'{build_dir}/.ninja_log', 'w') as f:
+        f.write(NINJA_LOG)
+    units = parse_ninja_log(build_dir)
+    assert [el['output'] for el in units] == ['a8w8_rowwise_256x256x256x64_dBF16_eBF16.cuda.o',
+                                              'gemm_a8w8.cuda.o']
+    assert units[0]['ms'] == 180990
+
+    # only what the next build appends is attributed to it
+    offset = ninja_log_offset(build_dir)
+    with open(f'{build_dir}/.ninja_log', 'a') as f:
+        f.write('0\t30000\t1700000100\tgemm_a8w8.cuda.o\t3333\n')
+    assert parse_ninja_log(build_dir, offset) == [{'output': 'gemm_a8w8.cuda.o', 'ms': 30000}]
+
+
+def test_report(tmp_path):
+    telemetry_dir = f'{tmp_path}/telemetry'
+    assert get_job_mem_gb(telemetry_dir) == 9
+    write_telemetry('module_a', {'md_name': 'module_a', 'status': 'built', 'peak_job_rss_gb': 5.0,
+                                 'units': [{'output': 'a0.o', 'ms': 9000}, {'output': 'a1.o', 'ms': 1000}]},
+                    telemetry_dir)
+    write_telemetry('module_b', {'md_name': 'module_b', 'status': 'built', 'peak_job_rss_gb': 2.0,
+                                 'units': [{'output': 'b0.o', 'ms': 5000}]}, telemetry_dir)
+    # a cache hit keeps the compile profile of the last build
+    write_telemetry('module_b', {'md_name': 'module_b', 'status': 'cache_hit', 'cache': 'hit'}, telemetry_dir)
+
+    records = load_telemetry(telemetry_dir)
+    assert [el['status'] for el in records] == ['built', 'cache_hit']
+    assert [el['md_name'] for el in load_telemetry(telemetry_dir, ['module_b'])] == ['module_b']
+    assert [el[2] for el in rank_units(records, top=2)] == ['a0.o', 'b0.o']
+    assert abs(get_job_mem_gb(telemetry_dir) - 6.0) < 1e-6
+    assert 'a0.o' in format_report(records)
+
+
+def alloc(mb):
+    subprocess.run([sys.executable, '-c', f'import time; b = bytearray({mb} << 20); time.sleep(1)'], check=True)
+
+
+def test_job_peak_rss():
+    # every build measures its own jobs, not the peak of an earlier one
+    with JobPeakRss(interval=0.05) as big:
+        alloc(400)
+    with JobPeakRss(interval=0.05) as small:
+        alloc(50)
+    assert 0.35 < big.gb < 0.5 and small.gb < 0.15
+    with JobPeakRss() as idle:
+        pass
+    assert idle.gb is None
+
+
+if __name__ == '__main__':
+    for test in [test_ninja_log, test_report]:
+        with tempfile.TemporaryDirectory() as tmp_path:
+            test(tmp_path)
+    test_job_peak_rss()
+    print('build telemetry tests passed')
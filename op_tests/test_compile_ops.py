@@ -0,0 +1,38 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# compile_ops binds the c++ function once per module, custom_build_args
+# included, on a stand-in load_op, no build needed
+import pytest
+from aiter.jit import core
+
+
+def test_bound_once(monkeypatch):
+    loads = []
+
+    def load_op(_md_name, loadName, custom_build_args={}):
+        loads.append(custom_build_args.get('md_name', _md_name))
+        return lambda *args: (custom_build_args.get('md_name', _md_name), args)
+    monkeypatch.setattr(core, 'load_op', load_op)
+
+    @core.compile_ops('module_test', fc_name='test')
+    def op(x): ...
+
+    for i in range(3):
+        assert op(i) == ('module_test', (i,))
+        # the mha way: a module per variant
+        assert op(i, custom_build_args={'md_name': 'module_test_a', 'blob_gen_cmd': 'a'}) == ('module_test_a', (i,))
+        assert op(i, custom_build_args={'blob_gen_cmd': 'b', 'md_name': 'module_test_b'}) == ('module_test_b', (i,))
+        # mha_varlen_fwd passes a list of generator commands
+        assert op(i, custom_build_args={'md_name': 'module_test_c', 'blob_gen_cmd': ['c fwd', 'c fwd_splitkv']}) \
+            == ('module_test_c', (i,))
+    assert loads == ['module_test', 'module_test_a', 'module_test_b', 'module_test_c']
+
+
+if __name__ == '__main__':
+    monkeypatch = pytest.MonkeyPatch()
+    try:
+        test_bound_once(monkeypatch)
+    finally:
+        monkeypatch.undo()
+    print('compile ops tests passed')
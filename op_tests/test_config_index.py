@@ -0,0 +1,104 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+import os
+import sys
+import time
+import tempfile
+from aiter.configs.config_index import get_config_table, compile_config, ConfigTable, \
+    TUNED_CONFIGS, this_dir
+from aiter.configs import tuned_lookup
+
+CK_CSV = '''M,N,K,kernelId,splitK,us,kernelName
+1,1280,8192,34,0,19.5424,a8w8_rowwise_256x16x64x512_16x16_1x1_32x8x1_32x8x1_1x16x1x16_4x4x1_1x1_intrawave_v3
+128,1280,8192,30,0,22.4841,a8w8_rowwise_256x32x64x512_16x16_1x2_32x8x1_32x8x1_1x32x1x8_8x8x1_1x2_intrawave_v3
+128,1280,8192,31,2,20.0000,a8w8_rowwise_256x64x64x512_16x16_1x2_32x8x1_32x8x1_1x32x1x8_8x8x1_1x2_intrawave_v3
+'''
+
+ASM_CSV = '''M,N,K,bias,outdtype,splitK,us
+128,1280,8192,True,torch.bfloat16,3,13.85
+128,1280,8192,False,torch.bfloat16,1,
+'''
+
+
+def write(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+    return path
+
+
+def test_lookup(tmp_path):
+    os.environ['AITER_CONFIG_INDEX_DIR'] = f'{tmp_path}/idx'
+    table = get_config_table(write(f'{tmp_path}/ck.csv', CK_CSV), ['M', 'N', 'K'])
+    assert len(table) == 3
+    assert table.get(7, 7, 7) is None
+    config = table.get(1, 1280, 8192)
+    assert config['kernelId'] == 34 and config['splitK'] == 0
+    assert (config['tile_m'], config['tile_n'], config['tile_k']) == (16, 64, 512)
+    # the last of duplicated shapes wins
+    assert table.get(128, 1280, 8192)['kernelId'] == 31
+
+    table = get_config_table(write(f'{tmp_path}/asm.csv', ASM_CSV), ['M', 'N', 'K', 'bias', 'outdtype'])
+    assert table.get(128, 1280, 8192, True, 'torch.bfloat16')['splitK'] == 3
+    assert table.get(128, 1280, 8192, False, 'torch.bfloat16')['splitK'] == 1
+    assert table.get(128, 1280, 8192, True, 'torch.float16') is None
+
+
+def test_recompile(tmp_path):
+    csv_path = write(f'{tmp_path}/ck.csv', CK_CSV)
+    index = compile_config(csv_path, ['M', 'N', 'K'], f'{tmp_path}/ck.idx')
+    assert ConfigTable(index).get(2, 1280, 8192) is None
+    time.sleep(0.01)
+    write(csv_path, CK_CSV + '2,1280,8192,34,0,19.0,a8w8_rowwise_256x16x64x512_16x16_1x1_32x8x1_32x8x1_1x16x1x16_4x4x1_1x1_intrawave_v3\n')
+    os.environ['AITER_CONFIG_INDEX_DIR'] = f'{tmp_path}/idx'
+    assert get_config_table(csv_path, ['M', 'N', 'K']).get(2, 1280, 8192)['kernelId'] == 34
+
+
+def test_shipped_configs(tmp_path):
+    os.environ['AITER_CONFIG_INDEX_DIR'] = f'{tmp_path}/idx'
+    for name, keys in TUNED_CONFIGS.items():
+        start = time.perf_counter()
+        table = get_config_table(f'{this_dir}/{name}', keys)
+        rows = list(table.rows())
+        for row in rows:
+            assert table.get(*[row[el] for el in keys]) is not None
+        print(f'[perf] {name}: {len(rows)} rows, index + full scan {(time.perf_counter()-start)*1e3:.2f} ms')
+    assert 'pandas' not in sys.modules
+
+
+def test_nearest(tmp_path):
+    os.environ['AITER_CONFIG_INDEX_DIR'] = f'{tmp_path}/idx'
+    csv_path = write(f'{tmp_path}/a8w8_tuned_gemm.csv', CK_CSV)
+    table = get_config_table(csv_path, ['M', 'N', 'K'])
+    # M buckets up to the next tuned M of the same (N, K), beyond the grid to the largest
+    assert table.nearest(1, 1280, 8192)['M'] == 1
+    assert table.nearest(17, 1280, 8192)['kernelId'] == 31
+    assert table.nearest(4096, 1280, 8192)['kernelId'] == 31
+    assert table.nearest(17, 1280, 4096) is None
+
+    config = tuned_lookup.lookup_tuned(csv_path, ['M', 'N', 'K'], (17, 1280, 8192))
+    assert config['M'] == 128
+    assert tuned_lookup.lookup_tuned(csv_path, ['M', 'N', 'K'], (1, 1280, 8192))['M'] == 1
+    # the hipblaslt/rocblas lookups take exact rows only
+    assert tuned_lookup.lookup_tuned(csv_path, ['M', 'N', 'K'], (17, 1280, 8192), nearest=False) is None
+    assert {'M': 17, 'N': 1280, 'K': 8192} in tuned_lookup.get_untuned_shapes()['a8w8_untuned_gemm.csv']
+
+    # splitK follows the kernel the CK dispatcher runs: the exact row, the
+    # row of the padded M, else its heuristic
+    predict = lambda tile_m, tile_n, tile_k: tile_m
+    assert tuned_lookup.ck_padded_m(100) == 128 and tuned_lookup.ck_padded_m(3) == 16
+    assert tuned_lookup.ck_padded_m(1) == 1 and tuned_lookup.ck_padded_m(20000) == 20480
+    lookup = lambda M: tuned_lookup.lookup_tuned(csv_path, ['M', 'N', 'K'], (M, 1280, 8192))
+    assert tuned_lookup.ck_splitK(lookup(128), 128, predict) == 2
+    assert tuned_lookup.ck_splitK(lookup(100), 100, predict) == 64
+    # the nearest row is not the padded one, the dispatcher runs another kernel
+    assert lookup(17)['M'] == 128 and tuned_lookup.ck_splitK(lookup(17), 17, predict) == 0
+    assert tuned_lookup.ck_splitK(dict(lookup(128), M=100, predicted=True), 100, predict) == 0
+    assert tuned_lookup.ck_splitK(None, 100, predict) == 0
+
+
+if __name__ == '__main__':
+    for test in [test_lookup, test_recompile, test_shipped_configs, test_nearest]:
+        with tempfile.TemporaryDirectory() as tmp_path:
+            test(tmp_path)
+    print('config index tests passed')
@@ -0,0 +1,77 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# the CK GEMM cost model, trained and checked on the tuned csv files, no GPU needed
+import sys
+import tempfile
+import pytest
+import numpy as np
+from aiter.tuning.cost_model import load_training_data, evaluate, fit, get_cost_model, \
+    CostModel, parse_kernel, MODEL_PATH
+from aiter.configs import tuned_lookup
+from aiter.jit.core import AITER_CSRC_DIR
+
+CK_CSV = '''M,N,K,kernelId,splitK,us,kernelName
+128,1280,8192,30,0,22.4841,a8w8_rowwise_256x32x64x512_16x16_1x2_32x8x1_32x8x1_1x32x1x8_8x8x1_1x2_intrawave_v3
+'''
+
+
+def test_holdout():
+    data = load_training_data()
+    errors, positions = evaluate(data)
+    median = np.median(errors)
+    top3 = np.mean([el[0] < 3 for el in positions])
+    print(f'[perf] cost model on unseen (N, K): median error {median * 100:.1f}%, tuned kernel in top 3 {top3 * 100:.1f}%')
+    assert median < 0.2
+    assert top3 > 0.75
+
+
+def test_save_load(tmp_path):
+    model = fit(load_training_data())
+    path = f'{tmp_path}/model.json'
+    model.save(path)
+    loaded = CostModel.from_dict(get_cost_model(path).to_dict())
+    rows = [(1, 1, 1280, 8192, name, 0) for name in model.kernels['a8w8_tuned_gemm.csv']]
+    assert np.allclose(model.predict_us('a8w8_tuned_gemm.csv', rows),
+                       loaded.predict_us('a8w8_tuned_gemm.csv', rows))
+    # the shipped model is there and knows every family
+    assert len(get_cost_model(MODEL_PATH).kernels) == 4
+
+
+def test_lookup_fallback(tmp_path, monkeypatch):
+    monkeypatch.setenv('AITER_CONFIG_INDEX_DIR', f'{tmp_path}/idx')
+    csv_path = f'{tmp_path}/a8w8_tuned_gemm.csv'
+    with open(csv_path, 'w') as f:
+        f.write(CK_CSV)
+    # same (N, K): nearest tuned M, no prediction
+    assert 'predicted' not in tuned_lookup.lookup_tuned(csv_path, ['M', 'N', 'K'], (64, 1280, 8192))
+    # unseen (N, K): the CK heuristic unless the prediction is asked for
+    assert tuned_lookup.lookup_tuned(csv_path, ['M', 'N', 'K'], (64, 4096, 2048)) is None
+    monkeypatch.setattr(tuned_lookup, 'AITER_GEMM_COST_MODEL', '1')
+    # and the tune module that runs the kernel is built
+    monkeypatch.setattr(tuned_lookup, '_tune_module_built', lambda md_name: False)
+    assert tuned_lookup.lookup_tuned(csv_path, ['M', 'N', 'K'], (64, 4096, 3072)) is None
+    monkeypatch.setattr(tuned_lookup, '_tune_module_built', lambda md_name: md_name == 'module_gemm_a8w8_tune')
+    # the kernel the model expects fastest, with the id the tune module runs it by
+    config = tuned_lookup.lookup_tuned(csv_path, ['M', 'N', 'K'], (64, 4096, 4096))
+    assert config['predicted'] and config['M'] == 64
+    assert parse_kernel(config['kernelName'])[1:4] == (config['tile_m'], config['tile_n'], config['tile_k'])
+    sys.path.insert(0, f'{AITER_CSRC_DIR}/ck_gemm_a8w8')
+    try:
+        from gemm_a8w8_common import kernels_list
+    finally:
+        sys.path.pop(0)
+    assert kernels_list[config['kernelId']].name == config['kernelName']
+
+
+if __name__ == '__main__':
+    test_holdout()
+    with tempfile.TemporaryDirectory() as tmp_path:
+        test_save_load(tmp_path)
+    with tempfile.TemporaryDirectory() as tmp_path:
+        monkeypatch = pytest.MonkeyPatch()
+        try:
+            test_lookup_fallback(tmp_path, monkeypatch)
+        finally:
+            monkeypatch.undo()
+    print('cost model tests passed')
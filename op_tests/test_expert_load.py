@@ -0,0 +1,126 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# the expert load counters and the placement planner on synthetic routing
+# traces, cpu tensors, no GPU needed
+import random
+import pytest
+import torch
+from aiter.fused_moe_core import select_experts
+from aiter.dist.expert_parallel import ExpertPlacement
+from aiter.dist.expert_load import ExpertLoad, plan_placement, rank_load, imbalance
+
+
+def trace(E, tokens, topk, skew=1.2, seed=0):
+    '''topk_ids of a zipf skewed routing, expert 0 the hottest'''
+    g = torch.Generator().manual_seed(seed)
+    p = 1.0 / torch.arange(1, E + 1, dtype=torch.float64) ** skew
+    return torch.multinomial(p.expand(tokens, E), topk, generator=g).to(torch.int32)
+
+
+def test_record_and_snapshots():
+    E = 8
+    load = ExpertLoad(E, device='cpu', snapshot_every=3, history=2)
+    batches = [trace(E, 20 + i, 2, seed=i) for i in range(7)]
+    for el in batches:
+        load.record(el)
+    # windows of 3 records, the oldest dropped
+    assert len(load.snapshots) == 2
+    window = lambda lo, hi: torch.bincount(torch.cat(batches[lo:hi]).view(-1).long(), minlength=E)
+    assert torch.equal(load.snapshots[0], window(0, 3)) and torch.equal(load.snapshots[1], window(3, 6))
+    # the last record waits on the device
+    assert torch.equal(load.counts, window(6, 7))
+    assert torch.equal(load.load(), (window(0, 3) + window(3, 6)).double())
+    assert torch.allclose(load.load(decay=0.5), 0.5 * window(0, 3) + window(3, 6).double())
+    assert torch.equal(load.snapshot(), window(6, 7)) and not load.counts.any()
+
+
+def test_select_experts():
+    E = 8
+    load = ExpertLoad(E, device='cpu')
+    gating = torch.randn(32, E)
+    _, topk_ids = select_experts(torch.empty(32, 1), gating, 2, True, expert_load=load)
+    _, grouped_ids = select_experts(torch.empty(32, 1), gating, 2, True, use_grouped_topk=True,
+                                    num_expert_group=4, topk_group=2, expert_load=load)
+    ids = torch.cat([topk_ids, grouped_ids]).view(-1).long()
+    assert torch.equal(load.counts, torch.bincount(ids, minlength=E)) and load.calls == 2
+
+
+def test_plan_balances():
+    E, world_size = 16, 4
+    load = ExpertLoad(E, device='cpu', snapshot_every=1)
+    for seed in range(10):
+        load.record(trace(E, 256, 2, seed=seed))
+    pairs = load.load()
+    contiguous = imbalance(rank_load(ExpertPlacement.contiguous(E, world_size), pairs))
+    plain = plan_placement(pairs, world_size)
+    plan = plan_placement(pairs, world_size, redundant=world_size)
+    assert plan.imbalance < plain.imbalance < contiguous
+    assert plan.imbalance < 1.1
+    # the copies go to the hottest experts
+    assert plan.replicas[0] == max(plan.replicas) > 1 and sum(plan.replicas) == E + world_size
+    assert abs(sum(plan.rank_load) - float(pairs.sum())) < 1e-6
+    assert 'imbalance' in str(plan)
+
+
+def test_plan_constraints():
+    # random loads, ranks and copies: equal slots, one copy of an expert per
+    # rank, every expert placed
+    rng = random.Random(0)
+    for _ in range(300):
+        world_size = rng.randint(1, 6)
+        E = world_size * rng.randint(1, 4) + rng.randint(0, world_size - 1)
+        redundant = (-E) % world_size + world_size * rng.randint(0, 2)
+        redundant = min(redundant, E * (world_size - 1) - (E * (world_size - 1) - redundant) % world_size)
+        load = [rng.choice([0, 1, rng.random() * 100, 1e4]) for _ in range(E)]
+        plan = plan_placement(load, world_size, redundant)
+        experts = plan.placement.experts
+        assert len({len(el) for el in experts}) == 1
+        assert all(len(set(el)) == len(el) for el in experts)
+        assert [sum(e in el for el in experts) for e in range(E)] == plan.replicas
+    with pytest.raises(ValueError, match='do not split'):
+        plan_placement([1] * 5, 2)
+    with pytest.raises(ValueError, match='one per rank'):
+        plan_placement([1] * 2, 2, redundant=4)
+
+
+def test_replicas_split_evenly():
+    # the hot expert is always top-1: its pairs sit in one column of the flat topk_ids
+    placement = ExpertPlacement.from_experts([[0, 1, 2], [0, 3, 4], [0, 5, 6]])
+    topk_ids = torch.stack([torch.zeros(1000, dtype=torch.long), torch.randint(1, 7, (1000,))], 1)
+    for offset in range(3):
+        slots = placement.slots(topk_ids.view(-1), offset)
+        copies = torch.bincount(slots[topk_ids.view(-1) == 0], minlength=placement.num_slots)
+        assert sorted(copies[[0, 3, 6]].tolist()) == [333, 333, 334]
+        # the first pair goes to the copy of the offset
+        assert slots[0] == placement.replica_slots[0, offset]
+    # as planned: every rank gets its share of the expert
+    plan = plan_placement([1000, 10, 10, 10, 10, 10], 2, redundant=2)
+    assert plan.replicas[0] == 2
+    slots = plan.placement.slots(torch.stack([torch.zeros(1000, dtype=torch.long),
+                                              torch.randint(1, 6, (1000,))], 1).view(-1))
+    ranks = plan.placement.slot_rank[slots]
+    assert torch.bincount(ranks[::2]).tolist() == [500, 500]
+
+
+def test_expert_mask():
+    placement = ExpertPlacement.contiguous(8, 4)
+    assert placement.expert_mask(1).tolist() == [0, 0, 1, 1, 0, 0, 0, 0]
+    replicated = ExpertPlacement.from_experts([[0, 1], [0, 2]])
+    assert replicated.num_replicas.tolist() == [2, 1, 1]
+    # the pairs of expert 0 alternate between its copies
+    assert replicated.slots(torch.tensor([0, 0, 0, 1, 2])).tolist() == [0, 2, 0, 1, 3]
+    with pytest.raises(ValueError, match='no expert_mask'):
+        replicated.expert_mask(0)
+    with pytest.raises(ValueError, match='no rank for experts'):
+        ExpertPlacement.from_experts([[0], [2]])
+
+
+if __name__ == '__main__':
+    test_record_and_snapshots()
+    test_select_experts()
+    test_plan_balances()
+    test_plan_constraints()
+    test_replicas_split_evenly()
+    test_expert_mask()
+    print('expert load tests passed')
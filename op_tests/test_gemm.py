@@ -63,8 +63,43 @@ def test_gemm(dtype, m, n, k, bias=False, otype=None, scaleA=None, scaleB=None):
     checkAllclose(a, b, msg=msg)
 
 
+def test_prepared(dtype, m, n, k, bias=False, otype=None, reuse_output=False):
+    '''tgemm.prepare of a layer against tgemm.mm, for every M of a decode loop'''
+    weight = torch.randn(n, k, dtype=dtype, device='cuda')
+    bias = torch.randn(n, dtype=dtype, device='cuda') if bias else None
+    prepared = tgemm.prepare(weight, bias, otype, reuse_output=reuse_output)
+    x = torch.randn(m, k, dtype=dtype, device='cuda')
+
+    # perftest copies its arguments, the prepared layer is not one of them
+    @perftest()
+    def run_gemm_prepared(x):
+        return prepared(x)
+    a, avg_a = run_gemm_b(x, weight, bias, otype)
+    b, avg_b = run_gemm_prepared(x)
+    msg = f"[perf] dim: {str((m, n, k)):<20} dtype: {dtype}, mm avg: {avg_a:<8.2f} us, prepared avg: {avg_b:<8.2f} us, uplift: {avg_a/avg_b-1:<5.1%}"
+    checkAllclose(a, b, msg=msg)
+    # (batch, seq, k) input of the same M
+    checkAllclose(a.view(1, m, n), prepared(x.view(1, m, k)), msg='3d input')
+
+
+def test_prepared_scaled(m, n, k, otype=torch.bfloat16):
+    '''a prepared fp8 layer given scale_a per call takes the solution mm takes'''
+    weight = torch.rand(n, k, dtype=otype, device='cuda').to(torch.float8_e4m3fnuz)
+    x = torch.randn(m, k, dtype=otype, device='cuda').to(torch.float8_e4m3fnuz)
+    scale = torch.tensor(0.5, dtype=torch.float, device='cuda')
+    prepared = tgemm.prepare(weight, otype=otype)
+    checkAllclose(tgemm.mm(x, weight, None, otype, scale), prepared(x, scale), msg='scale_a')
+    checkAllclose(tgemm.mm(x, weight, None, otype), prepared(x), msg='no scale_a')
+    assert len(prepared._plans) == 2
+
+
 test_gemm(torch.float8_e4m3fnuz, 128, 768, 4096, bias=False, otype=torch.bfloat16, scaleA=0.5, scaleB=0.5)
 test_gemm(torch.bfloat16, 128, 32, 8192)
+for m in [1, 4, 32, 128]:
+    test_prepared(torch.float16, m, 1280, 8192, bias=True)
+    test_prepared(torch.bfloat16, m, 8192, 1024)
+test_prepared(torch.float16, 1, 1280, 8192, reuse_output=True)
+test_prepared_scaled(128, 768, 4096)
 # for dtype in [torch.float16, torch.bfloat16]:
 #     # # qkv_proj
 #     # for (m, n, k) in [(4096, 1280, 8192),
@@ -0,0 +1,122 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# the GEMM benchmark harness on the torch_cpu backend, no GPU needed
+import time
+import tempfile
+from aiter.benchmark.gemm import load_spec, run_suite, register_backend, BACKENDS, \
+    TorchCPU, GemmCase, DEFAULT_SPEC, main
+from aiter.benchmark.history import History
+from aiter.benchmark.roofline import Roofline, get_roofline
+
+SPEC_YAML = '''suite: tiny
+groups:
+  - dtype: fp32
+    M: [1, 16]
+    NK: [[64, 128]]
+  - dtype: i8
+    M: [8]
+    N: [32, 64]
+    K: [64]
+    backends: [torch_cpu]
+'''
+
+SPEC_CSV = '''M,N,K,dtype,backends
+1,64,128,bf16,torch_cpu
+1,64,128,bf16,torch_cpu
+'''
+
+ROOF = Roofline('cpu', {'fp32': 1.0, 'bf16': 1.0, 'i8': 1.0}, 100.0)
+
+
+class SlowCPU(TorchCPU):
+    '''torch_cpu with a fixed delay, a regression of every case'''
+    name = 'slow_cpu'
+    delay = 0.0
+
+    def prepare(self, case):
+        run = super().prepare(case)
+
+        def slow():
+            time.sleep(self.delay)
+            return run()
+        return slow
+
+
+def test_spec(tmp_path):
+    with open(f'{tmp_path}/tiny.yaml', 'w') as f:
+        f.write(SPEC_YAML)
+    suite, cases = load_spec(f'{tmp_path}/tiny.yaml')
+    assert suite == 'tiny' and len(cases) == 4
+    assert GemmCase(8, 64, 64, 'i8', 'bf16', ('torch_cpu',)) in cases
+    with open(f'{tmp_path}/tiny.csv', 'w') as f:
+        f.write(SPEC_CSV)
+    assert load_spec(f'{tmp_path}/tiny.csv') == ('tiny', [GemmCase(1, 64, 128, 'bf16', 'bf16', ('torch_cpu',))])
+    # the shipped spec parses and only names known backends
+    _, cases = load_spec(DEFAULT_SPEC)
+    assert cases and all(b in BACKENDS for el in cases for b in el.backends)
+
+
+def test_roofline():
+    # 2 * 1000^3 flops at 1 TFLOPs: 2000 us, compute bound
+    us, bound = ROOF.min_us(1000, 1000, 1000, 'fp32', 'fp32')
+    assert abs(us - 2000) < 1e-6 and bound == 'compute'
+    # 1 x 1000 x 1000 moves ~4 MB, 40 us at 100 GB/s
+    us, bound = ROOF.min_us(1, 1000, 1000, 'fp32', 'fp32')
+    assert bound == 'memory' and abs(us - 40.08) < 1e-6
+    report = ROOF.report(1000, 1000, 1000, 'fp32', 'fp32', 4000)
+    assert abs(report['tflops'] - 0.5) < 1e-9 and abs(report['efficiency'] - 0.5) < 1e-9
+
+
+def test_suite(tmp_path):
+    with open(f'{tmp_path}/tiny.yaml', 'w') as f:
+        f.write(SPEC_YAML)
+    _, cases = load_spec(f'{tmp_path}/tiny.yaml')
+    results = run_suite(cases, device='cpu', iters=3, warmup=1, roofline=ROOF)
+    assert len(results) == 4 and {el['backend'] for el in results} == {'torch_cpu'}
+    assert all(el['us'] > 0 and el['tflops'] > 0 and el['efficiency'] > 0 for el in results)
+    # the gpu backends are never picked on the cpu
+    assert not run_suite(cases, ['hipb_mm', 'ck_a8w8'], device='cpu', roofline=ROOF)
+
+
+def test_regression(tmp_path):
+    register_backend(SlowCPU)
+    try:
+        cases = [GemmCase(4, 32, 32, 'fp32', 'fp32')]
+        history = History(f'{tmp_path}/bench.db')
+        base = history.add_run('tiny', 'cpu', run_suite(cases, ['slow_cpu'], 'cpu', 3, 1, ROOF))
+        SlowCPU.delay = 0.01
+        run = history.add_run('tiny', 'cpu', run_suite(cases, ['slow_cpu'], 'cpu', 3, 1, ROOF))
+        regressions, improvements = history.compare(run, threshold=0.05)
+        assert history.previous_run(run) == base and not improvements
+        assert [(el.backend, el.M) for el in regressions] == [('slow_cpu', 4)] and regressions[0].ratio > 2
+        # another device has its own history
+        other = history.add_run('tiny', 'gfx942', history.results(run))
+        assert history.previous_run(other) is None and history.compare(other) == ([], [])
+        SlowCPU.delay = 0.0
+        fast = history.add_run('tiny', 'cpu', run_suite(cases, ['slow_cpu'], 'cpu', 3, 1, ROOF))
+        regressions, improvements = history.compare(fast)
+        assert not regressions and len(improvements) == 1
+        history.close()
+    finally:
+        SlowCPU.delay = 0.0
+        del BACKENDS['slow_cpu']
+
+
+def test_main(tmp_path):
+    with open(f'{tmp_path}/tiny.yaml', 'w') as f:
+        f.write(SPEC_YAML)
+    get_roofline.cache_clear()
+    args = ['--spec', f'{tmp_path}/tiny.yaml', '--device', 'cpu', '--db', f'{tmp_path}/bench.db',
+            '--iters', '2', '--warmup', '1']
+    assert main(args) == 0
+    assert main(args + ['--threshold', '1000', '--fail_on_regression']) == 0
+    assert [el['suite'] for el in History(f'{tmp_path}/bench.db').runs()] == ['tiny', 'tiny']
+
+
+if __name__ == '__main__':
+    test_roofline()
+    for test in [test_spec, test_suite, test_regression, test_main]:
+        with tempfile.TemporaryDirectory() as tmp_path:
+            test(tmp_path)
+    print('gemm benchmark tests passed')
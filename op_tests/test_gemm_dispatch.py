@@ -0,0 +1,148 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# aiter.gemm dispatch: the merged tuning database, capability checks, the
+# trace and the fall through, on cpu tensors where only the torch backends run
+import tempfile
+import torch
+import torch.nn.functional as F
+import aiter
+from aiter.configs.gemm_db import GemmDB
+from aiter.ops import gemm_dispatch
+from aiter.ops.gemm_dispatch import make_problem, decide, register_gemm_backend, GEMM_BACKENDS
+
+CK_CSV = '''M,N,K,kernelId,splitK,us,kernelName
+128,1280,8192,30,0,22.4841,a8w8_rowwise_256x32x64x512_16x16_1x2_32x8x1_32x8x1_1x32x1x8_8x8x1_1x2_intrawave_v3
+256,1280,8192,30,0,30.5,a8w8_rowwise_256x32x64x512_16x16_1x2_32x8x1_32x8x1_1x32x1x8_8x8x1_1x2_intrawave_v3
+'''
+
+ASM_CSV = '''M,N,K,bias,outdtype,splitK,us
+128,1280,8192,True,torch.bfloat16,3,13.85
+256,1280,8192,True,torch.bfloat16,3,40.1
+'''
+
+DENSE_CSV = '''M,N,K,bias,dtype,outdtype,scaleAB,libtype,solidx,soltimes,kernelName
+128,1280,8192,False,torch.bfloat16,torch.bfloat16,False,hipblaslt,12345,10.5,Cijk_Alik_Bljk_BBS_BH
+256,1280,8192,False,torch.bfloat16,torch.bfloat16,False,rocblas,678,20.5,
+'''
+
+
+def write_configs(tmp_path):
+    for name, text in [('a8w8_tuned_gemm.csv', CK_CSV), ('asm_a8w8_gemm.csv', ASM_CSV),
+                       ('tuned_gemm.csv', DENSE_CSV)]:
+        with open(f'{tmp_path}/{name}', 'w') as f:
+            f.write(text)
+    return GemmDB(str(tmp_path))
+
+
+def test_gemm_db(tmp_path):
+    db = write_configs(tmp_path)
+    shape = {'M': 128, 'N': 1280, 'K': 8192, 'bias': True, 'outdtype': 'torch.bfloat16'}
+    assert [(el.backend, el.us, el.exact) for el in db.lookup('a8w8', shape)] == \
+        [('asm', 13.85, True), ('ck', 22.4841, True)]
+    # untuned M: the nearest tuned M of each csv
+    entries = db.lookup('a8w8', dict(shape, M=200))
+    assert [(el.backend, el.config['M'], el.exact) for el in entries] == [('ck', 256, False), ('asm', 256, False)]
+    assert db.lookup('blockscale', shape) == []
+    # a hipblaslt/rocblas solidx only holds for its exact shape
+    dense = {'M': 128, 'N': 1280, 'K': 8192, 'bias': False, 'dtype': 'torch.bfloat16',
+             'outdtype': 'torch.bfloat16'}
+    assert [(el.backend, el.config['solidx']) for el in db.lookup('dense', dense)] == [('hipblaslt', 12345)]
+    assert db.lookup('dense', dict(dense, M=129)) == [] and db.lookup('dense', dict(dense, M=255)) == []
+    merged = db.merged('a8w8')
+    assert [el.backend for el in merged[('a8w8', (('M', 256), ('N', 1280), ('K', 8192)))]] == ['ck', 'asm']
+
+
+def test_cpu_gemm():
+    x, w = torch.randn(2, 3, 64), torch.randn(32, 64)
+    out = aiter.gemm(x, w)
+    assert out.shape == (2, 3, 32) and torch.allclose(out, F.linear(x, w), atol=1e-5)
+    trace = aiter.gemm_trace(x, w)
+    assert 'hipblaslt  not capable: needs cuda tensors' in trace and '-> torch' in trace
+
+    xq = torch.randint(-20, 20, (8, 64), dtype=torch.int8)
+    wq = torch.randint(-20, 20, (32, 64), dtype=torch.int8)
+    x_scale, w_scale = torch.rand(8, 1), torch.rand(1, 32)
+    out = aiter.gemm(xq, wq, x_scale, w_scale, out_dtype=torch.float32)
+    ref = (xq.float() @ wq.float().t()) * x_scale * w_scale
+    assert torch.allclose(out, ref, rtol=1e-5)
+    assert make_problem(xq, wq, x_scale, w_scale).out_dtype == torch.bfloat16
+
+    # fp8 blockscale, scales of 1x128 and 128x128 blocks
+    xf = (torch.rand(4, 256) / 10).to(torch.float8_e4m3fnuz)
+    wf = (torch.rand(256, 256) / 10).to(torch.float8_e4m3fnuz)
+    xs, ws = torch.rand(4, 2), torch.rand(2, 2)
+    out = aiter.gemm(xf, wf, xs, ws, out_dtype=torch.float32)
+    ref = torch.zeros(4, 256)
+    for i in range(2):
+        for j in range(2):
+            blk = slice(i * 128, i * 128 + 128)
+            ref[:, blk] += (xf[:, j * 128:j * 128 + 128].float() * xs[:, j:j + 1]) @ \
+                (wf[blk, j * 128:j * 128 + 128].float() * ws[i, j]).t()
+    assert torch.allclose(out, ref, rtol=1e-4, atol=1e-5)
+    assert make_problem(xf, wf, torch.ones(1), torch.ones(1)).kind == 'fp8'
+
+    xb, wb = torch.randn(3, 4, 16, dtype=torch.bfloat16), torch.randn(3, 8, 16, dtype=torch.bfloat16)
+    assert aiter.gemm(xb, wb).shape == (3, 4, 8)
+    for args in [(xq, wq), (x.view(6, 64), w, x_scale, w_scale)]:
+        try:
+            aiter.gemm(*args)
+            assert False
+        except ValueError:
+            pass
+
+
+def test_tuned_competition(tmp_path):
+    db = write_configs(tmp_path)
+    saved = list(GEMM_BACKENDS['a8w8'])
+    try:
+        # cpu stand-ins under the names of the tuned backends
+        for name in ['asm', 'ck']:
+            register_gemm_backend('a8w8', name, lambda p: None)(lambda p, *args: None)
+        xq, wq = torch.zeros(128, 8192, dtype=torch.int8), torch.zeros(1280, 8192, dtype=torch.int8)
+        bias = torch.zeros(1, 1280)
+        problem = make_problem(xq, wq, torch.ones(128, 1), torch.ones(1, 1280), bias)
+        decision = decide(problem, db)
+        assert [el.name for el in decision.order] == ['asm', 'ck', 'torch']
+        assert '-> asm: fastest tuned over ck 22.4841us' in str(decision)
+        # without a bias the asm table has no row, ck is the only tuned one
+        decision = decide(make_problem(xq, wq, torch.ones(128, 1), torch.ones(1, 1280)), db)
+        assert [el.name for el in decision.order] == ['ck', 'asm', 'torch']
+        # at M=256 ck was faster
+        problem = make_problem(xq[:1].expand(256, -1), wq, torch.ones(256, 1), torch.ones(1, 1280), bias)
+        assert decide(problem, db).order[0].name == 'ck'
+    finally:
+        GEMM_BACKENDS['a8w8'] = saved
+        gemm_dispatch._decisions.clear()
+
+
+def test_fall_through():
+    saved = list(GEMM_BACKENDS['dense'])
+    calls = []
+    try:
+        @register_gemm_backend('dense', 'flaky', lambda p: None, first=True)
+        def run_flaky(p, entry, x, *args):
+            calls.append(p.M)
+            return None
+        x, w = torch.randn(4, 16), torch.randn(8, 16)
+        before = gemm_dispatch.get_decision(make_problem(x, w))
+        assert torch.allclose(aiter.gemm(x, w), F.linear(x, w))
+        assert 'flaky could not run it, falls through to torch' in aiter.gemm_trace(x, w)
+        # dropped for this problem from then on, in a new decision
+        decision = gemm_dispatch.get_decision(make_problem(x, w))
+        assert [el.name for el in decision.order] == ['torch']
+        assert [el.name for el in before.order] == ['flaky', 'torch']
+        aiter.gemm(x, w)
+        assert calls == [4]
+    finally:
+        GEMM_BACKENDS['dense'] = saved
+        gemm_dispatch._decisions.clear()
+
+
+if __name__ == '__main__':
+    test_cpu_gemm()
+    test_fall_through()
+    for test in [test_gemm_db, test_tuned_competition]:
+        with tempfile.TemporaryDirectory() as tmp_path:
+            test(tmp_path)
+    print('gemm dispatch tests passed')
@@ -0,0 +1,108 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# grouped gemm bucketing and planning, run by the torch reference executor
+# on cpu, no GPU needed
+import torch
+import torch.nn.functional as F
+import aiter
+from aiter.ops.grouped_gemm import plan_grouped_gemm, torch_grouped_executor, stack_grouped_weights, GroupedBucket
+
+
+def partitions(items):
+    if not items:
+        yield []
+        return
+    first, rest = items[0], items[1:]
+    for part in partitions(rest):
+        for i in range(len(part)):
+            yield part[:i] + [[first] + part[i]] + part[i + 1:]
+        yield [[first]] + part
+
+
+def cost(groups, Ms, N, K, launch_flops):
+    return sum(2 * len(el) * max(Ms[i] for i in el) * N * K + launch_flops for el in groups)
+
+
+def test_plan():
+    # the dynamic program over sorted M matches every partition of the set
+    N, K = 256, 512
+    for Ms in [[1, 2, 3, 64, 70, 128], [5, 5, 300, 7, 1024, 900], [16] * 5]:
+        for launch_flops in [0, 1 << 20, 1 << 24, 1 << 40]:
+            plan = plan_grouped_gemm([(M, N, K) for M in Ms], launch_flops)
+            best = min(cost(el, Ms, N, K, launch_flops) for el in partitions(list(range(len(Ms)))))
+            assert plan.flops + launch_flops * len(plan.buckets) == best
+    # free launches: nothing padded, a launch per distinct M
+    plan = plan_grouped_gemm([(M, N, K) for M in [8, 8, 32, 32, 32]], 0)
+    assert plan.padding == 0 and [el.B for el in plan.buckets] == [2, 3]
+    # costly launches: one bucket per (N, K)
+    plan = plan_grouped_gemm([(3, N, K), (40, N, K), (5, 128, K), (7, 128, K)], 1 << 40)
+    assert plan.buckets == [GroupedBucket(40, N, K, (0, 1), (3, 40)), GroupedBucket(7, 128, K, (2, 3), (5, 7))]
+    assert abs(plan.padding - (1 - (43 * N + 12 * 128) / (80 * N + 14 * 128))) < 1e-12
+    plan = plan_grouped_gemm([(M, N, K) for M in [1, 2, 3, 4, 5]], 1 << 40, m_align=16, max_batch=2)
+    assert [el.B for el in plan.buckets] == [1, 2, 2] and {el.M for el in plan.buckets} == {16}
+    assert '3 launches' in str(plan)
+
+
+def test_grouped_gemm():
+    torch.manual_seed(0)
+    shapes = [(3, 64, 32), (17, 64, 32), (16, 64, 32), (1, 48, 32), (9, 48, 96)]
+    xs = [torch.randn(M, K) for M, N, K in shapes]
+    ws = [torch.randn(N, K) for M, N, K in shapes]
+    for launch_flops in [0, 1 << 40]:
+        outs = aiter.grouped_gemm(xs, ws, executor=torch_grouped_executor, launch_flops=launch_flops)
+        for x, w, y in zip(xs, ws, outs):
+            assert torch.allclose(y, F.linear(x, w), atol=1e-5)
+
+    # int8 rowwise, through aiter.gemm and its batched torch backend on cpu
+    xq = [torch.randint(-20, 20, (M, K), dtype=torch.int8) for M, N, K in shapes]
+    wq = [torch.randint(-20, 20, (N, K), dtype=torch.int8) for M, N, K in shapes]
+    x_scales = [torch.rand(M, 1) for M, N, K in shapes]
+    w_scales = [torch.rand(1, N) for M, N, K in shapes]
+    outs = aiter.grouped_gemm(xq, wq, x_scales, w_scales, out_dtype=torch.float32, launch_flops=1 << 40)
+    for x, w, xs_, ws_, y in zip(xq, wq, x_scales, w_scales, outs):
+        assert torch.allclose(y, (x.float() @ w.float().t()) * xs_ * ws_, rtol=1e-5)
+
+    xb, wb = [el.to(torch.bfloat16) for el in xs], [el.to(torch.bfloat16) for el in ws]
+    outs = aiter.grouped_gemm(xb, wb, plan=plan_grouped_gemm([tuple(el) for el in shapes], 1 << 40))
+    assert [tuple(el.shape) for el in outs] == [(M, N) for M, N, K in shapes] and outs[0].dtype == torch.bfloat16
+    for args in [(xs[:2], ws[:1]), (xs[:1], [ws[4]]), (xq, wq, x_scales)]:
+        try:
+            aiter.grouped_gemm(*args)
+            assert False
+        except ValueError:
+            pass
+
+
+def test_stacked():
+    # a plan and its weights reused across calls, the weights stacked once
+    torch.manual_seed(0)
+    shapes = [(3, 64, 32), (17, 64, 32), (16, 64, 32), (9, 48, 96)]
+    wq = [torch.randint(-20, 20, (N, K), dtype=torch.int8) for M, N, K in shapes]
+    w_scales = [torch.rand(1, N) for M, N, K in shapes]
+    plan = plan_grouped_gemm(shapes, 1 << 40)
+    stacked = stack_grouped_weights(plan, wq, w_scales)
+    assert [tuple(w.shape) for w, _ in stacked] == [(3, 64, 32), (1, 48, 96)]
+    for step in range(2):
+        xq = [torch.randint(-20, 20, (M, K), dtype=torch.int8) for M, N, K in shapes]
+        x_scales = [torch.rand(M, 1) for M, N, K in shapes]
+        outs = aiter.grouped_gemm(xq, wq, x_scales, w_scales, out_dtype=torch.float32, plan=plan,
+                                  stacked=stacked, executor=torch_grouped_executor)
+        ref = aiter.grouped_gemm(xq, wq, x_scales, w_scales, out_dtype=torch.float32, plan=plan,
+                                 executor=torch_grouped_executor)
+        for x, w, xs_, ws_, y, r in zip(xq, wq, x_scales, w_scales, outs, ref):
+            assert torch.equal(y, r)
+            assert torch.allclose(y, (x.float() @ w.float().t()) * xs_ * ws_, rtol=1e-5)
+    for kwargs in [dict(stacked=stacked), dict(plan=plan, stacked=stacked[:1]),
+                   dict(plan=plan, stacked=stack_grouped_weights(plan, wq))]:
+        try:
+            aiter.grouped_gemm(xq, wq, x_scales, w_scales, **kwargs)
+            assert False
+        except ValueError:
+            pass
+
+
+if __name__ == '__main__':
+    for test in [test_plan, test_grouped_gemm, test_stacked]:
+        test()
+    print('grouped gemm tests passed')
@@ -0,0 +1,45 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# startup benchmark: `import aiter` must stay within budget,
+# ops (and torch, jit, module builds) are only loaded on first use
+import os
+import sys
+import subprocess
+import statistics
+
+IMPORT_BUDGET_MS = float(os.environ.get('AITER_IMPORT_BUDGET_MS', 300))
+NUM_RUNS = int(os.environ.get('AITER_IMPORT_RUNS', 5))
+
+CHECK = '''
+import sys, time
+t = time.perf_counter()
+import aiter
+t = (time.perf_counter() - t) * 1000
+heavy = [md for md in ['torch', 'triton', 'pandas', 'aiter.jit.core'] if md in sys.modules]
+print(t, ','.join(heavy))
+'''
+
+
+def measure_import():
+    out = subprocess.run([sys.executable, '-c', CHECK],
+                         stdout=subprocess.PIPE,
+                         check=True,
+                         text=True).stdout.split()
+    return float(out[0]), out[1:]
+
+
+def test_import_time():
+    times = []
+    for _ in range(NUM_RUNS):
+        t, heavy = measure_import()
+        assert not heavy, f'import aiter pulls in {heavy}'
+        times.append(t)
+    median = statistics.median(times)
+    print(f'[perf] import aiter: median {median:.2f} ms, max {max(times):.2f} ms, budget {IMPORT_BUDGET_MS} ms')
+    assert median < IMPORT_BUDGET_MS, \
+        f'import aiter took {median:.2f} ms, over the {IMPORT_BUDGET_MS} ms budget'
+
+
+if __name__ == '__main__':
+    test_import_time()
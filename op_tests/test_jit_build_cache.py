@@ -0,0 +1,103 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+import os
+import subprocess
+import tempfile
+import pytest
+from aiter.jit import core
+from aiter.jit.build_cache import BuildCache, BuildStore, get_build_digest, get_ck_revision
+
+
+def make_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+    return path
+
+
+def test_digest(tmp_path):
+    src = make_file(f'{tmp_path}/src/kernel.cu', 'kernel v1')
+    args = dict(md_name='module_test', srcs=[src], flags_cc=['-O3'], flags_hip=['--offload-arch=gfx942'],
+                blob_gen_cmd='', extra_include=[], extra_ldflags=None, hip_version='6.3', ck_revision='abc')
+    d0 = get_build_digest(**args)
+    assert d0 == get_build_digest(**args)
+    assert d0 != get_build_digest(**{**args, 'flags_hip': ['--offload-arch=gfx90a']})
+    assert d0 != get_build_digest(**{**args, 'ck_revision': 'abd'})
+    make_file(src, 'kernel v2')
+    assert d0 != get_build_digest(**args)
+
+
+def test_ck_revision(tmp_path):
+    ck = f'{tmp_path}/ck'
+    make_file(f'{ck}/include/ck.hpp', 'v1')
+    git = ['git', '-C', ck, '-c', 'user.name=aiter', '-c', 'user.email=aiter@localhost']
+    subprocess.run(git + ['init', '-q'], check=True)
+    subprocess.run(git + ['add', '.'], check=True)
+    subprocess.run(git + ['commit', '-qm', 'v1'], check=True)
+    revision = lambda: get_ck_revision.__wrapped__(ck)
+    clean = revision()
+    assert len(clean) == 40
+    # every local edit of the checkout is a different revision
+    make_file(f'{ck}/include/ck.hpp', 'v2')
+    v2 = revision()
+    make_file(f'{ck}/include/ck.hpp', 'v3')
+    v3 = revision()
+    make_file(f'{ck}/include/new.hpp', 'new')
+    untracked = revision()
+    assert len({clean, v2, v3, untracked}) == 4 and v2.startswith(clean)
+    make_file(f'{ck}/include/new.hpp', 'newer')
+    assert revision() != untracked
+
+
+def test_cache(tmp_path):
+    so = make_file(f'{tmp_path}/build/module_test.so', 'x' * 1024)
+    cache = BuildCache(f'{tmp_path}/local', f'{tmp_path}/shared')
+    assert cache.lookup('ab' * 32, 'module_test') is None
+    cache.publish('ab' * 32, 'module_test', so)
+    assert open(cache.local.lookup('ab' * 32, 'module_test')).read() == 'x' * 1024
+    assert cache.shared.lookup('ab' * 32, 'module_test') is not None
+
+    # another host only sees the shared store
+    other = BuildCache(f'{tmp_path}/local2', f'{tmp_path}/shared')
+    assert other.lookup('ab' * 32, 'module_test') is not None
+    assert other.local.lookup('ab' * 32, 'module_test') is not None
+
+
+def test_lru(tmp_path):
+    so = make_file(f'{tmp_path}/build/module_test.so', 'x' * 1024)
+    store = BuildStore(f'{tmp_path}/lru', max_bytes=4000)
+    for i, digest in enumerate(['aa' * 32, 'bb' * 32, 'cc' * 32]):
+        store.publish(digest, 'module_test', so)
+        os.utime(store.entry_dir(digest), (i, i))
+    store.lookup('aa' * 32, 'module_test')
+    store.publish('dd' * 32, 'module_test', so)
+    assert store.lookup('bb' * 32, 'module_test') is None
+    assert store.lookup('aa' * 32, 'module_test') is not None
+
+
+def test_up_to_date(tmp_path, monkeypatch):
+    # no build cache: a built .so is reused, a missing one is built
+    monkeypatch.setenv('AITER_JIT_CACHE', '0')
+    monkeypatch.setattr(core, 'get_user_jit_dir', lambda: str(tmp_path))
+    core.is_module_up_to_date.cache_clear()
+    # the list blob_gen_cmd of mha_varlen_fwd
+    key = core.build_args_key({'md_name': 'module_test_a', 'blob_gen_cmd': ['gen fwd', 'gen fwd_splitkv']})
+    assert key == core.build_args_key({'blob_gen_cmd': ['gen fwd', 'gen fwd_splitkv'], 'md_name': 'module_test_a'})
+    assert not core.is_module_up_to_date('module_test', 'module_test_a', key)
+    make_file(f'{tmp_path}/module_test_b.so', 'so')
+    assert core.is_module_up_to_date('module_test', 'module_test_b', key)
+    core.is_module_up_to_date.cache_clear()
+
+
+if __name__ == '__main__':
+    for test in [test_digest, test_ck_revision, test_cache, test_lru]:
+        with tempfile.TemporaryDirectory() as tmp_path:
+            test(tmp_path)
+    monkeypatch = pytest.MonkeyPatch()
+    try:
+        with tempfile.TemporaryDirectory() as tmp_path:
+            test_up_to_date(tmp_path, monkeypatch)
+    finally:
+        monkeypatch.undo()
+    print('jit build cache tests passed')
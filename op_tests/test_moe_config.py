@@ -0,0 +1,117 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# the tuned triton moe config tables and their tuner, on cpu tensors through
+# the triton interpreter, no GPU needed
+import os
+# run as a script the interpreter is set here, under pytest by conftest.py
+os.environ.setdefault('TRITON_INTERPRET', '1')
+import random
+import tempfile
+import pytest
+from aiter import fused_moe_core
+from aiter.configs import moe_config
+from aiter.configs.moe_config import MoeConfigKey, MoeConfigTable, write_moe_table, get_moe_table, \
+    list_moe_tables, lookup_moe_config, get_moe_coverage
+from aiter.tuning.moe_tune import tune_moe, moe_candidates, main
+from aiter.tuning.search import Exhaustive
+from triton.runtime.interpreter import InterpretedFunction
+
+# the tuner runs the kernels on cpu tensors, in a run where triton was
+# imported without TRITON_INTERPRET=1 they are compiled for the GPU
+needs_interpreter = pytest.mark.skipif(not isinstance(fused_moe_core.fused_moe_kernel.fn, InterpretedFunction),
+                                       reason='the moe kernels were decorated without TRITON_INTERPRET=1')
+
+CONFIG = {'BLOCK_SIZE_M': 16, 'BLOCK_SIZE_N': 32, 'BLOCK_SIZE_K': 32, 'GROUP_SIZE_M': 1}
+
+
+def test_bucket_lookup():
+    Ms = [1, 2, 4, 8, 16, 24, 32, 48, 64, 96, 128, 256, 512, 1024, 1536, 2048, 3072, 4096]
+    table = MoeConfigTable(MoeConfigKey(8, 128, 64, 2, 'bf16', 'gfx942'),
+                           {M: dict(CONFIG, BLOCK_SIZE_M=M, us=1.0) for M in Ms})
+    rng = random.Random(0)
+    for M in [0, 1, 3, 5, 6, 7, 20, 40, 100, 4095, 5000, 1 << 20] + [rng.randint(1, 8192) for _ in range(500)]:
+        # what the linear scan picked
+        nearest = min(Ms, key=lambda el: abs(el - M))
+        assert table.get(M)['BLOCK_SIZE_M'] == nearest
+    # the table hands out kernel parameters only
+    assert 'us' not in table.get(1) and table.us[0] == 1.0
+    assert table.gaps([1, 2, 3, 8000, 20000]) == [(20000, 4096)]
+
+
+def test_tables_and_coverage(tmp_path):
+    key = MoeConfigKey(4, 32, 64, 2, 'fp32', 'gfx942')
+    path = write_moe_table(key, {16: dict(CONFIG, us=3.5), 1: dict(CONFIG, BLOCK_SIZE_M=32)}, str(tmp_path))
+    assert os.path.basename(path) == 'E=4,N=32,K=64,topk=2,dtype=fp32,arch=gfx942.json'
+    assert get_moe_table(4, 32, 64, 2, 'fp32', 'gfx942', str(tmp_path)).Ms == [1, 16]
+    # another arch, dtype or topk has no table
+    assert get_moe_table(4, 32, 64, 2, 'fp32', 'gfx90a', str(tmp_path)) is None
+    assert get_moe_table(4, 32, 64, 1, 'fp32', 'gfx942', str(tmp_path)) is None
+    assert [el.key for el in list_moe_tables(str(tmp_path))] == [key]
+
+    # the engine looks up tables of the current arch in AITER_MOE_CONFIG_DIR
+    saved = moe_config.AITER_MOE_CONFIG_DIR, moe_config.AITER_MOE_ARCH
+    moe_config.AITER_MOE_CONFIG_DIR, moe_config.AITER_MOE_ARCH = str(tmp_path), 'gfx942'
+    moe_config.get_device_arch.cache_clear()
+    moe_config.get_moe_table.cache_clear()
+    try:
+        assert lookup_moe_config(4, 32, 64, 2, 'fp32', 100) == CONFIG
+        assert lookup_moe_config(4, 32, 64, 2, 'fp16', 100) is None
+        coverage = get_moe_coverage()
+        assert 'E=4,N=32,K=64,topk=2,dtype=fp16,arch=gfx942' in coverage['missing']
+        assert coverage['gaps']['E=4,N=32,K=64,topk=2,dtype=fp32,arch=gfx942'] == {100: 16}
+        assert fused_moe_core.try_get_optimal_moe_config((4, 64, 64), (4, 64, 32), 2, 'fp32', 2) \
+            == dict(CONFIG, BLOCK_SIZE_M=32)
+        # no table: the defaults
+        assert fused_moe_core.try_get_optimal_moe_config((4, 64, 64), (4, 64, 32), 2, 'fp16', 2)['BLOCK_SIZE_M'] == 16
+        # a table written after the miss is found
+        write_moe_table(MoeConfigKey(4, 32, 64, 2, 'fp16', 'gfx942'), {16: CONFIG}, str(tmp_path))
+        assert lookup_moe_config(4, 32, 64, 2, 'fp16', 100) == CONFIG
+        assert not get_moe_coverage()['missing']
+    finally:
+        moe_config.AITER_MOE_CONFIG_DIR, moe_config.AITER_MOE_ARCH = saved
+        moe_config.get_device_arch.cache_clear()
+        moe_config.get_moe_table.cache_clear()
+
+
+def test_candidates():
+    space = {'BLOCK_SIZE_M': [16, 32, 64, 128], 'BLOCK_SIZE_N': [32, 64], 'BLOCK_SIZE_K': [32, 128],
+             'GROUP_SIZE_M': [1, 8], 'num_warps': [4], 'num_stages': [2]}
+    cands = [dict(el) for el in moe_candidates(4, 8, 64, 64, 2, space)]
+    # 4 tokens x 2 on 8 experts: one row per expert, the smallest blocks only
+    assert {el['BLOCK_SIZE_M'] for el in cands} == {16}
+    assert {el['BLOCK_SIZE_K'] for el in cands} == {32} and {el['GROUP_SIZE_M'] for el in cands} == {1}
+    cands = [dict(el) for el in moe_candidates(512, 8, 64, 256, 2, space)]
+    assert {el['BLOCK_SIZE_M'] for el in cands} == {16, 32, 64, 128} and len(cands) == 32
+
+
+@needs_interpreter
+def test_tune(tmp_path):
+    space = {'BLOCK_SIZE_M': [16], 'BLOCK_SIZE_N': [32, 64], 'BLOCK_SIZE_K': [32], 'GROUP_SIZE_M': [1],
+             'num_warps': [4], 'num_stages': [2]}
+    configs = tune_moe(4, 32, 64, 2, 'fp32', [4, 16], search=Exhaustive(iters=2), device='cpu', space=space)
+    assert sorted(configs) == [4, 16]
+    assert all(el['BLOCK_SIZE_N'] in (32, 64) and el['us'] > 0 for el in configs.values())
+
+    # the driver writes the table the lookup reads, and keeps earlier M
+    from aiter.tuning import moe_tune
+    saved = moe_tune.MOE_SEARCH_SPACE
+    moe_tune.MOE_SEARCH_SPACE = space
+    try:
+        args = ['-E', '4', '-N', '32', '-K', '64', '--topk', '2', '--dtype', 'int8_w8a8', '--device', 'cpu',
+                '--arch', 'gfx942', '--search', 'halving', '-o', str(tmp_path)]
+        assert main(args + ['-M', '8']) == 0
+        assert main(args + ['-M', '2']) == 0
+    finally:
+        moe_tune.MOE_SEARCH_SPACE = saved
+    table = get_moe_table(4, 32, 64, 2, 'int8_w8a8', 'gfx942', str(tmp_path))
+    assert table.Ms == [2, 8] and table.get(3)['BLOCK_SIZE_M'] == 16
+
+
+if __name__ == '__main__':
+    test_bucket_lookup()
+    test_candidates()
+    for test in [test_tables_and_coverage, test_tune]:
+        with tempfile.TemporaryDirectory() as tmp:
+            test(tmp)
+    print('moe config tests passed')
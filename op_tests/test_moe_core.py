@@ -0,0 +1,145 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# the moe engine on cpu tensors through the triton interpreter, no GPU needed.
+# the interpreter has no bf16, so fp16 and fp32 only
+import os
+# run as a script the interpreter is set here, under pytest by conftest.py
+os.environ.setdefault('TRITON_INTERPRET', '1')
+import pytest
+import torch
+import torch.nn.functional as F
+from aiter import fused_moe_core
+from aiter.fused_moe_core import fused_experts, fused_moe, moe_align_block_size, fused_topk
+from triton.runtime.interpreter import InterpretedFunction
+
+# the kernels run on cpu tensors, in a run where triton was imported
+# without TRITON_INTERPRET=1 they are compiled for the GPU
+needs_interpreter = pytest.mark.skipif(not isinstance(fused_moe_core.fused_moe_kernel.fn, InterpretedFunction),
+                                       reason='the moe kernels were decorated without TRITON_INTERPRET=1')
+
+
+def torch_moe(x, w1, w2, topk_weights, topk_ids, activation, w1_scale=None, w2_scale=None):
+    '''reference, weights dequantized per channel when scaled'''
+    inter = w2.shape[2]
+    if w1_scale is not None:
+        w1 = w1.float() * w1_scale.view(w1.shape[0], -1, 1)
+        w2 = w2.float() * w2_scale.view(w2.shape[0], -1, 1)
+    act = {'silu': F.silu, 'gelu': F.gelu, 'gelu_tanh': lambda el: F.gelu(el, approximate='tanh')}[activation]
+    out = torch.zeros(x.shape, dtype=torch.float32)
+    for t in range(x.shape[0]):
+        for k in range(topk_ids.shape[1]):
+            e = topk_ids[t, k]
+            h = w1[e].float() @ x[t].float()
+            h = act(h[:inter]) * h[inter:] if h.shape[0] == 2 * inter else act(h)
+            out[t] += topk_weights[t, k] * (w2[e].float() @ h)
+    return out
+
+
+def routing(tokens, E, topk, seed=0):
+    torch.manual_seed(seed)
+    gating = torch.randn(tokens, E)
+    return fused_topk(torch.empty(tokens, 1), gating, topk, True)
+
+
+def rel_err(a, b):
+    return ((a.float() - b.float()).norm() / b.float().norm()).item()
+
+
+def test_moe_align_block_size():
+    torch.manual_seed(0)
+    E, block = 6, 4
+    topk_ids = torch.randint(0, E, (13, 2), dtype=torch.int32)
+    sorted_ids, expert_ids, token_nums, post_pad = moe_align_block_size(topk_ids, block, E)
+    flat = topk_ids.view(-1)
+    n_blocks = int(post_pad) // block
+    assert int(post_pad) == sum(-(-int((flat == e).sum()) // block) * block for e in range(E))
+    seen = []
+    for b in range(n_blocks):
+        ids = sorted_ids[b * block:(b + 1) * block]
+        real = ids[:token_nums[b]]
+        assert (ids[token_nums[b]:] == flat.numel()).all()
+        assert (flat[real.long()] == expert_ids[b]).all()
+        seen += real.tolist()
+    assert sorted(seen) == list(range(flat.numel()))
+    # experts in order, tokens of an expert in order
+    assert (expert_ids[1:n_blocks] >= expert_ids[:n_blocks - 1]).all()
+    assert seen == sorted(seen, key=lambda el: (int(flat[el]), el))
+
+
+@pytest.mark.parametrize('dtype', [torch.float16, torch.float32])
+@pytest.mark.parametrize('activation,gated', [('silu', True), ('gelu', True), ('gelu_tanh', False), ('gelu', False)])
+@needs_interpreter
+def test_triton(dtype, activation, gated):
+    tokens, E, topk, dim, inter = 24, 4, 2, 64, 32
+    torch.manual_seed(1)
+    x = torch.randn(tokens, dim, dtype=dtype)
+    w1 = torch.randn(E, inter * (2 if gated else 1), dim, dtype=dtype) / dim ** 0.5
+    w2 = torch.randn(E, dim, inter, dtype=dtype) / inter ** 0.5
+    topk_weights, topk_ids = routing(tokens, E, topk)
+    config = {'BLOCK_SIZE_M': 16, 'BLOCK_SIZE_N': 32, 'BLOCK_SIZE_K': 32, 'GROUP_SIZE_M': 1}
+    out = fused_experts(x, w1, w2, topk_weights, topk_ids, override_config=config, activation=activation)
+    assert out.dtype == dtype
+    assert rel_err(out, torch_moe(x, w1, w2, topk_weights, topk_ids, activation)) < 1e-2
+
+
+@pytest.mark.parametrize('quant', ['int8_w8a16', 'int8_w8a8'])
+@needs_interpreter
+def test_triton_int8(quant):
+    tokens, E, topk, dim, inter = 16, 4, 2, 64, 32
+    torch.manual_seed(2)
+    x = torch.randn(tokens, dim, dtype=torch.float16)
+    w1 = torch.randint(-127, 128, (E, 2 * inter, dim), dtype=torch.int8)
+    w2 = torch.randint(-127, 128, (E, dim, inter), dtype=torch.int8)
+    w1_scale = torch.rand(E, 2 * inter) / 127 / dim ** 0.5
+    w2_scale = torch.rand(E, dim) / 127 / inter ** 0.5
+    topk_weights, topk_ids = routing(tokens, E, topk)
+    config = {'BLOCK_SIZE_M': 16, 'BLOCK_SIZE_N': 32, 'BLOCK_SIZE_K': 32, 'GROUP_SIZE_M': 1}
+    out = fused_experts(x, w1, w2, topk_weights, topk_ids, override_config=config, quant=quant,
+                        w1_scale=w1_scale, w2_scale=w2_scale)
+    ref = torch_moe(x, w1, w2, topk_weights, topk_ids, 'silu', w1_scale, w2_scale)
+    # per token int8 activations lose about 1%
+    assert rel_err(out, ref) < (1e-2 if quant == 'int8_w8a16' else 3e-2)
+
+
+@needs_interpreter
+def test_chunks_and_padding(monkeypatch):
+    # 3 chunks, the last one short, and weights padded along K
+    monkeypatch.setattr(fused_moe_core, 'VLLM_FUSED_MOE_CHUNK_SIZE', 8)
+    tokens, E, topk, dim, inter, pad = 19, 4, 2, 32, 32, 16
+    torch.manual_seed(3)
+    x = torch.randn(tokens, dim, dtype=torch.float32)
+    w1 = torch.randn(E, 2 * inter, dim, dtype=torch.float32) / dim ** 0.5
+    w2 = torch.randn(E, dim, inter, dtype=torch.float32) / inter ** 0.5
+    gating = torch.randn(tokens, E)
+    config = {'BLOCK_SIZE_M': 16, 'BLOCK_SIZE_N': 32, 'BLOCK_SIZE_K': 16, 'GROUP_SIZE_M': 1}
+    out = fused_moe(x, F.pad(w1, (0, pad)), F.pad(w2, (0, pad)), gating, topk, True, override_config=config)
+    topk_weights, topk_ids = fused_topk(x, gating, topk, True)
+    assert rel_err(out, torch_moe(x, w1, w2, topk_weights, topk_ids, 'silu')) < 1e-4
+
+
+@needs_interpreter
+def test_backend_checks():
+    x = torch.randn(4, 32)
+    w1, w2 = torch.randn(2, 64, 32), torch.randn(2, 32, 32)
+    topk_weights, topk_ids = routing(4, 2, 1)
+    for backend, match in [('asm', 'needs cuda'), ('ck_2stages', 'needs cuda'), ('cutlass', 'unknown moe')]:
+        with pytest.raises(ValueError, match=match):
+            fused_experts(x, w1, w2, topk_weights, topk_ids, backend=backend)
+    with pytest.raises(ValueError, match='unknown activation'):
+        fused_experts(x, w1, w2, topk_weights, topk_ids, activation='relu')
+    with pytest.raises(ValueError, match='do not fit'):
+        fused_experts(x, torch.randn(2, 48, 32), w2, topk_weights, topk_ids)
+
+
+if __name__ == '__main__':
+    test_moe_align_block_size()
+    for dtype in [torch.float16, torch.float32]:
+        for activation, gated in [('silu', True), ('gelu', True), ('gelu_tanh', False), ('gelu', False)]:
+            test_triton(dtype, activation, gated)
+    for quant in ['int8_w8a16', 'int8_w8a8']:
+        test_triton_int8(quant)
+    fused_moe_core.VLLM_FUSED_MOE_CHUNK_SIZE = 8
+    test_chunks_and_padding(pytest.MonkeyPatch())
+    test_backend_checks()
+    print('moe core tests passed')
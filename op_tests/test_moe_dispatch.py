@@ -0,0 +1,172 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# the expert parallel moe over all-to-all, on gloo ranks with cpu tensors,
+# the local experts through the triton interpreter, no GPU needed
+import os
+# the spawned ranks import this module before triton, so the interpreter is
+# theirs in a full run too
+os.environ.setdefault('TRITON_INTERPRET', '1')
+import math
+import tempfile
+import pytest
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn.functional as F
+from aiter.dist.expert_parallel import ExpertPlacement, ExpertParallelMoE, local_experts
+from aiter.dist.expert_load import ExpertLoad, plan_placement
+
+E, DIM, INTER, TOPK = 8, 32, 32, 2
+
+
+def weights():
+    torch.manual_seed(0)
+    w1 = torch.randn(E, 2 * INTER, DIM) / DIM ** 0.5
+    w2 = torch.randn(E, DIM, INTER) / INTER ** 0.5
+    return w1, w2
+
+
+def batch(rank, tokens):
+    # every rank routes its own tokens, some of them skewed to expert 0
+    g = torch.Generator().manual_seed(100 + rank)
+    x = torch.randn(tokens, DIM, generator=g)
+    gating = torch.randn(tokens, E, generator=g)
+    gating[::2, 0] += 4
+    topk_weights, topk_ids = torch.softmax(gating, 1).topk(TOPK, 1)
+    return x, topk_weights, topk_ids.to(torch.int32)
+
+
+def expert(x, w1, w2):
+    h = x.float() @ w1.float().t()
+    return (F.silu(h[:, :INTER]) * h[:, INTER:]) @ w2.float().t()
+
+
+def torch_experts(w1, w2):
+    def run(x, ids):
+        out = torch.zeros(x.shape)
+        for e in ids.unique().tolist():
+            out[ids == e] = expert(x[ids == e], w1[e], w2[e])
+        return out
+    return run
+
+
+def reference(x, topk_weights, topk_ids, w1, w2, capacity=None):
+    '''single process moe, an expert takes the first capacity pairs of the batch'''
+    out = torch.zeros(x.shape)
+    taken = [0] * E
+    for t in range(x.shape[0]):
+        for k in range(TOPK):
+            e = int(topk_ids[t, k])
+            taken[e] += 1
+            if capacity is None or taken[e] <= capacity:
+                out[t] += topk_weights[t, k] * expert(x[t:t + 1], w1[e], w2[e])[0]
+    return out
+
+
+def worker(rank, world_size, store, tokens, num_chunks, capacity_factor, fused, experts):
+    from aiter.dist.parallel_state import GroupCoordinator
+    dist.init_process_group('gloo', init_method=f'file://{store}', rank=rank, world_size=world_size)
+    try:
+        group = GroupCoordinator([list(range(world_size))], rank, 'gloo', use_pynccl=False,
+                                 use_custom_allreduce=False, use_tpu_communicator=False)
+        placement = ExpertPlacement.from_experts(experts) if experts else ExpertPlacement.contiguous(E, world_size)
+        w1, w2 = weights()
+        mine = placement.local_experts(rank)
+        if fused:
+            config = {'BLOCK_SIZE_M': 16, 'BLOCK_SIZE_N': 32, 'BLOCK_SIZE_K': 32, 'GROUP_SIZE_M': 1}
+            fn = local_experts(w1[mine], w2[mine], override_config=config)
+        else:
+            fn = torch_experts(w1[mine], w2[mine])
+        load = ExpertLoad(E, device='cpu', group=group)
+        ep = ExpertParallelMoE(group, placement, fn, capacity_factor, num_chunks, expert_load=load)
+        x, topk_weights, topk_ids = batch(rank, tokens[rank])
+        out = ep(x, topk_weights, topk_ids)
+        snapshot = load.snapshot()
+        # every rank plans the same placement from the global load
+        plan = plan_placement(load.load(), world_size, redundant=world_size)
+        torch.save({'out': out, 'stats': ep.stats, 'load': snapshot, 'plan': plan.placement.experts},
+                   f'{store}.{rank}')
+    finally:
+        dist.destroy_process_group()
+
+
+def run(tmp, world_size, tokens, num_chunks=1, capacity_factor=None, fused=False, experts=None):
+    store = os.path.join(str(tmp), f'store_{world_size}_{num_chunks}_{capacity_factor}_{fused}_{bool(experts)}')
+    mp.spawn(worker, args=(world_size, store, tokens, num_chunks, capacity_factor, fused, experts),
+             nprocs=world_size)
+    return [torch.load(f'{store}.{rank}') for rank in range(world_size)]
+
+
+@pytest.mark.parametrize('world_size,num_chunks', [(2, 1), (4, 3)])
+def test_dispatch(tmp_path, world_size, num_chunks):
+    # uneven batches, one rank with fewer tokens than chunks
+    tokens = [13, 2, 7, 20][:world_size]
+    results = run(tmp_path, world_size, tokens, num_chunks)
+    w1, w2 = weights()
+    for rank, res in enumerate(results):
+        x, topk_weights, topk_ids = batch(rank, tokens[rank])
+        assert torch.allclose(res['out'], reference(x, topk_weights, topk_ids, w1, w2), atol=1e-5)
+        assert res['stats']['sent'] == tokens[rank] * TOPK and res['stats']['dropped'] == 0
+    # every pair is received once
+    assert sum(el['stats']['received'] for el in results) == sum(tokens) * TOPK
+
+
+def test_capacity(tmp_path):
+    tokens, capacity_factor = [16, 12], 1.0
+    results = run(tmp_path, 2, tokens, 2, capacity_factor)
+    w1, w2 = weights()
+    for rank, res in enumerate(results):
+        x, topk_weights, topk_ids = batch(rank, tokens[rank])
+        capacity = math.ceil(capacity_factor * tokens[rank] * TOPK / E)
+        ref = reference(x, topk_weights, topk_ids, w1, w2, capacity)
+        assert torch.allclose(res['out'], ref, atol=1e-5)
+        # the skew to expert 0 overflows it
+        over = sum(max(0, int((topk_ids == e).sum()) - capacity) for e in range(E))
+        assert res['stats']['dropped'] == over > 0
+        assert res['stats']['sent'] == tokens[rank] * TOPK - over
+
+
+def test_fused_experts(tmp_path):
+    tokens = [9, 6]
+    results = run(tmp_path, 2, tokens, 2, fused=True)
+    w1, w2 = weights()
+    for rank, res in enumerate(results):
+        x, topk_weights, topk_ids = batch(rank, tokens[rank])
+        ref = reference(x, topk_weights, topk_ids, w1, w2)
+        assert ((res['out'] - ref).norm() / ref.norm()).item() < 1e-4
+
+
+def test_replicated(tmp_path):
+    # the planned placement of the skewed routing, expert 0 on both ranks
+    tokens = [16, 10]
+    pairs = sum(torch.bincount(batch(rank, n)[2].view(-1).long(), minlength=E) for rank, n in enumerate(tokens))
+    plan = plan_placement(pairs, 2, redundant=2)
+    assert plan.replicas[0] == 2
+    results = run(tmp_path, 2, tokens, 2, experts=plan.placement.experts)
+    w1, w2 = weights()
+    for rank, res in enumerate(results):
+        x, topk_weights, topk_ids = batch(rank, tokens[rank])
+        assert torch.allclose(res['out'], reference(x, topk_weights, topk_ids, w1, w2), atol=1e-5)
+    # the layer counted the routing of all ranks, on every rank
+    assert all(torch.equal(el['load'], pairs) for el in results)
+    assert all(el['plan'] == plan.placement.experts for el in results)
+
+
+def test_placement():
+    placement = ExpertPlacement([1, 0, 1, 1], 2)
+    assert placement.local_experts(1) == [0, 2, 3] and placement.slot_local.tolist() == [0, 0, 1, 2]
+    assert placement.max_local == 3
+    with pytest.raises(ValueError, match='do not split'):
+        ExpertPlacement.contiguous(6, 4)
+
+
+if __name__ == '__main__':
+    test_placement()
+    with tempfile.TemporaryDirectory() as tmp:
+        for world_size, num_chunks in [(2, 1), (4, 3)]:
+            test_dispatch(tmp, world_size, num_chunks)
+        test_capacity(tmp)
+        test_replicated(tmp)
+        test_fused_experts(tmp)
+    print('moe dispatch tests passed')
@@ -0,0 +1,108 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# the persistent scratch of the triton moe, on cpu tensors through the triton
+# interpreter, no GPU needed
+import os
+# run as a script the interpreter is set here, under pytest by conftest.py
+os.environ.setdefault('TRITON_INTERPRET', '1')
+import pytest
+import torch
+from aiter import fused_moe_core
+from aiter.fused_moe_core import MoeWorkspace, fused_experts, fused_topk, make_moe_problem, \
+    get_moe_workspace, moe_workspace_stats, release_moe_workspaces
+from triton.runtime.interpreter import InterpretedFunction
+
+# the kernels run on cpu tensors, in a run where triton was imported
+# without TRITON_INTERPRET=1 they are compiled for the GPU
+needs_interpreter = pytest.mark.skipif(not isinstance(fused_moe_core.fused_moe_kernel.fn, InterpretedFunction),
+                                       reason='the moe kernels were decorated without TRITON_INTERPRET=1')
+
+CONFIG = {'BLOCK_SIZE_M': 16, 'BLOCK_SIZE_N': 32, 'BLOCK_SIZE_K': 32, 'GROUP_SIZE_M': 1}
+
+
+def layer(tokens, E=4, topk=2, dim=64, inter=32, seed=0):
+    torch.manual_seed(seed)
+    x = torch.randn(tokens, dim, dtype=torch.float16)
+    w1 = torch.randn(E, 2 * inter, dim, dtype=torch.float16) / dim ** 0.5
+    w2 = torch.randn(E, dim, inter, dtype=torch.float16) / inter ** 0.5
+    topk_weights, topk_ids = fused_topk(x, torch.randn(tokens, E), topk, True)
+    return x, w1, w2, topk_weights, topk_ids
+
+
+def ptrs(ws):
+    return {name: el.data_ptr() for name, el in ws.buffers.items()}
+
+
+@needs_interpreter
+def test_shared_by_layers():
+    release_moe_workspaces()
+    x, w1, w2, topk_weights, topk_ids = layer(16)
+    ref = fused_experts(x, w1, w2, topk_weights, topk_ids, override_config=CONFIG).clone()
+    ws = get_moe_workspace(make_moe_problem(x, w1, w2, topk_ids), 'cpu')
+    before, nbytes = ptrs(ws), ws.nbytes
+    # another layer of the same shape and fewer tokens: the same memory
+    for seed in range(1, 4):
+        fused_experts(*layer(8, seed=seed), override_config=CONFIG)
+    assert ptrs(ws) == before and ws.nbytes == nbytes and ws.calls == 4
+    assert len(moe_workspace_stats()['workspaces']) == 1
+    # the reused scratch gives the same result
+    assert torch.equal(fused_experts(x, w1, w2, topk_weights, topk_ids, override_config=CONFIG), ref)
+    # another shape has its own workspace
+    fused_experts(*layer(8, E=8), override_config=CONFIG)
+    assert len(moe_workspace_stats()['workspaces']) == 2
+
+
+@needs_interpreter
+def test_reserve_and_peak():
+    x, w1, w2, topk_weights, topk_ids = layer(40)
+    p = make_moe_problem(x, w1, w2, topk_ids)
+    ws = MoeWorkspace(p, 8, 'cpu')
+    small = ws.nbytes
+    fused_experts(x[:5], w1, w2, topk_weights[:5], topk_ids[:5], override_config=CONFIG, workspace=ws)
+    peak = ws.peak_bytes
+    assert 0 < peak < small
+    # a larger batch grows it once, later ones fit
+    fused_experts(x, w1, w2, topk_weights, topk_ids, override_config=CONFIG, workspace=ws)
+    assert ws.max_tokens == 40 and ws.nbytes > small and peak < ws.peak_bytes <= ws.nbytes
+    before = ptrs(ws)
+    fused_experts(x[:33], w1, w2, topk_weights[:33], topk_ids[:33], override_config=CONFIG, workspace=ws)
+    assert ptrs(ws) == before
+    # the peak is the bytes of the largest chunk
+    assert ws.peak_bytes == ws.nbytes
+    # a workspace of another shape is refused
+    with pytest.raises(ValueError, match='can not run'):
+        fused_experts(*layer(8, dim=32), override_config=CONFIG, workspace=ws)
+
+
+@needs_interpreter
+def test_no_growth_in_capture(monkeypatch):
+    x, w1, w2, topk_weights, topk_ids = layer(16)
+    ws = MoeWorkspace(make_moe_problem(x, w1, w2, topk_ids), 16, 'cpu')
+    monkeypatch.setattr(fused_moe_core, '_capturing', lambda device: True)
+    fused_experts(x, w1, w2, topk_weights, topk_ids, override_config=CONFIG, workspace=ws)
+    with pytest.raises(RuntimeError, match='reserve'):
+        ws.reserve(17)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason='needs a GPU')
+def test_per_stream():
+    release_moe_workspaces()
+    x, w1, w2, topk_weights, topk_ids = layer(16)
+    p = make_moe_problem(x, w1, w2, topk_ids)
+    ws = get_moe_workspace(p, 'cuda')
+    assert get_moe_workspace(p, 'cuda') is ws
+    # a layer on another stream does not share the buffers
+    with torch.cuda.stream(torch.cuda.Stream()):
+        side = get_moe_workspace(p, 'cuda')
+    assert side is not ws and not set(ptrs(side).values()) & set(ptrs(ws).values())
+    release_moe_workspaces()
+
+
+if __name__ == '__main__':
+    test_shared_by_layers()
+    test_reserve_and_peak()
+    test_no_growth_in_capture(pytest.MonkeyPatch())
+    if torch.cuda.is_available():
+        test_per_stream()
+    print('moe workspace tests passed')
@@ -0,0 +1,72 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# the wave model behind splitK of the CK GEMMs and their tuners, no GPU needed
+import numpy as np
+from aiter.tuning.occupancy import occupancy, best_splitK, splitK_range, MAX_SPLITK
+from aiter.tuning.cost_model import load_training_data, parse_kernel, CU_NUM
+
+
+def test_occupancy():
+    # 10 x 20 tiles on 304 CUs: one wave, 200 busy
+    occ = occupancy(160, 320, 4096, 16, 16, 256, cu_num=304)
+    assert (occ.tiles, occ.waves, occ.k_iters) == (200, 1, 16)
+    assert abs(occ.efficiency - 200 / 304) < 1e-9 and occ.tail == occ.efficiency
+    # splitK=1 doubles the tiles into a second, partial wave
+    occ = occupancy(160, 320, 4096, 16, 16, 256, splitK=1, cu_num=304)
+    assert (occ.tiles, occ.waves, occ.k_iters) == (400, 2, 8)
+    assert abs(occ.tail - 96 / 304) < 1e-9
+    assert occupancy(1, 1, 1, 16, 16, 256, cu_num=304, B=8).tiles == 8
+
+
+def test_best_splitK():
+    # one tile and a long K: split as far as it goes
+    assert best_splitK(16, 64, 8192, 16, 64, 256, 304).splitK == 5
+    # a skinny GEMM of 80 tiles fills the CUs better split in two, in four
+    # it takes a second wave
+    assert best_splitK(16, 1280, 8192, 16, 16, 512, 304).splitK == 1
+    # 19 x 32 tiles, two full waves already
+    assert best_splitK(4864, 8192, 8192, 256, 256, 64, 304).splitK == 0
+    # the batch fills the CUs as well as M, N do
+    assert best_splitK(16, 64, 8192, 16, 64, 256, 304, B=16).splitK == 4
+    assert best_splitK(16, 64, 8192, 16, 64, 256, 304, B=304).splitK == 0
+    assert best_splitK(16, 64, 128, 16, 64, 128, 304).splitK == 0
+
+
+def test_splitK_range():
+    for shape in [(16, 1280, 8192, 16, 16, 512), (128, 8192, 1024, 128, 128, 64), (1, 64, 65536, 16, 64, 256)]:
+        splits = splitK_range(*shape, cu_num=304)
+        assert splits[0] == 0 and best_splitK(*shape, 304).splitK in splits
+        # the tuners used to time every splitK up to the old heuristic
+        assert len(splits) < MAX_SPLITK + 1
+    assert splitK_range(16, 1280, 8192, 16, 16, 512, cu_num=304, slack=0) == [0, 1]
+    assert splitK_range(4864, 8192, 8192, 256, 256, 64, cu_num=304, slack=0) == [0]
+
+
+def spearman(a, b):
+    ra, rb = np.argsort(np.argsort(a)), np.argsort(np.argsort(b))
+    return np.corrcoef(ra, rb)[0, 1]
+
+
+def test_recorded_latency():
+    # the tuned csv files hold splitK=0 only, so the model is checked on how
+    # it ranks the recorded latencies of the tuned kernels over M
+    corr = []
+    for family, rows in load_training_data().items():
+        groups = {}
+        for B, M, N, K, name, splitK, us in rows:
+            _, tile_m, tile_n, tile_k, _, _ = parse_kernel(name)
+            cost = occupancy(M, N, K, tile_m, tile_n, tile_k, splitK, CU_NUM, B).cost
+            groups.setdefault((family, B, N, K), []).append((cost, us))
+        for el in groups.values():
+            cost, us = zip(*el)
+            if len(el) >= 4 and len(set(cost)) > 1:
+                corr.append(spearman(cost, us))
+    print(f'[perf] occupancy cost vs tuned us: {len(corr)} groups, median rank correlation {np.median(corr):.3f}')
+    assert corr and np.median(corr) > 0.9
+
+
+if __name__ == '__main__':
+    for test in [test_occupancy, test_best_splitK, test_splitK_range, test_recorded_latency]:
+        test()
+    print('occupancy tests passed')
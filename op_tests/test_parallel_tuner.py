@@ -0,0 +1,67 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# scheduling, checkpoint and merge of the parallel GemmTuner on the fake backend, no GPU needed
+import os
+import csv
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../gradlib/gradlib'))
+from parallel_tuner import ParallelTuner, FakeBackend, make_shape, shape_id, load_checkpoint  # noqa: E402
+
+TUNED_CSV = '''M,N,K,bias,dtype,outdtype,scaleAB,libtype,solidx,soltimes,kernelName
+1,1,1,False,torch.bfloat16,torch.bfloat16,False,hipblaslt,7,1.0,old_kernel
+16,1024,1024,False,torch.float16,torch.float16,False,rocblas,3,9.9,
+'''
+
+
+def read(path):
+    with open(path, newline='') as f:
+        return {shape_id(el): el for el in csv.DictReader(f)}
+
+
+def shapes(num):
+    return [make_shape(16 * (i + 1), 1024, 1024, dtype='torch.float16') for i in range(num)]
+
+
+def test_parallel(tmp_path):
+    tuned = f'{tmp_path}/tuned_gemm.csv'
+    with open(tuned, 'w') as f:
+        f.write(TUNED_CSV)
+    stats = ParallelTuner(tuned, [0, 1, 2, 3], FakeBackend(delay=0.05)).run(shapes(12))
+    assert stats == {'tuned': 12, 'resumed': 0, 'failed': []}
+    rows = read(tuned)
+    # untouched rows stay, retuned shapes are replaced
+    assert len(rows) == 13
+    assert rows['1_1_1_False_torch.bfloat16_torch.bfloat16_False']['kernelName'] == 'old_kernel'
+    assert rows[shape_id(shapes(1)[0])]['libtype'] == 'hipblaslt'
+    assert not os.path.exists(f'{tuned}.ckpt.jsonl')
+
+
+def test_crash_resume(tmp_path):
+    tuned = f'{tmp_path}/tuned_gemm.csv'
+    bad = shape_id(shapes(6)[3])
+    stats = ParallelTuner(tuned, [0, 1], FakeBackend(crash=[bad]), retries=1).run(shapes(6))
+    assert stats == {'tuned': 5, 'resumed': 0, 'failed': [bad]}
+    # the checkpoint is kept for the rerun, the good shapes are merged already
+    assert len(load_checkpoint(f'{tuned}.ckpt.jsonl')) == 5
+    assert len(read(tuned)) == 5
+
+    stats = ParallelTuner(tuned, [0, 1], FakeBackend()).run(shapes(6))
+    assert stats == {'tuned': 1, 'resumed': 5, 'failed': []}
+    assert len(read(tuned)) == 6
+
+
+def test_timeout(tmp_path):
+    tuned = f'{tmp_path}/tuned_gemm.csv'
+    hung = shape_id(shapes(3)[0])
+    stats = ParallelTuner(tuned, [0, 1], FakeBackend(hang=[hung]), timeout=1, retries=0).run(shapes(3))
+    assert stats == {'tuned': 2, 'resumed': 0, 'failed': [hung]}
+
+
+if __name__ == '__main__':
+    for test in [test_parallel, test_crash_resume, test_timeout]:
+        with tempfile.TemporaryDirectory() as tmp_path:
+            test(tmp_path)
+    print('parallel tuner tests passed')
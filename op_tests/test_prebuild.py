@@ -0,0 +1,95 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# aiter-prebuild with a stand-in build_module, no compiler or GPU needed
+import os
+import json
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from aiter.jit import core, prebuild
+
+
+def make_file(path, content=''):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+    return path
+
+
+def test_estimate_cost(tmp_path):
+    for name in ['a.cu', 'b.cpp', 'c.h']:
+        make_file(f'{tmp_path}/srcs/{name}')
+    srcs = [f'{tmp_path}/srcs', make_file(f'{tmp_path}/d.cu'), f'{tmp_path}/missing.cu']
+    assert prebuild.estimate_cost({'srcs': srcs, 'blob_gen_cmd': ''}) == 3
+    assert prebuild.estimate_cost({'srcs': srcs, 'blob_gen_cmd': 'gen.py'}) == 3 + prebuild.BLOB_GEN_COST
+    # mha passes a list of generators
+    assert prebuild.estimate_cost({'srcs': srcs, 'blob_gen_cmd': ['gen.py fwd', 'gen.py bwd']}) \
+        == 3 + 2 * prebuild.BLOB_GEN_COST
+
+
+def test_num_workers(monkeypatch):
+    monkeypatch.setattr(os, 'cpu_count', lambda: 20)
+    monkeypatch.setattr(prebuild, 'get_job_mem_gb', lambda: 4.0)
+    monkeypatch.setattr(prebuild, 'get_free_memory_gb', lambda: 40.0)
+    # memory: 10 jobs, cores: 16
+    assert prebuild.get_num_workers(100) == 10
+    assert prebuild.get_num_workers(3) == 3
+    assert prebuild.get_num_workers(100, workers=2) == 2
+    monkeypatch.setattr(prebuild, 'get_free_memory_gb', lambda: 1.0)
+    # at least one build
+    assert prebuild.get_num_workers(100, workers=8) == 1
+
+
+def test_manifest(tmp_path, monkeypatch):
+    jit_dir = f'{tmp_path}/jit'
+    make_file(f'{jit_dir}/module_built.so', 'so')
+    built = []
+
+    def build_module(md_name, *args):
+        if md_name == 'module_broken':
+            raise RuntimeError('compile error')
+        built.append(md_name)
+        make_file(f'{jit_dir}/{md_name}.so', 'so')
+
+    monkeypatch.setattr(core, 'get_user_jit_dir', lambda: jit_dir)
+    monkeypatch.setattr(core, 'build_module', build_module)
+    # the answer without the build cache, a missing .so is still built
+    monkeypatch.setattr(core, 'is_module_up_to_date', lambda ops_name, md_name: True)
+    monkeypatch.setattr(core, 'get_args_of_build', lambda md_name: {
+        'srcs': [], 'flags_extra_cc': [], 'flags_extra_hip': [], 'blob_gen_cmd': '',
+        'extra_include': [], 'extra_ldflags': None, 'verbose': False})
+    monkeypatch.setattr(core, 'get_hip_version', lambda: '6.3')
+    monkeypatch.setattr(core, 'get_ck_revision', lambda path: 'abc')
+    monkeypatch.setattr(prebuild, 'get_num_workers', lambda num_modules, workers=None: 2)
+    # the builds in this process, the stand-ins do not reach spawned ones
+    monkeypatch.setattr(prebuild, 'ProcessPoolExecutor',
+                        lambda max_workers, mp_context: ThreadPoolExecutor(max_workers))
+    manifest = f'{tmp_path}/manifest.json'
+    ret = prebuild.prebuild(['module_built', 'module_new', 'module_broken'], manifest=manifest)
+    assert built == ['module_new']
+    with open(manifest) as f:
+        assert json.load(f) == ret
+    modules = {el['md_name']: el for el in ret['modules']}
+    assert [el['md_name'] for el in ret['modules']] == ['module_broken', 'module_built', 'module_new']
+    assert modules['module_built']['status'] == 'up_to_date' and modules['module_new']['status'] == 'built'
+    assert modules['module_new']['size'] == 2 and modules['module_new']['so'] == f'{jit_dir}/module_new.so'
+    assert modules['module_broken']['status'] == 'failed' and 'compile error' in modules['module_broken']['error']
+    assert ret['workers'] == 2 and ret['ck_revision'] == 'abc'
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as tmp_path:
+        test_estimate_cost(tmp_path)
+    monkeypatch = pytest.MonkeyPatch()
+    try:
+        test_num_workers(monkeypatch)
+    finally:
+        monkeypatch.undo()
+    monkeypatch = pytest.MonkeyPatch()
+    try:
+        with tempfile.TemporaryDirectory() as tmp_path:
+            test_manifest(tmp_path, monkeypatch)
+    finally:
+        monkeypatch.undo()
+    print('prebuild tests passed')
@@ -0,0 +1,88 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# weight layouts and the prepack cache on cpu tensors, no GPU needed
+import os
+import tempfile
+import torch
+from aiter.ops.shuffle import shuffle_weight, pack_int4, get_layout, WeightLayout, WEIGHT_LAYOUTS
+from aiter.prepack import PrepackCache, tensor_digest
+
+# nibble j of a packed word holds element ORDER[j] of its 8
+ORDER = [0, 2, 4, 6, 1, 3, 5, 7]
+
+
+def test_pack_int4():
+    x = torch.randint(-8, 8, (3, 16, 64), dtype=torch.int8)
+    packed = pack_int4(x)
+    assert packed.shape == (3, 16, 8) and packed.dtype == torch.uint32
+    words = packed.view(torch.int32).to(torch.int64) & 0xFFFFFFFF
+    for j, el in enumerate(ORDER):
+        assert torch.equal((words >> (4 * j)) & 0xF, x[..., el::8].to(torch.int64) & 0xF)
+    # any rank, the old helper took (E, N, K) only
+    assert torch.equal(pack_int4(x[0]), packed[0])
+
+
+def test_layouts():
+    assert list(WEIGHT_LAYOUTS) == ['shuffle16x16', 'shuffle32x16', 'shuffle32x32', 'int4', 'int4_shuffle16x16']
+    w = torch.randint(-8, 8, (2, 32, 64), dtype=torch.int8)
+    assert torch.equal(get_layout('shuffle32x16').apply(w), shuffle_weight(w, (32, 16)))
+    assert get_layout((32, 16)) == WEIGHT_LAYOUTS['shuffle32x16']
+    # the int4 shuffle works on the packed words, 32 of them per 256 int8
+    q = torch.randint(-8, 8, (2, 32, 256), dtype=torch.int8)
+    assert torch.equal(get_layout('int4_shuffle16x16').apply(q), shuffle_weight(pack_int4(q)))
+    assert WeightLayout().name == 'plain'
+    try:
+        get_layout('shuffle8x8')
+        assert False
+    except ValueError:
+        pass
+
+
+def test_cache(tmp_path):
+    cache = PrepackCache(str(tmp_path))
+    w = torch.randn(64, 128).to(torch.bfloat16)
+    ref = shuffle_weight(w)
+    first = cache.prepack(w, 'shuffle16x16')
+    assert torch.equal(first, ref) and cache.stats()['misses'] == 1
+    # a restart: a new cache over the same directory maps the packed file
+    cache = PrepackCache(str(tmp_path))
+    second = cache.prepack(w.clone(), 'shuffle16x16')
+    assert torch.equal(second, ref) and cache.stats() == {'hits': 1, 'misses': 0, 'bytes_written': 0}
+    # another layout or other bytes are other entries
+    assert torch.equal(cache.prepack(w, 'shuffle32x16'), shuffle_weight(w, (32, 16)))
+    w2 = w.clone()
+    w2[0, 0] += 1
+    assert tensor_digest(w2) != tensor_digest(w)
+    assert torch.equal(cache.prepack(w2, 'shuffle16x16'), shuffle_weight(w2))
+    assert cache.stats()['misses'] == 2
+
+    # the caller's key skips the hashing
+    q = torch.randint(-8, 8, (4, 32, 256), dtype=torch.int8)
+    packed = cache.prepack(q, 'int4_shuffle16x16', key='ckpt.safetensors:experts.w1')
+    assert torch.equal(PrepackCache(str(tmp_path)).prepack(q, 'int4_shuffle16x16', key='ckpt.safetensors:experts.w1'),
+                       packed)
+
+    # a broken file is dropped and packed again
+    files = [os.path.join(r, el) for r, _, fs in os.walk(tmp_path) for el in fs]
+    assert len(files) == 4 and all(el.endswith('.pt') for el in files)
+    for el in files:
+        with open(el, 'wb') as f:
+            f.write(b'broken')
+    assert torch.equal(cache.prepack(w, 'shuffle16x16'), ref)
+    cache.clear()
+    assert not [el for _, _, fs in os.walk(tmp_path) for el in fs]
+
+
+def test_no_cache():
+    cache = PrepackCache('')
+    w = torch.randn(32, 64)
+    assert torch.equal(cache.prepack(w), shuffle_weight(w)) and cache.stats()['misses'] == 0
+
+
+if __name__ == '__main__':
+    for test in [test_pack_int4, test_layouts, test_no_cache]:
+        test()
+    with tempfile.TemporaryDirectory() as tmp_path:
+        test_cache(tmp_path)
+    print('prepack tests passed')
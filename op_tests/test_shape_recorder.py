@@ -0,0 +1,82 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+import os
+import time
+import tempfile
+import threading
+from aiter.configs.shape_recorder import ShapeRecorder, read_recorded
+from aiter.configs import tune_recorded
+
+CK_CSV = '''M,N,K,kernelId,splitK,us,kernelName
+128,1280,8192,31,2,20.0000,a8w8_rowwise_256x64x64x512_16x16_1x2_32x8x1_32x8x1_1x32x1x8_8x8x1_1x2_intrawave_v3
+'''
+KEYS = ['M', 'N', 'K']
+
+
+def write(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+    return path
+
+
+def test_record_flush(tmp_path):
+    os.environ['AITER_CONFIG_INDEX_DIR'] = f'{tmp_path}/idx'
+    tuned_csv = write(f'{tmp_path}/a8w8_tuned_gemm.csv', CK_CSV)
+    recorder = ShapeRecorder(f'{tmp_path}/record', interval=3600)
+    for m in [1, 1, 1, 16, 128]:
+        recorder.record(tuned_csv, KEYS, (m, 1280, 8192))
+    recorder.flush()
+    path = f'{tmp_path}/record/a8w8_untuned_gemm.csv'
+    # tuned shapes are dropped, hottest first
+    assert read_recorded(path, KEYS) == {('1', '1280', '8192'): 3, ('16', '1280', '8192'): 1}
+    with open(path) as f:
+        assert f.read().split()[:2] == ['M,N,K,count', '1,1280,8192,3']
+
+    # counts accumulate across flushes, shapes tuned meanwhile disappear
+    recorder.record(tuned_csv, KEYS, (16, 1280, 8192))
+    time.sleep(0.01)
+    write(tuned_csv, CK_CSV + CK_CSV.splitlines()[1].replace('128,', '1,', 1) + '\n')
+    recorder.flush()
+    assert read_recorded(path, KEYS) == {('16', '1280', '8192'): 2}
+
+
+def test_record_threads(tmp_path):
+    recorder = ShapeRecorder(f'{tmp_path}/record', interval=3600)
+    csv_path = f'{tmp_path}/a8w8_tuned_gemm.csv'
+
+    def run():
+        for m in range(2000):
+            recorder.record(csv_path, KEYS, (m % 8, 1, 1))
+
+    workers = [threading.Thread(target=run) for _ in range(4)]
+    for el in workers:
+        el.start()
+    while any(el.is_alive() for el in workers):
+        recorder.flush()
+    recorder.flush()
+    counts = read_recorded(f'{tmp_path}/record/a8w8_untuned_gemm.csv', KEYS)
+    assert len(counts) == 8
+    # a flush racing record() may drop a few increments, never more
+    assert 8000 * 0.9 <= sum(counts.values()) <= 8000
+
+
+def test_plan(tmp_path):
+    os.environ['AITER_CONFIG_INDEX_DIR'] = f'{tmp_path}/idx'
+    write(f'{tmp_path}/a8w8_tuned_gemm.csv', CK_CSV)
+    os.makedirs(f'{tmp_path}/record')
+    write(f'{tmp_path}/record/a8w8_untuned_gemm.csv',
+          'M,N,K,count\n16,1280,8192,5\n128,1280,8192,9\n32,1280,8192,7\n1,1280,8192,1\n')
+    shapes = tune_recorded.plan(f'{tmp_path}/record', tmp_path, top=2)
+    assert shapes == {'a8w8_tuned_gemm.csv': [(('32', '1280', '8192'), 7),
+                                              (('16', '1280', '8192'), 5)]}
+    assert tune_recorded.tune(f'{tmp_path}/record', tmp_path, top=2, dry_run=True) == 2
+    with open(f'{tmp_path}/record/queue_a8w8_untuned_gemm.csv') as f:
+        assert f.read().split() == ['M,N,K', '32,1280,8192', '16,1280,8192']
+
+
+if __name__ == '__main__':
+    for test in [test_record_flush, test_record_threads, test_plan]:
+        with tempfile.TemporaryDirectory() as tmp_path:
+            test(tmp_path)
+    print('shape recorder tests passed')
@@ -0,0 +1,67 @@
+# SPDX-License-Identifier: MIT
+# Copyright (c) 2024, Advanced Micro Devices, Inc. All rights reserved.
+
+# search strategies of the tuners against the simulated latency model, no GPU needed
+import os
+import sys
+import math
+from aiter.tuning.search import get_search, SimulatedTimer, simulate_gemm_us, SEARCH_STRATEGIES
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '../csrc/ck_gemm_a8w8'))
+from gemm_a8w8_common import kernels_list  # noqa: E402
+
+SHAPES = [(1, 1280, 8192), (32, 7168, 8192), (256, 8192, 1024), (4096, 1280, 8192)]
+CU_NUM = 304
+
+
+def max_splitK(m, n, k, tile_m, tile_n, tile_k):
+    cus_per_tile = CU_NUM / (math.ceil(m / tile_m) * math.ceil(n / tile_n))
+    splitK = 0
+    while cus_per_tile >= 2 ** (splitK + 1) and 2 ** (splitK + 1) * tile_k < 2 * k:
+        splitK += 1
+    return splitK
+
+
+def ck_latency(m, n, k):
+    '''simulated latency of every (kernelId, splitK) the CK a8w8 tuner would try'''
+    ret = {}
+    for i, kernel in kernels_list.items():
+        tile = (kernel.MPerBLOCK, kernel.NPerBLOCK, kernel.KPerBLOCK)
+        for splitK in range(max_splitK(m, n, k, *tile) + 1):
+            ret[(i, splitK)] = simulate_gemm_us(m, n, k, *tile, splitK, cu_num=CU_NUM)
+    return ret
+
+
+def test_strategies():
+    for shape in SHAPES:
+        latency = ck_latency(*shape)
+        best = min(latency.values())
+        # the old loop: perftest, 5 warmup and 101 timed iterations per candidate
+        baseline = SimulatedTimer(latency, warmup=5)
+        ranking = get_search('exhaustive').search(list(latency), baseline)
+        assert latency[ranking[0][0]] <= best * 1.01
+        for name in SEARCH_STRATEGIES:
+            if name == 'exhaustive':
+                continue
+            timer = SimulatedTimer(latency)
+            ranking = get_search(name).search(list(latency), timer)
+            speedup = baseline.cost / timer.cost
+            print(f'[perf] {shape} {len(latency)} candidates, {name:<8}: {speedup:5.1f}x less GPU time')
+            # same winner as the exhaustive search, up to candidates of the same latency
+            assert latency[ranking[0][0]] <= best * 1.01, (shape, name)
+            assert speedup >= (10 if name == 'halving' else 5), (shape, name, speedup)
+
+
+def test_invalid():
+    latency = {i: 10.0 + i for i in range(20)}
+    for name in SEARCH_STRATEGIES:
+        ranking = get_search(name).search(list(latency), SimulatedTimer(latency, invalid=[0, 1]))
+        assert ranking[0][0] == 2 and all(el not in [0, 1] for el, _ in ranking), name
+        # a single candidate still gets timed
+        assert get_search(name).search([5], SimulatedTimer(latency))[0][0] == 5
+
+
+if __name__ == '__main__':
+    test_strategies()
+    test_invalid()
+    print('tune search tests passed')
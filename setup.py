@@ -118,6 +118,12 @@ setup(
     ],
     #ext_modules=ext_modules,
     cmdclass={"build_ext": NinjaBuildExtension},
+    entry_points={
+        "console_scripts": [
+            "aiter-prebuild = aiter.jit.prebuild:main",
+            "aiter-build-report = aiter.jit.build_telemetry:main",
+        ],
+    },
     python_requires=">=3.8",
     # install_requires=[
     #     "torch",